@@ -0,0 +1,66 @@
+#!/usr/bin/env python3
+"""
+🔍 查询计划检查
+
+对真实数据库（默认 DATABASE_URL，例如本地 MySQL 容器）执行热点查询的 EXPLAIN，
+出现全表扫描或 filesort 时以非零状态退出，可用于 CI 或上线前检查
+
+数据库需已执行 database/migrations 中的迁移；表中数据过少时优化器可能选择全表扫描，
+建议在有代表性数据量的库上运行
+
+用法:
+    python scripts/check_query_plans.py [--url mysql+asyncmy://...] [--only messages.]
+"""
+
+import argparse
+import asyncio
+import sys
+from pathlib import Path
+
+# 添加项目根目录到路径
+sys.path.append(str(Path(__file__).parent.parent))
+
+from loguru import logger
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from src.config.settings import get_settings
+from src.services.queries import HOT_QUERIES
+from src.utils.query_plans import check_queries
+
+
+async def run(url: str, only: str = None) -> int:
+    """执行检查，返回有问题的查询数"""
+    queries = {name: build for name, build in HOT_QUERIES.items() if not only or name.startswith(only)}
+    engine = create_async_engine(url)
+
+    try:
+        async with engine.connect() as conn:
+            report = await conn.run_sync(check_queries, queries)
+    finally:
+        await engine.dispose()
+
+    for name in queries:
+        if name in report:
+            logger.error(f"❌ {name}: {'; '.join(report[name])}")
+        else:
+            logger.info(f"✅ {name}")
+
+    return len(report)
+
+
+def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description="检查热点查询的执行计划")
+    parser.add_argument("--url", default=None, help="数据库连接URL（默认使用 DATABASE_URL）")
+    parser.add_argument("--only", default=None, help="只检查名称以此开头的查询")
+    args = parser.parse_args()
+
+    failures = asyncio.run(run(args.url or get_settings().DATABASE_URL, args.only))
+    if failures:
+        logger.error(f"{failures} queries have plan problems")
+        sys.exit(1)
+    logger.info("🎉 All query plans use indexes")
+
+
+if __name__ == "__main__":
+    main()
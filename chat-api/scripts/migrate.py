@@ -20,6 +20,13 @@ from src.core.database import Base
 from src.models import *  # 导入所有模型
 
 
+def _create_missing_indexes(conn):
+    """为已存在的表补建模型中声明的索引"""
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(conn, checkfirst=True)
+
+
 async def create_tables():
     """创建数据库表"""
     settings = get_settings()
@@ -37,6 +44,8 @@ async def create_tables():
         # 创建所有表
         async with engine.begin() as conn:
             await conn.run_sync(Base.metadata.create_all)
+            # 已存在的表不会被 create_all 补建新索引，这里单独补齐
+            await conn.run_sync(_create_missing_indexes)
         
         logger.info("✅ 数据库表创建成功")
         
@@ -0,0 +1,299 @@
+#!/usr/bin/env python3
+"""
+🔄 会话存储迁移脚本
+
+将旧版会话存储结构原地转换为当前结构（可重复执行）
+
+- session:{id}            JSON 字符串 -> 哈希
+- user_sessions:{user_id} 列表        -> 有序集合（score 为过期时间戳）
+- session_index           列表        -> 有序集合（score 为过期时间戳）
+- session_expiry:{shard}  根据全局索引补全清理调度
+
+每个键先写入临时键，再在 WATCH/MULTI 事务中 RENAME 覆盖原键，
+转换期间原键被并发修改时自动重试
+
+用法:
+    python scripts/migrate_session_store.py [--dry-run] [--batch-size 500]
+"""
+
+import argparse
+import asyncio
+import json
+import sys
+import time
+from datetime import datetime
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+# 添加项目根目录到路径
+sys.path.append(str(Path(__file__).parent.parent))
+
+from loguru import logger
+from redis.asyncio import Redis
+from redis.exceptions import ResponseError, WatchError
+
+from src.config.settings import get_settings
+from src.core.redis import init_redis, close_redis, get_redis_manager
+from src.models.session import Session, SessionConfig, SessionStatus
+from src.session.store import SessionStore, serialize_session
+
+MAX_RETRIES = 5
+
+# 已结束的会话不再进入活跃索引
+_INACTIVE_STATUSES = {SessionStatus.CLOSED.value, SessionStatus.EXPIRED.value}
+
+
+def _tmp_key(key: str) -> str:
+    return f"{key}:migrating"
+
+
+async def _scan_keys(client: Redis, pattern: str, key_type: str, batch_size: int) -> List[str]:
+    """扫描指定类型的键"""
+    matched = []
+    async for key in client.scan_iter(match=pattern, count=batch_size, _type=key_type):
+        matched.append(key)
+    return matched
+
+
+async def migrate_session_doc(client: Redis, key: str, dry_run: bool) -> bool:
+    """JSON 字符串会话 -> 哈希"""
+    tmp_key = _tmp_key(key)
+
+    for _ in range(MAX_RETRIES):
+        async with client.pipeline(transaction=True) as pipe:
+            try:
+                await pipe.watch(key)
+                if await pipe.type(key) != "string":
+                    return False
+
+                raw = await pipe.get(key)
+                ttl_ms = await pipe.pttl(key)
+                mapping = serialize_session(Session(**json.loads(raw)))
+
+                if dry_run:
+                    return True
+
+                pipe.multi()
+                pipe.delete(tmp_key)
+                pipe.hset(tmp_key, mapping=mapping)
+                pipe.rename(tmp_key, key)
+                if ttl_ms and ttl_ms > 0:
+                    pipe.pexpire(key, ttl_ms)
+                await pipe.execute()
+                return True
+
+            except WatchError:
+                continue
+
+    logger.warning(f"⚠️ Gave up migrating {key} after {MAX_RETRIES} retries")
+    return False
+
+
+def _legacy_fields(raw: Optional[str]) -> Tuple[Optional[str], Optional[str]]:
+    """从旧版 JSON 会话数据中读取 (status, expires_at)，无法解析时视为不存在"""
+    try:
+        doc = json.loads(raw) if raw else None
+    except ValueError:
+        return None, None
+    if not isinstance(doc, dict):
+        return None, None
+    return doc.get("status"), doc.get("expires_at")
+
+
+async def _index_scores(
+    client: Redis,
+    store: SessionStore,
+    session_ids: List[str],
+    default_ttl: int,
+    dry_run: bool = False
+) -> Dict[str, float]:
+    """计算仍然有效的会话在新索引中的 score（过期时间戳）"""
+    pipe = client.pipeline(transaction=False)
+    for session_id in session_ids:
+        pipe.hmget(store.session_key(session_id), "status", "expires_at")
+    rows = await pipe.execute(raise_on_error=False)
+
+    # 会话数据仍是旧版字符串（未迁移或 dry run 未转换）时 HMGET 返回 WRONGTYPE
+    legacy_ids = [
+        session_id for session_id, row in zip(session_ids, rows)
+        if isinstance(row, ResponseError)
+    ]
+    legacy: Dict[str, Tuple[Optional[str], Optional[str]]] = {}
+    if dry_run and legacy_ids:
+        # dry run 不转换会话数据，按旧版 JSON 估算
+        pipe = client.pipeline(transaction=False)
+        for session_id in legacy_ids:
+            pipe.get(store.session_key(session_id))
+        raws = await pipe.execute(raise_on_error=False)
+        legacy = {
+            session_id: _legacy_fields(raw if isinstance(raw, str) else None)
+            for session_id, raw in zip(legacy_ids, raws)
+        }
+
+    now = time.time()
+    scores: Dict[str, float] = {}
+    for session_id, row in zip(session_ids, rows):
+        if isinstance(row, ResponseError):
+            status, expires_at = legacy.get(session_id, (None, None))
+        else:
+            status, expires_at = row
+
+        # 会话数据已不存在（或未能迁移）的条目直接丢弃
+        if status is None or status in _INACTIVE_STATUSES:
+            continue
+
+        score: Optional[float] = None
+        if expires_at:
+            try:
+                score = datetime.fromisoformat(expires_at).timestamp()
+            except (TypeError, ValueError):
+                score = None
+        score = score or now + default_ttl
+
+        if score > now:
+            scores[session_id] = score
+    return scores
+
+
+async def migrate_index(
+    client: Redis,
+    store: SessionStore,
+    key: str,
+    default_ttl: int,
+    dry_run: bool
+) -> Optional[int]:
+    """
+    列表索引 -> 有序集合
+
+    Returns:
+        新索引中的条目数，键无需迁移时返回 None
+    """
+    tmp_key = _tmp_key(key)
+
+    for _ in range(MAX_RETRIES):
+        async with client.pipeline(transaction=True) as pipe:
+            try:
+                await pipe.watch(key)
+                if await pipe.type(key) != "list":
+                    return None
+
+                session_ids = list(dict.fromkeys(await pipe.lrange(key, 0, -1)))
+                ttl_ms = await pipe.pttl(key)
+                scores = await _index_scores(client, store, session_ids, default_ttl, dry_run)
+
+                if dry_run:
+                    return len(scores)
+
+                pipe.multi()
+                pipe.delete(tmp_key)
+                if scores:
+                    pipe.zadd(tmp_key, scores)
+                    pipe.rename(tmp_key, key)
+                    if ttl_ms and ttl_ms > 0:
+                        pipe.pexpire(key, ttl_ms)
+                else:
+                    pipe.delete(key)
+                await pipe.execute()
+                return len(scores)
+
+            except WatchError:
+                continue
+
+    logger.warning(f"⚠️ Gave up migrating {key} after {MAX_RETRIES} retries")
+    return None
+
+
+async def migrate(dry_run: bool = False, batch_size: int = 500):
+    """执行迁移"""
+    settings = get_settings()
+    client = get_redis_manager().session
+    store = SessionStore(
+        client,
+        shards=settings.SESSION_SWEEP_SHARDS,
+        idle_timeout=settings.SESSION_IDLE_TIMEOUT
+    )
+    default_ttl = SessionConfig().max_session_duration
+    mode = " (dry run)" if dry_run else ""
+
+    # 1. 会话数据：后续索引迁移需要读取哈希中的状态和过期时间
+    logger.info(f"🔄 Migrating session documents{mode}...")
+    doc_keys = await _scan_keys(client, f"{store.session_prefix}*", "string", batch_size)
+    migrated_docs = 0
+    for key in doc_keys:
+        try:
+            if await migrate_session_doc(client, key, dry_run):
+                migrated_docs += 1
+        except Exception as e:
+            logger.error(f"❌ Failed to migrate {key}: {e}")
+    logger.info(f"✅ Session documents: {migrated_docs}/{len(doc_keys)}")
+
+    # 2. 用户会话索引
+    logger.info(f"🔄 Migrating user session indexes{mode}...")
+    user_keys = await _scan_keys(client, f"{store.user_sessions_prefix}*", "list", batch_size)
+    migrated_users = 0
+    for key in user_keys:
+        try:
+            if await migrate_index(client, store, key, default_ttl, dry_run) is not None:
+                migrated_users += 1
+        except Exception as e:
+            logger.error(f"❌ Failed to migrate {key}: {e}")
+    logger.info(f"✅ User session indexes: {migrated_users}/{len(user_keys)}")
+
+    # 3. 全局会话索引
+    logger.info(f"🔄 Migrating global session index{mode}...")
+    try:
+        active = await migrate_index(client, store, store.session_index_key, default_ttl, dry_run)
+        if active is None:
+            logger.info("✅ Global session index already migrated")
+        else:
+            logger.info(f"✅ Global session index: {active} active sessions")
+    except Exception as e:
+        logger.error(f"❌ Failed to migrate {store.session_index_key}: {e}")
+
+    # 4. 清理调度：所有活跃会话先按立即到期加入，由清理任务按实际活动时间重新调度
+    logger.info(f"🔄 Rebuilding session expiry schedule{mode}...")
+    scheduled = 0
+    batch: List[str] = []
+    if await client.type(store.session_index_key) != "zset":
+        logger.info("⏭️ Global session index is not a sorted set, skipping schedule rebuild")
+        return
+    async for session_id, _ in client.zscan_iter(store.session_index_key, count=batch_size):
+        batch.append(session_id)
+        if len(batch) >= batch_size:
+            if not dry_run:
+                await store.schedule(batch)
+            scheduled += len(batch)
+            batch = []
+    if batch:
+        if not dry_run:
+            await store.schedule(batch)
+        scheduled += len(batch)
+    logger.info(f"✅ Scheduled {scheduled} sessions")
+
+    remaining = await store.find_legacy_keys()
+    if remaining and not dry_run:
+        logger.warning(f"⚠️ Legacy keys still present (e.g. {remaining[:3]}), re-run the migration")
+
+
+async def main():
+    """主函数"""
+    parser = argparse.ArgumentParser(description="迁移会话存储结构")
+    parser.add_argument("--dry-run", action="store_true", help="只统计需要迁移的键，不写入")
+    parser.add_argument("--batch-size", type=int, default=500, help="SCAN 每批数量")
+    args = parser.parse_args()
+
+    try:
+        await init_redis()
+        await migrate(dry_run=args.dry_run, batch_size=args.batch_size)
+        logger.info("🎉 会话存储迁移完成")
+
+    except Exception as e:
+        logger.error(f"❌ 会话存储迁移失败: {e}")
+        sys.exit(1)
+
+    finally:
+        await close_redis()
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,320 @@
+"""
+⚡ AI 服务熔断器
+
+每个提供商一个熔断器，状态通过 Redis 在所有 worker 间共享
+- closed:    正常放行，统计滑动窗口内的错误率与慢请求比例
+- open:      超过阈值后熔断，请求直接绕过该提供商
+- half_open: 熔断到期后由一个 worker（持有 Redis 锁）发送轻量探测，成功则恢复
+"""
+
+import asyncio
+import time
+from collections import deque
+from typing import Awaitable, Callable, Deque, Dict, Optional, Set, Tuple
+from uuid import uuid4
+
+from loguru import logger
+
+from src.config.settings import get_settings
+from src.utils.metrics import metrics
+
+settings = get_settings()
+
+CLOSED = "closed"
+OPEN = "open"
+HALF_OPEN = "half_open"
+
+
+class CircuitBreaker:
+    """单个提供商的熔断器"""
+
+    def __init__(
+        self,
+        provider: str,
+        probe: Callable[[], Awaitable[bool]],
+        on_transition: Callable[["CircuitBreaker"], Awaitable[None]] = None
+    ):
+        self.provider = provider
+        self.state = CLOSED
+        self.opened_until = 0.0
+        self._probe = probe
+        self._on_transition = on_transition
+        self._probe_task: Optional[asyncio.Task] = None
+        # 发布中的状态变更任务（保留引用，避免执行完之前被回收）
+        self._publishing: Set[asyncio.Task] = set()
+        self._last_probe_at = 0.0
+        # 滑动窗口内的 (时间, 是否失败, 是否慢请求)
+        self._events: Deque[Tuple[float, bool, bool]] = deque(maxlen=10000)
+
+    # ==========================================
+    # 🚦 放行判断
+    # ==========================================
+
+    def allow_request(self) -> bool:
+        """是否放行请求（open 到期时转入 half_open 并触发探测）"""
+        if self.state == CLOSED:
+            return True
+
+        now = time.time()
+        if self.state == OPEN and now < self.opened_until:
+            return False
+
+        if self.state == OPEN:
+            self._transition(HALF_OPEN)
+        self._maybe_probe(now)
+        return False
+
+    # ==========================================
+    # 📝 结果记录
+    # ==========================================
+
+    def record_success(self, latency: float):
+        """记录成功请求（latency 为响应或首字延迟）"""
+        self._record(False, latency >= settings.AI_BREAKER_SLOW_THRESHOLD)
+
+    def record_failure(self):
+        """记录失败请求"""
+        self._record(True, False)
+
+    def _record(self, failed: bool, slow: bool):
+        now = time.time()
+        self._events.append((now, failed, slow))
+
+        if self.state != CLOSED:
+            return
+
+        cutoff = now - settings.AI_BREAKER_WINDOW
+        while self._events and self._events[0][0] < cutoff:
+            self._events.popleft()
+
+        total = len(self._events)
+        if total < settings.AI_BREAKER_MIN_REQUESTS:
+            return
+
+        failures = sum(1 for _, event_failed, _ in self._events if event_failed)
+        slow_calls = sum(1 for _, _, event_slow in self._events if event_slow)
+
+        if failures / total >= settings.AI_BREAKER_ERROR_RATE:
+            self.trip(f"error rate {failures}/{total}")
+        elif slow_calls / total >= settings.AI_BREAKER_SLOW_RATE:
+            self.trip(f"slow calls {slow_calls}/{total}")
+
+    # ==========================================
+    # 🔀 状态转换
+    # ==========================================
+
+    def trip(self, reason: str):
+        """熔断"""
+        logger.warning(f"⚡ Circuit for {self.provider} opened: {reason}")
+        self.opened_until = time.time() + settings.AI_BREAKER_OPEN_SECONDS
+        self._transition(OPEN)
+
+    def reset(self):
+        """恢复"""
+        logger.info(f"✅ Circuit for {self.provider} closed")
+        self.opened_until = 0.0
+        self._transition(CLOSED)
+
+    def _transition(self, state: str, publish: bool = True):
+        if state == self.state:
+            return
+
+        self.state = state
+        self._events.clear()
+        metrics.set_ai_circuit_state(self.provider, state)
+
+        # half_open 由各 worker 按时间自行进入，只共享 open / closed
+        if publish and state != HALF_OPEN and self._on_transition:
+            task = asyncio.ensure_future(self._on_transition(self))
+            self._publishing.add(task)
+            task.add_done_callback(self._publishing.discard)
+
+    def apply_remote(self, state: str, opened_until: float):
+        """应用其他 worker 共享的状态"""
+        self.opened_until = opened_until
+        if state == OPEN and opened_until <= time.time():
+            state = HALF_OPEN
+        if state != self.state:
+            self._transition(state, publish=False)
+
+    # ==========================================
+    # 🔎 半开探测
+    # ==========================================
+
+    def _maybe_probe(self, now: float):
+        if self._probe_task is not None and not self._probe_task.done():
+            return
+        if now - self._last_probe_at < settings.AI_BREAKER_PROBE_INTERVAL:
+            return
+
+        self._last_probe_at = now
+        self._probe_task = asyncio.ensure_future(self._run_probe())
+
+    async def _run_probe(self):
+        from src.core.redis import RedisLock, get_redis_manager
+
+        lock = None
+        try:
+            lock = RedisLock(
+                get_redis_manager().client,
+                f"lock:ai_breaker_probe:{self.provider}",
+                int(settings.AI_BREAKER_PROBE_TIMEOUT * 2000)
+            )
+            if not await lock.acquire():
+                # 其他 worker 正在探测，等待其广播结果
+                return
+        except Exception as e:
+            # Redis 不可用时各 worker 自行探测
+            logger.debug(f"Circuit probe lock unavailable for {self.provider}: {e}")
+            lock = None
+
+        try:
+            healthy = await asyncio.wait_for(self._probe(), settings.AI_BREAKER_PROBE_TIMEOUT)
+        except Exception as e:
+            logger.warning(f"Circuit probe for {self.provider} failed: {e}")
+            healthy = False
+
+        try:
+            if self.state == HALF_OPEN:
+                if healthy:
+                    self.reset()
+                else:
+                    self.trip("probe failed")
+        finally:
+            if lock is not None:
+                try:
+                    await lock.release()
+                except Exception:
+                    pass
+
+    def to_dict(self) -> Dict[str, object]:
+        return {
+            "state": self.state,
+            "opened_until": self.opened_until or None,
+        }
+
+
+class CircuitBreakerRegistry:
+    """所有提供商熔断器的注册表，负责 Redis 状态共享"""
+
+    def __init__(self, prefix: str = "ai_breaker:", channel: str = "ai_breaker"):
+        self.prefix = prefix
+        self.channel = channel
+        self.enabled = settings.AI_BREAKER_ENABLED
+        self._breakers: Dict[str, CircuitBreaker] = {}
+        self._instance_id = uuid4().hex
+        self._subscribed = False
+
+    def get(self, provider: str) -> CircuitBreaker:
+        """获取提供商熔断器"""
+        breaker = self._breakers.get(provider)
+        if breaker is None:
+            breaker = CircuitBreaker(provider, self._probe_fn(provider), self._share)
+            self._breakers[provider] = breaker
+        return breaker
+
+    def allow_request(self, provider: str) -> bool:
+        """是否放行请求"""
+        return not self.enabled or self.get(provider).allow_request()
+
+    def record_success(self, provider: str, latency: float):
+        if self.enabled:
+            self.get(provider).record_success(latency)
+
+    def record_failure(self, provider: str):
+        if self.enabled:
+            self.get(provider).record_failure()
+
+    def get_states(self) -> Dict[str, Dict[str, object]]:
+        """获取所有熔断器状态"""
+        return {provider: breaker.to_dict() for provider, breaker in self._breakers.items()}
+
+    @staticmethod
+    def _probe_fn(provider: str) -> Callable[[], Awaitable[bool]]:
+        async def probe() -> bool:
+            from src.ai.client import get_ai_client
+
+            client = await get_ai_client(provider)
+            return bool(client) and await client.probe()
+
+        return probe
+
+    # ==========================================
+    # 🔄 跨 worker 共享
+    # ==========================================
+
+    async def start(self, providers=()):
+        """加载共享状态并订阅状态变更"""
+        if not self.enabled:
+            return
+
+        from src.core.redis import get_pubsub_dispatcher, get_redis_manager
+
+        for provider in providers:
+            breaker = self.get(provider)
+            metrics.set_ai_circuit_state(provider, breaker.state, transition=False)
+            try:
+                data = await get_redis_manager().client.hgetall(f"{self.prefix}{provider}")
+                if data.get("state"):
+                    breaker.apply_remote(data["state"], float(data.get("opened_until") or 0))
+            except Exception as e:
+                logger.warning(f"⚠️ Failed to load circuit state for {provider}: {e}")
+
+        try:
+            await get_pubsub_dispatcher().subscribe(self.channel, self._on_message)
+            self._subscribed = True
+        except Exception as e:
+            logger.warning(f"⚠️ Circuit breaker notifications unavailable: {e}")
+
+    async def stop(self):
+        """等待状态变更发布完成并取消订阅"""
+        publishing = [task for breaker in self._breakers.values() for task in breaker._publishing]
+        if publishing:
+            await asyncio.gather(*publishing, return_exceptions=True)
+
+        if self._subscribed:
+            from src.core.redis import get_pubsub_dispatcher
+
+            try:
+                await get_pubsub_dispatcher().unsubscribe(self.channel)
+            except Exception:
+                pass
+            self._subscribed = False
+
+        for breaker in self._breakers.values():
+            if breaker._probe_task is not None:
+                breaker._probe_task.cancel()
+
+    async def _share(self, breaker: CircuitBreaker):
+        """写入 Redis 并广播状态变更"""
+        from src.core.redis import get_pubsub_dispatcher, get_redis_manager
+
+        key = f"{self.prefix}{breaker.provider}"
+        try:
+            client = get_redis_manager().client
+            await client.hset(key, mapping={"state": breaker.state, "opened_until": breaker.opened_until})
+            await client.expire(key, 86400)
+            await get_pubsub_dispatcher().publish(
+                self.channel,
+                f"{self._instance_id}|{breaker.provider}|{breaker.state}|{breaker.opened_until}"
+            )
+        except Exception as e:
+            logger.warning(f"⚠️ Failed to share circuit state for {breaker.provider}: {e}")
+
+    async def _on_message(self, channel: str, data: str):
+        """处理其他 worker 的状态变更"""
+        try:
+            origin, provider, state, opened_until = data.split("|")
+            opened_until = float(opened_until)
+        except ValueError:
+            logger.warning(f"Malformed circuit breaker message: {data}")
+            return
+
+        if origin == self._instance_id:
+            return
+
+        self.get(provider).apply_remote(state, opened_until)
+
+
+# 全局熔断器注册表
+circuit_breakers = CircuitBreakerRegistry()
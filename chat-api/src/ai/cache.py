@@ -0,0 +1,236 @@
+"""
+💾 AI 回复缓存
+
+客服场景中大量问题高度重复（营业时间、退款政策等），缓存回复可省去付费调用与数秒延迟
+- 精确匹配: 规范化后的系统提示词 + 上下文 + 问题 + 模型参数，存储在 cache_redis 中并设置 TTL
+- 相似匹配（可选）: 进程内字符 n-gram 索引，在上下文相同的前提下按 Jaccard 相似度命中
+- 按租户失效: 每个租户一个代数计数器，失效时递增，旧代数的键自然过期
+- 回放: 缓存的回复按片段回放，前端依然收到 ai_stream 帧
+"""
+
+import asyncio
+import hashlib
+import json
+import re
+import time
+import unicodedata
+from collections import OrderedDict
+from typing import Any, AsyncGenerator, Dict, FrozenSet, List, Optional, Tuple
+
+from loguru import logger
+
+from src.config.settings import get_settings
+from src.utils.cache import TTLCache
+from src.utils.metrics import metrics
+
+settings = get_settings()
+
+DEFAULT_TENANT = "default"
+
+_WHITESPACE = re.compile(r"\s+")
+_TRAILING_PUNCTUATION = "?？!！。.,，~～ "
+
+
+def normalize_text(text: str) -> str:
+    """规范化文本：全半角统一、小写、折叠空白、去掉结尾标点"""
+    text = unicodedata.normalize("NFKC", text or "").lower()
+    return _WHITESPACE.sub(" ", text).strip().rstrip(_TRAILING_PUNCTUATION)
+
+
+def _digest(value: Any) -> str:
+    raw = json.dumps(value, ensure_ascii=False, sort_keys=True, separators=(",", ":"))
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+def _ngrams(text: str, n: int = 3) -> FrozenSet[str]:
+    if len(text) <= n:
+        return frozenset((text,))
+    return frozenset(text[i:i + n] for i in range(len(text) - n + 1))
+
+
+class CacheKey:
+    """一次请求的缓存键"""
+
+    __slots__ = ("tenant", "scope", "question", "digest")
+
+    def __init__(self, tenant: str, scope: str, question: str):
+        self.tenant = tenant
+        # scope 覆盖提示词、上下文与模型参数，相似匹配只在同一 scope 内进行
+        self.scope = scope
+        self.question = question
+        self.digest = _digest([scope, question])
+
+
+class SimilarityIndex:
+    """进程内 n-gram 相似度索引"""
+
+    def __init__(self, max_entries: int, threshold: float):
+        self.max_entries = max_entries
+        self.threshold = threshold
+        # (tenant, scope) -> {question: (ngrams, digest)}
+        self._groups: "OrderedDict[Tuple[str, str], OrderedDict[str, Tuple[FrozenSet[str], str]]]" = OrderedDict()
+        self._size = 0
+
+    def add(self, key: CacheKey):
+        group = self._groups.setdefault((key.tenant, key.scope), OrderedDict())
+        self._groups.move_to_end((key.tenant, key.scope))
+        if key.question not in group:
+            self._size += 1
+        group[key.question] = (_ngrams(key.question), key.digest)
+        group.move_to_end(key.question)
+
+        while self._size > self.max_entries and self._groups:
+            oldest_key, oldest = next(iter(self._groups.items()))
+            oldest.popitem(last=False)
+            self._size -= 1
+            if not oldest:
+                del self._groups[oldest_key]
+
+    def find(self, key: CacheKey) -> Optional[str]:
+        """查找最相似问题的摘要"""
+        group = self._groups.get((key.tenant, key.scope))
+        if not group:
+            return None
+
+        grams = _ngrams(key.question)
+        best_digest, best_score = None, self.threshold
+        for question_grams, digest in group.values():
+            union = len(grams | question_grams)
+            score = len(grams & question_grams) / union if union else 0.0
+            if score >= best_score:
+                best_digest, best_score = digest, score
+        return best_digest
+
+    def clear_tenant(self, tenant: str):
+        for group_key in [group_key for group_key in self._groups if group_key[0] == tenant]:
+            self._size -= len(self._groups.pop(group_key))
+
+
+class ResponseCache:
+    """AI 回复缓存"""
+
+    def __init__(self, prefix: str = "ai_cache:", generation_prefix: str = "ai_cache_gen:"):
+        self.prefix = prefix
+        self.generation_prefix = generation_prefix
+        self.enabled = settings.AI_CACHE_ENABLED
+        self.ttl = settings.AI_CACHE_TTL
+        # 租户代数在本地缓存片刻，其他 worker 的失效最多延迟这么久生效
+        self._generations: TTLCache[int] = TTLCache("ai_cache_generation", 1000, settings.AI_CACHE_GENERATION_TTL)
+        self.similarity: Optional[SimilarityIndex] = None
+        if settings.AI_CACHE_SIMILARITY_ENABLED:
+            self.similarity = SimilarityIndex(
+                settings.AI_CACHE_SIMILARITY_MAX_ENTRIES,
+                settings.AI_CACHE_SIMILARITY_THRESHOLD
+            )
+
+    @property
+    def redis(self):
+        from src.core.redis import get_redis_manager
+        return get_redis_manager().cache
+
+    def make_key(
+        self,
+        question: str,
+        system_prompt: Optional[str] = None,
+        history: Optional[List[Dict[str, str]]] = None,
+        tenant: Optional[str] = None,
+        **params
+    ) -> CacheKey:
+        """构建缓存键"""
+        scope = _digest({
+            "system": normalize_text(system_prompt or ""),
+            "history": [
+                [turn.get("role", ""), normalize_text(turn.get("content", ""))]
+                for turn in history or ()
+            ],
+            "params": params,
+        })
+        return CacheKey(tenant or DEFAULT_TENANT, scope, normalize_text(question))
+
+    async def _generation(self, tenant: str) -> int:
+        generation = self._generations.get(tenant, record=False)
+        if generation is None:
+            generation = int(await self.redis.get(f"{self.generation_prefix}{tenant}") or 0)
+            self._generations.set(tenant, generation)
+        return generation
+
+    def _redis_key(self, tenant: str, generation: int, digest: str) -> str:
+        return f"{self.prefix}{tenant}:{generation}:{digest}"
+
+    async def get(self, key: CacheKey) -> Optional[str]:
+        """查找缓存的回复（先精确匹配，再相似匹配）"""
+        if not self.enabled:
+            return None
+
+        try:
+            generation = await self._generation(key.tenant)
+            raw = await self.redis.get(self._redis_key(key.tenant, generation, key.digest))
+
+            if raw is None and self.similarity is not None:
+                similar_digest = self.similarity.find(key)
+                if similar_digest and similar_digest != key.digest:
+                    raw = await self.redis.get(self._redis_key(key.tenant, generation, similar_digest))
+                    if raw is not None:
+                        logger.debug(f"AI response cache similarity hit for tenant {key.tenant}")
+        except Exception as e:
+            logger.warning(f"AI response cache lookup failed: {e}")
+            return None
+
+        metrics.record_cache_lookup("ai_response", raw is not None)
+        if raw is None:
+            return None
+
+        try:
+            return json.loads(raw)["content"]
+        except (ValueError, KeyError):
+            return None
+
+    async def set(self, key: CacheKey, content: str, provider: Optional[str] = None):
+        """缓存回复"""
+        if not self.enabled or not content:
+            return
+
+        entry = json.dumps({
+            "content": content,
+            "provider": provider,
+            "created_at": time.time(),
+        }, ensure_ascii=False)
+
+        try:
+            generation = await self._generation(key.tenant)
+            await self.redis.set(self._redis_key(key.tenant, generation, key.digest), entry, ex=self.ttl)
+        except Exception as e:
+            logger.warning(f"AI response cache write failed: {e}")
+            return
+
+        if self.similarity is not None:
+            self.similarity.add(key)
+
+    async def invalidate(self, tenant: Optional[str] = None) -> int:
+        """
+        使租户的全部缓存失效
+
+        Returns:
+            新的代数
+        """
+        tenant = tenant or DEFAULT_TENANT
+        generation = await self.redis.incr(f"{self.generation_prefix}{tenant}")
+        self._generations.set(tenant, generation)
+        if self.similarity is not None:
+            self.similarity.clear_tenant(tenant)
+        logger.info(f"AI response cache invalidated for tenant {tenant} (generation {generation})")
+        return generation
+
+    async def replay(self, content: str) -> AsyncGenerator[str, None]:
+        """把缓存的回复按片段回放"""
+        chunk_size = max(1, settings.AI_CACHE_REPLAY_CHUNK_SIZE)
+        delay = settings.AI_CACHE_REPLAY_DELAY
+
+        for offset in range(0, len(content), chunk_size):
+            yield content[offset:offset + chunk_size]
+            # 让出事件循环，长回复回放时不独占 worker
+            await asyncio.sleep(delay)
+
+
+# 全局回复缓存实例
+response_cache = ResponseCache()
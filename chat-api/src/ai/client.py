@@ -12,6 +12,7 @@ from typing import Dict, List, Optional, Any, AsyncGenerator
 import httpx
 from loguru import logger
 
+from src.ai.transport import ProviderTransport
 from src.config.settings import get_settings
 from src.core.exceptions import AIServiceException
 from src.utils.metrics import metrics
@@ -22,10 +23,15 @@ settings = get_settings()
 class AIClient(ABC):
     """AI客户端抽象基类"""
     
+    provider: str = "unknown"
+    # 轻量探测路径（列出模型，不产生计费）
+    probe_path: str = "/models"
+    
     def __init__(self, api_key: str, base_url: str = None):
         self.api_key = api_key
         self.base_url = base_url
-        self.client = httpx.AsyncClient(timeout=settings.AI_TIMEOUT)
+        self.transport = ProviderTransport(self.provider, base_url)
+        self.client = self.transport.client
     
     @abstractmethod
     async def send_message(
@@ -45,14 +51,31 @@ class AIClient(ABC):
         """流式发送消息"""
         pass
     
+    async def probe(self) -> bool:
+        """探测服务可用性"""
+        response = await self.transport.request(
+            "GET",
+            self.probe_path,
+            headers={"Authorization": f"Bearer {self.api_key}"},
+            timeout=settings.AI_BREAKER_PROBE_TIMEOUT
+        )
+        return response.is_success
+    
+    async def warm_up(self):
+        """预热连接池"""
+        await self.transport.warm_up()
+    
     async def close(self):
         """关闭客户端"""
-        await self.client.aclose()
+        await self.transport.close()
 
 
 class DashScopeClient(AIClient):
     """阿里百炼 DashScope 客户端"""
     
+    provider = "dashscope"
+    probe_path = "/compatible-mode/v1/models"
+    
     def __init__(self, api_key: str = None):
         super().__init__(
             api_key=api_key or settings.DASHSCOPE_API_KEY,
@@ -85,8 +108,9 @@ class DashScopeClient(AIClient):
             }
             
             # 发送请求
-            response = await self.client.post(
-                f"{self.base_url}/api/v1/services/aigc/text-generation/generation",
+            response = await self.transport.request(
+                "POST",
+                "/api/v1/services/aigc/text-generation/generation",
                 json=data,
                 headers={
                     "Authorization": f"Bearer {self.api_key}",
@@ -153,9 +177,9 @@ class DashScopeClient(AIClient):
             }
 
             # 发送流式请求
-            async with self.client.stream(
+            async with self.transport.stream(
                 "POST",
-                f"{self.base_url}/api/v1/services/aigc/text-generation/generation",
+                "/api/v1/services/aigc/text-generation/generation",
                 json=data,
                 headers={
                     "Authorization": f"Bearer {self.api_key}",
@@ -212,6 +236,8 @@ class DashScopeClient(AIClient):
 class OpenAIClient(AIClient):
     """OpenAI 客户端"""
     
+    provider = "openai"
+    
     def __init__(self, api_key: str = None):
         super().__init__(
             api_key=api_key or settings.OPENAI_API_KEY,
@@ -239,8 +265,9 @@ class OpenAIClient(AIClient):
             }
             
             # 发送请求
-            response = await self.client.post(
-                f"{self.base_url}/chat/completions",
+            response = await self.transport.request(
+                "POST",
+                "/chat/completions",
                 json=data,
                 headers={
                     "Authorization": f"Bearer {self.api_key}",
@@ -296,9 +323,9 @@ class OpenAIClient(AIClient):
             }
             
             # 发送流式请求
-            async with self.client.stream(
+            async with self.transport.stream(
                 "POST",
-                f"{self.base_url}/chat/completions",
+                "/chat/completions",
                 json=data,
                 headers={
                     "Authorization": f"Bearer {self.api_key}",
@@ -342,6 +369,7 @@ class OpenAIClient(AIClient):
 # 全局AI客户端实例
 _dashscope_client: Optional[DashScopeClient] = None
 _openai_client: Optional[OpenAIClient] = None
+_clients_lock = asyncio.Lock()
 
 
 async def get_dashscope_client() -> Optional[DashScopeClient]:
@@ -352,7 +380,9 @@ async def get_dashscope_client() -> Optional[DashScopeClient]:
         return None
     
     if not _dashscope_client:
-        _dashscope_client = DashScopeClient()
+        async with _clients_lock:
+            if not _dashscope_client:
+                _dashscope_client = DashScopeClient()
     
     return _dashscope_client
 
@@ -365,39 +395,61 @@ async def get_openai_client() -> Optional[OpenAIClient]:
         return None
     
     if not _openai_client:
-        _openai_client = OpenAIClient()
+        async with _clients_lock:
+            if not _openai_client:
+                _openai_client = OpenAIClient()
     
     return _openai_client
 
 
+async def get_ai_client(provider: str) -> Optional[AIClient]:
+    """按名称获取AI客户端"""
+    if provider == "dashscope":
+        return await get_dashscope_client()
+    if provider == "openai":
+        return await get_openai_client()
+    raise AIServiceException(f"Unknown AI provider: {provider}")
+
+
+def get_ai_clients() -> List[AIClient]:
+    """获取已初始化的AI客户端"""
+    return [client for client in (_dashscope_client, _openai_client) if client]
+
+
 async def init_ai_clients():
-    """初始化AI客户端"""
-    global _dashscope_client, _openai_client
-    
+    """初始化AI客户端并预热连接池"""
     # 初始化DashScope客户端
-    if settings.DASHSCOPE_API_KEY:
-        _dashscope_client = DashScopeClient()
+    if await get_dashscope_client():
         logger.info("✅ DashScope client initialized")
     
     # 初始化OpenAI客户端
-    if settings.OPENAI_API_KEY:
-        _openai_client = OpenAIClient()
+    if await get_openai_client():
         logger.info("✅ OpenAI client initialized")
     
-    if not _dashscope_client and not _openai_client:
+    clients = get_ai_clients()
+    if not clients:
         logger.warning("⚠️ No AI clients configured")
+        return
+    
+    await asyncio.gather(*(client.warm_up() for client in clients))
 
 
 async def close_ai_clients():
     """关闭AI客户端"""
     global _dashscope_client, _openai_client
     
-    if _dashscope_client:
-        await _dashscope_client.close()
+    async with _clients_lock:
+        clients = get_ai_clients()
         _dashscope_client = None
-    
-    if _openai_client:
-        await _openai_client.close()
         _openai_client = None
     
+    for client in clients:
+        await client.close()
+    
     logger.info("✅ AI clients closed")
+
+
+def export_ai_transport_metrics():
+    """导出AI连接池指标"""
+    for client in get_ai_clients():
+        client.transport.export_metrics()
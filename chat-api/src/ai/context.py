@@ -0,0 +1,281 @@
+"""
+🧠 对话上下文引擎
+
+每个对话在 Redis 中维护最近若干轮消息的滚动窗口，消息创建时追加，
+构建提示词时不需要查询数据库，也不需要重新计算令牌数
+- 每轮消息在追加时计算一次令牌数，构建时按令牌预算从新到旧选取
+- 超出窗口的旧消息可以折叠进运行摘要（可选），预算不足时用摘要替代更早的对话
+- 缓存缺失（过期或服务重启）时从数据库加载一次
+"""
+
+import asyncio
+import json
+from typing import Any, Dict, List, Optional, Sequence
+
+from loguru import logger
+
+from src.ai.tokenizer import get_tokenizer
+from src.config.settings import get_settings
+
+settings = get_settings()
+
+# 发送者类型到AI角色的映射，其他类型（系统消息等）不进入上下文
+SENDER_ROLES = {
+    "contact": "user",
+    "agent": "assistant",
+    "ai": "assistant",
+}
+
+SUMMARY_PROMPT = (
+    "请将以下客服对话要点合并进已有摘要，保留用户的问题、诉求、已提供的信息和已给出的答复，"
+    "不超过 {max_tokens} 个令牌，只输出摘要本身。"
+)
+
+
+def _sender_value(sender_type: Any) -> str:
+    return sender_type.value if hasattr(sender_type, "value") else str(sender_type)
+
+
+class ConversationContext:
+    """对话上下文引擎"""
+
+    def __init__(
+        self,
+        prefix: str = "ai_context:",
+        summary_prefix: str = "ai_context_summary:",
+        max_turns: int = None,
+        ttl: int = None
+    ):
+        self.prefix = prefix
+        self.summary_prefix = summary_prefix
+        self.max_turns = max_turns or settings.AI_CONTEXT_MAX_TURNS
+        self.ttl = ttl or settings.AI_CONTEXT_TTL
+        self.tokenizer = get_tokenizer()
+        self.summary_enabled = settings.AI_CONTEXT_SUMMARY_ENABLED
+        self._summary_tasks: Dict[int, asyncio.Task] = {}
+
+    @property
+    def redis(self):
+        from src.core.redis import get_redis_manager
+        return get_redis_manager().cache
+
+    def _key(self, conversation_id: int) -> str:
+        return f"{self.prefix}{conversation_id}"
+
+    def _summary_key(self, conversation_id: int) -> str:
+        return f"{self.summary_prefix}{conversation_id}"
+
+    def make_turn(self, message_id: Any, sender_type: Any, content: str) -> Optional[Dict[str, Any]]:
+        """把消息转换为上下文轮次（不参与上下文的消息返回 None）"""
+        role = SENDER_ROLES.get(_sender_value(sender_type))
+        if role is None or not content:
+            return None
+        return {
+            "id": message_id,
+            "role": role,
+            "content": content,
+            "tokens": self.tokenizer.count_message(content),
+        }
+
+    # ==========================================
+    # ➕ 追加
+    # ==========================================
+
+    async def append(self, message) -> None:
+        """
+        追加新消息到对话窗口
+
+        窗口不存在时不创建（RPUSHX），下次构建时从数据库完整加载，避免窗口只包含最新一条
+        """
+        if getattr(message, "is_private", False):
+            return
+
+        turn = self.make_turn(message.id, message.sender_type, message.content)
+        if turn is None:
+            return
+
+        key = self._key(message.conversation_id)
+        try:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                pipe.rpushx(key, json.dumps(turn, ensure_ascii=False))
+                pipe.expire(key, self.ttl)
+                length, _ = await pipe.execute()
+
+            if length > self.max_turns:
+                await self._trim(message.conversation_id, length - self.max_turns)
+        except Exception as e:
+            logger.warning(f"Failed to append message to AI context: {e}")
+
+    async def _trim(self, conversation_id: int, overflow: int):
+        """移出窗口外的旧消息，按需折叠进摘要"""
+        key = self._key(conversation_id)
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.lrange(key, 0, overflow - 1)
+            pipe.ltrim(key, overflow, -1)
+            removed, _ = await pipe.execute()
+
+        if self.summary_enabled and removed:
+            self._schedule_summary(conversation_id, [json.loads(item) for item in removed])
+
+    # ==========================================
+    # 🏗️ 构建
+    # ==========================================
+
+    async def build(
+        self,
+        conversation_id: int,
+        max_tokens: int = None,
+        exclude_ids: Sequence[Any] = (),
+        db=None
+    ) -> List[Dict[str, str]]:
+        """
+        构建对话上下文
+
+        Args:
+            conversation_id: 对话ID
+            max_tokens: 令牌预算
+            exclude_ids: 不计入上下文的消息ID（例如当前正在回复的用户消息，它会单独追加）
+            db: 数据库会话，窗口缺失时用于加载历史
+
+        Returns:
+            按时间顺序的 [{"role": ..., "content": ...}]
+        """
+        max_tokens = max_tokens or settings.AI_CONTEXT_MAX_TOKENS
+        turns, summary = await self._load(conversation_id, db)
+
+        excluded = {str(message_id) for message_id in exclude_ids}
+        selected: List[Dict[str, Any]] = []
+        used = 0
+
+        # 从新到旧选取，最后整体反转一次
+        for turn in reversed(turns):
+            if str(turn.get("id")) in excluded:
+                continue
+            tokens = turn.get("tokens") or self.tokenizer.count_message(turn["content"])
+            if used + tokens > max_tokens:
+                break
+            selected.append({"role": turn["role"], "content": turn["content"]})
+            used += tokens
+        selected.reverse()
+
+        # 更早的对话已移出窗口并折叠进摘要时，用摘要替代
+        if summary.get("summary"):
+            summary_tokens = int(summary.get("tokens") or 0)
+            while selected and used + summary_tokens > max_tokens:
+                dropped = selected.pop(0)
+                used -= self.tokenizer.count_message(dropped["content"])
+            if used + summary_tokens <= max_tokens:
+                selected.insert(0, {"role": "system", "content": f"此前对话摘要：{summary['summary']}"})
+
+        return selected
+
+    async def _load(self, conversation_id: int, db=None):
+        """读取窗口与摘要，窗口缺失时从数据库加载"""
+        key = self._key(conversation_id)
+        try:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                pipe.lrange(key, 0, -1)
+                pipe.hgetall(self._summary_key(conversation_id))
+                raw_turns, summary = await pipe.execute()
+        except Exception as e:
+            logger.warning(f"Failed to read AI context from Redis: {e}")
+            raw_turns, summary = [], {}
+
+        if raw_turns:
+            return [json.loads(item) for item in raw_turns], summary
+
+        if db is None:
+            return [], summary
+
+        turns = await self._load_from_db(conversation_id, db)
+        await self._store(conversation_id, turns)
+        return turns, summary
+
+    async def _load_from_db(self, conversation_id: int, db) -> List[Dict[str, Any]]:
+        from src.services.queries import context_messages_query
+
+        rows = (await db.execute(context_messages_query(conversation_id, self.max_turns))).all()
+
+        turns = []
+        for message_id, sender_type, content in reversed(rows):
+            turn = self.make_turn(message_id, sender_type, content)
+            if turn is not None:
+                turns.append(turn)
+        return turns
+
+    async def _store(self, conversation_id: int, turns: List[Dict[str, Any]]):
+        if not turns:
+            return
+
+        key = self._key(conversation_id)
+        try:
+            async with self.redis.pipeline(transaction=True) as pipe:
+                pipe.delete(key)
+                pipe.rpush(key, *(json.dumps(turn, ensure_ascii=False) for turn in turns))
+                pipe.expire(key, self.ttl)
+                await pipe.execute()
+        except Exception as e:
+            logger.warning(f"Failed to store AI context: {e}")
+
+    async def clear(self, conversation_id: int):
+        """清除对话的窗口与摘要"""
+        await self.redis.delete(self._key(conversation_id), self._summary_key(conversation_id))
+
+    # ==========================================
+    # 📝 运行摘要
+    # ==========================================
+
+    async def get_summary(self, conversation_id: int) -> Optional[str]:
+        """获取对话摘要"""
+        return await self.redis.hget(self._summary_key(conversation_id), "summary")
+
+    async def set_summary(self, conversation_id: int, summary: str):
+        """保存对话摘要（替代已移出窗口的消息）"""
+        key = self._summary_key(conversation_id)
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.hset(key, mapping={
+                "summary": summary,
+                "tokens": self.tokenizer.count_message(summary),
+            })
+            pipe.expire(key, self.ttl)
+            await pipe.execute()
+
+    def _schedule_summary(self, conversation_id: int, removed: List[Dict[str, Any]]):
+        previous = self._summary_tasks.get(conversation_id)
+
+        async def run():
+            # 同一对话的摘要按顺序折叠
+            if previous is not None:
+                await asyncio.gather(previous, return_exceptions=True)
+            try:
+                await self._fold_summary(conversation_id, removed)
+            finally:
+                if self._summary_tasks.get(conversation_id) is task:
+                    del self._summary_tasks[conversation_id]
+
+        task = asyncio.create_task(run())
+        self._summary_tasks[conversation_id] = task
+
+    async def _fold_summary(self, conversation_id: int, removed: List[Dict[str, Any]]):
+        """把移出窗口的消息折叠进运行摘要"""
+        from src.ai.service import ai_service
+
+        try:
+            previous = await self.get_summary(conversation_id) or "（无）"
+            transcript = "\n".join(f"{turn['role']}: {turn['content']}" for turn in removed)
+            max_tokens = settings.AI_CONTEXT_SUMMARY_MAX_TOKENS
+
+            summary = await ai_service.chat_completion(
+                f"已有摘要：\n{previous}\n\n新的对话：\n{transcript}",
+                system_prompt=SUMMARY_PROMPT.format(max_tokens=max_tokens),
+                use_cache=False,
+                max_tokens=max_tokens
+            )
+            if summary:
+                await self.set_summary(conversation_id, summary.strip())
+        except Exception as e:
+            logger.warning(f"Failed to update AI context summary for conversation {conversation_id}: {e}")
+
+
+# 全局对话上下文实例
+conversation_context = ConversationContext()
@@ -0,0 +1,388 @@
+"""
+📬 AI 回复队列
+
+AI 回复由固定数量的 worker 处理，不再为每条消息创建不受控的任务
+- 并发上限: 同时进行的提供商流式请求和数据库会话数不超过 worker 数
+- 优先级: 按对话优先级（urgent > high > medium > low）出队
+- 公平性: 同优先级下在租户（无租户时为终端用户）之间轮转，单个来源刷屏不会饿死其他人
+- 会话串行: 同一会话同时最多处理一条回复，后续消息等前一条回复结束后按顺序处理
+- 排队反馈: 排队中的会话定期收到 ai_queue 帧（位置与预计等待时间）
+- 优雅退出: 停止接收新任务，在超时内处理完已排队的任务
+"""
+
+import asyncio
+import heapq
+import itertools
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+from loguru import logger
+
+from src.config.settings import get_settings
+from src.core.exceptions import RateLimitException
+from src.utils.cache import TTLCache
+from src.utils.metrics import metrics
+
+settings = get_settings()
+
+PRIORITY_LEVELS = {
+    "low": 0,
+    "medium": 1,
+    "high": 2,
+    "urgent": 3,
+}
+
+
+class AIReplyJob:
+    """一次AI回复任务"""
+
+    __slots__ = (
+        "session_id", "conversation_id", "user_message", "user_message_id",
+        "fairness_key", "priority", "seq", "enqueued_at", "notified",
+    )
+
+    def __init__(
+        self,
+        session_id: str,
+        conversation_id: int,
+        user_message: str,
+        user_message_id: Optional[int],
+        fairness_key: str,
+        priority: int,
+        seq: int
+    ):
+        self.session_id = session_id
+        self.conversation_id = conversation_id
+        self.user_message = user_message
+        self.user_message_id = user_message_id
+        self.fairness_key = fairness_key
+        self.priority = priority
+        self.seq = seq
+        self.enqueued_at = time.monotonic()
+        # 是否已向客户端发送过排队帧
+        self.notified = False
+
+    def sort_key(self) -> Tuple[int, int]:
+        return (-self.priority, self.seq)
+
+    def __lt__(self, other: "AIReplyJob") -> bool:
+        return self.sort_key() < other.sort_key()
+
+
+class AIReplyQueue:
+    """有界并发、按优先级与公平性调度的AI回复队列"""
+
+    def __init__(
+        self,
+        handler: Callable[[AIReplyJob], Awaitable[None]] = None,
+        workers: int = None,
+        max_size: int = None
+    ):
+        self._handler = handler
+        self.worker_count = workers or settings.AI_QUEUE_WORKERS
+        self.max_size = max_size or settings.AI_QUEUE_MAX_SIZE
+
+        # 公平性键 -> 该来源的任务堆；顺序为最久未被服务的来源在前
+        self._buckets: "OrderedDict[str, List[AIReplyJob]]" = OrderedDict()
+        self._size = 0
+        self._seq = itertools.count()
+        self._available = asyncio.Event()
+
+        self._workers: List[asyncio.Task] = []
+        self._notifier: Optional[asyncio.Task] = None
+        self._active = 0
+        # 正在处理回复的会话
+        self._busy: Set[str] = set()
+        self._accepting = False
+        self._idle = asyncio.Event()
+        self._idle.set()
+
+        # 平均处理耗时（EWMA），用于估算等待时间
+        self._avg_duration = 5.0
+        self._priorities: TTLCache[int] = TTLCache("conversation_priority", 10000, 30.0)
+
+    @property
+    def depth(self) -> int:
+        return self._size
+
+    @property
+    def active(self) -> int:
+        return self._active
+
+    # ==========================================
+    # 🚀 生命周期
+    # ==========================================
+
+    def start(self):
+        """启动 worker"""
+        if self._accepting:
+            return
+
+        self._accepting = True
+        for index in range(self.worker_count):
+            self._spawn_worker(index)
+        self._notifier = asyncio.create_task(self._notify_loop())
+        logger.info(f"✅ AI reply queue started with {self.worker_count} workers")
+
+    def _spawn_worker(self, index: int):
+        task = asyncio.create_task(self._worker_loop(index))
+        task.add_done_callback(lambda finished, index=index: self._on_worker_exit(index, finished))
+        if index < len(self._workers):
+            self._workers[index] = task
+        else:
+            self._workers.append(task)
+
+    def _on_worker_exit(self, index: int, task: asyncio.Task):
+        # worker 异常退出时由监督逻辑重启
+        if not self._accepting or task.cancelled():
+            return
+        logger.error(f"AI reply worker {index} exited unexpectedly: {task.exception()}, restarting")
+        self._spawn_worker(index)
+
+    async def stop(self, timeout: float = None):
+        """
+        优雅停止
+
+        停止接收新任务，等待已排队和进行中的任务在超时内完成，随后取消剩余任务
+        """
+        if not self._workers:
+            return
+
+        timeout = settings.AI_QUEUE_DRAIN_TIMEOUT if timeout is None else timeout
+        self._accepting = False
+        logger.info(f"🔄 Draining AI reply queue ({self._size} queued, {self._active} active)")
+
+        deadline = time.monotonic() + timeout
+        while (self._size or self._active) and time.monotonic() < deadline:
+            self._idle.clear()
+            try:
+                await asyncio.wait_for(self._idle.wait(), deadline - time.monotonic())
+            except asyncio.TimeoutError:
+                break
+
+        dropped = self._size
+        if dropped:
+            logger.warning(f"⚠️ AI reply queue drain timed out, dropping {dropped} queued jobs")
+            self._buckets.clear()
+            self._size = 0
+
+        tasks = self._workers + ([self._notifier] if self._notifier else [])
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        self._workers = []
+        self._notifier = None
+        metrics.set_ai_queue_stats(0, 0)
+
+    # ==========================================
+    # 📥 入队
+    # ==========================================
+
+    async def submit(
+        self,
+        session_id: str,
+        conversation_id: int,
+        user_message: str,
+        user_message_id: int = None,
+        fairness_key: str = None,
+        db=None
+    ) -> int:
+        """
+        提交AI回复任务
+
+        Returns:
+            排队位置（0 表示有空闲 worker，会立即处理）
+
+        Raises:
+            RateLimitException: 队列已满或正在停止
+        """
+        if not self._accepting:
+            raise RateLimitException("AI服务正在重启，请稍后重试")
+        if self._size >= self.max_size:
+            metrics.record_ai_queue_rejected()
+            raise RateLimitException("AI服务繁忙，请稍后重试", details={"queue_depth": self._size})
+
+        priority = await self._get_priority(conversation_id, db)
+        job = AIReplyJob(
+            session_id, conversation_id, user_message, user_message_id,
+            fairness_key or session_id, priority, next(self._seq)
+        )
+
+        bucket = self._buckets.get(job.fairness_key)
+        if bucket is None:
+            bucket = self._buckets[job.fairness_key] = []
+        heapq.heappush(bucket, job)
+        self._size += 1
+        self._available.set()
+
+        position = max(0, self._size - self._idle_workers())
+        metrics.set_ai_queue_stats(self._size, self._active)
+        if position > 0:
+            await self._send_position(job, position)
+        return position
+
+    def _idle_workers(self) -> int:
+        return max(0, len(self._workers) - self._active)
+
+    async def _get_priority(self, conversation_id: int, db=None) -> int:
+        priority = self._priorities.get(conversation_id)
+        if priority is not None:
+            return priority
+
+        priority = PRIORITY_LEVELS["medium"]
+        if db is not None:
+            from sqlalchemy import select
+
+            from src.models.conversation import Conversation
+
+            try:
+                value = (await db.execute(
+                    select(Conversation.priority).where(Conversation.id == conversation_id)
+                )).scalar_one_or_none()
+                if value is not None:
+                    priority = PRIORITY_LEVELS.get(getattr(value, "value", value), priority)
+            except Exception as e:
+                logger.warning(f"Failed to load conversation priority: {e}")
+
+        self._priorities.set(conversation_id, priority)
+        return priority
+
+    def set_priority(self, conversation_id: int, priority: Any):
+        """对话优先级变更时更新缓存"""
+        self._priorities.set(conversation_id, PRIORITY_LEVELS.get(getattr(priority, "value", priority), 1))
+
+    # ==========================================
+    # 📤 出队与处理
+    # ==========================================
+
+    def _pop(self) -> Optional[AIReplyJob]:
+        """
+        取出优先级最高的任务，同优先级时取最久未被服务的来源
+
+        正在处理回复的会话的任务跳过，留在队列中等前一条回复结束
+        """
+        best_key, best_job = None, None
+        for key, bucket in self._buckets.items():
+            head = bucket[0]
+            if head.session_id in self._busy:
+                head = min((job for job in bucket if job.session_id not in self._busy), default=None)
+                if head is None:
+                    continue
+            if best_job is None or head.priority > best_job.priority:
+                best_key, best_job = key, head
+
+        if best_job is None:
+            return None
+
+        bucket = self._buckets.pop(best_key)
+        if bucket[0] is best_job:
+            heapq.heappop(bucket)
+        else:
+            bucket.remove(best_job)
+            heapq.heapify(bucket)
+        if bucket:
+            # 被服务的来源移到末尾
+            self._buckets[best_key] = bucket
+        self._size -= 1
+        self._busy.add(best_job.session_id)
+        return best_job
+
+    async def _worker_loop(self, index: int):
+        while True:
+            job = self._pop()
+            if job is None:
+                self._available.clear()
+                if not self._active:
+                    self._idle.set()
+                await self._available.wait()
+                continue
+
+            self._active += 1
+            wait_time = time.monotonic() - job.enqueued_at
+            metrics.record_ai_queue_wait(wait_time)
+            metrics.set_ai_queue_stats(self._size, self._active)
+
+            start_time = time.monotonic()
+            try:
+                if job.notified:
+                    await self._send_position(job, 0)
+                await self._run(job)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"AI reply job for session {job.session_id} failed: {e}")
+            finally:
+                duration = time.monotonic() - start_time
+                self._avg_duration = 0.8 * self._avg_duration + 0.2 * duration
+                self._active -= 1
+                self._busy.discard(job.session_id)
+                metrics.set_ai_queue_stats(self._size, self._active)
+                if self._size:
+                    # 该会话排队中的任务现在可以处理
+                    self._available.set()
+                elif not self._active:
+                    self._idle.set()
+
+    async def _run(self, job: AIReplyJob):
+        if self._handler is not None:
+            await self._handler(job)
+            return
+
+        from src.services.message import _process_ai_response_async
+
+        await _process_ai_response_async(
+            job.session_id,
+            job.conversation_id,
+            job.user_message,
+            job.user_message_id
+        )
+
+    # ==========================================
+    # 📣 排队反馈
+    # ==========================================
+
+    def _estimated_wait(self, position: int) -> float:
+        return round(position * self._avg_duration / max(1, self.worker_count), 1)
+
+    async def _send_position(self, job: AIReplyJob, position: int):
+        from src.websocket.manager import websocket_manager
+
+        job.notified = True
+        try:
+            await websocket_manager.send_to_session(job.session_id, {
+                "type": "ai_queue",
+                "data": {
+                    "session_id": job.session_id,
+                    "status": "queued" if position else "processing",
+                    "position": position,
+                    "estimated_wait": self._estimated_wait(position),
+                }
+            })
+        except Exception as e:
+            logger.debug(f"Failed to send AI queue position: {e}")
+
+    async def _notify_loop(self):
+        """定期向排队中的会话推送位置（近似：按优先级与入队顺序排名）"""
+        while True:
+            await asyncio.sleep(settings.AI_QUEUE_POSITION_INTERVAL)
+            if not self._size:
+                continue
+
+            queued = sorted(job for bucket in self._buckets.values() for job in bucket)
+            for position, job in enumerate(queued, start=1):
+                await self._send_position(job, position)
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取队列统计"""
+        return {
+            "workers": len(self._workers),
+            "active": self._active,
+            "depth": self._size,
+            "sources": len(self._buckets),
+            "avg_duration": round(self._avg_duration, 3),
+        }
+
+
+# 全局AI回复队列
+ai_reply_queue = AIReplyQueue()
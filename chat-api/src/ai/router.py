@@ -0,0 +1,165 @@
+"""
+🧭 AI 服务路由
+
+按提供商跟踪 EWMA 延迟、首字延迟（TTFT）与错误率，优先选择最快的健康提供商
+并基于 p95 延迟给出对冲请求的等待时间
+"""
+
+import math
+import time
+from collections import deque
+from typing import Deque, Dict, List, Optional
+
+from src.config.settings import get_settings
+
+settings = get_settings()
+
+
+class ProviderStats:
+    """单个提供商的路由统计"""
+
+    __slots__ = (
+        "latency", "ttft", "error_rate", "successes", "failures",
+        "last_failure_at", "_latency_samples", "_ttft_samples",
+    )
+
+    def __init__(self, window: int = 200):
+        self.latency: Optional[float] = None
+        self.ttft: Optional[float] = None
+        self.error_rate = 0.0
+        self.successes = 0
+        self.failures = 0
+        self.last_failure_at = 0.0
+        self._latency_samples: Deque[float] = deque(maxlen=window)
+        self._ttft_samples: Deque[float] = deque(maxlen=window)
+
+    @staticmethod
+    def _ewma(current: Optional[float], value: float, alpha: float) -> float:
+        return value if current is None else alpha * value + (1 - alpha) * current
+
+    def observe_latency(self, latency: float, ttft: Optional[float], alpha: float):
+        self.latency = self._ewma(self.latency, latency, alpha)
+        self._latency_samples.append(latency)
+        if ttft is not None:
+            self.ttft = self._ewma(self.ttft, ttft, alpha)
+            self._ttft_samples.append(ttft)
+
+    def observe_result(self, success: bool, alpha: float):
+        self.error_rate = self._ewma(self.error_rate, 0.0 if success else 1.0, alpha)
+        if success:
+            self.successes += 1
+        else:
+            self.failures += 1
+            self.last_failure_at = time.monotonic()
+
+    def percentile(self, q: float, stream: bool) -> Optional[float]:
+        samples = self._ttft_samples if stream else self._latency_samples
+        if not samples:
+            return None
+        ordered = sorted(samples)
+        return ordered[min(len(ordered) - 1, math.ceil(q * len(ordered)) - 1)]
+
+    def sample_count(self, stream: bool) -> int:
+        return len(self._ttft_samples if stream else self._latency_samples)
+
+    def to_dict(self) -> Dict[str, Optional[float]]:
+        return {
+            "latency_ewma": self.latency,
+            "ttft_ewma": self.ttft,
+            "latency_p95": self.percentile(0.95, stream=False),
+            "ttft_p95": self.percentile(0.95, stream=True),
+            "error_rate": round(self.error_rate, 4),
+            "successes": self.successes,
+            "failures": self.failures,
+        }
+
+
+class ProviderRouter:
+    """延迟感知的提供商路由器"""
+
+    def __init__(
+        self,
+        providers: List[str] = None,
+        alpha: float = None,
+        error_threshold: float = None,
+        recovery_time: float = None
+    ):
+        self.providers = providers or [
+            name.strip() for name in settings.AI_PROVIDER_ORDER.split(",") if name.strip()
+        ]
+        self.alpha = alpha or settings.AI_ROUTER_EWMA_ALPHA
+        self.error_threshold = error_threshold or settings.AI_ROUTER_ERROR_THRESHOLD
+        self.recovery_time = recovery_time or settings.AI_ROUTER_RECOVERY_TIME
+        self._stats: Dict[str, ProviderStats] = {name: ProviderStats() for name in self.providers}
+
+    def _get(self, provider: str) -> ProviderStats:
+        stats = self._stats.get(provider)
+        if stats is None:
+            stats = self._stats[provider] = ProviderStats()
+            self.providers.append(provider)
+        return stats
+
+    # ==========================================
+    # 📝 记录
+    # ==========================================
+
+    def record_success(self, provider: str, latency: float, ttft: Optional[float] = None):
+        """记录成功请求"""
+        stats = self._get(provider)
+        stats.observe_latency(latency, ttft, self.alpha)
+        stats.observe_result(True, self.alpha)
+
+    def record_failure(self, provider: str):
+        """记录失败请求"""
+        self._get(provider).observe_result(False, self.alpha)
+
+    def record_abandoned(self, provider: str, elapsed: float, stream: bool = False):
+        """
+        记录被对冲请求取代而取消的请求
+
+        已等待的时间是真实延迟的下限，计入延迟统计，避免慢提供商因为总被取消而一直排在前面
+        """
+        stats = self._get(provider)
+        stats.observe_latency(elapsed, elapsed if stream else None, self.alpha)
+
+    # ==========================================
+    # 🎯 选择
+    # ==========================================
+
+    def is_healthy(self, provider: str) -> bool:
+        """错误率低于阈值，或距上次失败已超过恢复时间"""
+        stats = self._get(provider)
+        if stats.error_rate < self.error_threshold:
+            return True
+        return time.monotonic() - stats.last_failure_at > self.recovery_time
+
+    def rank(self, candidates: List[str], stream: bool = False) -> List[str]:
+        """
+        按健康状况与延迟对候选提供商排序
+
+        没有样本的提供商视为最快，以便尽快获得统计；同分时按配置的优先顺序
+        """
+        order = {name: index for index, name in enumerate(self.providers)}
+
+        def key(provider: str):
+            stats = self._get(provider)
+            score = stats.ttft if stream and stats.ttft is not None else stats.latency
+            return (not self.is_healthy(provider), score or 0.0, order.get(provider, len(order)))
+
+        return sorted(candidates, key=key)
+
+    def hedge_delay(self, provider: str, stream: bool = False) -> float:
+        """对冲等待时间：主提供商的 p95 延迟，样本不足时使用上限"""
+        stats = self._get(provider)
+        if stats.sample_count(stream) < settings.AI_HEDGE_MIN_SAMPLES:
+            return settings.AI_HEDGE_MAX_DELAY
+
+        p95 = stats.percentile(0.95, stream)
+        return min(max(p95, settings.AI_HEDGE_MIN_DELAY), settings.AI_HEDGE_MAX_DELAY)
+
+    def get_stats(self) -> Dict[str, Dict[str, Optional[float]]]:
+        """获取路由统计"""
+        return {
+            provider: {**stats.to_dict(), "healthy": self.is_healthy(provider)}
+            for provider, stats in self._stats.items()
+        }
@@ -5,13 +5,19 @@
 """
 
 import asyncio
-from typing import Dict, List, Optional, Any, AsyncGenerator
+import time
+from typing import Dict, List, Optional, Any, AsyncGenerator, Awaitable, Callable, Tuple
 
 from loguru import logger
 
 from src.config.settings import get_settings
 from src.core.exceptions import AIServiceException
-from src.ai.client import get_dashscope_client, get_openai_client
+from src.ai.breaker import circuit_breakers
+from src.ai.cache import CacheKey, response_cache
+from src.ai.client import AIClient, get_ai_client
+from src.ai.router import ProviderRouter
+from src.ai.singleflight import single_flight
+from src.utils.metrics import metrics
 
 settings = get_settings()
 
@@ -20,9 +26,147 @@ class AIService:
     """AI服务类"""
     
     def __init__(self):
-        self.default_provider = "dashscope"  # 默认使用DashScope
+        self.router = ProviderRouter()
+        self.default_provider = self.router.providers[0] if self.router.providers else "dashscope"
         self.retry_attempts = settings.AI_RETRY_ATTEMPTS
         self.retry_delay = settings.AI_RETRY_DELAY
+        self.hedge_enabled = settings.AI_HEDGE_ENABLED
+    
+    # ==========================================
+    # 🧭 提供商选择
+    # ==========================================
+    
+    async def _get_client(self, provider: str) -> Optional[AIClient]:
+        """获取提供商客户端"""
+        return await get_ai_client(provider)
+    
+    def _record_success(self, provider: str, latency: float, ttft: Optional[float] = None):
+        """记录成功请求（流式请求按首字延迟判断是否为慢请求）"""
+        self.router.record_success(provider, latency, ttft=ttft)
+        circuit_breakers.record_success(provider, ttft if ttft is not None else latency)
+    
+    def _record_failure(self, provider: str):
+        """记录失败请求"""
+        self.router.record_failure(provider)
+        circuit_breakers.record_failure(provider)
+    
+    async def _candidates(self, provider: str = None, stream: bool = False) -> List[str]:
+        """
+        获取按优先级排序的候选提供商
+        
+        指定 provider 时优先使用，其余提供商按路由统计排序作为备用；熔断中的提供商直接跳过
+        """
+        if provider and provider not in self.router.providers:
+            raise AIServiceException(f"Unknown AI provider: {provider}")
+        
+        configured = [name for name in self.router.providers if await self._get_client(name)]
+        if not configured:
+            raise AIServiceException("No AI provider available")
+        
+        available = [name for name in configured if circuit_breakers.allow_request(name)]
+        if not available:
+            raise AIServiceException("All AI providers are temporarily unavailable (circuit open)")
+        
+        ranked = self.router.rank(available, stream=stream)
+        if provider in ranked:
+            ranked.remove(provider)
+            ranked.insert(0, provider)
+        return ranked
+    
+    async def _hedged(
+        self,
+        candidates: List[str],
+        start: Callable[[str], Awaitable[Any]],
+        stream: bool = False,
+        discard: Callable[[Any], Awaitable[None]] = None
+    ) -> Tuple[str, Any]:
+        """
+        按顺序尝试候选提供商
+        
+        开启对冲时，主请求超过对冲延迟仍未完成则并发发起下一个提供商的请求，
+        先成功者胜出，其余请求被取消；失败时立即切换到下一个提供商
+        """
+        queue = list(candidates)
+        pending: Dict[asyncio.Future, str] = {}
+        started_at: Dict[str, float] = {}
+        last_error: Optional[Exception] = None
+        hedged = False
+        
+        def launch(provider: str):
+            started_at[provider] = time.monotonic()
+            pending[asyncio.ensure_future(start(provider))] = provider
+        
+        try:
+            while queue or pending:
+                if not pending:
+                    launch(queue.pop(0))
+                
+                timeout = None
+                if self.hedge_enabled and queue and len(pending) == 1:
+                    timeout = self.router.hedge_delay(next(iter(pending.values())), stream)
+                
+                done, _ = await asyncio.wait(pending, timeout=timeout, return_when=asyncio.FIRST_COMPLETED)
+                
+                if not done:
+                    provider = queue.pop(0)
+                    logger.info(f"AI request slower than {timeout:.2f}s, hedging with {provider}")
+                    metrics.record_ai_hedge(provider, "launched")
+                    hedged = True
+                    launch(provider)
+                    continue
+                
+                winner = None
+                for task in done:
+                    provider = pending.pop(task)
+                    if task.exception() is not None:
+                        last_error = task.exception()
+                        logger.warning(f"AI provider {provider} failed: {last_error}")
+                    elif winner is None:
+                        winner = (provider, task.result())
+                    elif discard:
+                        await discard(task.result())
+                
+                if winner is not None:
+                    if hedged:
+                        metrics.record_ai_hedge(winner[0], "won")
+                    return winner
+        
+        finally:
+            # 取消落败的请求
+            for task, provider in pending.items():
+                task.cancel()
+                self.router.record_abandoned(provider, time.monotonic() - started_at[provider], stream)
+            if pending:
+                results = await asyncio.gather(*pending, return_exceptions=True)
+                if discard:
+                    # 取消前恰好完成的请求也需要释放
+                    for result in results:
+                        if not isinstance(result, BaseException):
+                            await discard(result)
+        
+        if isinstance(last_error, AIServiceException):
+            raise last_error
+        raise AIServiceException(f"All AI providers failed: {last_error}")
+    
+    # ==========================================
+    # 💬 消息发送
+    # ==========================================
+    
+    async def _send_with(self, provider: str, messages: List[Dict[str, str]], **kwargs) -> str:
+        """通过指定提供商发送并记录路由统计"""
+        client = await self._get_client(provider)
+        if not client:
+            raise AIServiceException(f"{provider} client not available")
+        
+        start_time = time.monotonic()
+        try:
+            content = await client.send_message(messages, **kwargs)
+        except Exception:
+            self._record_failure(provider)
+            raise
+        
+        self._record_success(provider, time.monotonic() - start_time)
+        return content
     
     async def send_message(
         self,
@@ -35,55 +179,59 @@ class AIService:
         
         Args:
             messages: 消息列表，格式为 [{"role": "user", "content": "..."}]
-            provider: AI服务提供商 (dashscope/openai)
+            provider: 优先使用的AI服务提供商 (dashscope/openai)，默认按路由统计选择
             **kwargs: 其他参数
             
         Returns:
             AI回复内容
         """
-        provider = provider or self.default_provider
+        last_error: Optional[Exception] = None
         
         for attempt in range(self.retry_attempts):
+            candidates = await self._candidates(provider)
             try:
-                if provider == "dashscope":
-                    client = await get_dashscope_client()
-                    if not client:
-                        raise AIServiceException("DashScope client not available")
-                    
-                    return await client.send_message(messages, **kwargs)
-                
-                elif provider == "openai":
-                    client = await get_openai_client()
-                    if not client:
-                        raise AIServiceException("OpenAI client not available")
-                    
-                    return await client.send_message(messages, **kwargs)
-                
-                else:
-                    raise AIServiceException(f"Unknown AI provider: {provider}")
+                _, content = await self._hedged(
+                    candidates,
+                    lambda name: self._send_with(name, messages, **kwargs)
+                )
+                return content
             
             except AIServiceException as e:
+                last_error = e
                 if attempt == self.retry_attempts - 1:
-                    # 最后一次尝试失败，尝试备用提供商
-                    if provider == "dashscope":
-                        logger.warning(f"DashScope failed, trying OpenAI: {e}")
-                        try:
-                            return await self.send_message(messages, "openai", **kwargs)
-                        except Exception:
-                            pass
-                    elif provider == "openai":
-                        logger.warning(f"OpenAI failed, trying DashScope: {e}")
-                        try:
-                            return await self.send_message(messages, "dashscope", **kwargs)
-                        except Exception:
-                            pass
-                    
-                    raise e
+                    break
                 
-                logger.warning(f"AI request attempt {attempt + 1} failed: {e}")
-                await asyncio.sleep(self.retry_delay * (attempt + 1))
+                # 所有提供商都失败时指数退避后重试
+                delay = self.retry_delay * (2 ** attempt)
+                logger.warning(f"AI request attempt {attempt + 1} failed on all providers, retrying in {delay}s: {e}")
+                await asyncio.sleep(delay)
+        
+        raise last_error or AIServiceException("All AI service attempts failed")
+    
+    async def _open_stream(
+        self,
+        provider: str,
+        messages: List[Dict[str, str]],
+        **kwargs
+    ) -> Tuple[str, AsyncGenerator[str, None], float]:
+        """打开流式请求并等待首个片段，返回 (首个片段, 剩余片段, 开始时间)"""
+        client = await self._get_client(provider)
+        if not client:
+            raise AIServiceException(f"{provider} client not available")
         
-        raise AIServiceException("All AI service attempts failed")
+        start_time = time.monotonic()
+        stream = client.stream_message(messages, **kwargs)
+        try:
+            first_chunk = await stream.__anext__()
+        except StopAsyncIteration:
+            first_chunk = ""
+        except BaseException as e:
+            await stream.aclose()
+            if isinstance(e, Exception):
+                self._record_failure(provider)
+            raise
+        
+        return first_chunk, stream, start_time
     
     async def stream_message(
         self,
@@ -94,62 +242,83 @@ class AIService:
         """
         流式发送消息到AI服务
         
+        在收到首个片段之前可以切换或对冲提供商；一旦开始输出，中途失败直接抛出，
+        避免向用户重复输出内容
+        
         Args:
             messages: 消息列表
-            provider: AI服务提供商
+            provider: 优先使用的AI服务提供商
             **kwargs: 其他参数
             
         Yields:
             AI回复内容片段
         """
-        provider = provider or self.default_provider
+        async def discard(result):
+            await result[1].aclose()
+        
+        candidates = await self._candidates(provider, stream=True)
+        provider, (first_chunk, stream, start_time) = await self._hedged(
+            candidates,
+            lambda name: self._open_stream(name, messages, **kwargs),
+            stream=True,
+            discard=discard
+        )
+        ttft = time.monotonic() - start_time
         
         try:
-            if provider == "dashscope":
-                client = await get_dashscope_client()
-                if not client:
-                    raise AIServiceException("DashScope client not available")
-                
-                async for chunk in client.stream_message(messages, **kwargs):
-                    yield chunk
-            
-            elif provider == "openai":
-                client = await get_openai_client()
-                if not client:
-                    raise AIServiceException("OpenAI client not available")
-                
-                async for chunk in client.stream_message(messages, **kwargs):
-                    yield chunk
-            
-            else:
-                raise AIServiceException(f"Unknown AI provider: {provider}")
-        
-        except AIServiceException as e:
-            # 流式请求失败时尝试备用提供商
-            if provider == "dashscope":
-                logger.warning(f"DashScope stream failed, trying OpenAI: {e}")
-                try:
-                    async for chunk in self.stream_message(messages, "openai", **kwargs):
-                        yield chunk
-                    return
-                except Exception:
-                    pass
-            elif provider == "openai":
-                logger.warning(f"OpenAI stream failed, trying DashScope: {e}")
-                try:
-                    async for chunk in self.stream_message(messages, "dashscope", **kwargs):
-                        yield chunk
-                    return
-                except Exception:
-                    pass
-            
-            raise e
+            if first_chunk:
+                yield first_chunk
+            async for chunk in stream:
+                yield chunk
+        except Exception:
+            self._record_failure(provider)
+            raise
+        finally:
+            await stream.aclose()
+        
+        self._record_success(provider, time.monotonic() - start_time, ttft=ttft)
+    
+    def _build_messages(
+        self,
+        user_message: str,
+        conversation_history: List[Dict[str, str]] = None,
+        system_prompt: str = None
+    ) -> List[Dict[str, str]]:
+        """组装发送给提供商的消息列表"""
+        messages = []
+        
+        # 添加系统提示词
+        if system_prompt:
+            messages.append({"role": "system", "content": system_prompt})
+        
+        # 添加对话历史
+        if conversation_history:
+            messages.extend(conversation_history)
+        
+        # 添加当前用户消息
+        messages.append({"role": "user", "content": user_message})
+        
+        return messages
+    
+    def _cache_key(
+        self,
+        user_message: str,
+        conversation_history: Optional[List[Dict[str, str]]],
+        system_prompt: Optional[str],
+        tenant: Optional[str],
+        kwargs: Dict[str, Any]
+    ) -> CacheKey:
+        # 指定提供商不影响回复内容，其余参数（模型、温度等）参与缓存键
+        params = {key: value for key, value in kwargs.items() if key != "provider"}
+        return response_cache.make_key(user_message, system_prompt, conversation_history, tenant, **params)
     
     async def chat_completion(
         self,
         user_message: str,
         conversation_history: List[Dict[str, str]] = None,
         system_prompt: str = None,
+        tenant: str = None,
+        use_cache: bool = True,
         **kwargs
     ) -> str:
         """
@@ -159,99 +328,127 @@ class AIService:
             user_message: 用户消息
             conversation_history: 对话历史
             system_prompt: 系统提示词
+            tenant: 租户标识（回复缓存按租户隔离与失效）
+            use_cache: 是否使用回复缓存
             **kwargs: 其他参数
             
         Returns:
             AI回复
         """
-        messages = []
+        cache_key = self._cache_key(user_message, conversation_history, system_prompt, tenant, kwargs)
         
-        # 添加系统提示词
-        if system_prompt:
-            messages.append({"role": "system", "content": system_prompt})
+        async def complete() -> str:
+            if use_cache:
+                cached = await response_cache.get(cache_key)
+                if cached is not None:
+                    return cached
+            
+            messages = self._build_messages(user_message, conversation_history, system_prompt)
+            content = await self.send_message(messages, **kwargs)
+            
+            if use_cache:
+                await response_cache.set(cache_key, content)
+            return content
         
-        # 添加对话历史
-        if conversation_history:
-            messages.extend(conversation_history)
+        if not settings.AI_SINGLEFLIGHT_ENABLED:
+            return await complete()
         
-        # 添加当前用户消息
-        messages.append({"role": "user", "content": user_message})
-        
-        return await self.send_message(messages, **kwargs)
+        # 相同的进行中请求只向提供商发送一次
+        return await single_flight.call(f"{cache_key.tenant}:{cache_key.digest}", complete)
     
     async def stream_chat_completion(
         self,
         user_message: str,
         conversation_history: List[Dict[str, str]] = None,
         system_prompt: str = None,
+        tenant: str = None,
+        use_cache: bool = True,
         **kwargs
     ) -> AsyncGenerator[str, None]:
         """
         流式聊天补全
         
+        命中回复缓存时按片段回放缓存内容，调用方看到的依然是流式输出；
+        相同的请求同时进行时共享同一个上游流
+        
         Args:
             user_message: 用户消息
             conversation_history: 对话历史
             system_prompt: 系统提示词
+            tenant: 租户标识（回复缓存按租户隔离与失效）
+            use_cache: 是否使用回复缓存
             **kwargs: 其他参数
             
         Yields:
             AI回复片段
         """
-        messages = []
-        
-        # 添加系统提示词
-        if system_prompt:
-            messages.append({"role": "system", "content": system_prompt})
+        cache_key = self._cache_key(user_message, conversation_history, system_prompt, tenant, kwargs)
         
-        # 添加对话历史
-        if conversation_history:
-            messages.extend(conversation_history)
+        async def generate() -> AsyncGenerator[str, None]:
+            if use_cache:
+                cached = await response_cache.get(cache_key)
+                if cached is not None:
+                    async for chunk in response_cache.replay(cached):
+                        yield chunk
+                    return
+            
+            messages = self._build_messages(user_message, conversation_history, system_prompt)
+            chunks = []
+            
+            async for chunk in self.stream_message(messages, **kwargs):
+                chunks.append(chunk)
+                yield chunk
+            
+            # 只缓存完整输出的回复
+            if use_cache:
+                await response_cache.set(cache_key, "".join(chunks))
         
-        # 添加当前用户消息
-        messages.append({"role": "user", "content": user_message})
+        if settings.AI_SINGLEFLIGHT_ENABLED:
+            stream = single_flight.stream(f"{cache_key.tenant}:{cache_key.digest}", generate)
+        else:
+            stream = generate()
         
-        async for chunk in self.stream_message(messages, **kwargs):
+        async for chunk in stream:
             yield chunk
     
     def build_conversation_context(
         self,
         messages: List[Dict[str, Any]],
-        max_context_length: int = 4000
+        max_context_tokens: int = None
     ) -> List[Dict[str, str]]:
         """
         构建对话上下文
         
+        对话上下文通常由 conversation_context 从 Redis 窗口构建，此方法用于调用方已持有消息列表的场景
+        
         Args:
-            messages: 消息列表
-            max_context_length: 最大上下文长度
+            messages: 按时间顺序的消息列表
+            max_context_tokens: 令牌预算
             
         Returns:
             格式化的对话上下文
         """
+        from src.ai.context import conversation_context
+        
+        max_context_tokens = max_context_tokens or settings.AI_CONTEXT_MAX_TOKENS
         context = []
-        total_length = 0
+        total_tokens = 0
         
-        # 从最新消息开始，向前构建上下文
+        # 从最新消息开始，向前构建上下文，最后整体反转
         for message in reversed(messages):
-            content = message.get("content", "")
-            sender_type = message.get("sender_type", "")
-            
-            # 转换发送者类型到AI格式
-            if sender_type == "contact":
-                role = "user"
-            elif sender_type in ["agent", "ai"]:
-                role = "assistant"
-            else:
+            turn = conversation_context.make_turn(
+                message.get("id"), message.get("sender_type", ""), message.get("content", "")
+            )
+            if turn is None:
                 continue  # 跳过系统消息等
             
-            message_length = len(content)
-            if total_length + message_length > max_context_length:
+            if total_tokens + turn["tokens"] > max_context_tokens:
                 break
             
-            context.insert(0, {"role": role, "content": content})
-            total_length += message_length
+            context.append({"role": turn["role"], "content": turn["content"]})
+            total_tokens += turn["tokens"]
         
+        context.reverse()
         return context
     
     def get_default_system_prompt(self, language: str = "zh-CN") -> str:
@@ -286,40 +483,30 @@ class AIService:
         """
         检查AI服务可用性
         
+        使用轻量探测（列出模型）而不是发送真实对话，不产生计费
+        
         Returns:
             各服务提供商的可用性状态
         """
         availability = {}
         
-        # 检查DashScope
-        try:
-            client = await get_dashscope_client()
-            if client:
-                # 发送测试消息
-                test_messages = [{"role": "user", "content": "Hello"}]
-                await client.send_message(test_messages)
-                availability["dashscope"] = True
-            else:
-                availability["dashscope"] = False
-        except Exception as e:
-            logger.warning(f"DashScope availability check failed: {e}")
-            availability["dashscope"] = False
-        
-        # 检查OpenAI
-        try:
-            client = await get_openai_client()
-            if client:
-                # 发送测试消息
-                test_messages = [{"role": "user", "content": "Hello"}]
-                await client.send_message(test_messages)
-                availability["openai"] = True
-            else:
-                availability["openai"] = False
-        except Exception as e:
-            logger.warning(f"OpenAI availability check failed: {e}")
-            availability["openai"] = False
+        for provider in self.router.providers:
+            try:
+                client = await self._get_client(provider)
+                availability[provider] = bool(client) and await client.probe()
+            except Exception as e:
+                logger.warning(f"{provider} availability check failed: {e}")
+                availability[provider] = False
         
         return availability
+    
+    def get_provider_status(self) -> Dict[str, Dict[str, Any]]:
+        """获取各提供商的路由统计与熔断状态"""
+        states = circuit_breakers.get_states()
+        return {
+            provider: {**stats, "circuit": states.get(provider, {"state": "closed"})}
+            for provider, stats in self.router.get_stats().items()
+        }
 
 
 # 全局AI服务实例
@@ -0,0 +1,142 @@
+"""
+🛫 AI 请求合并（single-flight）
+
+相同的请求（规范化后的提示词与上下文一致）同时到达时只向提供商发送一次：
+第一个请求在后台任务中发起上游流式请求，所有相同请求（包括第一个）订阅同一个片段流，
+后加入的请求会先收到已产生的片段，再继续接收后续片段
+上游在后台任务中运行，任一订阅者断开都不会中断其他订阅者
+"""
+
+import asyncio
+from typing import AsyncGenerator, AsyncIterator, Awaitable, Callable, Dict, List, Optional, TypeVar
+
+from loguru import logger
+
+from src.utils.metrics import metrics
+
+T = TypeVar("T")
+
+
+class Flight:
+    """一次进行中的上游流式请求"""
+
+    __slots__ = ("key", "chunks", "done", "error", "subscribers", "task", "_changed")
+
+    def __init__(self, key: str):
+        self.key = key
+        self.chunks: List[str] = []
+        self.done = False
+        self.error: Optional[BaseException] = None
+        self.subscribers = 0
+        self.task: Optional[asyncio.Task] = None
+        self._changed = asyncio.Event()
+
+    def _notify(self):
+        self._changed.set()
+        self._changed = asyncio.Event()
+
+    def publish(self, chunk: str):
+        self.chunks.append(chunk)
+        self._notify()
+
+    def finish(self, error: BaseException = None):
+        self.done = True
+        self.error = error
+        self._notify()
+
+    async def subscribe(self) -> AsyncGenerator[str, None]:
+        """从头订阅片段流"""
+        index = 0
+        while True:
+            while index < len(self.chunks):
+                yield self.chunks[index]
+                index += 1
+
+            if self.done:
+                if self.error is not None:
+                    raise self.error
+                return
+
+            await self._changed.wait()
+
+
+class SingleFlight:
+    """相同请求合并器"""
+
+    def __init__(self):
+        self._flights: Dict[str, Flight] = {}
+        self._calls: Dict[str, asyncio.Future] = {}
+
+    def __len__(self) -> int:
+        return len(self._flights) + len(self._calls)
+
+    async def stream(
+        self,
+        key: str,
+        factory: Callable[[], AsyncIterator[str]]
+    ) -> AsyncGenerator[str, None]:
+        """
+        合并相同的流式请求
+
+        Args:
+            key: 请求键
+            factory: 发起上游流式请求的函数（只对第一个请求调用）
+
+        Yields:
+            上游片段
+        """
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = Flight(key)
+            self._flights[key] = flight
+            flight.task = asyncio.create_task(self._run(flight, factory))
+            metrics.record_ai_singleflight("leader")
+        else:
+            logger.debug(f"Joining in-flight AI request ({len(flight.chunks)} chunks so far)")
+            metrics.record_ai_singleflight("follower")
+
+        flight.subscribers += 1
+        try:
+            async for chunk in flight.subscribe():
+                yield chunk
+        finally:
+            flight.subscribers -= 1
+
+    async def _run(self, flight: Flight, factory: Callable[[], AsyncIterator[str]]):
+        try:
+            async for chunk in factory():
+                flight.publish(chunk)
+            flight.finish()
+        except asyncio.CancelledError as e:
+            flight.finish(e)
+            raise
+        except Exception as e:
+            flight.finish(e)
+        finally:
+            if self._flights.get(flight.key) is flight:
+                del self._flights[flight.key]
+
+    async def call(self, key: str, factory: Callable[[], Awaitable[T]]) -> T:
+        """合并相同的非流式请求"""
+        future = self._calls.get(key)
+        if future is not None:
+            metrics.record_ai_singleflight("follower")
+            return await asyncio.shield(future)
+
+        metrics.record_ai_singleflight("leader")
+        future = asyncio.ensure_future(factory())
+        self._calls[key] = future
+        future.add_done_callback(lambda _: self._calls.pop(key, None) if self._calls.get(key) is future else None)
+        return await asyncio.shield(future)
+
+    async def cancel_all(self):
+        """取消所有进行中的上游请求"""
+        tasks = [flight.task for flight in self._flights.values() if flight.task] + list(self._calls.values())
+        for task in tasks:
+            task.cancel()
+        if tasks:
+            await asyncio.gather(*tasks, return_exceptions=True)
+
+
+# 全局请求合并器
+single_flight = SingleFlight()
@@ -0,0 +1,100 @@
+"""
+🔢 令牌计数
+
+上下文预算按令牌而不是字符计算，计数器可插拔:
+- heuristic: 无依赖的本地估算（CJK 字符约 1 个令牌，其余文本约 4 个字符 1 个令牌）
+- tiktoken:<encoding>: 使用 tiktoken 精确计数（需要安装 tiktoken）
+"""
+
+import math
+import re
+from abc import ABC, abstractmethod
+from functools import lru_cache
+from typing import Callable, Dict
+
+from loguru import logger
+
+from src.config.settings import get_settings
+
+try:
+    import tiktoken
+    TIKTOKEN_AVAILABLE = True
+except ImportError:
+    TIKTOKEN_AVAILABLE = False
+
+settings = get_settings()
+
+# 每条消息的固定开销（角色、分隔符等）
+MESSAGE_OVERHEAD_TOKENS = 4
+
+_CJK = re.compile(r"[぀-ヿ㐀-䶿一-鿿가-힯豈-﫿＀-￯]")
+
+
+class Tokenizer(ABC):
+    """令牌计数器基类"""
+
+    name = "base"
+
+    @abstractmethod
+    def count(self, text: str) -> int:
+        """文本的令牌数"""
+
+    def count_message(self, content: str) -> int:
+        """单条消息的令牌数（含固定开销）"""
+        return self.count(content) + MESSAGE_OVERHEAD_TOKENS
+
+
+class HeuristicTokenizer(Tokenizer):
+    """本地估算计数器"""
+
+    name = "heuristic"
+
+    def count(self, text: str) -> int:
+        if not text:
+            return 0
+        cjk = len(_CJK.findall(text))
+        return cjk + math.ceil((len(text) - cjk) / 4)
+
+
+class TiktokenTokenizer(Tokenizer):
+    """tiktoken 计数器"""
+
+    def __init__(self, encoding: str = "cl100k_base"):
+        self.name = f"tiktoken:{encoding}"
+        self._encoding = tiktoken.get_encoding(encoding)
+
+    def count(self, text: str) -> int:
+        return len(self._encoding.encode(text or "", disallowed_special=()))
+
+
+_factories: Dict[str, Callable[[str], Tokenizer]] = {
+    "heuristic": lambda _: HeuristicTokenizer(),
+}
+if TIKTOKEN_AVAILABLE:
+    _factories["tiktoken"] = lambda encoding: TiktokenTokenizer(encoding or "cl100k_base")
+
+
+def register_tokenizer(name: str, factory: Callable[[str], Tokenizer]):
+    """
+    注册令牌计数器
+
+    Args:
+        name: 名称（配置形如 "name" 或 "name:参数"）
+        factory: 接收参数字符串、返回计数器的工厂函数
+    """
+    _factories[name] = factory
+    get_tokenizer.cache_clear()
+
+
+@lru_cache(maxsize=None)
+def get_tokenizer(spec: str = None) -> Tokenizer:
+    """按配置获取令牌计数器，不可用时退回本地估算"""
+    spec = spec or settings.AI_CONTEXT_TOKENIZER
+    name, _, argument = spec.partition(":")
+
+    factory = _factories.get(name)
+    if factory is None:
+        logger.warning(f"⚠️ Tokenizer '{spec}' not available, using heuristic token counts")
+        return HeuristicTokenizer()
+
+    return factory(argument)
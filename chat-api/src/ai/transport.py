@@ -0,0 +1,206 @@
+"""
+🔌 AI 服务传输层
+
+每个服务提供商共享一个受管理的 HTTP 连接池
+- 显式的连接池上限与 keep-alive 过期时间，并发流复用已建立的连接
+- 可选 HTTP/2 多路复用（需要安装 h2）
+- 拆分的连接 / 读取 / 首字节超时
+- 启动时预热连接池，并导出连接复用与池饱和度统计
+"""
+
+import asyncio
+from contextlib import asynccontextmanager
+from typing import Any, AsyncIterator, Dict
+
+import httpx
+from loguru import logger
+
+from src.config.settings import get_settings
+from src.utils.metrics import metrics
+
+try:
+    import h2  # noqa: F401
+    HTTP2_AVAILABLE = True
+except ImportError:
+    HTTP2_AVAILABLE = False
+
+settings = get_settings()
+
+
+class ProviderTransport:
+    """单个AI服务提供商的共享连接池"""
+
+    def __init__(
+        self,
+        provider: str,
+        base_url: str,
+        http2: bool = None,
+        max_connections: int = None,
+        max_keepalive_connections: int = None,
+        keepalive_expiry: float = None,
+        first_byte_timeout: float = None
+    ):
+        self.provider = provider
+        self.base_url = base_url.rstrip("/")
+        self.http2 = (settings.AI_HTTP2 if http2 is None else http2) and HTTP2_AVAILABLE
+        self.max_connections = max_connections or settings.AI_MAX_CONNECTIONS
+        self.first_byte_timeout = first_byte_timeout or settings.AI_FIRST_BYTE_TIMEOUT
+
+        if (settings.AI_HTTP2 if http2 is None else http2) and not HTTP2_AVAILABLE:
+            logger.warning(f"⚠️ HTTP/2 requested for {provider} but h2 is not installed, using HTTP/1.1")
+
+        self.client = httpx.AsyncClient(
+            http2=self.http2,
+            limits=httpx.Limits(
+                max_connections=self.max_connections,
+                max_keepalive_connections=max_keepalive_connections or settings.AI_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=keepalive_expiry or settings.AI_KEEPALIVE_EXPIRY
+            ),
+            timeout=httpx.Timeout(
+                connect=settings.AI_CONNECT_TIMEOUT,
+                read=settings.AI_READ_TIMEOUT,
+                write=settings.AI_READ_TIMEOUT,
+                pool=settings.AI_POOL_TIMEOUT
+            ),
+            event_hooks={"request": [self._on_request]}
+        )
+
+        # 连接复用统计
+        self.requests = 0
+        self.connections_opened = 0
+        self.tls_handshakes = 0
+        self.pool_timeouts = 0
+
+    # ==========================================
+    # 📡 请求
+    # ==========================================
+
+    def url(self, path: str) -> str:
+        return f"{self.base_url}{path}"
+
+    async def request(
+        self,
+        method: str,
+        path: str,
+        timeout: float = None,
+        **kwargs
+    ) -> httpx.Response:
+        """
+        发送请求并读取完整响应
+
+        首字节超时约束等待响应头的时间，整体超时约束包括读取响应体在内的总耗时
+        """
+        async def _send() -> httpx.Response:
+            async with self.stream(method, path, **kwargs) as response:
+                await response.aread()
+                return response
+
+        return await asyncio.wait_for(_send(), timeout or settings.AI_TIMEOUT)
+
+    @asynccontextmanager
+    async def stream(self, method: str, path: str, **kwargs) -> AsyncIterator[httpx.Response]:
+        """发送流式请求（首字节超时后放弃）"""
+        request = self.client.build_request(method, self.url(path), **kwargs)
+
+        try:
+            response = await asyncio.wait_for(
+                self.client.send(request, stream=True),
+                self.first_byte_timeout
+            )
+        except asyncio.TimeoutError:
+            raise httpx.ReadTimeout(
+                f"{self.provider} did not respond within {self.first_byte_timeout}s",
+                request=request
+            )
+        except httpx.PoolTimeout:
+            self.pool_timeouts += 1
+            metrics.record_ai_pool_timeout(self.provider)
+            raise
+
+        try:
+            yield response
+        finally:
+            await response.aclose()
+
+    # ==========================================
+    # 🔥 预热与关闭
+    # ==========================================
+
+    async def warm_up(self, connections: int = None):
+        """
+        预热连接池
+
+        并发发送轻量请求，提前完成 TCP/TLS 握手（HTTP/2 下一个连接即可多路复用）
+        """
+        connections = settings.AI_POOL_WARMUP_CONNECTIONS if connections is None else connections
+        if connections <= 0:
+            return
+        if self.http2:
+            connections = 1
+
+        async def _ping():
+            try:
+                response = await self.client.head(self.base_url, timeout=settings.AI_CONNECT_TIMEOUT)
+                await response.aclose()
+            except httpx.HTTPError as e:
+                logger.debug(f"{self.provider} warm-up request failed: {e}")
+
+        await asyncio.gather(*(_ping() for _ in range(connections)))
+        logger.info(
+            f"🔥 {self.provider} connection pool warmed "
+            f"({self.connections_opened} connection(s), http2={self.http2})"
+        )
+
+    async def close(self):
+        """关闭连接池"""
+        await self.client.aclose()
+
+    # ==========================================
+    # 📊 统计
+    # ==========================================
+
+    async def _on_request(self, request: httpx.Request):
+        self.requests += 1
+        metrics.record_ai_http_request(self.provider)
+        # 只有新建连接时才会产生 connect_tcp / start_tls 事件
+        request.extensions["trace"] = self._trace
+
+    async def _trace(self, event_name: str, info: Dict[str, Any]):
+        if event_name == "connection.connect_tcp.complete":
+            self.connections_opened += 1
+            metrics.record_ai_connection_opened(self.provider, "tcp")
+        elif event_name == "connection.start_tls.complete":
+            self.tls_handshakes += 1
+            metrics.record_ai_connection_opened(self.provider, "tls")
+
+    def _pool_connections(self):
+        # httpx 未公开连接池对象，取不到时只返回计数统计
+        pool = getattr(getattr(self.client, "_transport", None), "_pool", None)
+        return getattr(pool, "connections", None) or []
+
+    def get_stats(self) -> Dict[str, Any]:
+        """获取连接池统计"""
+        connections = self._pool_connections()
+        idle = sum(1 for connection in connections if connection.is_idle())
+        active = len(connections) - idle
+        reuse_ratio = 1 - self.connections_opened / self.requests if self.requests else 0.0
+
+        return {
+            "provider": self.provider,
+            "http2": self.http2,
+            "max_connections": self.max_connections,
+            "connections": len(connections),
+            "active": active,
+            "idle": idle,
+            "utilization": active / self.max_connections,
+            "requests": self.requests,
+            "connections_opened": self.connections_opened,
+            "tls_handshakes": self.tls_handshakes,
+            "reuse_ratio": max(reuse_ratio, 0.0),
+            "pool_timeouts": self.pool_timeouts,
+        }
+
+    def export_metrics(self):
+        """导出连接池指标"""
+        stats = self.get_stats()
+        metrics.set_ai_pool_stats(self.provider, stats["active"], stats["idle"], stats["utilization"])
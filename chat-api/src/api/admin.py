@@ -15,7 +15,8 @@ from src.api.deps import (
     get_pagination_params, get_user_filters
 )
 from src.config.settings import get_settings
-from src.core.exceptions import NotFoundException, ValidationException
+from src.core.exceptions import NotFoundException, RateLimitException, ValidationException
+from src.core.passwords import hash_password
 from src.middleware.logging import log_user_action
 from src.models.user import (
     User, UserCreate, UserUpdate, UserResponse, UserListResponse,
@@ -58,6 +59,8 @@ async def get_users(
     
     - **page**: 页码
     - **size**: 每页数量
+    - **cursor**: 游标分页，传入上一页返回的 next_cursor（可选）
+    - **count**: 总数计算方式 exact / estimate / none（默认 estimate）
     - **role**: 角色过滤（可选）
     - **status**: 状态过滤（可选）
     - **search**: 搜索关键词（可选）
@@ -71,7 +74,9 @@ async def get_users(
             page=pagination.page,
             size=pagination.size,
             filters=filters,
-            search=filters.get("search")
+            search=filters.get("search"),
+            cursor=pagination.cursor,
+            count=pagination.count
         )
         
         user_responses = [UserResponse.model_validate(user) for user in users]
@@ -81,9 +86,14 @@ async def get_users(
             total=pagination_info.total,
             page=pagination_info.page,
             size=pagination_info.size,
-            pages=pagination_info.pages
+            pages=pagination_info.pages,
+            has_next=pagination_info.has_next,
+            next_cursor=pagination_info.next_cursor,
+            total_estimated=pagination_info.total_estimated
         )
         
+    except ValidationException as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=e.message)
     except Exception as e:
         logger.error(f"Get users error: {e}")
         raise HTTPException(
@@ -111,10 +121,7 @@ async def create_user(
     返回创建的用户信息
     """
     try:
-        from passlib.context import CryptContext
-        
         user_service = UserService(db)
-        pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
         
         # 检查邮箱是否已存在
         existing_user = await user_service.get_user_by_email(user_create.email)
@@ -123,7 +130,7 @@ async def create_user(
         
         # 创建用户数据
         user_data = user_create.model_dump()
-        user_data["password_hash"] = pwd_context.hash(user_create.password)
+        user_data["password_hash"] = await hash_password(user_create.password)
         del user_data["password"]  # 移除明文密码
         
         user = await user_service.create_user(user_data)
@@ -140,7 +147,7 @@ async def create_user(
         
         return UserResponse.model_validate(user)
         
-    except ValidationException:
+    except (ValidationException, RateLimitException):
         raise
     except Exception as e:
         logger.error(f"Create user error: {e}")
@@ -360,10 +367,7 @@ async def reset_user_password(
     返回操作结果
     """
     try:
-        from passlib.context import CryptContext
-
         user_service = UserService(db)
-        pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
         # 检查用户是否存在
         user = await user_service.get_user_by_id(user_id)
@@ -374,7 +378,7 @@ async def reset_user_password(
             )
 
         # 加密新密码
-        hashed_password = pwd_context.hash(new_password)
+        hashed_password = await hash_password(new_password)
 
         # 更新密码
         update_data = UserUpdate(password_hash=hashed_password)
@@ -395,7 +399,7 @@ async def reset_user_password(
             "message": "密码重置成功"
         }
 
-    except HTTPException:
+    except (HTTPException, RateLimitException):
         raise
     except Exception as e:
         logger.error(f"Reset password error: {e}")
@@ -463,33 +467,34 @@ async def get_dashboard_analytics(
     """
     try:
         user_service = UserService(db)
+        conversation_service = ConversationService(db)
         
-        # 获取用户统计
+        # 用户统计（一次分组查询），对话与消息统计读取增量维护的计数
         user_stats = await user_service.get_user_stats()
-        
-        # 这里可以添加更多统计数据
-        # conversation_stats = await conversation_service.get_stats()
-        # message_stats = await message_service.get_stats()
+        conversation_stats = await conversation_service.get_conversation_stats()
         
         dashboard_data = {
             "users": user_stats,
             "conversations": {
-                "total_conversations": 156,
-                "active_conversations": 23,
-                "ai_handled": 134,
-                "human_handled": 22,
-                "avg_response_time": 2.5
+                "total_conversations": conversation_stats.total_conversations,
+                "active_conversations": conversation_stats.open_conversations,
+                "pending_conversations": conversation_stats.pending_conversations,
+                "ai_handled": conversation_stats.ai_handled,
+                "human_handled": conversation_stats.human_handled,
+                "avg_response_time": conversation_stats.avg_response_time
             },
             "messages": {
-                "total_messages": 1024,
-                "today_messages": 89,
-                "avg_messages_per_conversation": 6.5
+                "total_messages": conversation_stats.total_messages,
+                "today_messages": conversation_stats.today_messages,
+                "avg_messages_per_conversation": conversation_stats.avg_messages_per_conversation
             },
             "performance": {
-                "customer_satisfaction": 4.2,
-                "resolution_rate": 0.89,
-                "first_response_time": 1.8
-            }
+                "customer_satisfaction": conversation_stats.customer_satisfaction,
+                "resolution_rate": conversation_stats.resolution_rate,
+                "first_response_time": conversation_stats.avg_response_time,
+                "resolution_time": conversation_stats.avg_resolution_time
+            },
+            "stats_reconciled_at": conversation_stats.reconciled_at
         }
         
         return dashboard_data
@@ -524,6 +529,8 @@ async def get_conversations(
 
     - **page**: 页码
     - **size**: 每页数量
+    - **cursor**: 游标分页，传入上一页返回的 next_cursor（可选）
+    - **count**: 总数计算方式 exact / estimate / none（默认 estimate）
     - **status**: 会话状态过滤
     - **assignee_id**: 指派客服ID过滤
     - **priority**: 优先级过滤
@@ -553,14 +560,23 @@ async def get_conversations(
             page=pagination.page,
             size=pagination.size,
             filters=filters,
-            search=search
+            cursor=pagination.cursor,
+            count=pagination.count
         )
 
         return ConversationListResponse(
             conversations=[ConversationResponse.model_validate(conv) for conv in conversations],
-            pagination=pagination_info
+            total=pagination_info.total,
+            page=pagination_info.page,
+            size=pagination_info.size,
+            pages=pagination_info.pages,
+            has_next=pagination_info.has_next,
+            next_cursor=pagination_info.next_cursor,
+            total_estimated=pagination_info.total_estimated
         )
 
+    except ValidationException as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=e.message)
     except Exception as e:
         logger.error(f"Get conversations error: {e}")
         raise HTTPException(
@@ -811,6 +827,8 @@ async def get_conversation_messages(
     - **conversation_id**: 会话ID
     - **page**: 页码
     - **size**: 每页数量
+    - **cursor**: 游标分页，传入上一页返回的 next_cursor（可选）
+    - **count**: 总数计算方式 exact / estimate / none（默认 estimate）
     - **include_private**: 是否包含私有消息
 
     返回消息列表和分页信息
@@ -818,11 +836,13 @@ async def get_conversation_messages(
     try:
         message_service = MessageService(db)
 
-        messages, pagination_info = await message_service.list_messages_by_conversation(
+        messages, pagination_info = await message_service.get_conversation_messages(
             conversation_id=conversation_id,
             page=pagination.page,
             size=pagination.size,
-            include_private=include_private
+            include_private=include_private,
+            cursor=pagination.cursor,
+            count=pagination.count
         )
 
         return MessageListResponse(
@@ -830,6 +850,8 @@ async def get_conversation_messages(
             pagination=pagination_info
         )
 
+    except ValidationException as e:
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail=e.message)
     except Exception as e:
         logger.error(f"Get conversation messages error: {e}")
         raise HTTPException(
@@ -1029,3 +1051,41 @@ async def get_user_analytics(
             status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
             detail="获取用户统计失败"
         )
+
+
+# ==========================================
+# 🤖 AI 服务管理
+# ==========================================
+
+@router.delete("/ai/cache", summary="清除AI回复缓存")
+async def invalidate_ai_cache(
+    request: Request,
+    tenant: Optional[str] = None,
+    current_user: TokenData = Depends(get_current_admin)
+):
+    """
+    使指定租户的AI回复缓存全部失效（需要管理员权限）
+    
+    - **tenant**: 租户标识，不传时为默认租户
+    
+    知识库或话术更新后调用，旧回复不再命中
+    """
+    try:
+        from src.ai.cache import response_cache
+        
+        generation = await response_cache.invalidate(tenant)
+        
+        log_user_action(request, "invalidate_ai_cache", "ai_cache", {"tenant": tenant})
+        
+        return {
+            "success": True,
+            "message": "AI回复缓存已清除",
+            "data": {"tenant": tenant, "generation": generation}
+        }
+        
+    except Exception as e:
+        logger.error(f"Invalidate AI cache error: {e}")
+        raise HTTPException(
+            status_code=status.HTTP_500_INTERNAL_SERVER_ERROR,
+            detail="清除AI回复缓存失败"
+        )
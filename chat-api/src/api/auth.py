@@ -11,13 +11,14 @@ from fastapi import APIRouter, Depends, HTTPException, Request, status
 from fastapi.security import HTTPBearer
 from jose import jwt
 from loguru import logger
-from passlib.context import CryptContext
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from src.api.deps import get_db, get_current_user_required
 from src.config.settings import get_settings
-from src.core.exceptions import AuthenticationException, ValidationException
+from src.core.exceptions import AuthenticationException, RateLimitException, ValidationException
+from src.core.passwords import hash_password, verify_password
 from src.middleware.logging import log_user_action
+from src.middleware.token_cache import token_cache
 from src.models.user import (
     User, UserLogin, UserCreate, UserResponse, Token, 
     RefreshToken, UserChangePassword, TokenData
@@ -27,22 +28,11 @@ from src.services.user import UserService
 # 配置
 settings = get_settings()
 security = HTTPBearer()
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
 
 # 创建路由
 router = APIRouter()
 
 
-def verify_password(plain_password: str, hashed_password: str) -> bool:
-    """验证密码"""
-    return pwd_context.verify(plain_password, hashed_password)
-
-
-def get_password_hash(password: str) -> str:
-    """生成密码哈希"""
-    return pwd_context.hash(password)
-
-
 def create_access_token(data: Dict[str, Any], expires_delta: timedelta = None) -> str:
     """创建访问令牌"""
     to_encode = data.copy()
@@ -101,7 +91,7 @@ async def login(
             raise AuthenticationException("邮箱或密码错误")
         
         # 验证密码
-        if not verify_password(user_login.password, user.password_hash):
+        if not await verify_password(user_login.password, user.password_hash):
             raise AuthenticationException("邮箱或密码错误")
         
         # 检查用户状态
@@ -158,7 +148,7 @@ async def login(
             }
         }
         
-    except AuthenticationException:
+    except (AuthenticationException, RateLimitException):
         raise
     except Exception as e:
         logger.error(f"Login error: {e}")
@@ -194,7 +184,7 @@ async def register(
         
         # 创建用户
         user_data = user_create.model_dump()
-        user_data["password_hash"] = get_password_hash(user_create.password)
+        user_data["password_hash"] = await hash_password(user_create.password)
         del user_data["password"]  # 移除明文密码
         
         user = await user_service.create_user(user_data)
@@ -206,7 +196,7 @@ async def register(
         
         return UserResponse.model_validate(user)
         
-    except ValidationException:
+    except (ValidationException, RateLimitException):
         raise
     except Exception as e:
         logger.error(f"Registration error: {e}")
@@ -372,11 +362,11 @@ async def change_password(
             raise AuthenticationException("用户不存在")
         
         # 验证旧密码
-        if not verify_password(password_data.old_password, user.password_hash):
+        if not await verify_password(password_data.old_password, user.password_hash):
             raise ValidationException("旧密码错误")
         
         # 更新密码
-        new_password_hash = get_password_hash(password_data.new_password)
+        new_password_hash = await hash_password(password_data.new_password)
         await user_service.update_password(user.id, new_password_hash)
         
         # 记录密码修改日志
@@ -386,7 +376,7 @@ async def change_password(
         
         return {"message": "密码修改成功"}
         
-    except (AuthenticationException, ValidationException):
+    except (AuthenticationException, ValidationException, RateLimitException):
         raise
     except Exception as e:
         logger.error(f"Change password error: {e}")
@@ -404,10 +394,15 @@ async def logout(
     """
     用户登出接口
     
-    注意：由于使用JWT，实际的令牌失效需要在客户端处理
-    这个接口主要用于记录登出日志
+    当前访问令牌写入吊销列表，所有 worker 立即拒绝该令牌
     """
     try:
+        # 吊销当前令牌
+        context = getattr(request.state, "request_context", None)
+        token = context.token if context else None
+        if token:
+            await token_cache.revoke(token, current_user.exp)
+        
         # 记录登出日志
         log_user_action(request, "logout", "user", {"user_id": current_user.user_id})
         
@@ -78,10 +78,12 @@ def check_authenticated(request: Request) -> bool:
 
 def get_pagination_params(
     page: int = 1,
-    size: int = 20
+    size: int = 20,
+    cursor: Optional[str] = None,
+    count: str = "estimate"
 ) -> PaginationParams:
     """获取分页参数"""
-    return PaginationParams(page=page, size=size)
+    return PaginationParams(page=page, size=size, cursor=cursor, count=count)
 
 
 # ==========================================
@@ -42,7 +42,11 @@ class Settings(BaseSettings):
     JWT_ALGORITHM: str = Field(default="HS256", description="JWT 算法")
     JWT_EXPIRE_MINUTES: int = Field(default=60, description="JWT 过期时间（分钟）")
     JWT_REFRESH_EXPIRE_DAYS: int = Field(default=7, description="JWT 刷新令牌过期时间（天）")
+    JWT_CACHE_SIZE: int = Field(default=10000, description="已验证令牌缓存最大条目数（0 为禁用）")
+    JWT_REVOCATION_ENABLED: bool = Field(default=True, description="启用基于 Redis 的令牌吊销（登出即失效）")
     BCRYPT_ROUNDS: int = Field(default=12, description="密码哈希轮数")
+    PASSWORD_HASH_WORKERS: int = Field(default=0, description="密码哈希线程数（0 表示按 CPU 核数，最多 4 个）")
+    PASSWORD_HASH_MAX_PENDING: int = Field(default=32, description="排队中的密码运算上限，超出时直接返回 429")
     
     # ==========================================
     # 💾 数据库配置
@@ -52,6 +56,18 @@ class Settings(BaseSettings):
     DATABASE_MAX_OVERFLOW: int = Field(default=30, description="数据库连接池最大溢出")
     DATABASE_POOL_TIMEOUT: int = Field(default=30, description="数据库连接池超时")
     DATABASE_POOL_RECYCLE: int = Field(default=3600, description="数据库连接回收时间")
+    MESSAGE_WRITE_BEHIND_ENABLED: bool = Field(default=True, description="消息先写入 Redis Stream 缓冲再批量落库")
+    MESSAGE_WRITER_STREAM: str = Field(default="message_ingest", description="消息写入缓冲的 Redis Stream 名称")
+    MESSAGE_WRITER_BATCH_SIZE: int = Field(default=200, description="单次批量写入的最大消息数")
+    MESSAGE_WRITER_FLUSH_INTERVAL_MS: int = Field(default=5, description="批量写入的攒批时间（毫秒）")
+    MESSAGE_WRITER_CLAIM_IDLE_MS: int = Field(default=30000, description="未确认条目空闲多久后由其他进程接管（毫秒）")
+    MESSAGE_WRITER_DRAIN_TIMEOUT: float = Field(default=10.0, description="关闭时写完缓冲消息的最长时间（秒）")
+    CONTACT_CACHE_SIZE: int = Field(default=10000, description="外部用户ID到联系人ID的本地缓存条目数")
+    CONTACT_CACHE_TTL: float = Field(default=3600.0, description="联系人ID本地缓存时间（秒）")
+    PAGINATION_COUNT_CACHE_TTL: float = Field(default=60.0, description="列表总数估计值的缓存时间（秒）")
+    STATS_RECONCILE_INTERVAL: float = Field(default=600.0, description="对话统计与数据库对账的间隔（秒）")
+    STATS_CONVERSATION_TTL: int = Field(default=604800, description="单个对话统计状态（创建/最后消息时间）的保留时间（秒）")
+    SNOWFLAKE_WORKER_ID: int = Field(default=-1, description="雪花ID worker 编号（0-63，-1 表示启动时通过 Redis 自动分配）")
     
     # ==========================================
     # 🔴 Redis 配置
@@ -66,6 +82,14 @@ class Settings(BaseSettings):
     # 会话配置
     SESSION_EXPIRE_SECONDS: int = Field(default=3600, description="会话过期时间（秒）")
     SESSION_CLEANUP_INTERVAL: int = Field(default=300, description="会话清理间隔（秒）")
+    SESSION_SWEEP_SHARDS: int = Field(default=16, description="会话过期调度分片数")
+    SESSION_SWEEP_BATCH_SIZE: int = Field(default=200, description="会话清理每批处理条目数")
+    SESSION_SWEEP_MAX_BATCHES: int = Field(default=50, description="每个分片每轮最多处理批数")
+    SESSION_SWEEP_LOCK_TTL: int = Field(default=30, description="分片清理锁过期时间（秒）")
+    SESSION_ACTIVITY_FLUSH_INTERVAL: float = Field(default=1.0, description="会话活动时间合并写入间隔（秒）")
+    SESSION_ACTIVITY_MAX_PENDING: int = Field(default=5000, description="待写入活动时间达到该数量时提前刷新")
+    SESSION_CACHE_SIZE: int = Field(default=10000, description="会话本地缓存最大条目数（0 为禁用）")
+    SESSION_CACHE_TTL: float = Field(default=5.0, description="会话本地缓存存活时间（秒）")
     
     # ==========================================
     # 🤖 AI 服务配置
@@ -88,6 +112,51 @@ class Settings(BaseSettings):
     AI_TIMEOUT: int = Field(default=30, description="AI 服务超时时间（秒）")
     AI_RETRY_ATTEMPTS: int = Field(default=3, description="AI 服务重试次数")
     AI_RETRY_DELAY: int = Field(default=1, description="AI 服务重试延迟（秒）")
+    AI_CONNECT_TIMEOUT: float = Field(default=5.0, description="AI 服务建立连接超时（秒）")
+    AI_READ_TIMEOUT: float = Field(default=30.0, description="AI 服务两次读取之间的超时（秒）")
+    AI_FIRST_BYTE_TIMEOUT: float = Field(default=15.0, description="AI 服务首字节（响应头）超时（秒）")
+    AI_POOL_TIMEOUT: float = Field(default=5.0, description="等待空闲连接的超时（秒）")
+    AI_MAX_CONNECTIONS: int = Field(default=200, description="每个 AI 服务的最大连接数")
+    AI_MAX_KEEPALIVE_CONNECTIONS: int = Field(default=50, description="每个 AI 服务保持的空闲连接数")
+    AI_KEEPALIVE_EXPIRY: float = Field(default=60.0, description="空闲连接保持时间（秒）")
+    AI_HTTP2: bool = Field(default=True, description="启用 HTTP/2 多路复用（需要安装 h2）")
+    AI_POOL_WARMUP_CONNECTIONS: int = Field(default=2, description="启动时预热的连接数")
+    AI_PROVIDER_ORDER: str = Field(default="dashscope,openai", description="AI 服务提供商优先顺序（无延迟统计时使用）")
+    AI_ROUTER_EWMA_ALPHA: float = Field(default=0.2, description="提供商延迟与错误率 EWMA 平滑系数")
+    AI_ROUTER_ERROR_THRESHOLD: float = Field(default=0.5, description="错误率超过此值的提供商视为不健康")
+    AI_ROUTER_RECOVERY_TIME: float = Field(default=30.0, description="不健康提供商重新参与排序前的等待时间（秒）")
+    AI_HEDGE_ENABLED: bool = Field(default=False, description="启用对冲请求（主提供商过慢时并发请求备用提供商）")
+    AI_HEDGE_MIN_DELAY: float = Field(default=0.5, description="对冲请求最短等待时间（秒）")
+    AI_HEDGE_MAX_DELAY: float = Field(default=5.0, description="对冲请求最长等待时间（秒），样本不足时使用")
+    AI_HEDGE_MIN_SAMPLES: int = Field(default=20, description="按 p95 计算对冲等待时间所需的最少样本数")
+    AI_BREAKER_ENABLED: bool = Field(default=True, description="启用 AI 服务熔断器")
+    AI_BREAKER_WINDOW: float = Field(default=60.0, description="熔断统计滑动窗口（秒）")
+    AI_BREAKER_MIN_REQUESTS: int = Field(default=10, description="窗口内触发熔断所需的最少请求数")
+    AI_BREAKER_ERROR_RATE: float = Field(default=0.5, description="触发熔断的错误率")
+    AI_BREAKER_SLOW_THRESHOLD: float = Field(default=10.0, description="慢请求阈值（秒，流式请求按首字延迟）")
+    AI_BREAKER_SLOW_RATE: float = Field(default=0.8, description="触发熔断的慢请求比例")
+    AI_BREAKER_OPEN_SECONDS: float = Field(default=30.0, description="熔断持续时间（秒），到期后进入半开探测")
+    AI_BREAKER_PROBE_TIMEOUT: float = Field(default=5.0, description="半开探测超时（秒）")
+    AI_BREAKER_PROBE_INTERVAL: float = Field(default=5.0, description="半开状态下两次探测的最小间隔（秒）")
+    AI_CACHE_ENABLED: bool = Field(default=True, description="启用 AI 回复缓存")
+    AI_CACHE_TTL: int = Field(default=3600, description="AI 回复缓存过期时间（秒）")
+    AI_CACHE_GENERATION_TTL: float = Field(default=5.0, description="本地缓存租户缓存代数的时间（秒），即跨 worker 失效的最大延迟")
+    AI_CACHE_SIMILARITY_ENABLED: bool = Field(default=False, description="启用相似问题匹配（进程内 n-gram 索引）")
+    AI_CACHE_SIMILARITY_THRESHOLD: float = Field(default=0.9, description="相似匹配的 Jaccard 相似度阈值")
+    AI_CACHE_SIMILARITY_MAX_ENTRIES: int = Field(default=5000, description="相似度索引最大条目数")
+    AI_CACHE_REPLAY_CHUNK_SIZE: int = Field(default=16, description="回放缓存回复时每个片段的字符数")
+    AI_CACHE_REPLAY_DELAY: float = Field(default=0.0, description="回放缓存回复时片段之间的间隔（秒）")
+    AI_SINGLEFLIGHT_ENABLED: bool = Field(default=True, description="合并相同的进行中 AI 请求")
+    AI_CONTEXT_MAX_TOKENS: int = Field(default=3000, description="对话上下文令牌预算")
+    AI_CONTEXT_MAX_TURNS: int = Field(default=50, description="Redis 中每个对话保留的最近消息数")
+    AI_CONTEXT_TTL: int = Field(default=86400, description="对话上下文窗口过期时间（秒）")
+    AI_CONTEXT_TOKENIZER: str = Field(default="heuristic", description="令牌计数器（heuristic 或 tiktoken:<encoding>）")
+    AI_CONTEXT_SUMMARY_ENABLED: bool = Field(default=False, description="把移出窗口的消息折叠进运行摘要（会调用 AI 服务）")
+    AI_CONTEXT_SUMMARY_MAX_TOKENS: int = Field(default=500, description="运行摘要最大令牌数")
+    AI_QUEUE_WORKERS: int = Field(default=8, description="AI 回复 worker 数（同时进行的回复生成上限，应小于数据库连接池大小）")
+    AI_QUEUE_MAX_SIZE: int = Field(default=1000, description="AI 回复队列最大长度，超出时拒绝新任务")
+    AI_QUEUE_POSITION_INTERVAL: float = Field(default=2.0, description="向排队会话推送排队位置的间隔（秒）")
+    AI_QUEUE_DRAIN_TIMEOUT: float = Field(default=30.0, description="关闭时等待队列处理完成的最长时间（秒）")
     
     # ==========================================
     # 📡 WebSocket 配置
@@ -97,6 +166,21 @@ class Settings(BaseSettings):
     WS_CONNECTION_TIMEOUT: int = Field(default=300, description="WebSocket 连接超时（秒）")
     WS_MESSAGE_MAX_SIZE: int = Field(default=1048576, description="WebSocket 消息最大大小（字节）")
     WS_RATE_LIMIT: int = Field(default=60, description="WebSocket 消息限流（每分钟）")
+    WS_STREAM_PROTOCOL_VERSION: int = Field(default=2, description="服务端支持的最高AI流式协议版本")
+    WS_STREAM_BUFFER_TTL: int = Field(default=120, description="AI流式缓冲保留时间（秒），用于重连补齐")
+    WS_BROKER_BACKEND: str = Field(default="local", description="跨 worker 消息代理（local / redis）")
+    WS_BROKER_PREFIX: str = Field(default="ws:", description="消息代理频道和键前缀")
+    WS_PRESENCE_TTL: int = Field(default=90, description="集群在线状态登记过期时间（秒）")
+    WS_SEND_QUEUE_SIZE: int = Field(default=256, description="每个连接出站队列的最大长度")
+    WS_SEND_TIMEOUT: float = Field(default=10.0, description="单帧发送超时（秒），超时视为连接失效")
+    WS_DROPPABLE_FRAME_TYPES: str = Field(
+        default="typing,heartbeat",
+        description="队列满时优先丢弃的帧类型（逗号分隔）"
+    )
+    WS_SLOW_CONSUMER_POLICY: str = Field(
+        default="disconnect",
+        description="丢弃可丢弃帧后队列仍满时的策略（disconnect / drop）"
+    )
     
     # ==========================================
     # 📝 日志配置
@@ -107,6 +191,10 @@ class Settings(BaseSettings):
     LOG_MAX_SIZE: int = Field(default=10485760, description="日志文件最大大小（字节）")
     LOG_BACKUP_COUNT: int = Field(default=5, description="日志文件备份数量")
     LOG_ROTATION: str = Field(default="daily", description="日志轮转策略")
+    LOG_REQUEST_BODY: bool = Field(
+        default=False,
+        description="请求日志记录请求体大小（调试模式下附带 1KB 以内的内容预览）"
+    )
     
     # ==========================================
     # 🔒 CORS 配置
@@ -129,6 +217,12 @@ class Settings(BaseSettings):
     RATE_LIMIT_REQUESTS: int = Field(default=100, description="限流请求数")
     RATE_LIMIT_WINDOW: int = Field(default=60, description="限流时间窗口（秒）")
     RATE_LIMIT_STORAGE: str = Field(default="redis", description="限流存储")
+    RATE_LIMIT_LOCAL_SHARE: float = Field(
+        default=0.1,
+        description="本地预检额度占剩余名额的比例（0 为禁用，每次都访问 Redis）"
+    )
+    RATE_LIMIT_LOCAL_TTL: float = Field(default=1.0, description="本地预检额度有效期（秒）")
+    RATE_LIMIT_LOCAL_MAX_KEYS: int = Field(default=10000, description="本地预检额度最大缓存键数")
     
     # API 特定限流
     AUTH_RATE_LIMIT: int = Field(default=5, description="认证接口限流（每分钟）")
@@ -247,6 +341,13 @@ class Settings(BaseSettings):
             return []
         return [lang.strip() for lang in self.SUPPORTED_LANGUAGES.split(",") if lang.strip()]
 
+    @property
+    def ws_droppable_frame_types_list(self) -> List[str]:
+        """获取队列满时可丢弃的帧类型列表"""
+        if not self.WS_DROPPABLE_FRAME_TYPES.strip():
+            return []
+        return [frame_type.strip() for frame_type in self.WS_DROPPABLE_FRAME_TYPES.split(",") if frame_type.strip()]
+
     @property
     def human_takeover_keywords_list(self) -> List[str]:
         """获取人工接管关键词列表"""
@@ -0,0 +1,101 @@
+"""
+🔑 密码哈希
+
+bcrypt 计算在专用的有界线程池中执行，不阻塞事件循环
+（bcrypt 在计算期间释放 GIL，线程池即可并行）
+排队中的密码运算超过上限时立即拒绝，避免登录洪峰拖垮整个 worker
+"""
+
+import asyncio
+import os
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Optional, TypeVar
+
+from loguru import logger
+from passlib.context import CryptContext
+
+from src.config.settings import get_settings
+from src.core.exceptions import RateLimitException
+
+settings = get_settings()
+
+T = TypeVar("T")
+
+# 共享的密码上下文（轮数取自配置）
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__rounds=settings.BCRYPT_ROUNDS
+)
+
+
+class PasswordHasher:
+    """在有界线程池中执行密码哈希与校验"""
+
+    def __init__(
+        self,
+        context: CryptContext = None,
+        max_workers: int = None,
+        max_pending: int = None
+    ):
+        self.context = context or pwd_context
+        self.max_workers = max_workers or settings.PASSWORD_HASH_WORKERS or min(4, os.cpu_count() or 1)
+        self.max_pending = max_pending or settings.PASSWORD_HASH_MAX_PENDING
+        self._executor: Optional[ThreadPoolExecutor] = None
+        # 已提交（执行中 + 排队中）的运算数，只在事件循环线程中修改
+        self._pending = 0
+
+    @property
+    def pending(self) -> int:
+        return self._pending
+
+    def _get_executor(self) -> ThreadPoolExecutor:
+        if self._executor is None:
+            self._executor = ThreadPoolExecutor(
+                max_workers=self.max_workers,
+                thread_name_prefix="password-hash"
+            )
+        return self._executor
+
+    async def _run(self, func: Callable[..., T], *args) -> T:
+        if self._pending >= self.max_pending:
+            logger.warning(f"Password hashing saturated ({self._pending} pending), rejecting request")
+            raise RateLimitException(
+                message="请求过多，请稍后重试",
+                details={"pending": self._pending, "limit": self.max_pending}
+            )
+
+        self._pending += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._get_executor(), func, *args)
+        finally:
+            self._pending -= 1
+
+    async def hash(self, password: str) -> str:
+        """生成密码哈希"""
+        return await self._run(self.context.hash, password)
+
+    async def verify(self, password: str, hashed_password: str) -> bool:
+        """验证密码"""
+        return await self._run(self.context.verify, password, hashed_password)
+
+    def shutdown(self):
+        """关闭线程池"""
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+
+# 全局密码哈希器
+password_hasher = PasswordHasher()
+
+
+async def hash_password(password: str) -> str:
+    """生成密码哈希（不阻塞事件循环）"""
+    return await password_hasher.hash(password)
+
+
+async def verify_password(plain_password: str, hashed_password: str) -> bool:
+    """验证密码（不阻塞事件循环）"""
+    return await password_hasher.verify(plain_password, hashed_password)
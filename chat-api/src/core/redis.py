@@ -8,7 +8,8 @@
 import asyncio
 import json
 from contextlib import asynccontextmanager
-from typing import Any, Dict, List, Optional, Union
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Union
+from uuid import uuid4
 
 import redis.asyncio as redis
 from loguru import logger
@@ -31,7 +32,7 @@ async def init_redis() -> None:
     初始化 Redis 连接
     创建不同用途的 Redis 客户端
     """
-    global redis_client, session_redis, cache_redis, queue_redis, redis_manager
+    global redis_client, session_redis, cache_redis, queue_redis, redis_manager, pubsub_dispatcher
     
     try:
         logger.info("🔄 Initializing Redis connections...")
@@ -83,6 +84,9 @@ async def init_redis() -> None:
         # 初始化 Redis 管理器
         redis_manager = RedisManager()
 
+        # 初始化发布订阅分发器（复用队列连接池）
+        pubsub_dispatcher = PubSubDispatcher(queue_redis)
+
         logger.info("✅ Redis connections initialized successfully")
         
     except Exception as e:
@@ -95,11 +99,14 @@ async def close_redis() -> None:
     关闭 Redis 连接
     清理资源
     """
-    global redis_client, session_redis, cache_redis, queue_redis, redis_manager
+    global redis_client, session_redis, cache_redis, queue_redis, redis_manager, pubsub_dispatcher
     
     try:
         logger.info("🔄 Closing Redis connections...")
         
+        if pubsub_dispatcher:
+            await pubsub_dispatcher.close()
+        
         clients = [redis_client, session_redis, cache_redis, queue_redis]
         for client in clients:
             if client:
@@ -107,6 +114,7 @@ async def close_redis() -> None:
         
         redis_client = session_redis = cache_redis = queue_redis = None
         redis_manager = None
+        pubsub_dispatcher = None
 
         logger.info("✅ Redis connections closed")
         
@@ -399,9 +407,151 @@ class RedisManager:
             }
 
 
+class PubSubDispatcher:
+    """
+    Redis 发布订阅分发器
+    所有频道复用一条订阅连接，按频道分发到注册的处理函数
+    """
+    
+    def __init__(self, client: Redis):
+        self.client = client
+        self._pubsub = None
+        self._handlers: Dict[str, Callable[[str, str], Awaitable[None]]] = {}
+        self._lock = asyncio.Lock()
+        self._listen_task: Optional[asyncio.Task] = None
+    
+    async def subscribe(self, channel: str, handler: Callable[[str, str], Awaitable[None]]) -> None:
+        """
+        订阅频道
+        
+        Args:
+            channel: 频道名
+            handler: 处理函数，参数为 (channel, data)
+        """
+        async with self._lock:
+            already_subscribed = channel in self._handlers
+            self._handlers[channel] = handler
+            if already_subscribed:
+                return
+            
+            if self._pubsub is None:
+                self._pubsub = self.client.pubsub(ignore_subscribe_messages=True)
+            await self._pubsub.subscribe(channel)
+            
+            if self._listen_task is None or self._listen_task.done():
+                self._listen_task = asyncio.create_task(self._listen_loop())
+    
+    async def unsubscribe(self, channel: str) -> None:
+        """取消订阅频道"""
+        async with self._lock:
+            if self._handlers.pop(channel, None) is None:
+                return
+            if self._pubsub is not None:
+                await self._pubsub.unsubscribe(channel)
+    
+    async def publish(self, channel: str, data: str) -> int:
+        """发布消息，返回收到消息的订阅者数量"""
+        return await self.client.publish(channel, data)
+    
+    def is_subscribed(self, channel: str) -> bool:
+        """是否已订阅频道"""
+        return channel in self._handlers
+    
+    async def _listen_loop(self):
+        """接收循环"""
+        while True:
+            try:
+                if not self._handlers:
+                    await asyncio.sleep(1)
+                    continue
+                
+                message = await self._pubsub.get_message(ignore_subscribe_messages=True, timeout=1.0)
+                if not message or message.get("type") != "message":
+                    continue
+                
+                handler = self._handlers.get(message["channel"])
+                if handler is None:
+                    continue
+                
+                try:
+                    await handler(message["channel"], message["data"])
+                except Exception as e:
+                    logger.error(f"❌ PubSub handler error on {message['channel']}: {e}")
+                
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # 连接异常时等待重连，redis-py 会在重连后自动恢复订阅
+                logger.error(f"❌ PubSub listen error: {e}")
+                await asyncio.sleep(1)
+    
+    async def close(self) -> None:
+        """关闭分发器"""
+        if self._listen_task:
+            self._listen_task.cancel()
+            try:
+                await self._listen_task
+            except (asyncio.CancelledError, Exception):
+                pass
+            self._listen_task = None
+        
+        if self._pubsub is not None:
+            try:
+                await self._pubsub.close()
+            except Exception:
+                pass
+            self._pubsub = None
+        
+        self._handlers.clear()
+
+
+class RedisLock:
+    """
+    基于 SET NX PX 的分布式锁
+    只有持有者（token 匹配）才能释放或续期，锁到期自动失效
+    """
+    
+    _RELEASE_SCRIPT = """
+    if redis.call('GET', KEYS[1]) == ARGV[1] then
+        return redis.call('DEL', KEYS[1])
+    end
+    return 0
+    """
+    
+    _EXTEND_SCRIPT = """
+    if redis.call('GET', KEYS[1]) == ARGV[1] then
+        return redis.call('PEXPIRE', KEYS[1], ARGV[2])
+    end
+    return 0
+    """
+    
+    def __init__(self, client: Redis, name: str, ttl_ms: int):
+        self.client = client
+        self.name = name
+        self.ttl_ms = ttl_ms
+        self.token = uuid4().hex
+        self._release = client.register_script(self._RELEASE_SCRIPT)
+        self._extend = client.register_script(self._EXTEND_SCRIPT)
+    
+    async def acquire(self) -> bool:
+        """尝试获取锁（不等待）"""
+        return bool(await self.client.set(self.name, self.token, nx=True, px=self.ttl_ms))
+    
+    async def extend(self) -> bool:
+        """续期锁"""
+        return bool(await self._extend(keys=[self.name], args=[self.token, self.ttl_ms]))
+    
+    async def release(self) -> bool:
+        """释放锁"""
+        return bool(await self._release(keys=[self.name], args=[self.token]))
+
+
 # Redis 管理器实例（延迟初始化）
 redis_manager: Optional[RedisManager] = None
 
+# 发布订阅分发器实例
+pubsub_dispatcher: Optional[PubSubDispatcher] = None
+
 
 def get_redis_manager() -> RedisManager:
     """获取 Redis 管理器实例"""
@@ -414,12 +564,22 @@ def get_redis_manager() -> RedisManager:
     return redis_manager
 
 
+def get_pubsub_dispatcher() -> PubSubDispatcher:
+    """获取发布订阅分发器实例"""
+    if pubsub_dispatcher is None:
+        raise RuntimeError("Redis connections not initialized. Call init_redis() first.")
+    return pubsub_dispatcher
+
+
 # 导出常用函数和类
 __all__ = [
     "init_redis",
     "close_redis",
     "RedisManager",
     "get_redis_manager",
+    "PubSubDispatcher",
+    "get_pubsub_dispatcher",
+    "RedisLock",
     "redis_client",
     "session_redis",
     "cache_redis",
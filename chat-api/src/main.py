@@ -70,6 +70,44 @@ async def lifespan(app: FastAPI):
         # 清理资源
         logger.info("🔄 Shutting down Chat API application...")
         
+        # 先处理完排队中的AI回复，再关闭 WebSocket 连接
+        from src.ai.queue import ai_reply_queue
+        await ai_reply_queue.stop()
+        logger.info("✅ AI reply queue drained")
+        
+        # 写完缓冲中的消息
+        from src.services.message_writer import message_writer
+        await message_writer.stop()
+        
+        from src.utils.ids import worker_id_lease
+        await worker_id_lease.stop()
+        
+        from src.services.stats import conversation_stats
+        await conversation_stats.stop()
+        
+        from src.websocket.manager import close_websocket_manager
+        await close_websocket_manager()
+        logger.info("✅ WebSocket manager closed")
+        
+        from src.session.manager import close_session_manager
+        await close_session_manager()
+        logger.info("✅ Session manager closed")
+        
+        from src.ai.breaker import circuit_breakers
+        await circuit_breakers.stop()
+        
+        from src.ai.singleflight import single_flight
+        await single_flight.cancel_all()
+        
+        from src.ai.client import close_ai_clients
+        await close_ai_clients()
+        
+        from src.middleware.token_cache import token_cache
+        await token_cache.stop()
+        
+        from src.core.passwords import password_hasher
+        password_hasher.shutdown()
+        
         await close_redis()
         logger.info("✅ Redis connection closed")
         
@@ -82,21 +120,45 @@ async def lifespan(app: FastAPI):
 async def _initialize_services():
     """初始化各种服务"""
     try:
+        # 分配消息ID的 worker 编号并启动批量消息写入
+        from src.utils.ids import worker_id_lease
+        await worker_id_lease.start()
+        from src.services.message_writer import message_writer
+        await message_writer.start()
+
         # 初始化 AI 服务
         from src.ai.client import init_ai_clients
         await init_ai_clients()
+        
+        # 加载共享的熔断状态
+        from src.ai.breaker import circuit_breakers
+        from src.ai.service import ai_service
+        await circuit_breakers.start(ai_service.router.providers)
         logger.info("✅ AI services initialized")
 
         # 初始化会话管理器
-        from src.session.manager import init_session_manager
+        from src.session.manager import init_session_manager, get_session_manager
         init_session_manager()
+        await get_session_manager().start()
         logger.info("✅ Session manager initialized")
 
+        # 订阅令牌吊销通知
+        from src.middleware.token_cache import token_cache
+        await token_cache.start()
+
         # 初始化 WebSocket 管理器
         from src.websocket.manager import init_websocket_manager
         await init_websocket_manager()
         logger.info("✅ WebSocket manager initialized")
 
+        # 启动 AI 回复队列
+        from src.ai.queue import ai_reply_queue
+        ai_reply_queue.start()
+
+        # 增量维护对话统计并定期对账
+        from src.services.stats import conversation_stats
+        conversation_stats.start()
+
     except Exception as e:
         logger.error(f"❌ Failed to initialize services: {e}")
         raise
@@ -4,149 +4,93 @@
 处理JWT认证和用户身份验证
 """
 
-import time
 from typing import Optional
 
-from fastapi import Request, Response
+from fastapi import Request
 from jose import JWTError, jwt
 from loguru import logger
-from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.types import ASGIApp, Receive, Scope, Send
 
 from src.config.settings import get_settings
 from src.core.exceptions import AuthenticationException
+from src.middleware.context import AUTH_EXEMPT_PATHS, AUTH_EXEMPT_PREFIXES, get_request_context
+from src.middleware.token_cache import token_cache
 from src.models.user import TokenData, UserRole
 
 settings = get_settings()
 
 
-class AuthMiddleware(BaseHTTPMiddleware):
+def verify_token(token: str) -> Optional[TokenData]:
+    """验证JWT令牌"""
+    try:
+        # 解码JWT
+        payload = jwt.decode(
+            token,
+            settings.JWT_SECRET_KEY,
+            algorithms=[settings.JWT_ALGORITHM]
+        )
+        
+        # 提取用户信息
+        user_id = payload.get("sub")
+        email = payload.get("email")
+        role = payload.get("role")
+        exp = payload.get("exp")
+        
+        if not user_id or not email:
+            return None
+        
+        # 创建令牌数据
+        return TokenData(
+            user_id=int(user_id),
+            email=email,
+            role=UserRole(role) if role else UserRole.GUEST,
+            exp=exp
+        )
+        
+    except JWTError as e:
+        logger.warning(f"JWT verification failed: {e}")
+        return None
+    except Exception as e:
+        logger.error(f"Token verification error: {e}")
+        return None
+
+
+class AuthMiddleware:
     """认证中间件"""
     
     # 不需要认证的路径
-    EXEMPT_PATHS = {
-        "/",
-        "/health",
-        "/metrics",
-        "/docs",
-        "/redoc",
-        "/openapi.json",
-        "/api/v1/auth/login",
-        "/api/v1/auth/register",
-        "/favicon.ico",
-    }
+    EXEMPT_PATHS = AUTH_EXEMPT_PATHS
     
     # 不需要认证的路径前缀
-    EXEMPT_PREFIXES = {
-        "/static/",
-        "/uploads/",
-        "/ws",  # WebSocket 连接在连接时单独处理认证
-    }
+    EXEMPT_PREFIXES = AUTH_EXEMPT_PREFIXES
     
-    async def dispatch(self, request: Request, call_next):
-        """处理请求"""
-        start_time = time.time()
-        
-        try:
-            # 检查是否需要认证
-            if self._is_exempt_path(request.url.path):
-                response = await call_next(request)
-                return response
-            
-            # 提取和验证令牌
-            token = self._extract_token(request)
-            if token:
-                user_data = self._verify_token(token)
-                if user_data:
-                    # 将用户信息添加到请求状态
-                    request.state.user = user_data
-                    request.state.authenticated = True
-                else:
-                    request.state.user = None
-                    request.state.authenticated = False
-            else:
-                request.state.user = None
-                request.state.authenticated = False
-            
-            # 继续处理请求
-            response = await call_next(request)
-            
-            # 添加处理时间头
-            process_time = time.time() - start_time
-            response.headers["X-Process-Time"] = str(process_time)
-            
-            return response
-            
-        except AuthenticationException:
-            raise
-        except Exception as e:
-            logger.error(f"Authentication middleware error: {e}")
-            request.state.user = None
-            request.state.authenticated = False
-            response = await call_next(request)
-            return response
+    def __init__(self, app: ASGIApp):
+        self.app = app
     
-    def _is_exempt_path(self, path: str) -> bool:
-        """检查路径是否免于认证"""
-        # 检查完全匹配
-        if path in self.EXEMPT_PATHS:
-            return True
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
         
-        # 检查前缀匹配
-        for prefix in self.EXEMPT_PREFIXES:
-            if path.startswith(prefix):
-                return True
-        
-        return False
-    
-    def _extract_token(self, request: Request) -> Optional[str]:
-        """从请求中提取令牌"""
-        # 从 Authorization 头提取
-        authorization = request.headers.get("Authorization")
-        if authorization and authorization.startswith("Bearer "):
-            return authorization[7:]  # 移除 "Bearer " 前缀
+        context = get_request_context(scope)
+        state = scope["state"]
         
-        # 从查询参数提取（用于某些特殊情况）
-        token = request.query_params.get("token")
-        if token:
-            return token
-        
-        return None
-    
-    def _verify_token(self, token: str) -> Optional[TokenData]:
-        """验证JWT令牌"""
-        try:
-            # 解码JWT
-            payload = jwt.decode(
-                token,
-                settings.JWT_SECRET_KEY,
-                algorithms=[settings.JWT_ALGORITHM]
-            )
+        if not context.path_class.auth_exempt:
+            try:
+                # 令牌在整个请求中只解码一次，同一令牌的后续请求直接命中缓存
+                token = context.token
+                context.user = await token_cache.verify(token, verify_token) if token else None
+                context.authenticated = context.user is not None
+            except Exception as e:
+                logger.error(f"Authentication middleware error: {e}")
+                context.user = None
+                context.authenticated = False
             
-            # 提取用户信息
-            user_id = payload.get("sub")
-            email = payload.get("email")
-            role = payload.get("role")
-            exp = payload.get("exp")
-            
-            if not user_id or not email:
-                return None
-            
-            # 创建令牌数据
-            token_data = TokenData(
-                user_id=int(user_id),
-                email=email,
-                role=UserRole(role) if role else UserRole.GUEST,
-                exp=exp
-            )
-            
-            return token_data
-            
-        except JWTError as e:
-            logger.warning(f"JWT verification failed: {e}")
-            return None
-        except Exception as e:
-            logger.error(f"Token verification error: {e}")
-            return None
+            # 将用户信息添加到请求状态
+            state["user"] = context.user
+            state["authenticated"] = context.authenticated
+        
+        await self.app(scope, receive, send)
 
 
 def get_current_user(request: Request) -> Optional[TokenData]:
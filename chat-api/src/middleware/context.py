@@ -0,0 +1,177 @@
+"""
+🧭 请求上下文
+
+纯 ASGI 中间件共享的每请求上下文，保存在 scope["state"] 中
+请求ID、客户端IP、令牌、路径分类等只在第一次使用时计算一次，各层中间件直接复用
+"""
+
+import time
+from functools import lru_cache
+from typing import Any, Dict, MutableMapping, Optional
+from urllib.parse import parse_qs
+from uuid import uuid4
+
+# 不需要认证的路径
+AUTH_EXEMPT_PATHS = {
+    "/",
+    "/health",
+    "/metrics",
+    "/docs",
+    "/redoc",
+    "/openapi.json",
+    "/api/v1/auth/login",
+    "/api/v1/auth/register",
+    "/favicon.ico",
+}
+
+# 不需要认证的路径前缀
+AUTH_EXEMPT_PREFIXES = (
+    "/static/",
+    "/uploads/",
+    "/ws",  # WebSocket 连接在连接时单独处理认证
+)
+
+# 不记录日志的路径
+LOG_SKIP_PATHS = {
+    "/health",
+    "/metrics",
+    "/favicon.ico",
+}
+
+# 不记录日志的路径前缀
+LOG_SKIP_PREFIXES = (
+    "/static/",
+    "/docs",
+    "/redoc",
+    "/openapi.json",
+)
+
+# 限流规则（按前缀匹配，先匹配先生效）
+RATE_LIMIT_RULES = (
+    ("/api/v1/auth/login", "auth"),
+    ("/api/v1/chat/messages", "message"),
+    ("/api/v1/admin", "admin"),
+)
+
+STATE_KEY = "request_context"
+
+
+class PathClass:
+    """路径分类结果"""
+
+    __slots__ = ("auth_exempt", "skip_logging", "rate_limit_rule")
+
+    def __init__(self, auth_exempt: bool, skip_logging: bool, rate_limit_rule: str):
+        self.auth_exempt = auth_exempt
+        self.skip_logging = skip_logging
+        self.rate_limit_rule = rate_limit_rule
+
+
+@lru_cache(maxsize=2048)
+def classify_path(path: str) -> PathClass:
+    """对请求路径分类（结果按路径缓存）"""
+    auth_exempt = path in AUTH_EXEMPT_PATHS or path.startswith(AUTH_EXEMPT_PREFIXES)
+    skip_logging = path in LOG_SKIP_PATHS or path.startswith(LOG_SKIP_PREFIXES)
+
+    rate_limit_rule = "default"
+    for prefix, rule in RATE_LIMIT_RULES:
+        if path.startswith(prefix):
+            rate_limit_rule = rule
+            break
+
+    return PathClass(auth_exempt, skip_logging, rate_limit_rule)
+
+
+class RequestContext:
+    """单个请求的共享上下文"""
+
+    __slots__ = (
+        "scope", "method", "path", "start_time", "headers", "path_class",
+        "_request_id", "_client_ip", "_token", "_token_resolved",
+        "user", "authenticated", "body_size", "body_preview",
+    )
+
+    def __init__(self, scope: MutableMapping[str, Any]):
+        self.scope = scope
+        self.method: str = scope.get("method", "GET")
+        self.path: str = scope.get("path", "/")
+        self.start_time = time.time()
+
+        # 请求头只解码一次（同名头取第一个）
+        headers: Dict[str, str] = {}
+        for name, value in scope.get("headers", ()):
+            key = name.decode("latin-1")
+            if key not in headers:
+                headers[key] = value.decode("latin-1")
+        self.headers = headers
+
+        self.path_class = classify_path(self.path)
+
+        self._request_id: Optional[str] = None
+        self._client_ip: Optional[str] = None
+        self._token: Optional[str] = None
+        self._token_resolved = False
+
+        # 由认证中间件填充
+        self.user = None
+        self.authenticated = False
+
+        # 由日志中间件填充（仅在开启请求体记录时）
+        self.body_size = 0
+        self.body_preview: Optional[bytes] = None
+
+    @property
+    def request_id(self) -> str:
+        if self._request_id is None:
+            self._request_id = str(uuid4())
+        return self._request_id
+
+    @property
+    def client_ip(self) -> str:
+        """客户端IP地址（优先使用代理头）"""
+        if self._client_ip is None:
+            forwarded_for = self.headers.get("x-forwarded-for")
+            if forwarded_for:
+                self._client_ip = forwarded_for.split(",")[0].strip()
+            elif self.headers.get("x-real-ip"):
+                self._client_ip = self.headers["x-real-ip"]
+            else:
+                client = self.scope.get("client")
+                self._client_ip = client[0] if client else "unknown"
+        return self._client_ip
+
+    @property
+    def token(self) -> Optional[str]:
+        """请求携带的令牌（Authorization 头或 token 查询参数）"""
+        if not self._token_resolved:
+            self._token_resolved = True
+            authorization = self.headers.get("authorization")
+            if authorization and authorization.startswith("Bearer "):
+                self._token = authorization[7:]
+            else:
+                query_string = self.scope.get("query_string", b"")
+                if b"token=" in query_string:
+                    values = parse_qs(query_string.decode("latin-1")).get("token")
+                    self._token = values[0] if values else None
+        return self._token
+
+    @property
+    def user_id(self) -> Optional[int]:
+        return getattr(self.user, "user_id", None)
+
+    @property
+    def url(self) -> str:
+        query_string = self.scope.get("query_string", b"")
+        if query_string:
+            return f"{self.path}?{query_string.decode('latin-1')}"
+        return self.path
+
+
+def get_request_context(scope: MutableMapping[str, Any]) -> RequestContext:
+    """获取（必要时创建）请求上下文，同时作为 request.state.request_context 暴露"""
+    state = scope.setdefault("state", {})
+    context = state.get(STATE_KEY)
+    if context is None:
+        context = RequestContext(scope)
+        state[STATE_KEY] = context
+    return context
@@ -6,221 +6,195 @@
 
 import json
 import time
-import uuid
-from typing import Any, Dict
+from typing import Any, Dict, Optional
 
-from fastapi import Request, Response
+from fastapi import Request
 from loguru import logger
-from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 
 from src.config.settings import get_settings
+from src.middleware.context import (
+    LOG_SKIP_PATHS, LOG_SKIP_PREFIXES, RequestContext, get_request_context
+)
 
 settings = get_settings()
 
+# 请求体预览的最大字节数
+BODY_PREVIEW_LIMIT = 1024
 
-class LoggingMiddleware(BaseHTTPMiddleware):
+
+class LoggingMiddleware:
     """日志中间件"""
     
     # 不记录日志的路径
-    SKIP_PATHS = {
-        "/health",
-        "/metrics",
-        "/favicon.ico",
-    }
+    SKIP_PATHS = LOG_SKIP_PATHS
     
     # 不记录日志的路径前缀
-    SKIP_PREFIXES = {
-        "/static/",
-        "/docs",
-        "/redoc",
-        "/openapi.json",
+    SKIP_PREFIXES = LOG_SKIP_PREFIXES
+    
+    # 需要过滤的敏感头
+    SENSITIVE_HEADERS = {
+        "authorization",
+        "cookie",
+        "x-api-key",
+        "x-auth-token",
     }
     
-    async def dispatch(self, request: Request, call_next):
-        """处理请求"""
-        # 生成请求ID
-        request_id = str(uuid.uuid4())
-        request.state.request_id = request_id
+    def __init__(self, app: ASGIApp, log_body: Optional[bool] = None):
+        self.app = app
+        # 请求体不再整体读取缓冲，开启时边转发边统计大小并截取预览
+        self.log_body = settings.LOG_REQUEST_BODY if log_body is None else log_body
+    
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
         
-        # 检查是否需要记录日志
-        if self._should_skip_logging(request.url.path):
-            response = await call_next(request)
-            return response
+        context = get_request_context(scope)
+        request_id = context.request_id
+        scope["state"]["request_id"] = request_id
         
-        # 记录请求开始
-        start_time = time.time()
-        request_data = await self._extract_request_data(request)
+        # 检查是否需要记录日志
+        if context.path_class.skip_logging:
+            await self.app(scope, receive, send)
+            return
         
         logger.info(
             "Request started",
             extra={
                 "request_id": request_id,
-                "method": request.method,
-                "url": str(request.url),
-                "path": request.url.path,
-                "query_params": dict(request.query_params),
-                "headers": self._filter_headers(dict(request.headers)),
-                "client_ip": self._get_client_ip(request),
-                "user_agent": request.headers.get("user-agent"),
-                "user_id": getattr(request.state, "user", {}).get("user_id") if hasattr(request.state, "user") else None,
-                "body_size": request_data.get("body_size", 0),
+                "method": context.method,
+                "url": context.url,
+                "path": context.path,
+                "headers": self._filter_headers(context.headers),
+                "client_ip": context.client_ip,
+                "user_agent": context.headers.get("user-agent"),
+                "user_id": context.user_id,
+                "body_size": self._declared_body_size(context),
                 "event_type": "request_start",
             }
         )
         
+        if self.log_body:
+            receive = self._tee_receive(context, receive)
+        
+        status_code = 500
+        response_size = 0
+        
+        async def send_with_logging(message: Message):
+            nonlocal status_code, response_size
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                process_time = time.time() - context.start_time
+                headers = list(message.get("headers", ()))
+                headers.append((b"x-request-id", request_id.encode("latin-1")))
+                headers.append((b"x-process-time", str(process_time).encode("latin-1")))
+                message["headers"] = headers
+            elif message["type"] == "http.response.body":
+                response_size += len(message.get("body", b""))
+            await send(message)
+        
         try:
-            # 处理请求
-            response = await call_next(request)
-            
-            # 计算处理时间
-            process_time = time.time() - start_time
-            
-            # 记录请求完成
-            logger.info(
-                "Request completed",
-                extra={
-                    "request_id": request_id,
-                    "method": request.method,
-                    "url": str(request.url),
-                    "path": request.url.path,
-                    "status_code": response.status_code,
-                    "process_time": round(process_time, 4),
-                    "response_size": self._get_response_size(response),
-                    "user_id": getattr(request.state, "user", {}).user_id if hasattr(request.state, "user") and hasattr(getattr(request.state, "user", {}), "user_id") else None,
-                    "event_type": "request_complete",
-                }
-            )
-            
-            # 添加响应头
-            response.headers["X-Request-ID"] = request_id
-            response.headers["X-Process-Time"] = str(process_time)
-            
-            # 检查慢请求
-            if process_time > settings.SLOW_REQUEST_THRESHOLD:
-                logger.warning(
-                    "Slow request detected",
-                    extra={
-                        "request_id": request_id,
-                        "method": request.method,
-                        "path": request.url.path,
-                        "process_time": process_time,
-                        "threshold": settings.SLOW_REQUEST_THRESHOLD,
-                        "event_type": "slow_request",
-                    }
-                )
-            
-            return response
-            
+            await self.app(scope, receive, send_with_logging)
         except Exception as e:
-            # 计算处理时间
-            process_time = time.time() - start_time
-            
             # 记录请求错误
             logger.error(
                 "Request failed",
                 extra={
                     "request_id": request_id,
-                    "method": request.method,
-                    "url": str(request.url),
-                    "path": request.url.path,
-                    "process_time": round(process_time, 4),
+                    "method": context.method,
+                    "url": context.url,
+                    "path": context.path,
+                    "process_time": round(time.time() - context.start_time, 4),
                     "error": str(e),
                     "error_type": type(e).__name__,
-                    "user_id": getattr(request.state, "user", None).user_id if hasattr(request.state, "user") and getattr(request.state, "user", None) else None,
+                    "user_id": context.user_id,
                     "event_type": "request_error",
                 }
             )
-            
             raise
-    
-    def _should_skip_logging(self, path: str) -> bool:
-        """检查是否应该跳过日志记录"""
-        # 检查完全匹配
-        if path in self.SKIP_PATHS:
-            return True
         
-        # 检查前缀匹配
-        for prefix in self.SKIP_PREFIXES:
-            if path.startswith(prefix):
-                return True
-        
-        return False
-    
-    async def _extract_request_data(self, request: Request) -> Dict[str, Any]:
-        """提取请求数据"""
-        data = {}
-        
-        try:
-            # 获取请求体大小
-            if hasattr(request, "_body"):
-                body = request._body
-            else:
-                body = await request.body()
-                request._body = body  # 缓存请求体
-            
-            data["body_size"] = len(body) if body else 0
-            
-            # 记录请求体内容（仅在调试模式下）
-            if settings.DEBUG and body and data["body_size"] < 1024:  # 小于1KB
-                try:
-                    content_type = request.headers.get("content-type", "")
-                    if "application/json" in content_type:
-                        data["body"] = json.loads(body.decode())
-                    elif "application/x-www-form-urlencoded" in content_type:
-                        data["body"] = body.decode()
-                except Exception:
-                    pass  # 忽略解析错误
-            
-        except Exception as e:
-            logger.warning(f"Failed to extract request data: {e}")
+        process_time = time.time() - context.start_time
         
-        return data
-    
-    def _filter_headers(self, headers: Dict[str, str]) -> Dict[str, str]:
-        """过滤敏感头信息"""
-        sensitive_headers = {
-            "authorization",
-            "cookie",
-            "x-api-key",
-            "x-auth-token",
+        # 记录请求完成
+        completed = {
+            "request_id": request_id,
+            "method": context.method,
+            "url": context.url,
+            "path": context.path,
+            "status_code": status_code,
+            "process_time": round(process_time, 4),
+            "response_size": response_size,
+            "user_id": context.user_id,
+            "event_type": "request_complete",
         }
+        if self.log_body:
+            completed["body_size"] = context.body_size
+            # 请求体内容仅在调试模式下记录
+            body = self._decode_body_preview(context) if settings.DEBUG else None
+            if body is not None:
+                completed["body"] = body
+        logger.info("Request completed", extra=completed)
         
-        filtered = {}
-        for key, value in headers.items():
-            if key.lower() in sensitive_headers:
-                filtered[key] = "***FILTERED***"
-            else:
-                filtered[key] = value
-        
-        return filtered
+        # 检查慢请求
+        if process_time > settings.SLOW_REQUEST_THRESHOLD:
+            logger.warning(
+                "Slow request detected",
+                extra={
+                    "request_id": request_id,
+                    "method": context.method,
+                    "path": context.path,
+                    "process_time": process_time,
+                    "threshold": settings.SLOW_REQUEST_THRESHOLD,
+                    "event_type": "slow_request",
+                }
+            )
     
-    def _get_client_ip(self, request: Request) -> str:
-        """获取客户端IP地址"""
-        # 检查代理头
-        forwarded_for = request.headers.get("x-forwarded-for")
-        if forwarded_for:
-            return forwarded_for.split(",")[0].strip()
+    def _tee_receive(self, context: RequestContext, receive: Receive) -> Receive:
+        """包装 receive：统计请求体大小并保留前 1KB 作为预览"""
+        preview = bytearray()
         
-        real_ip = request.headers.get("x-real-ip")
-        if real_ip:
-            return real_ip
+        async def tee() -> Message:
+            message = await receive()
+            if message["type"] == "http.request":
+                body = message.get("body", b"")
+                context.body_size += len(body)
+                if len(preview) < BODY_PREVIEW_LIMIT:
+                    preview.extend(body[:BODY_PREVIEW_LIMIT - len(preview)])
+                    context.body_preview = bytes(preview)
+            return message
         
-        # 返回直接连接的IP
-        if hasattr(request, "client") and request.client:
-            return request.client.host
-        
-        return "unknown"
+        return tee
     
-    def _get_response_size(self, response: Response) -> int:
-        """获取响应大小"""
+    def _declared_body_size(self, context: RequestContext) -> int:
+        """请求声明的请求体大小"""
         try:
-            content_length = response.headers.get("content-length")
-            if content_length:
-                return int(content_length)
-        except Exception:
-            pass
+            return int(context.headers.get("content-length", 0))
+        except ValueError:
+            return 0
+    
+    def _decode_body_preview(self, context: RequestContext) -> Optional[Any]:
+        """解析请求体预览（仅完整读取且小于 1KB 的 JSON / 表单请求体）"""
+        body = context.body_preview
+        if not body or context.body_size >= BODY_PREVIEW_LIMIT:
+            return None
         
-        return 0
+        try:
+            content_type = context.headers.get("content-type", "")
+            if "application/json" in content_type:
+                return json.loads(body.decode())
+            if "application/x-www-form-urlencoded" in content_type:
+                return body.decode()
+        except Exception:
+            pass  # 忽略解析错误
+        return None
+    
+    def _filter_headers(self, headers: Dict[str, str]) -> Dict[str, str]:
+        """过滤敏感头信息"""
+        return {
+            key: "***FILTERED***" if key.lower() in self.SENSITIVE_HEADERS else value
+            for key, value in headers.items()
+        }
 
 
 def get_request_id(request: Request) -> str:
@@ -2,228 +2,222 @@
 🛡️ 限流中间件
 
 基于Redis的API请求限流
+
+滑动窗口计数由单个 Lua 脚本原子完成（清理过期记录、计数、记录本次请求），
+每次请求使用唯一成员，同一毫秒内的请求不会合并
+明显未接近上限的客户端可以在本地额度内直接放行，放行记录在下一次访问 Redis 时补写
 """
 
+import itertools
+import math
 import time
-from typing import Dict, Optional
+from typing import Any, Dict, List, Optional, Tuple
+from uuid import uuid4
 
-from fastapi import Request, Response
+from fastapi.responses import JSONResponse
 from loguru import logger
-from starlette.middleware.base import BaseHTTPMiddleware
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 
 from src.config.settings import get_settings
-from src.core.exceptions import RateLimitException
-from src.core.redis import redis_manager
+from src.core.redis import get_redis_manager
+from src.middleware.context import RequestContext, get_request_context
+from src.models.base import ErrorResponse
+from src.utils.cache import TTLCache
 
 settings = get_settings()
 
 
-class RateLimitMiddleware(BaseHTTPMiddleware):
-    """限流中间件"""
-    
-    def __init__(self, app, redis_client=None):
-        super().__init__(app)
-        self.redis = redis_client or redis_manager
-        
-        # 路径特定的限流配置
-        self.path_limits = {
-            "/api/v1/auth/login": {
-                "requests": settings.AUTH_RATE_LIMIT,
-                "window": 60,  # 1分钟
-            },
-            "/api/v1/chat/messages": {
-                "requests": settings.MESSAGE_RATE_LIMIT,
-                "window": 60,  # 1分钟
-            },
-            "/api/v1/admin": {
-                "requests": settings.ADMIN_RATE_LIMIT,
-                "window": 60,  # 1分钟
-            },
+# KEYS[1]: 限流键
+# ARGV: 当前毫秒时间, 窗口毫秒数, 上限, 本次成员, 之后为本地已放行请求的 (score, 成员) 对
+_SLIDING_WINDOW_SCRIPT = """
+local key = KEYS[1]
+local now = tonumber(ARGV[1])
+local window = tonumber(ARGV[2])
+local limit = tonumber(ARGV[3])
+
+redis.call('ZREMRANGEBYSCORE', key, '-inf', now - window)
+for i = 5, #ARGV, 2 do
+    redis.call('ZADD', key, ARGV[i], ARGV[i + 1])
+end
+
+local count = redis.call('ZCARD', key)
+local allowed = 0
+if count < limit then
+    redis.call('ZADD', key, now, ARGV[4])
+    count = count + 1
+    allowed = 1
+end
+redis.call('PEXPIRE', key, window)
+
+local reset = now + window
+local oldest = redis.call('ZRANGE', key, 0, 0, 'WITHSCORES')
+if oldest[2] then
+    reset = tonumber(oldest[2]) + window
+end
+return {allowed, count, reset}
+"""
+
+
+class RateLimitResult:
+    """一次限流检查的结果"""
+
+    __slots__ = ("allowed", "limit", "remaining", "window", "reset_at", "retry_after", "current")
+
+    def __init__(
+        self,
+        allowed: bool,
+        limit: int,
+        current: int,
+        window: int,
+        reset_at: float
+    ):
+        self.allowed = allowed
+        self.limit = limit
+        self.current = current
+        self.remaining = max(0, limit - current)
+        self.window = window
+        # 窗口中最早一条记录过期（即释放出一个名额）的时间
+        self.reset_at = reset_at
+        self.retry_after = 0 if allowed else max(1, math.ceil(reset_at - time.time()))
+
+    def headers(self) -> Dict[str, str]:
+        """X-RateLimit-* 响应头"""
+        headers = {
+            "X-RateLimit-Limit": str(self.limit),
+            "X-RateLimit-Remaining": str(self.remaining),
+            "X-RateLimit-Reset": str(math.ceil(self.reset_at)),
+            "X-RateLimit-Window": str(self.window),
         }
-        
-        # 默认限流配置
-        self.default_limit = {
-            "requests": settings.RATE_LIMIT_REQUESTS,
-            "window": settings.RATE_LIMIT_WINDOW,
+        if not self.allowed:
+            headers["Retry-After"] = str(self.retry_after)
+        return headers
+
+    def to_dict(self) -> Dict[str, Any]:
+        return {
+            "allowed": self.allowed,
+            "limit": self.limit,
+            "current": self.current,
+            "remaining": self.remaining,
+            "window": self.window,
+            "reset_time": math.ceil(self.reset_at),
+            "retry_after": self.retry_after,
         }
-    
-    async def dispatch(self, request: Request, call_next):
-        """处理请求"""
-        if not settings.RATE_LIMIT_ENABLED:
-            return await call_next(request)
-        
-        try:
-            # 获取客户端标识
-            client_id = self._get_client_id(request)
-            
-            # 获取限流配置
-            limit_config = self._get_limit_config(request.url.path)
-            
-            # 检查限流
-            await self._check_rate_limit(client_id, request.url.path, limit_config)
-            
-            # 继续处理请求
-            response = await call_next(request)
-            
-            # 添加限流头信息
-            self._add_rate_limit_headers(response, client_id, request.url.path, limit_config)
-            
-            return response
-            
-        except RateLimitException:
-            raise
-        except Exception as e:
-            logger.error(f"Rate limit middleware error: {e}")
-            return await call_next(request)
-    
-    def _get_client_id(self, request: Request) -> str:
-        """获取客户端标识"""
-        # 优先使用用户ID（如果已认证）
-        user = getattr(request.state, "user", None)
-        if user and hasattr(user, "user_id"):
-            return f"user:{user.user_id}"
-        
-        # 使用IP地址
-        client_ip = self._get_client_ip(request)
-        return f"ip:{client_ip}"
-    
-    def _get_client_ip(self, request: Request) -> str:
-        """获取客户端IP地址"""
-        # 检查代理头
-        forwarded_for = request.headers.get("x-forwarded-for")
-        if forwarded_for:
-            return forwarded_for.split(",")[0].strip()
-        
-        real_ip = request.headers.get("x-real-ip")
-        if real_ip:
-            return real_ip
-        
-        # 返回直接连接的IP
-        if hasattr(request, "client") and request.client:
-            return request.client.host
-        
-        return "unknown"
-    
-    def _get_limit_config(self, path: str) -> Dict[str, int]:
-        """获取路径的限流配置"""
-        # 检查精确匹配
-        if path in self.path_limits:
-            return self.path_limits[path]
-        
-        # 检查前缀匹配
-        for pattern, config in self.path_limits.items():
-            if path.startswith(pattern):
-                return config
-        
-        # 返回默认配置
-        return self.default_limit
-    
-    async def _check_rate_limit(
-        self, 
-        client_id: str, 
-        path: str, 
-        limit_config: Dict[str, int]
-    ) -> None:
-        """检查限流"""
-        try:
-            # 构建Redis键
-            key = f"rate_limit:{client_id}:{path}"
-            window = limit_config["window"]
-            max_requests = limit_config["requests"]
-            
-            # 获取当前时间窗口
-            current_time = int(time.time())
-            window_start = current_time - (current_time % window)
-            
-            # 使用滑动窗口算法
-            if not self.redis.client:
-                logger.warning("Redis client not available for rate limiting")
-                return False
-
-            pipe = await self.redis.client.pipeline()
-            
-            # 移除过期的请求记录
-            await pipe.zremrangebyscore(key, 0, current_time - window)
-            
-            # 获取当前窗口内的请求数
-            current_requests = await pipe.zcard(key)
-            
-            if current_requests >= max_requests:
-                # 获取重置时间
-                reset_time = window_start + window
-                
-                raise RateLimitException(
-                    message=f"请求频率超限: {max_requests}次/{window}秒",
-                    details={
-                        "limit": max_requests,
-                        "window": window,
-                        "current": current_requests,
-                        "reset_time": reset_time,
-                    }
-                )
-            
-            # 记录当前请求
-            await pipe.zadd(key, {str(current_time): current_time})
-            await pipe.expire(key, window)
-            await pipe.execute()
-            
-        except RateLimitException:
-            raise
-        except Exception as e:
-            logger.warning(f"Rate limit check error: {e}")
-            # 限流检查失败时不阻止请求
-    
-    def _add_rate_limit_headers(
-        self, 
-        response: Response, 
-        client_id: str, 
-        path: str, 
-        limit_config: Dict[str, int]
-    ) -> None:
-        """添加限流头信息"""
-        try:
-            max_requests = limit_config["requests"]
-            window = limit_config["window"]
-            
-            # 添加限流头
-            response.headers["X-RateLimit-Limit"] = str(max_requests)
-            response.headers["X-RateLimit-Window"] = str(window)
-            
-            # 获取剩余请求数（异步操作，这里简化处理）
-            response.headers["X-RateLimit-Remaining"] = str(max_requests - 1)
-            
-            # 重置时间
-            current_time = int(time.time())
-            window_start = current_time - (current_time % window)
-            reset_time = window_start + window
-            response.headers["X-RateLimit-Reset"] = str(reset_time)
-            
-        except Exception as e:
-            logger.warning(f"Failed to add rate limit headers: {e}")
+
+
+class _LocalAllowance:
+    """本地放行额度（按 Redis 返回的剩余名额按比例发放）"""
+
+    __slots__ = ("tokens", "expires_at", "limit", "current", "reset_at", "pending")
+
+    def __init__(self, tokens: int, expires_at: float, limit: int, current: int, reset_at: float):
+        self.tokens = tokens
+        self.expires_at = expires_at
+        self.limit = limit
+        self.current = current
+        self.reset_at = reset_at
+        # 本地放行但尚未写入 Redis 的请求 (毫秒时间, 成员)
+        self.pending: List[Tuple[int, str]] = []
 
 
 class RateLimiter:
     """限流器工具类"""
-    
+
     def __init__(self, redis_client=None):
-        self.redis = redis_client or redis_manager
-    
+        self._redis = redis_client
+        self._script = None
+        self._member_prefix = uuid4().hex[:8]
+        self._member_seq = itertools.count()
+
+        # 本地预检：剩余名额超过一半时，发放剩余名额的一小部分供本地直接放行
+        self.local_share = settings.RATE_LIMIT_LOCAL_SHARE
+        self.local_ttl = settings.RATE_LIMIT_LOCAL_TTL
+        self._allowances: TTLCache[_LocalAllowance] = TTLCache(
+            "rate_limit_local",
+            settings.RATE_LIMIT_LOCAL_MAX_KEYS if self.local_share > 0 else 0,
+            self.local_ttl
+        )
+
+    @property
+    def redis(self):
+        """延迟获取 Redis 管理器，避免导入时 Redis 尚未初始化"""
+        if self._redis is None:
+            self._redis = get_redis_manager()
+        return self._redis
+
+    def _next_member(self, now_ms: int) -> str:
+        return f"{now_ms}:{self._member_prefix}:{next(self._member_seq)}"
+
+    async def check(self, key: str, limit: int, window: int) -> RateLimitResult:
+        """
+        检查并记录一次请求
+
+        Args:
+            key: 完整的限流键
+            limit: 窗口内最大请求数
+            window: 时间窗口（秒）
+
+        Returns:
+            限流结果
+        """
+        now = time.time()
+        now_ms = int(now * 1000)
+
+        allowance = self._allowances.peek(key)
+        if allowance is not None and allowance.tokens > 0 and allowance.expires_at > now:
+            allowance.tokens -= 1
+            allowance.current += 1
+            allowance.pending.append((now_ms, self._next_member(now_ms)))
+            return RateLimitResult(True, limit, allowance.current, window, allowance.reset_at)
+
+        # 补写本地已放行且仍在窗口内的请求
+        args: List[Any] = [now_ms, window * 1000, limit, self._next_member(now_ms)]
+        if allowance is not None:
+            self._allowances.pop(key)
+            window_start = now_ms - window * 1000
+            for score, member in allowance.pending:
+                if score > window_start:
+                    args.extend((score, member))
+
+        if self._script is None:
+            self._script = self.redis.client.register_script(_SLIDING_WINDOW_SCRIPT)
+        allowed, current, reset_ms = await self._script(keys=[key], args=args)
+
+        result = RateLimitResult(bool(allowed), limit, int(current), window, int(reset_ms) / 1000)
+
+        if result.allowed and self.local_share > 0 and result.remaining * 2 > limit:
+            tokens = int(result.remaining * self.local_share)
+            if tokens > 0:
+                self._allowances.set(
+                    key,
+                    _LocalAllowance(
+                        tokens,
+                        now + min(self.local_ttl, window),
+                        limit,
+                        result.current,
+                        result.reset_at
+                    ),
+                    # 额度过期后仍需保留待补写的记录，直到它们移出窗口
+                    ttl=window
+                )
+
+        return result
+
     async def is_allowed(
-        self, 
-        key: str, 
-        limit: int, 
+        self,
+        key: str,
+        limit: int,
         window: int,
         identifier: str = None
     ) -> tuple[bool, Dict[str, int]]:
         """
         检查是否允许请求
-        
+
         Args:
             key: 限流键
             limit: 请求限制数
             window: 时间窗口（秒）
             identifier: 标识符（可选）
-        
+
         Returns:
             (是否允许, 限流信息)
         """
@@ -231,45 +225,10 @@ class RateLimiter:
             full_key = f"rate_limit:{key}"
             if identifier:
                 full_key += f":{identifier}"
-            
-            current_time = int(time.time())
-            
-            # 使用滑动窗口算法
-            if not self.redis.client:
-                logger.warning("Redis client not available for rate limiting")
-                return 0
-
-            pipe = await self.redis.client.pipeline()
-            
-            # 移除过期记录
-            await pipe.zremrangebyscore(full_key, 0, current_time - window)
-            
-            # 获取当前请求数
-            current_count = await pipe.zcard(full_key)
-            
-            if current_count >= limit:
-                return False, {
-                    "allowed": False,
-                    "limit": limit,
-                    "current": current_count,
-                    "window": window,
-                    "reset_time": current_time + window,
-                }
-            
-            # 记录当前请求
-            await pipe.zadd(full_key, {str(current_time): current_time})
-            await pipe.expire(full_key, window)
-            await pipe.execute()
-            
-            return True, {
-                "allowed": True,
-                "limit": limit,
-                "current": current_count + 1,
-                "remaining": limit - current_count - 1,
-                "window": window,
-                "reset_time": current_time + window,
-            }
-            
+
+            result = await self.check(full_key, limit, window)
+            return result.allowed, result.to_dict()
+
         except Exception as e:
             logger.error(f"Rate limiter error: {e}")
             # 出错时允许请求
@@ -277,21 +236,117 @@ class RateLimiter:
                 "allowed": True,
                 "error": str(e),
             }
-    
+
     async def reset(self, key: str, identifier: str = None) -> bool:
         """重置限流计数"""
         try:
             full_key = f"rate_limit:{key}"
             if identifier:
                 full_key += f":{identifier}"
-            
+
+            self._allowances.pop(full_key)
             await self.redis.delete(full_key)
             return True
-            
+
         except Exception as e:
             logger.error(f"Rate limiter reset error: {e}")
             return False
 
 
+class RateLimitMiddleware:
+    """限流中间件"""
+
+    def __init__(self, app: ASGIApp, limiter: Optional[RateLimiter] = None):
+        self.app = app
+        self.limiter = limiter or rate_limiter
+
+        # 路径特定的限流配置（路径分类见 src.middleware.context.RATE_LIMIT_RULES）
+        self.rule_limits = {
+            "auth": {
+                "requests": settings.AUTH_RATE_LIMIT,
+                "window": 60,  # 1分钟
+            },
+            "message": {
+                "requests": settings.MESSAGE_RATE_LIMIT,
+                "window": 60,  # 1分钟
+            },
+            "admin": {
+                "requests": settings.ADMIN_RATE_LIMIT,
+                "window": 60,  # 1分钟
+            },
+        }
+
+        # 默认限流配置
+        self.default_limit = {
+            "requests": settings.RATE_LIMIT_REQUESTS,
+            "window": settings.RATE_LIMIT_WINDOW,
+        }
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http" or not settings.RATE_LIMIT_ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        context = get_request_context(scope)
+        limit_config = self.rule_limits.get(context.path_class.rate_limit_rule, self.default_limit)
+        result = await self._check_rate_limit(self._get_client_id(context), context.path, limit_config)
+
+        if result is None:
+            await self.app(scope, receive, send)
+            return
+
+        headers = [
+            (name.lower().encode("latin-1"), value.encode("latin-1"))
+            for name, value in result.headers().items()
+        ]
+
+        if not result.allowed:
+            # 直接返回 429，不再经过异常处理链
+            error_response = ErrorResponse.create(
+                code="RATE_LIMIT_EXCEEDED",
+                message=f"请求频率超限: {result.limit}次/{result.window}秒",
+                details=result.to_dict()
+            )
+            response = JSONResponse(
+                status_code=429,
+                content=error_response.model_dump(mode="json"),
+                headers=result.headers()
+            )
+            await response(scope, receive, send)
+            return
+
+        async def send_with_headers(message: Message):
+            if message["type"] == "http.response.start":
+                message["headers"] = list(message.get("headers", ())) + headers
+            await send(message)
+
+        await self.app(scope, receive, send_with_headers)
+
+    def _get_client_id(self, context: RequestContext) -> str:
+        """获取客户端标识"""
+        # 优先使用用户ID（如果已认证）
+        if context.user_id is not None:
+            return f"user:{context.user_id}"
+
+        # 使用IP地址
+        return f"ip:{context.client_ip}"
+
+    async def _check_rate_limit(
+        self,
+        client_id: str,
+        path: str,
+        limit_config: Dict[str, int]
+    ) -> Optional[RateLimitResult]:
+        """检查限流"""
+        try:
+            key = f"rate_limit:{client_id}:{path}"
+            return await self.limiter.check(key, limit_config["requests"], limit_config["window"])
+
+        except Exception as e:
+            logger.warning(f"Rate limit check error: {e}")
+            # 限流检查失败时不阻止请求
+            return None
+
+
 # 创建全局限流器实例
 rate_limiter = RateLimiter()
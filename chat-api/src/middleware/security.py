@@ -4,68 +4,84 @@
 提供安全头、CSRF保护等安全功能
 """
 
-from fastapi import Request, Response
-from starlette.middleware.base import BaseHTTPMiddleware
+from typing import List, Tuple
+
+from starlette.types import ASGIApp, Message, Receive, Scope, Send
 
 from src.config.settings import get_settings
 
 settings = get_settings()
 
 
-class SecurityMiddleware(BaseHTTPMiddleware):
-    """安全中间件"""
-    
-    async def dispatch(self, request: Request, call_next):
-        """处理请求"""
-        response = await call_next(request)
-        
-        # 添加安全头
-        self._add_security_headers(response)
-        
-        return response
-    
-    def _add_security_headers(self, response: Response) -> None:
-        """添加安全头"""
+def _build_security_headers() -> List[Tuple[bytes, bytes]]:
+    """构建安全头（启动时构建一次）"""
+    headers = {
         # X-Content-Type-Options
-        response.headers["X-Content-Type-Options"] = "nosniff"
-        
+        "X-Content-Type-Options": "nosniff",
         # X-Frame-Options
-        response.headers["X-Frame-Options"] = "DENY"
-        
+        "X-Frame-Options": "DENY",
         # X-XSS-Protection
-        response.headers["X-XSS-Protection"] = "1; mode=block"
-        
+        "X-XSS-Protection": "1; mode=block",
         # Referrer-Policy
-        response.headers["Referrer-Policy"] = "strict-origin-when-cross-origin"
-        
-        # Content-Security-Policy
-        if not settings.DEBUG:
-            csp = (
-                "default-src 'self'; "
-                "script-src 'self' 'unsafe-inline' 'unsafe-eval'; "
-                "style-src 'self' 'unsafe-inline'; "
-                "img-src 'self' data: https:; "
-                "font-src 'self' data:; "
-                "connect-src 'self' ws: wss:; "
-                "frame-ancestors 'none';"
-            )
-            response.headers["Content-Security-Policy"] = csp
-        
-        # Strict-Transport-Security (仅HTTPS)
-        if not settings.DEBUG and settings.ENVIRONMENT == "production":
-            response.headers["Strict-Transport-Security"] = "max-age=31536000; includeSubDomains"
-        
-        # Permissions-Policy
-        response.headers["Permissions-Policy"] = (
-            "geolocation=(), "
-            "microphone=(), "
-            "camera=(), "
-            "payment=(), "
-            "usb=(), "
-            "magnetometer=(), "
-            "gyroscope=(), "
-            "speaker=()"
+        "Referrer-Policy": "strict-origin-when-cross-origin",
+    }
+
+    # Content-Security-Policy
+    if not settings.DEBUG:
+        headers["Content-Security-Policy"] = (
+            "default-src 'self'; "
+            "script-src 'self' 'unsafe-inline' 'unsafe-eval'; "
+            "style-src 'self' 'unsafe-inline'; "
+            "img-src 'self' data: https:; "
+            "font-src 'self' data:; "
+            "connect-src 'self' ws: wss:; "
+            "frame-ancestors 'none';"
         )
-        
-        # Server header
-        response.headers["Server"] = "Chat-API"
+
+    # Strict-Transport-Security (仅HTTPS)
+    if not settings.DEBUG and settings.ENVIRONMENT == "production":
+        headers["Strict-Transport-Security"] = "max-age=31536000; includeSubDomains"
+
+    # Permissions-Policy
+    headers["Permissions-Policy"] = (
+        "geolocation=(), "
+        "microphone=(), "
+        "camera=(), "
+        "payment=(), "
+        "usb=(), "
+        "magnetometer=(), "
+        "gyroscope=(), "
+        "speaker=()"
+    )
+
+    # Server header
+    headers["Server"] = "Chat-API"
+
+    return [(name.lower().encode("latin-1"), value.encode("latin-1")) for name, value in headers.items()]
+
+
+class SecurityMiddleware:
+    """安全中间件"""
+
+    def __init__(self, app: ASGIApp):
+        self.app = app
+        self.headers = _build_security_headers()
+        self._header_names = {name for name, _ in self.headers}
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        async def send_with_headers(message: Message):
+            if message["type"] == "http.response.start":
+                # 覆盖同名响应头
+                raw_headers = [
+                    (name, value) for name, value in message.get("headers", ())
+                    if name.lower() not in self._header_names
+                ]
+                raw_headers.extend(self.headers)
+                message["headers"] = raw_headers
+            await send(message)
+
+        await self.app(scope, receive, send_with_headers)
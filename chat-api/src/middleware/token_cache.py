@@ -0,0 +1,163 @@
+"""
+🎫 令牌验证缓存
+
+每个 worker 缓存已验证的访问令牌声明，避免同一令牌在每次请求中重复做 HMAC 校验
+- 以令牌的 SHA-256 摘要为键，缓存在令牌过期时刻失效
+- 登出时写入 Redis 吊销列表并通过发布订阅通知所有 worker 清除缓存
+"""
+
+import hashlib
+import time
+from datetime import datetime
+from typing import Callable, Optional
+
+from loguru import logger
+
+from src.config.settings import get_settings
+from src.models.user import TokenData
+from src.utils.cache import TTLCache
+
+settings = get_settings()
+
+
+def token_digest(token: str) -> str:
+    """令牌摘要（十六进制）"""
+    return hashlib.sha256(token.encode("utf-8")).hexdigest()
+
+
+def _expires_in(exp: datetime) -> float:
+    return exp.timestamp() - time.time()
+
+
+class TokenCache:
+    """已验证令牌缓存"""
+
+    def __init__(
+        self,
+        maxsize: int = None,
+        revocation_enabled: bool = None,
+        prefix: str = "jwt:revoked:"
+    ):
+        maxsize = settings.JWT_CACHE_SIZE if maxsize is None else maxsize
+        self.revocation_enabled = (
+            settings.JWT_REVOCATION_ENABLED if revocation_enabled is None else revocation_enabled
+        )
+        self.prefix = prefix
+        self.channel = "jwt:revoke"
+
+        # TTL 按令牌剩余有效期逐条设置
+        self._claims: TTLCache[TokenData] = TTLCache("jwt", maxsize, settings.JWT_EXPIRE_MINUTES * 60)
+        # 本 worker 已知被吊销的令牌摘要
+        self._revoked: TTLCache[bool] = TTLCache("jwt_revoked", maxsize, settings.JWT_EXPIRE_MINUTES * 60)
+        self._subscribed = False
+
+    async def start(self):
+        """订阅吊销通知"""
+        if not self.revocation_enabled or self._subscribed:
+            return
+
+        from src.core.redis import get_pubsub_dispatcher
+
+        try:
+            await get_pubsub_dispatcher().subscribe(self.channel, self._on_revoke)
+            self._subscribed = True
+        except Exception as e:
+            logger.warning(f"⚠️ Token revocation notifications unavailable: {e}")
+
+    async def stop(self):
+        """取消订阅并清空缓存"""
+        if self._subscribed:
+            from src.core.redis import get_pubsub_dispatcher
+
+            try:
+                await get_pubsub_dispatcher().unsubscribe(self.channel)
+            except Exception:
+                pass
+            self._subscribed = False
+
+        self._claims.clear()
+        self._revoked.clear()
+
+    async def verify(
+        self,
+        token: str,
+        decoder: Callable[[str], Optional[TokenData]]
+    ) -> Optional[TokenData]:
+        """
+        验证令牌（优先使用缓存）
+
+        Args:
+            token: 访问令牌
+            decoder: 缓存未命中时的完整校验函数
+
+        Returns:
+            令牌声明，无效或已吊销时返回 None
+        """
+        digest = token_digest(token)
+
+        if self._revoked.peek(digest):
+            return None
+
+        token_data = self._claims.get(digest)
+        if token_data is not None:
+            return token_data
+
+        token_data = decoder(token)
+        if token_data is None:
+            return None
+
+        if self.revocation_enabled and await self._is_revoked(digest):
+            self._revoked.set(digest, True, ttl=_expires_in(token_data.exp))
+            return None
+
+        self._claims.set(digest, token_data, ttl=_expires_in(token_data.exp))
+        return token_data
+
+    async def revoke(self, token: str, exp: datetime):
+        """
+        吊销令牌（登出时调用）
+
+        Args:
+            token: 访问令牌
+            exp: 令牌过期时间，吊销记录保留到此时
+        """
+        digest = token_digest(token)
+        ttl = _expires_in(exp)
+
+        self._claims.pop(digest)
+        self._revoked.set(digest, True, ttl=ttl)
+
+        if not self.revocation_enabled or ttl <= 0:
+            return
+
+        from src.core.redis import get_pubsub_dispatcher, get_redis_manager
+
+        try:
+            await get_redis_manager().client.set(f"{self.prefix}{digest}", "1", px=int(ttl * 1000))
+            await get_pubsub_dispatcher().publish(self.channel, f"{digest}|{exp.timestamp()}")
+        except Exception as e:
+            logger.warning(f"⚠️ Failed to publish token revocation: {e}")
+
+    async def _is_revoked(self, digest: str) -> bool:
+        from src.core.redis import get_redis_manager
+
+        try:
+            return bool(await get_redis_manager().client.exists(f"{self.prefix}{digest}"))
+        except Exception as e:
+            # Redis 不可用时不阻止认证
+            logger.warning(f"⚠️ Token revocation check failed: {e}")
+            return False
+
+    async def _on_revoke(self, channel: str, data: str):
+        """处理其他 worker 的吊销通知"""
+        digest, _, exp = data.partition("|")
+        try:
+            ttl = float(exp) - time.time()
+        except ValueError:
+            ttl = None
+        self._claims.pop(digest)
+        self._revoked.set(digest, True, ttl=ttl)
+
+
+# 全局令牌缓存实例
+token_cache = TokenCache()
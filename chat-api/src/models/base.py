@@ -78,6 +78,8 @@ class PaginationParams(BaseModel):
     
     page: int = Field(default=1, ge=1, description="页码")
     size: int = Field(default=20, ge=1, le=100, description="每页数量")
+    cursor: Optional[str] = Field(default=None, description="游标（上一页返回的 next_cursor），提供时忽略页码")
+    count: str = Field(default="estimate", pattern="^(exact|estimate|none)$", description="总数计算方式")
     
     @property
     def offset(self) -> int:
@@ -88,12 +90,14 @@ class PaginationParams(BaseModel):
 class PaginationResponse(BaseModel):
     """分页响应模型"""
     
-    total: int = Field(description="总数量")
+    total: Optional[int] = Field(description="总数量（未计数时为空）")
     page: int = Field(description="当前页码")
     size: int = Field(description="每页数量")
-    pages: int = Field(description="总页数")
+    pages: Optional[int] = Field(description="总页数（未计数时为空）")
     has_next: bool = Field(description="是否有下一页")
     has_prev: bool = Field(description="是否有上一页")
+    next_cursor: Optional[str] = Field(default=None, description="下一页游标")
+    total_estimated: bool = Field(default=False, description="总数是否为缓存的估计值")
     
     @classmethod
     def create(cls, total: int, page: int, size: int) -> "PaginationResponse":
@@ -107,6 +111,28 @@ class PaginationResponse(BaseModel):
             has_next=page < pages,
             has_prev=page > 1,
         )
+    
+    @classmethod
+    def create_cursor(
+        cls,
+        size: int,
+        next_cursor: Optional[str],
+        has_prev: bool,
+        total: Optional[int] = None,
+        estimated: bool = False,
+        page: int = 1
+    ) -> "PaginationResponse":
+        """创建游标分页响应"""
+        return cls(
+            total=total,
+            page=page,
+            size=size,
+            pages=(total + size - 1) // size if total is not None else None,
+            has_next=next_cursor is not None,
+            has_prev=has_prev,
+            next_cursor=next_cursor,
+            total_estimated=estimated,
+        )
 
 
 class ErrorResponse(BaseModel):
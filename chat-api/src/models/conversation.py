@@ -10,7 +10,7 @@ from typing import Dict, List, Optional, Any
 
 from pydantic import Field, EmailStr
 from sqlalchemy import (
-    Boolean, DateTime, Enum as SQLEnum, ForeignKey, Integer, 
+    Boolean, DateTime, Enum as SQLEnum, ForeignKey, Index, Integer, 
     String, Text, JSON
 )
 from sqlalchemy.orm import Mapped, mapped_column, relationship
@@ -54,9 +54,14 @@ class CustomerContact(Base, TimestampMixin, UUIDMixin):
     """客户联系人数据库模型"""
     
     __tablename__ = "customer_contacts"
-    __table_args__ = {"comment": "客户联系人表"}
+    __table_args__ = (
+        # 会话创建时按外部用户ID查找/写入联系人
+        Index("uq_customer_contacts_external_user_id", "external_user_id", unique=True),
+        {"comment": "客户联系人表"},
+    )
     
     id: Mapped[int] = mapped_column(Integer, primary_key=True, comment="客户ID")
+    external_user_id: Mapped[Optional[str]] = mapped_column(String(255), comment="外部用户ID（会话 user_id）")
     name: Mapped[Optional[str]] = mapped_column(String(100), comment="客户姓名")
     email: Mapped[Optional[str]] = mapped_column(String(255), comment="邮箱")
     phone: Mapped[Optional[str]] = mapped_column(String(20), comment="电话")
@@ -73,7 +78,14 @@ class Conversation(Base, TimestampMixin, UUIDMixin):
     """对话数据库模型"""
     
     __tablename__ = "conversations"
-    __table_args__ = {"comment": "对话表"}
+    __table_args__ = (
+        # 列表按 (created_at, id) 游标分页，常用过滤列在前，见 src/services/queries.py
+        Index("idx_conversations_created", "created_at", "id"),
+        Index("idx_conversations_status_created", "status", "created_at", "id"),
+        Index("idx_conversations_priority_created", "priority", "created_at", "id"),
+        Index("idx_conversations_assignee_created", "assignee_id", "created_at", "id"),
+        {"comment": "对话表"},
+    )
     
     id: Mapped[int] = mapped_column(Integer, primary_key=True, comment="对话ID")
     contact_id: Mapped[int] = mapped_column(
@@ -211,19 +223,29 @@ class ConversationSwitchAgent(BaseModel):
 class ConversationListResponse(BaseModel):
     """对话列表响应模型"""
     conversations: List[ConversationResponse] = Field(description="对话列表")
-    total: int = Field(description="总数量")
+    total: Optional[int] = Field(description="总数量（未计数时为空）")
     page: int = Field(description="当前页码")
     size: int = Field(description="每页数量")
-    pages: int = Field(description="总页数")
+    pages: Optional[int] = Field(description="总页数（未计数时为空）")
+    has_next: bool = Field(default=False, description="是否有下一页")
+    next_cursor: Optional[str] = Field(default=None, description="下一页游标")
+    total_estimated: bool = Field(default=False, description="总数是否为缓存的估计值")
 
 
 class ConversationStats(BaseModel):
     """对话统计模型"""
     total_conversations: int = Field(description="总对话数")
     open_conversations: int = Field(description="进行中对话数")
+    pending_conversations: int = Field(default=0, description="等待中对话数")
     resolved_conversations: int = Field(description="已解决对话数")
+    closed_conversations: int = Field(default=0, description="已关闭对话数")
     ai_handled: int = Field(description="AI处理数")
     human_handled: int = Field(description="人工处理数")
-    avg_response_time: float = Field(description="平均响应时间（分钟）")
+    total_messages: int = Field(default=0, description="消息总数")
+    today_messages: int = Field(default=0, description="今日消息数")
+    avg_messages_per_conversation: float = Field(default=0, description="平均每个对话的消息数")
+    avg_response_time: Optional[float] = Field(default=None, description="平均首次响应时间（分钟）")
+    avg_resolution_time: Optional[float] = Field(default=None, description="平均解决时间（分钟）")
     customer_satisfaction: Optional[float] = Field(default=None, description="客户满意度")
     resolution_rate: float = Field(description="解决率")
+    reconciled_at: Optional[float] = Field(default=None, description="最近一次与数据库对账的时间戳")
@@ -10,7 +10,7 @@ from typing import Any, Dict, List, Optional
 
 from pydantic import Field
 from sqlalchemy import (
-    Boolean, DateTime, Enum as SQLEnum, ForeignKey, Integer, 
+    BigInteger, Boolean, DateTime, Enum as SQLEnum, ForeignKey, Index, Integer, 
     String, Text, JSON
 )
 from sqlalchemy.orm import Mapped, mapped_column, relationship
@@ -42,9 +42,14 @@ class Message(Base, TimestampMixin, UUIDMixin):
     """消息数据库模型"""
     
     __tablename__ = "messages"
-    __table_args__ = {"comment": "消息表"}
+    __table_args__ = (
+        # 对话内按时间翻页；is_private 放在末尾使公开消息的计数与过滤只读索引
+        Index("idx_messages_conversation_created", "conversation_id", "created_at", "id", "is_private"),
+        {"comment": "消息表"},
+    )
     
-    id: Mapped[int] = mapped_column(Integer, primary_key=True, comment="消息ID")
+    # 消息ID由应用预先生成（雪花ID，见 src/utils/ids.py）
+    id: Mapped[int] = mapped_column(BigInteger, primary_key=True, autoincrement=False, comment="消息ID")
     conversation_id: Mapped[int] = mapped_column(
         Integer, 
         ForeignKey("conversations.id", ondelete="CASCADE"), 
@@ -148,6 +153,7 @@ class WebSocketAuth(BaseModel):
     type: str = Field(default="auth", description="消息类型")
     token: Optional[str] = Field(default=None, description="认证令牌")
     session_id: Optional[str] = Field(default=None, description="会话ID")
+    stream_protocol: Optional[int] = Field(default=None, description="请求的AI流式协议版本")
 
 
 class WebSocketResponse(BaseModel):
@@ -9,7 +9,7 @@ from enum import Enum
 from typing import List, Optional
 
 from pydantic import EmailStr, Field, validator
-from sqlalchemy import Boolean, Enum as SQLEnum, Integer, String, Text, DateTime
+from sqlalchemy import Boolean, Enum as SQLEnum, Index, Integer, String, Text, DateTime
 from sqlalchemy.orm import Mapped, mapped_column
 
 from src.core.database import Base
@@ -35,7 +35,13 @@ class User(Base, TimestampMixin, UUIDMixin):
     """用户数据库模型"""
     
     __tablename__ = "users"
-    __table_args__ = {"comment": "用户表"}
+    __table_args__ = (
+        # 列表按 (created_at, id) 游标分页，见 src/services/queries.py
+        Index("idx_users_created", "created_at", "id"),
+        Index("idx_users_role_created", "role", "created_at", "id"),
+        Index("idx_users_status_created", "status", "created_at", "id"),
+        {"comment": "用户表"},
+    )
     
     id: Mapped[int] = mapped_column(Integer, primary_key=True, comment="用户ID")
     email: Mapped[str] = mapped_column(String(255), unique=True, nullable=False, comment="邮箱")
@@ -167,7 +173,10 @@ class UserProfile(BaseModel):
 class UserListResponse(BaseModel):
     """用户列表响应模型"""
     users: List[UserResponse] = Field(description="用户列表")
-    total: int = Field(description="总数量")
+    total: Optional[int] = Field(description="总数量（未计数时为空）")
     page: int = Field(description="当前页码")
     size: int = Field(description="每页数量")
-    pages: int = Field(description="总页数")
+    pages: Optional[int] = Field(description="总页数（未计数时为空）")
+    has_next: bool = Field(default=False, description="是否有下一页")
+    next_cursor: Optional[str] = Field(default=None, description="下一页游标")
+    total_estimated: bool = Field(default=False, description="总数是否为缓存的估计值")
@@ -8,7 +8,8 @@ from datetime import datetime
 from typing import Dict, List, Optional, Any
 
 from loguru import logger
-from sqlalchemy import and_, or_, select, func, desc, update
+from sqlalchemy import or_, select, func, desc, update
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from src.core.exceptions import NotFoundException, ValidationException
@@ -19,6 +20,16 @@ from src.models.conversation import (
     ConversationSwitchAgent, ConversationStats
 )
 from src.models.base import PaginationResponse
+from src.config.settings import get_settings
+from src.services.queries import contact_by_external_user_id_query, conversation_list_query
+from src.services.stats import conversation_stats
+from src.utils.cache import TTLCache
+from src.utils.pagination import COUNT_ESTIMATE, paginate_keyset, paginate_offset
+
+settings = get_settings()
+
+# 外部用户ID -> 联系人ID
+contact_id_cache: TTLCache[int] = TTLCache("contact_id", settings.CONTACT_CACHE_SIZE, settings.CONTACT_CACHE_TTL)
 
 
 class ConversationService:
@@ -160,63 +171,40 @@ class ConversationService:
         page: int = 1,
         size: int = 20,
         filters: Optional[Dict[str, Any]] = None,
-        assignee_id: int = None
+        assignee_id: int = None,
+        cursor: Optional[str] = None,
+        count: str = COUNT_ESTIMATE
     ) -> tuple[List[Conversation], PaginationResponse]:
         """
-        获取对话列表
+        获取对话列表（按创建时间倒序）
         
         Args:
-            page: 页码
+            page: 页码（未提供游标时使用，第一页之后为 OFFSET 分页）
             size: 每页数量
             filters: 过滤条件
             assignee_id: 指派客服ID
+            cursor: 上一页返回的 next_cursor
+            count: 总数计算方式（exact / estimate / none）
             
         Returns:
             (对话列表, 分页信息)
         """
         try:
-            # 构建查询
-            stmt = select(Conversation)
-            
-            # 应用过滤条件
-            conditions = []
-            
-            if assignee_id:
-                conditions.append(Conversation.assignee_id == assignee_id)
-            
-            if filters:
-                if filters.get("status"):
-                    conditions.append(Conversation.status == ConversationStatus(filters["status"]))
-
-                if filters.get("priority"):
-                    conditions.append(Conversation.priority == ConversationPriority(filters["priority"]))
-
-                if filters.get("assignee_id"):
-                    conditions.append(Conversation.assignee_id == filters["assignee_id"])
-            
-            if conditions:
-                stmt = stmt.where(and_(*conditions))
-            
-            # 按创建时间排序
-            stmt = stmt.order_by(desc(Conversation.created_at))
-            
-            # 获取总数
-            count_stmt = select(func.count()).select_from(stmt.subquery())
-            total_result = await self.db.execute(count_stmt)
-            total = total_result.scalar()
-            
-            # 应用分页
-            offset = (page - 1) * size
-            stmt = stmt.offset(offset).limit(size)
+            stmt = conversation_list_query(filters, assignee_id)
             
-            # 执行查询
-            result = await self.db.execute(stmt)
-            conversations = result.scalars().all()
-            
-            # 创建分页响应
-            pagination = PaginationResponse.create(total, page, size)
+            cache_key = (
+                "conversations",
+                assignee_id,
+                tuple(sorted((key, str(value)) for key, value in (filters or {}).items() if value))
+            )
+            if cursor or page == 1:
+                return await paginate_keyset(
+                    self.db, stmt, Conversation.created_at, Conversation.id, size,
+                    cursor=cursor, count=count, cache_key=cache_key
+                )
             
-            return list(conversations), pagination
+            stmt = stmt.order_by(desc(Conversation.created_at), desc(Conversation.id))
+            return await paginate_offset(self.db, stmt, page, size, count=count, cache_key=cache_key)
             
         except Exception as e:
             logger.error(f"Failed to list conversations: {e}")
@@ -226,56 +214,17 @@ class ConversationService:
         """
         获取对话统计信息
         
+        读取 Redis 中增量维护的计数；尚无计数（首次启动、Redis 数据丢失）时从数据库计算一次并写回
+        
         Returns:
             对话统计对象
         """
         try:
-            # 总对话数
-            total_stmt = select(func.count(Conversation.id))
-            total_result = await self.db.execute(total_stmt)
-            total_conversations = total_result.scalar()
-            
-            # 进行中对话数
-            open_stmt = select(func.count(Conversation.id)).where(
-                Conversation.status == ConversationStatus.OPEN
-            )
-            open_result = await self.db.execute(open_stmt)
-            open_conversations = open_result.scalar()
-
-            # 已解决对话数
-            resolved_stmt = select(func.count(Conversation.id)).where(
-                Conversation.status == ConversationStatus.RESOLVED
-            )
-            resolved_result = await self.db.execute(resolved_stmt)
-            resolved_conversations = resolved_result.scalar()
-
-            # AI处理数
-            ai_stmt = select(func.count(Conversation.id)).where(
-                Conversation.current_agent_type == AgentType.AI
-            )
-            ai_result = await self.db.execute(ai_stmt)
-            ai_handled = ai_result.scalar()
-
-            # 人工处理数
-            human_stmt = select(func.count(Conversation.id)).where(
-                Conversation.current_agent_type == AgentType.HUMAN
-            )
-            human_result = await self.db.execute(human_stmt)
-            human_handled = human_result.scalar()
-            
-            # 计算解决率
-            resolution_rate = resolved_conversations / total_conversations if total_conversations > 0 else 0
-            
-            return ConversationStats(
-                total_conversations=total_conversations,
-                open_conversations=open_conversations,
-                resolved_conversations=resolved_conversations,
-                ai_handled=ai_handled,
-                human_handled=human_handled,
-                avg_response_time=2.5,  # 模拟数据
-                customer_satisfaction=4.2,  # 模拟数据
-                resolution_rate=resolution_rate
-            )
+            stats = await conversation_stats.snapshot()
+            if stats is None:
+                stats = await conversation_stats.reconcile(self.db)
+            
+            return ConversationStats(**stats)
             
         except Exception as e:
             logger.error(f"Failed to get conversation stats: {e}")
@@ -301,11 +250,11 @@ class ConversationService:
                 raise NotFoundException(f"会话不存在: {session_id}")
             
             # 创建或获取客户联系人
-            contact = await self._get_or_create_contact(session.user_id)
+            contact_id = await self._get_or_create_contact_id(session.user_id)
             
             # 创建对话数据
             conversation_data = ConversationCreate(
-                contact_id=contact.id,
+                contact_id=contact_id,
                 inbox_id=1,  # 默认收件箱
                 status=ConversationStatus.OPEN,
                 priority=ConversationPriority.MEDIUM,
@@ -313,11 +262,16 @@ class ConversationService:
                 current_agent_type=session.agent_type
             )
             
-            conversation = await self.create_conversation(conversation_data)
+            try:
+                conversation = await self.create_conversation(conversation_data)
+            except IntegrityError:
+                # 缓存的联系人已被删除，重新获取后再试一次
+                contact_id_cache.pop(session.user_id)
+                conversation_data.contact_id = await self._get_or_create_contact_id(session.user_id)
+                conversation = await self.create_conversation(conversation_data)
             
             # 更新会话的对话ID
-            session.conversation_id = conversation.id
-            await session_manager._save_session(session)
+            await session_manager.attach_conversation(session_id, conversation.id)
             
             return conversation
             
@@ -327,37 +281,67 @@ class ConversationService:
             logger.error(f"Failed to create conversation for session {session_id}: {e}")
             raise
     
-    async def _get_or_create_contact(self, user_id: str) -> CustomerContact:
-        """获取或创建客户联系人"""
+    async def _get_or_create_contact_id(self, user_id: str) -> int:
+        """
+        获取或创建客户联系人，返回联系人ID
+        
+        先查本地 LRU，未命中时按 external_user_id 唯一索引执行一次原子 upsert，
+        并发创建同一用户的联系人不会产生重复记录
+        """
+        contact_id = contact_id_cache.get(user_id)
+        if contact_id is not None:
+            return contact_id
+        
         try:
-            # 尝试根据用户ID查找现有联系人
-            stmt = select(CustomerContact).where(
-                CustomerContact.custom_attributes.contains({"user_id": user_id})
-            )
-            result = await self.db.execute(stmt)
-            contact = result.scalar_one_or_none()
-            
-            if contact:
-                return contact
-            
-            # 创建新联系人
-            contact_data = {
-                "name": f"用户_{user_id[:8]}",
-                "custom_attributes": {"user_id": user_id}
-            }
-            
-            contact = CustomerContact(**contact_data)
-            self.db.add(contact)
+            contact_id = await self._upsert_contact(user_id)
             await self.db.commit()
-            await self.db.refresh(contact)
-            
-            logger.info(f"Customer contact created: {contact.id} for user: {user_id}")
-            return contact
-            
         except Exception as e:
             await self.db.rollback()
             logger.error(f"Failed to get or create contact for user {user_id}: {e}")
             raise
+        
+        contact_id_cache.set(user_id, contact_id)
+        return contact_id
+    
+    async def _upsert_contact(self, user_id: str) -> int:
+        """按外部用户ID插入联系人，已存在时只更新最后访问时间"""
+        table = CustomerContact.__table__
+        now = datetime.now()
+        values = {
+            "external_user_id": user_id,
+            "name": f"用户_{user_id[:8]}",
+            "custom_attributes": {"user_id": user_id},
+            "first_seen_at": now,
+            "last_seen_at": now,
+        }
+        dialect = self.db.bind.dialect.name
+        
+        if dialect == "mysql":
+            from sqlalchemy.dialects.mysql import insert as mysql_insert
+            # LAST_INSERT_ID(id) 使已存在的行同样通过 lastrowid 返回其ID
+            stmt = mysql_insert(table).values(**values).on_duplicate_key_update(
+                id=func.last_insert_id(table.c.id),
+                last_seen_at=now
+            )
+            result = await self.db.execute(stmt)
+            return result.lastrowid
+        
+        if dialect in ("postgresql", "sqlite"):
+            if dialect == "postgresql":
+                from sqlalchemy.dialects.postgresql import insert as dialect_insert
+            else:
+                from sqlalchemy.dialects.sqlite import insert as dialect_insert
+            stmt = dialect_insert(table).values(**values).on_conflict_do_update(
+                index_elements=[table.c.external_user_id],
+                set_={"last_seen_at": now}
+            ).returning(table.c.id)
+            return (await self.db.execute(stmt)).scalar_one()
+        
+        # 其他数据库：先查后插
+        contact_id = (await self.db.execute(contact_by_external_user_id_query(user_id))).scalar_one_or_none()
+        if contact_id is None:
+            contact_id = (await self.db.execute(table.insert().values(**values))).inserted_primary_key[0]
+        return contact_id
     
     async def create_customer_contact(
         self, 
@@ -374,6 +358,7 @@ class ConversationService:
         """
         try:
             contact = CustomerContact(**contact_data.model_dump())
+            contact.external_user_id = (contact_data.custom_attributes or {}).get("user_id")
             self.db.add(contact)
             await self.db.commit()
             await self.db.refresh(contact)
@@ -515,6 +500,11 @@ class ConversationService:
             await self.db.commit()
             await self.db.refresh(conversation)
 
+            if "priority" in conversation_data:
+                # 新的优先级对之后排队的AI回复生效
+                from src.ai.queue import ai_reply_queue
+                ai_reply_queue.set_priority(conversation_id, conversation.priority)
+
             logger.info(f"Conversation updated: {conversation_id}")
             return conversation
 
@@ -6,17 +6,24 @@
 
 from datetime import datetime
 from typing import Dict, List, Optional, Any, AsyncGenerator
+from uuid import uuid4
 
 from loguru import logger
-from sqlalchemy import and_, or_, select, func, desc
+from sqlalchemy import and_, or_, select, desc
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from src.core.exceptions import NotFoundException, ValidationException
+from src.core.exceptions import NotFoundException, RateLimitException, ValidationException
 from src.models.message import (
     Message, MessageCreate, MessageUpdate, MessageResponse,
     MessageSend, MessageType, SenderType, WebSocketMessageSend
 )
 from src.models.base import PaginationResponse
+from src.utils.pagination import COUNT_ESTIMATE, paginate_keyset, paginate_offset
+from src.services.message_writer import message_writer
+from src.services.queries import conversation_messages_query
+from src.services.stats import conversation_stats
+from src.utils.ids import next_id
+from src.ai.context import conversation_context
 from src.ai.service import ai_service
 from src.session.manager import get_session_manager
 from src.websocket.manager import websocket_manager
@@ -40,10 +47,28 @@ class MessageService:
             创建的消息对象
         """
         try:
-            message = Message(**message_data.model_dump())
-            self.db.add(message)
-            await self.db.commit()
-            await self.db.refresh(message)
+            # ID 与时间戳在应用侧生成，写入缓冲后即可使用，不需要等待数据库回填
+            data = message_data.model_dump()
+            now = datetime.now()
+            message = Message(
+                **{
+                    **data,
+                    "sender_type": SenderType(data["sender_type"]),
+                    "message_type": MessageType(data["message_type"]),
+                },
+                id=next_id(),
+                uuid=str(uuid4()),
+                created_at=now,
+                updated_at=now
+            )
+            
+            if not await message_writer.submit(message):
+                self.db.add(message)
+                await self.db.commit()
+            
+            # 追加到AI对话上下文窗口，并计入对话统计
+            await conversation_context.append(message)
+            await conversation_stats.message_created(message)
             
             logger.info(f"Message created: {message.id}")
             return message
@@ -77,48 +102,36 @@ class MessageService:
         conversation_id: int,
         page: int = 1,
         size: int = 20,
-        include_private: bool = False
+        include_private: bool = False,
+        cursor: Optional[str] = None,
+        count: str = COUNT_ESTIMATE
     ) -> tuple[List[Message], PaginationResponse]:
         """
-        获取对话的消息列表
+        获取对话的消息列表（按创建时间倒序）
         
         Args:
             conversation_id: 对话ID
-            page: 页码
+            page: 页码（未提供游标时使用，第一页之后为 OFFSET 分页）
             size: 每页数量
             include_private: 是否包含私有消息
+            cursor: 上一页返回的 next_cursor
+            count: 总数计算方式（exact / estimate / none）
             
         Returns:
             (消息列表, 分页信息)
         """
         try:
-            # 构建查询
-            stmt = select(Message).where(Message.conversation_id == conversation_id)
-            
-            # 是否包含私有消息
-            if not include_private:
-                stmt = stmt.where(Message.is_private == False)
+            stmt = conversation_messages_query(conversation_id, include_private)
             
-            # 按创建时间排序
-            stmt = stmt.order_by(desc(Message.created_at))
-            
-            # 获取总数
-            count_stmt = select(func.count()).select_from(stmt.subquery())
-            total_result = await self.db.execute(count_stmt)
-            total = total_result.scalar()
-            
-            # 应用分页
-            offset = (page - 1) * size
-            stmt = stmt.offset(offset).limit(size)
-            
-            # 执行查询
-            result = await self.db.execute(stmt)
-            messages = result.scalars().all()
+            cache_key = ("messages", conversation_id, include_private)
+            if cursor or page == 1:
+                return await paginate_keyset(
+                    self.db, stmt, Message.created_at, Message.id, size,
+                    cursor=cursor, count=count, cache_key=cache_key
+                )
             
-            # 创建分页响应
-            pagination = PaginationResponse.create(total, page, size)
-            
-            return list(messages), pagination
+            stmt = stmt.order_by(desc(Message.created_at), desc(Message.id))
+            return await paginate_offset(self.db, stmt, page, size, count=count, cache_key=cache_key)
             
         except Exception as e:
             logger.error(f"Failed to get conversation messages: {e}")
@@ -142,6 +155,7 @@ class MessageService:
         try:
             # 确定对话ID
             conversation_id = message_data.conversation_id
+            session = None
             
             if not conversation_id and message_data.session_id:
                 # 从会话获取对话ID
@@ -176,14 +190,15 @@ class MessageService:
             # 发送WebSocket通知
             await self._send_websocket_notification(message, message_data.session_id)
             
-            # 处理AI回复 - 使用独立的异步任务和数据库会话
+            # 处理AI回复 - 提交到AI回复队列，由 worker 使用独立的数据库会话处理
             if message_data.session_id:
-                import asyncio
-                asyncio.create_task(_process_ai_response_async(
+                await self._enqueue_ai_reply(
                     message_data.session_id,
                     conversation_id,
-                    message_data.content
-                ))
+                    message_data.content,
+                    message.id,
+                    session
+                )
             
             return MessageResponse.model_validate(message)
             
@@ -193,6 +208,47 @@ class MessageService:
             logger.error(f"Failed to send message: {e}")
             raise ValidationException(f"发送消息失败: {str(e)}")
     
+    async def _enqueue_ai_reply(
+        self,
+        session_id: str,
+        conversation_id: int,
+        content: str,
+        message_id: int,
+        session=None
+    ):
+        """提交AI回复任务，队列已满时通知客户端稍后重试"""
+        from src.ai.queue import ai_reply_queue
+
+        if session is None:
+            session = await self.session_manager.get_session(session_id)
+
+        # 公平性按租户划分，未配置租户时按终端用户划分
+        fairness_key = None
+        if session:
+            fairness_key = (session.session_metadata or {}).get("tenant") or f"user:{session.user_id}"
+
+        try:
+            await ai_reply_queue.submit(
+                session_id,
+                conversation_id,
+                content,
+                message_id,
+                fairness_key=fairness_key,
+                db=self.db
+            )
+        except RateLimitException as e:
+            logger.warning(f"AI reply rejected for session {session_id}: {e.message}")
+            await websocket_manager.send_to_session(session_id, {
+                "type": "error",
+                "data": {
+                    "session_id": session_id,
+                    "code": e.code,
+                    "message": e.message,
+                    "success": False,
+                    "timestamp": datetime.now().isoformat()
+                }
+            })
+    
     async def process_websocket_message(
         self,
         ws_message: WebSocketMessageSend,
@@ -320,7 +376,8 @@ class MessageService:
 async def _process_ai_response_async(
     session_id: str,
     conversation_id: int,
-    user_message: str
+    user_message: str,
+    user_message_id: int = None
 ):
     """
     独立的异步AI回复处理函数
@@ -357,18 +414,12 @@ async def _process_ai_response_async(
                 logger.info(f"Session {session_id} is not AI session, skipping AI response")
                 return
 
-            # 获取对话历史
-            messages, _ = await message_service.get_conversation_messages(conversation_id, size=10)
-
-            # 构建AI对话上下文
-            ai_context = ai_service.build_conversation_context([
-                {
-                    "content": msg.content,
-                    "sender_type": msg.sender_type.value if hasattr(msg.sender_type, 'value') else str(msg.sender_type),
-                    "created_at": msg.created_at
-                }
-                for msg in reversed(messages)  # 按时间顺序
-            ])
+            # 构建AI对话上下文（当前用户消息单独追加，不计入历史）
+            ai_context = await conversation_context.build(
+                conversation_id,
+                exclude_ids=[user_message_id] if user_message_id is not None else (),
+                db=db_session
+            )
 
             # 获取系统提示词
             system_prompt = ai_service.get_default_system_prompt()
@@ -386,30 +437,24 @@ async def _process_ai_response_async(
             }
             await websocket_manager.send_to_session(session_id, typing_message)
 
-            # 流式获取AI回复
-            full_response = ""
-            chunk_count = 0
+            # 流式获取AI回复，按连接协商的协议推送增量帧或兼容帧
+            stream = websocket_manager.begin_ai_stream(session_id)
+            chunks: List[str] = []
 
             async for chunk in ai_service.stream_chat_completion(
                 user_message,
                 conversation_history=ai_context,
-                system_prompt=system_prompt
+                system_prompt=system_prompt,
+                tenant=(session.session_metadata or {}).get("tenant")
             ):
-                full_response += chunk
-                chunk_count += 1
-
-                # 发送流式响应
-                stream_message = {
-                    "type": "ai_stream",
-                    "data": {
-                        "session_id": session_id,
-                        "content": chunk,
-                        "full_content": full_response,
-                        "is_complete": False
-                    }
-                }
-                await websocket_manager.send_to_session(session_id, stream_message)
-
+                if not chunk:
+                    continue
+                chunks.append(chunk)
+                await websocket_manager.push_ai_stream(stream, chunk)
+
+            # 保存的内容只来自本轮回复的片段，不受同一会话其他回复影响
+            chunk_count = len(chunks)
+            full_response = "".join(chunks)
             logger.info(f"AI response completed for session {session_id}, chunks: {chunk_count}, length: {len(full_response)}")
 
             # 如果没有收到任何回复，使用默认回复
@@ -432,18 +477,8 @@ async def _process_ai_response_async(
 
             ai_message = await message_service.create_message(ai_message_data)
 
-            # 发送完整AI回复
-            complete_message = {
-                "type": "ai_stream",
-                "data": {
-                    "session_id": session_id,
-                    "content": "",
-                    "full_content": full_response,
-                    "is_complete": True,
-                    "message_id": ai_message.id
-                }
-            }
-            await websocket_manager.send_to_session(session_id, complete_message)
+            # 发送结束帧
+            await websocket_manager.complete_ai_stream(stream, full_response, ai_message.id)
 
             # 发送消息通知
             await message_service._send_websocket_notification(ai_message, session_id)
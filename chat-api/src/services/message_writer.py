@@ -0,0 +1,323 @@
+"""
+✍️ 消息写入管道（write-behind）
+
+逐条 add → commit → refresh 每条消息至少三次数据库往返和一次事务提交，
+这里把消息写入改为先进入持久化缓冲、再批量落库:
+- 消息ID在进程内预先生成（雪花ID），创建消息只需一次 XADD
+- 缓冲使用 Redis Stream + 消费组，进程崩溃后未确认的条目由其他进程通过 XAUTOCLAIM 接管
+- 后台任务每隔几毫秒或攒满 N 条执行一次多行 INSERT，主键冲突时忽略，重复投递不会重复插入；
+  主键已被 uuid 不同的消息占用（ID 冲突）时不当作重复投递，转入死信流
+- 单行数据错误时逐条重试，无法写入的条目转入死信流，不阻塞后续消息
+- Redis 不可用、管道未启动或雪花ID worker 编号没有有效租约时退回同步写入
+
+注意：消息在缓冲期间（通常几毫秒）数据库中还查不到，
+需要立即读到的场景应直接使用创建时返回的消息对象
+"""
+
+import asyncio
+import json
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Tuple
+from uuid import uuid4
+
+from loguru import logger
+from sqlalchemy import insert, select
+from sqlalchemy.exc import DataError, IntegrityError
+
+from src.config.settings import get_settings
+from src.models.message import Message, MessageType, SenderType
+from src.utils.ids import worker_id_lease
+from src.utils.metrics import metrics
+
+settings = get_settings()
+
+COLUMNS = (
+    "id", "uuid", "conversation_id", "sender_type", "sender_id", "content",
+    "message_type", "message_metadata", "is_private", "created_at", "updated_at",
+)
+
+
+def _encode(message: Message) -> str:
+    row = {}
+    for column in COLUMNS:
+        value = getattr(message, column)
+        if isinstance(value, datetime):
+            value = value.isoformat()
+        elif hasattr(value, "value"):
+            value = value.value
+        row[column] = value
+    return json.dumps(row, ensure_ascii=False)
+
+
+def _decode(raw: str) -> Dict[str, Any]:
+    row = json.loads(raw)
+    row["sender_type"] = SenderType(row["sender_type"])
+    row["message_type"] = MessageType(row["message_type"])
+    row["created_at"] = datetime.fromisoformat(row["created_at"])
+    row["updated_at"] = datetime.fromisoformat(row["updated_at"])
+    return row
+
+
+class MessageWriter:
+    """批量消息写入器"""
+
+    def __init__(
+        self,
+        stream: str = None,
+        group: str = "message_writers",
+        batch_size: int = None,
+        flush_interval_ms: int = None
+    ):
+        self.stream = stream or settings.MESSAGE_WRITER_STREAM
+        self.dead_letter_stream = f"{self.stream}:dead"
+        self.group = group
+        self.consumer = f"writer-{uuid4().hex[:12]}"
+        self.batch_size = batch_size or settings.MESSAGE_WRITER_BATCH_SIZE
+        self.flush_interval = (flush_interval_ms or settings.MESSAGE_WRITER_FLUSH_INTERVAL_MS) / 1000
+        self.claim_idle_ms = settings.MESSAGE_WRITER_CLAIM_IDLE_MS
+        self.enabled = settings.MESSAGE_WRITE_BEHIND_ENABLED
+
+        self._task: Optional[asyncio.Task] = None
+        self._running = False
+
+    @property
+    def redis(self):
+        from src.core.redis import get_redis_manager
+        return get_redis_manager().queue
+
+    @property
+    def running(self) -> bool:
+        return self._running
+
+    # ==========================================
+    # 📥 提交
+    # ==========================================
+
+    async def submit(self, message: Message) -> bool:
+        """
+        把消息写入缓冲
+
+        Returns:
+            是否已进入缓冲；返回 False 时调用方需要同步写入
+        """
+        # 没有有效的 worker 编号租约时ID可能与其他进程重复，不能进入缓冲
+        if not self._running or not worker_id_lease.valid:
+            return False
+
+        try:
+            await self.redis.xadd(self.stream, {"row": _encode(message)})
+            return True
+        except Exception as e:
+            logger.warning(f"Message buffer unavailable, writing message {message.id} synchronously: {e}")
+            return False
+
+    # ==========================================
+    # 🚀 生命周期
+    # ==========================================
+
+    async def start(self):
+        """创建消费组并启动后台写入任务"""
+        if not self.enabled or self._running:
+            return
+
+        if not worker_id_lease.valid:
+            logger.warning("⚠️ Snowflake worker id is not leased, message writer disabled, writing synchronously")
+            return
+
+        try:
+            await self.redis.xgroup_create(self.stream, self.group, id="0", mkstream=True)
+        except Exception as e:
+            # 消费组已存在
+            if "BUSYGROUP" not in str(e):
+                logger.error(f"Failed to create message writer group, writing synchronously: {e}")
+                return
+
+        self._running = True
+        self._task = asyncio.create_task(self._run())
+        logger.info(f"✅ Message writer started (consumer {self.consumer})")
+
+    async def stop(self, timeout: float = None):
+        """停止接收新消息，把本进程已读取和缓冲中的消息写完"""
+        if not self._task:
+            return
+
+        self._running = False
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+        self._task = None
+
+        timeout = settings.MESSAGE_WRITER_DRAIN_TIMEOUT if timeout is None else timeout
+        try:
+            await asyncio.wait_for(self._drain(), timeout)
+            logger.info("✅ Message writer drained")
+        except asyncio.TimeoutError:
+            logger.warning("⚠️ Message writer drain timed out, remaining messages stay in the buffer")
+        except Exception as e:
+            logger.error(f"Message writer drain failed, remaining messages stay in the buffer: {e}")
+
+    async def _drain(self):
+        # 先写完本消费者已读取未确认的条目，再写缓冲中剩余的条目
+        for start_id in ("0", ">"):
+            while True:
+                entries = await self._read(start_id, block=None)
+                if not entries:
+                    break
+                await self._flush(entries)
+
+    # ==========================================
+    # 🔄 批量写入
+    # ==========================================
+
+    async def _run(self):
+        last_claim = 0.0
+        backoff = 0.1
+
+        while True:
+            try:
+                entries: List[Tuple[str, Dict[str, str]]] = []
+                if time.monotonic() - last_claim >= self.claim_idle_ms / 1000:
+                    entries = await self._claim()
+                    last_claim = time.monotonic()
+
+                if not entries:
+                    entries = await self._collect()
+                if entries:
+                    await self._flush(entries)
+                backoff = 0.1
+
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                # 数据库或 Redis 暂时不可用，条目保持未确认，稍后重试或被接管
+                logger.error(f"Message writer flush failed: {e}")
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, 5.0)
+
+    async def _read(self, start_id: str, count: int = None, block: Optional[int] = None):
+        response = await self.redis.xreadgroup(
+            self.group,
+            self.consumer,
+            {self.stream: start_id},
+            count=count or self.batch_size,
+            block=block
+        )
+        if not response:
+            return []
+        return response[0][1]
+
+    async def _collect(self) -> List[Tuple[str, Dict[str, str]]]:
+        """等待第一条消息，再在刷新间隔内攒批，攒满 N 条立即返回"""
+        entries = await self._read(">", block=1000)
+        if not entries or len(entries) >= self.batch_size:
+            return entries
+
+        deadline = time.monotonic() + self.flush_interval
+        while len(entries) < self.batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            await asyncio.sleep(remaining)
+            entries.extend(await self._read(">", count=self.batch_size - len(entries)))
+        return entries
+
+    async def _claim(self) -> List[Tuple[str, Dict[str, str]]]:
+        """接管其他消费者（崩溃的进程）长时间未确认的条目"""
+        result = await self.redis.xautoclaim(
+            self.stream,
+            self.group,
+            self.consumer,
+            min_idle_time=self.claim_idle_ms,
+            start_id="0-0",
+            count=self.batch_size
+        )
+        entries = result[1]
+        if entries:
+            logger.warning(f"Claimed {len(entries)} stale buffered messages")
+        return entries
+
+    async def _flush(self, entries: List[Tuple[str, Dict[str, str]]]):
+        """多行写入一批消息，成功后确认并删除缓冲条目"""
+        from src.core.database import get_db_session
+
+        start_time = time.perf_counter()
+        # 已删除的条目（字段为空）只需确认
+        entry_ids = [entry_id for entry_id, _ in entries]
+        entries = [(entry_id, fields) for entry_id, fields in entries if fields]
+        rows = [_decode(fields["row"]) for _, fields in entries]
+        if not rows:
+            await self._ack(entry_ids)
+            return
+
+        try:
+            async with get_db_session() as db:
+                conflicts = await self._insert(db, rows)
+                await db.commit()
+        except (IntegrityError, DataError) as e:
+            logger.warning(f"Batch insert of {len(rows)} messages failed, retrying row by row: {e}")
+            await self._flush_rows(entries, rows)
+        else:
+            metrics.record_message_flush(len(rows) - len(conflicts), time.perf_counter() - start_time)
+            for index in conflicts:
+                await self._dead_letter(entries[index][1], rows[index], "id already used by another message")
+
+        await self._ack(entry_ids)
+
+    async def _flush_rows(self, entries: List[Tuple[str, Dict[str, str]]], rows: List[Dict[str, Any]]):
+        from src.core.database import get_db_session
+
+        for (entry_id, fields), row in zip(entries, rows):
+            try:
+                async with get_db_session() as db:
+                    conflicts = await self._insert(db, [row])
+                    await db.commit()
+            except (IntegrityError, DataError) as e:
+                await self._dead_letter(fields, row, str(e))
+            else:
+                if conflicts:
+                    await self._dead_letter(fields, row, "id already used by another message")
+
+    async def _insert(self, db, rows: List[Dict[str, Any]]) -> List[int]:
+        """
+        多行插入
+
+        Returns:
+            因主键冲突没有写入的行下标；主键已存在且 uuid 相同的是重复投递，不算冲突
+        """
+        await db.execute(self._insert_statement(db.bind.dialect.name), rows)
+        result = await db.execute(
+            select(Message.id, Message.uuid).where(Message.id.in_([row["id"] for row in rows]))
+        )
+        stored = dict(result.all())
+        return [index for index, row in enumerate(rows) if stored.get(row["id"]) != row["uuid"]]
+
+    async def _dead_letter(self, fields: Dict[str, str], row: Dict[str, Any], error: str):
+        logger.error(f"Message {row['id']} cannot be written, moving to dead letter stream: {error}")
+        await self.redis.xadd(self.dead_letter_stream, {"row": fields["row"], "error": error[:500]})
+        metrics.record_message_dead_letter()
+
+    @staticmethod
+    def _insert_statement(dialect: str):
+        """多行插入语句，主键冲突的条目忽略（由 _insert 区分重复投递与ID冲突，其他约束错误照常抛出）"""
+        table = Message.__table__
+        if dialect == "mysql":
+            from sqlalchemy.dialects.mysql import insert as mysql_insert
+            stmt = mysql_insert(table)
+            return stmt.on_duplicate_key_update(id=stmt.inserted.id)
+        if dialect == "postgresql":
+            from sqlalchemy.dialects.postgresql import insert as pg_insert
+            return pg_insert(table).on_conflict_do_nothing(index_elements=["id"])
+        if dialect == "sqlite":
+            from sqlalchemy.dialects.sqlite import insert as sqlite_insert
+            return sqlite_insert(table).on_conflict_do_nothing(index_elements=["id"])
+        return insert(table)
+
+    async def _ack(self, entry_ids: List[str]):
+        async with self.redis.pipeline(transaction=False) as pipe:
+            pipe.xack(self.stream, self.group, *entry_ids)
+            pipe.xdel(self.stream, *entry_ids)
+            await pipe.execute()
+
+
+# 全局消息写入器
+message_writer = MessageWriter()
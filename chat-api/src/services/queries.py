@@ -0,0 +1,136 @@
+"""
+🗂️ 热点查询
+
+服务层的热点列表查询在这里集中构建，服务与查询计划检查（tests/test_query_plans.py、
+scripts/check_query_plans.py）使用同一份语句，新增或修改查询时计划检查会一并覆盖
+
+每个查询都依赖模型 __table_args__ 中声明的复合索引，
+排序列放在等值过滤列之后、主键之前，保证过滤与排序都由索引完成，不产生 filesort
+"""
+
+from datetime import datetime
+from typing import Any, Callable, Dict, Optional
+
+from sqlalchemy import and_, or_, select
+from sqlalchemy.sql import Select
+
+from src.models.conversation import Conversation, ConversationPriority, ConversationStatus, CustomerContact
+from src.models.message import Message
+from src.models.user import User, UserRole, UserStatus
+from src.utils.pagination import keyset_statement
+
+
+def conversation_messages_query(conversation_id: int, include_private: bool = False) -> Select:
+    """对话消息列表（idx_messages_conversation_created）"""
+    stmt = select(Message).where(Message.conversation_id == conversation_id)
+    if not include_private:
+        stmt = stmt.where(Message.is_private == False)  # noqa: E712
+    return stmt
+
+
+def context_messages_query(conversation_id: int, limit: int) -> Select:
+    """AI上下文窗口加载：对话最近的公开消息（idx_messages_conversation_created）"""
+    return (
+        select(Message.id, Message.sender_type, Message.content)
+        .where(Message.conversation_id == conversation_id, Message.is_private == False)  # noqa: E712
+        .order_by(Message.created_at.desc(), Message.id.desc())
+        .limit(limit)
+    )
+
+
+def contact_by_external_user_id_query(user_id: str) -> Select:
+    """按外部用户ID查找联系人（uq_customer_contacts_external_user_id）"""
+    return select(CustomerContact.id).where(CustomerContact.external_user_id == user_id)
+
+
+def conversation_list_query(
+    filters: Optional[Dict[str, Any]] = None,
+    assignee_id: Optional[int] = None
+) -> Select:
+    """
+    对话列表
+
+    按客服过滤时走 idx_conversations_assignee_created，按状态/优先级过滤时走对应的
+    (status|priority, created_at, id) 索引，其余条件在索引范围内过滤
+    """
+    stmt = select(Conversation)
+    conditions = []
+    filters = filters or {}
+
+    assignee_id = assignee_id or filters.get("assignee_id")
+    if assignee_id:
+        conditions.append(Conversation.assignee_id == assignee_id)
+
+    if filters.get("status"):
+        conditions.append(Conversation.status == ConversationStatus(filters["status"]))
+
+    if filters.get("priority"):
+        conditions.append(Conversation.priority == ConversationPriority(filters["priority"]))
+
+    if conditions:
+        stmt = stmt.where(and_(*conditions))
+    return stmt
+
+
+def user_list_query(filters: Optional[Dict[str, Any]] = None, search: Optional[str] = None) -> Select:
+    """
+    用户列表
+
+    角色/状态过滤走 (role|status, created_at, id) 索引；
+    模糊搜索（前后通配）无法使用索引，客服账号数量有限，不纳入计划检查
+    """
+    stmt = select(User)
+    conditions = []
+    filters = filters or {}
+
+    if filters.get("role"):
+        conditions.append(User.role == UserRole(filters["role"]))
+
+    if filters.get("status"):
+        conditions.append(User.status == UserStatus(filters["status"]))
+
+    if conditions:
+        stmt = stmt.where(and_(*conditions))
+
+    if search:
+        search_pattern = f"%{search}%"
+        stmt = stmt.where(
+            or_(
+                User.full_name.ilike(search_pattern),
+                User.email.ilike(search_pattern)
+            )
+        )
+    return stmt
+
+
+# ==========================================
+# 📋 计划检查清单
+# ==========================================
+
+_CURSOR = (datetime(2024, 1, 1), 1000)
+
+
+def _page(stmt: Select, model, after=None) -> Select:
+    return keyset_statement(stmt, model.created_at, model.id, 20, after)
+
+
+# 名称 -> 构建最终执行语句（含排序、翻页条件与 LIMIT）
+HOT_QUERIES: Dict[str, Callable[[], Select]] = {
+    "messages.first_page": lambda: _page(conversation_messages_query(1), Message),
+    "messages.next_page": lambda: _page(conversation_messages_query(1), Message, _CURSOR),
+    "messages.with_private": lambda: _page(conversation_messages_query(1, include_private=True), Message, _CURSOR),
+    "messages.context_window": lambda: context_messages_query(1, 50),
+    "messages.by_id": lambda: select(Message).where(Message.id == 1),
+    "contacts.by_external_user_id": lambda: contact_by_external_user_id_query("user"),
+    "conversations.first_page": lambda: _page(conversation_list_query(), Conversation),
+    "conversations.next_page": lambda: _page(conversation_list_query(), Conversation, _CURSOR),
+    "conversations.by_status": lambda: _page(conversation_list_query({"status": "open"}), Conversation, _CURSOR),
+    "conversations.by_priority": lambda: _page(conversation_list_query({"priority": "urgent"}), Conversation),
+    "conversations.by_assignee": lambda: _page(conversation_list_query(assignee_id=1), Conversation, _CURSOR),
+    "conversations.by_assignee_status": lambda: _page(
+        conversation_list_query({"status": "open"}, assignee_id=1), Conversation
+    ),
+    "users.first_page": lambda: _page(user_list_query(), User),
+    "users.by_role": lambda: _page(user_list_query({"role": "agent"}), User, _CURSOR),
+    "users.by_status": lambda: _page(user_list_query({"status": "active"}), User),
+}
@@ -0,0 +1,468 @@
+"""
+📊 对话统计
+
+仪表板的对话统计保存在 Redis 哈希中，读取为一次往返，不再每次加载都对全表执行 COUNT:
+- 对话的创建、删除、状态与代理类型变更通过 ORM 会话事件收集，事务提交后增量更新计数
+- 消息创建时更新消息数，并按消息时间戳累计首次响应时间（首条客服/AI 消息 - 对话创建）
+  与解决时间（解决前最后一条消息 - 对话创建）
+- 后台任务定期用 SQL 重新计算全部统计并覆盖计数，修正增量更新遗漏（Redis 故障、
+  绕过 ORM 的批量更新、级联删除等）造成的偏差，集群内每个周期只由一个 worker 执行
+
+客户满意度目前没有数据来源，统计中返回 None
+"""
+
+import asyncio
+import time
+from datetime import datetime
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+from loguru import logger
+from sqlalchemy import case, event, extract, func, inspect, literal_column, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from src.config.settings import get_settings
+from src.models.conversation import AgentType, Conversation, ConversationStatus
+from src.models.message import Message, SenderType
+
+settings = get_settings()
+
+# 计入首次响应的发送者类型
+REPLY_SENDERS = (SenderType.AGENT.value, SenderType.AI.value)
+
+# 会话事件收集的待应用变更在 session.info 中的键
+_PENDING_KEY = "conversation_stats"
+
+# KEYS: 统计哈希, 对话哈希, 当日消息计数
+# ARGV: 消息时间戳, 是否为回复(1/0), 对话哈希过期时间
+_MESSAGE_SCRIPT = """
+redis.call('HINCRBY', KEYS[1], 'messages', 1)
+redis.call('INCR', KEYS[3])
+redis.call('EXPIRE', KEYS[3], 172800)
+redis.call('HSET', KEYS[2], 'last_message', ARGV[1])
+redis.call('EXPIRE', KEYS[2], ARGV[3])
+if ARGV[2] == '1' and redis.call('HSETNX', KEYS[2], 'replied', 1) == 1 then
+    local created = redis.call('HGET', KEYS[2], 'created')
+    if created then
+        redis.call('HINCRBY', KEYS[1], 'first_response:count', 1)
+        redis.call('HINCRBYFLOAT', KEYS[1], 'first_response:seconds', math.max(0, ARGV[1] - created))
+        return 1
+    end
+end
+return 0
+"""
+
+# KEYS: 统计哈希, 对话哈希
+# ARGV: 对话创建时间戳（对话哈希缺失时使用，未知时为空）
+_RESOLVE_SCRIPT = """
+local ended = redis.call('HGET', KEYS[2], 'last_message')
+if not ended or redis.call('HSETNX', KEYS[2], 'resolved', 1) == 0 then
+    return 0
+end
+local created = redis.call('HGET', KEYS[2], 'created') or ARGV[1]
+if created == '' then
+    return 0
+end
+redis.call('HINCRBY', KEYS[1], 'resolution:count', 1)
+redis.call('HINCRBYFLOAT', KEYS[1], 'resolution:seconds', math.max(0, ended - created))
+return 1
+"""
+
+
+def _value(value: Any) -> Optional[str]:
+    return getattr(value, "value", value)
+
+
+def _timestamp(value: Optional[datetime]) -> Optional[float]:
+    return value.timestamp() if isinstance(value, datetime) else None
+
+
+def _seconds_between(dialect: str, start, end):
+    """两个时间列之间的秒数"""
+    if dialect == "mysql":
+        return func.timestampdiff(literal_column("SECOND"), start, end)
+    if dialect == "postgresql":
+        return extract("epoch", end - start)
+    return (func.julianday(end) - func.julianday(start)) * 86400
+
+
+def _average_minutes(total_seconds: float, count: int) -> Optional[float]:
+    return round(total_seconds / count / 60, 2) if count else None
+
+
+# ==========================================
+# 🪝 ORM 会话事件
+# ==========================================
+
+def _history(state, key: str) -> Optional[Tuple[Optional[str], str]]:
+    """属性本次刷新的 (旧值, 新值)，未变更时返回 None"""
+    history = state.attrs[key].history
+    if not history.added:
+        return None
+    old = _value(history.deleted[0]) if history.deleted else None
+    new = _value(history.added[0])
+    return None if old == new else (old, new)
+
+
+def _collect(session: Session, flush_context):
+    """刷新后记录对话变更（此时属性历史仍可读取），提交后再应用"""
+    ops = []
+
+    for obj in session.new:
+        if isinstance(obj, Conversation):
+            ops.append(("created", obj.id, _value(obj.status), _value(obj.current_agent_type), time.time()))
+
+    for obj in session.dirty:
+        if not isinstance(obj, Conversation):
+            continue
+        state = inspect(obj)
+        status = _history(state, "status")
+        if status:
+            ops.append(("status", obj.id, status[0], status[1], _timestamp(state.dict.get("created_at"))))
+        agent_type = _history(state, "current_agent_type")
+        if agent_type:
+            ops.append(("agent", obj.id, agent_type[0], agent_type[1]))
+
+    for obj in session.deleted:
+        if isinstance(obj, Conversation):
+            state = inspect(obj)
+            ops.append((
+                "deleted", obj.id,
+                _value(state.dict.get("status")), _value(state.dict.get("current_agent_type"))
+            ))
+
+    if ops:
+        session.info.setdefault(_PENDING_KEY, []).extend(ops)
+
+
+def _after_commit(session: Session):
+    ops = session.info.pop(_PENDING_KEY, None)
+    if ops:
+        conversation_stats.schedule(ops)
+
+
+def _after_rollback(session: Session):
+    session.info.pop(_PENDING_KEY, None)
+
+
+class ConversationStatsTracker:
+    """对话统计计数器"""
+
+    def __init__(
+        self,
+        key: str = "stats:conversations",
+        conversation_prefix: str = "stats:conversation:",
+        daily_prefix: str = "stats:messages:",
+        lock_name: str = "lock:stats_reconcile"
+    ):
+        self.key = key
+        self.conversation_prefix = conversation_prefix
+        self.daily_prefix = daily_prefix
+        self.lock_name = lock_name
+        self.reconcile_interval = settings.STATS_RECONCILE_INTERVAL
+        self.conversation_ttl = settings.STATS_CONVERSATION_TTL
+
+        self._message_script = None
+        self._resolve_script = None
+        self._pending: Set[asyncio.Task] = set()
+        self._reconcile_task: Optional[asyncio.Task] = None
+        self._listening = False
+
+    @property
+    def redis(self):
+        from src.core.redis import get_redis_manager
+        return get_redis_manager().cache
+
+    def _conversation_key(self, conversation_id: int) -> str:
+        return f"{self.conversation_prefix}{conversation_id}"
+
+    def _daily_key(self, day: datetime = None) -> str:
+        return f"{self.daily_prefix}{(day or datetime.now()).strftime('%Y-%m-%d')}"
+
+    def _scripts(self):
+        if self._message_script is None:
+            self._message_script = self.redis.register_script(_MESSAGE_SCRIPT)
+            self._resolve_script = self.redis.register_script(_RESOLVE_SCRIPT)
+        return self._message_script, self._resolve_script
+
+    # ==========================================
+    # ➕ 增量更新
+    # ==========================================
+
+    def schedule(self, ops: List[tuple]):
+        """在事件循环中异步应用已提交的变更（ORM 事件是同步回调）"""
+        try:
+            task = asyncio.get_running_loop().create_task(self.apply(ops))
+        except RuntimeError:
+            # 同步引擎（脚本、测试）中没有事件循环，由对账修正
+            return
+        self._pending.add(task)
+        task.add_done_callback(self._pending.discard)
+
+    async def apply(self, ops: List[tuple]):
+        """应用一批对话变更"""
+        try:
+            _, resolve = self._scripts()
+            async with self.redis.pipeline(transaction=False) as pipe:
+                for op in ops:
+                    kind, conversation_id = op[0], op[1]
+                    conversation_key = self._conversation_key(conversation_id)
+
+                    if kind == "created":
+                        _, _, status, agent_type, created = op
+                        pipe.hincrby(self.key, "total", 1)
+                        pipe.hincrby(self.key, f"status:{status}", 1)
+                        pipe.hincrby(self.key, f"agent:{agent_type}", 1)
+                        pipe.hset(conversation_key, "created", created)
+                        pipe.expire(conversation_key, self.conversation_ttl)
+
+                    elif kind == "deleted":
+                        _, _, status, agent_type = op
+                        pipe.hincrby(self.key, "total", -1)
+                        if status:
+                            pipe.hincrby(self.key, f"status:{status}", -1)
+                        if agent_type:
+                            pipe.hincrby(self.key, f"agent:{agent_type}", -1)
+                        pipe.delete(conversation_key)
+
+                    elif kind == "status":
+                        _, _, old, new, created = op
+                        if old:
+                            pipe.hincrby(self.key, f"status:{old}", -1)
+                        pipe.hincrby(self.key, f"status:{new}", 1)
+                        if new == ConversationStatus.RESOLVED.value:
+                            await resolve(
+                                keys=[self.key, conversation_key],
+                                args=[created if created is not None else ""],
+                                client=pipe
+                            )
+
+                    elif kind == "agent":
+                        _, _, old, new = op
+                        if old:
+                            pipe.hincrby(self.key, f"agent:{old}", -1)
+                        pipe.hincrby(self.key, f"agent:{new}", 1)
+
+                await pipe.execute()
+        except Exception as e:
+            logger.warning(f"Failed to update conversation stats, waiting for reconciliation: {e}")
+
+    async def message_created(self, message: Message):
+        """记录一条新消息，首条客服/AI 消息计入首次响应时间"""
+        try:
+            record, _ = self._scripts()
+            is_reply = _value(message.sender_type) in REPLY_SENDERS
+            await record(
+                keys=[self.key, self._conversation_key(message.conversation_id), self._daily_key(message.created_at)],
+                args=[message.created_at.timestamp(), 1 if is_reply else 0, self.conversation_ttl]
+            )
+        except Exception as e:
+            logger.debug(f"Failed to record message {message.id} in stats: {e}")
+
+    # ==========================================
+    # 📖 读取
+    # ==========================================
+
+    async def snapshot(self) -> Optional[Dict[str, Any]]:
+        """
+        读取当前统计
+
+        Returns:
+            统计字典；尚未对账过（没有基准）或 Redis 不可用时返回 None
+        """
+        try:
+            async with self.redis.pipeline(transaction=False) as pipe:
+                pipe.hgetall(self.key)
+                pipe.get(self._daily_key())
+                counters, today = await pipe.execute()
+        except Exception as e:
+            logger.warning(f"Conversation stats unavailable: {e}")
+            return None
+
+        if not counters or "reconciled_at" not in counters:
+            return None
+        return self._build(counters, int(today or 0))
+
+    @staticmethod
+    def _build(counters: Dict[str, Any], today_messages: int) -> Dict[str, Any]:
+        def count(field: str) -> int:
+            return max(0, int(float(counters.get(field) or 0)))
+
+        total = count("total")
+        resolved = count(f"status:{ConversationStatus.RESOLVED.value}")
+        messages = count("messages")
+
+        return {
+            "total_conversations": total,
+            "open_conversations": count(f"status:{ConversationStatus.OPEN.value}"),
+            "pending_conversations": count(f"status:{ConversationStatus.PENDING.value}"),
+            "resolved_conversations": resolved,
+            "closed_conversations": count(f"status:{ConversationStatus.CLOSED.value}"),
+            "ai_handled": count(f"agent:{AgentType.AI.value}"),
+            "human_handled": count(f"agent:{AgentType.HUMAN.value}"),
+            "total_messages": messages,
+            "today_messages": today_messages,
+            "avg_messages_per_conversation": round(messages / total, 2) if total else 0,
+            "avg_response_time": _average_minutes(
+                float(counters.get("first_response:seconds") or 0), count("first_response:count")
+            ),
+            "avg_resolution_time": _average_minutes(
+                float(counters.get("resolution:seconds") or 0), count("resolution:count")
+            ),
+            "customer_satisfaction": None,
+            "resolution_rate": resolved / total if total else 0,
+            "reconciled_at": float(counters["reconciled_at"]),
+        }
+
+    # ==========================================
+    # 🔁 对账
+    # ==========================================
+
+    async def compute(self, db: AsyncSession) -> Dict[str, Any]:
+        """用 SQL 计算全部统计（计数器字段格式）"""
+        dialect = db.bind.dialect.name
+        today = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
+        counters: Dict[str, Any] = {"total": 0}
+
+        for status in ConversationStatus:
+            counters[f"status:{status.value}"] = 0
+        for agent_type in AgentType:
+            counters[f"agent:{agent_type.value}"] = 0
+
+        # 状态 × 代理类型一次分组
+        grouped = await db.execute(
+            select(Conversation.status, Conversation.current_agent_type, func.count())
+            .group_by(Conversation.status, Conversation.current_agent_type)
+        )
+        for status, agent_type, n in grouped.all():
+            counters["total"] += n
+            counters[f"status:{_value(status)}"] += n
+            counters[f"agent:{_value(agent_type)}"] += n
+
+        messages, today_messages = (await db.execute(
+            select(func.count(Message.id), func.sum(case((Message.created_at >= today, 1), else_=0)))
+        )).one()
+        counters["messages"] = int(messages or 0)
+
+        # 每个对话的首条回复与最后一条消息时间
+        per_conversation = (
+            select(
+                Message.conversation_id,
+                func.min(case((Message.sender_type.in_([SenderType.AGENT, SenderType.AI]), Message.created_at)))
+                .label("first_reply_at"),
+                func.max(Message.created_at).label("last_message_at"),
+            )
+            .group_by(Message.conversation_id)
+            .subquery()
+        )
+        first_response = _seconds_between(dialect, Conversation.created_at, per_conversation.c.first_reply_at)
+        resolution = _seconds_between(dialect, Conversation.created_at, per_conversation.c.last_message_at)
+        is_resolved = Conversation.status == ConversationStatus.RESOLVED
+
+        durations = (await db.execute(
+            select(
+                func.count(per_conversation.c.first_reply_at),
+                func.sum(first_response),
+                func.sum(case((is_resolved, 1), else_=0)),
+                func.sum(case((is_resolved, resolution), else_=0)),
+            )
+            .select_from(Conversation)
+            .join(per_conversation, per_conversation.c.conversation_id == Conversation.id)
+        )).one()
+        counters["first_response:count"] = int(durations[0] or 0)
+        counters["first_response:seconds"] = float(durations[1] or 0)
+        counters["resolution:count"] = int(durations[2] or 0)
+        counters["resolution:seconds"] = float(durations[3] or 0)
+        counters["today_messages"] = int(today_messages or 0)
+
+        return counters
+
+    async def reconcile(self, db: AsyncSession) -> Dict[str, Any]:
+        """
+        用 SQL 重新计算统计并覆盖 Redis 计数
+
+        计算期间发生的增量更新可能被覆盖，偏差在下一次对账时修正
+
+        Returns:
+            统计字典
+        """
+        counters = await self.compute(db)
+        today_messages = counters.pop("today_messages")
+        counters["reconciled_at"] = time.time()
+
+        try:
+            previous = await self.redis.hgetall(self.key)
+            async with self.redis.pipeline(transaction=True) as pipe:
+                pipe.hset(self.key, mapping=counters)
+                pipe.set(self._daily_key(), today_messages, ex=172800)
+                await pipe.execute()
+
+            drift = {}
+            for field, value in counters.items():
+                if field in previous and isinstance(value, int):
+                    diff = int(float(previous[field])) - value
+                    if diff:
+                        drift[field] = diff
+            if drift:
+                logger.info(f"Conversation stats reconciled, corrected drift: {drift}")
+        except Exception as e:
+            logger.warning(f"Failed to store reconciled conversation stats: {e}")
+
+        return self._build(counters, today_messages)
+
+    async def _reconcile_once(self):
+        from src.core.database import get_db_session
+        from src.core.redis import RedisLock
+
+        # 锁在周期内不释放，集群内每个周期只对账一次
+        lock = RedisLock(self.redis, self.lock_name, int(self.reconcile_interval * 900))
+        if not await lock.acquire():
+            return
+
+        async with get_db_session() as db:
+            await self.reconcile(db)
+
+    async def _reconcile_loop(self):
+        """对账循环"""
+        while True:
+            try:
+                await self._reconcile_once()
+            except Exception as e:
+                logger.error(f"Conversation stats reconciliation error: {e}")
+            await asyncio.sleep(self.reconcile_interval)
+
+    # ==========================================
+    # 🚀 生命周期
+    # ==========================================
+
+    def start(self):
+        """注册会话事件并启动对账任务（幂等）"""
+        if not self._listening:
+            event.listen(Session, "after_flush", _collect)
+            event.listen(Session, "after_commit", _after_commit)
+            event.listen(Session, "after_rollback", _after_rollback)
+            self._listening = True
+
+        if not self._reconcile_task:
+            self._reconcile_task = asyncio.create_task(self._reconcile_loop())
+            logger.info("✅ Conversation stats tracker started")
+
+    async def stop(self):
+        """停止对账任务，等待已提交的变更写入"""
+        if self._listening:
+            event.remove(Session, "after_flush", _collect)
+            event.remove(Session, "after_commit", _after_commit)
+            event.remove(Session, "after_rollback", _after_rollback)
+            self._listening = False
+
+        if self._reconcile_task:
+            self._reconcile_task.cancel()
+            await asyncio.gather(self._reconcile_task, return_exceptions=True)
+            self._reconcile_task = None
+
+        if self._pending:
+            await asyncio.gather(*self._pending, return_exceptions=True)
+
+
+# 全局对话统计实例
+conversation_stats = ConversationStatsTracker()
@@ -4,16 +4,18 @@
 处理用户相关的业务逻辑
 """
 
-from datetime import datetime
+from datetime import datetime, timedelta
 from typing import Dict, List, Optional, Any
 
 from loguru import logger
-from sqlalchemy import and_, or_, select, update, func
+from sqlalchemy import case, select, update, func
 from sqlalchemy.ext.asyncio import AsyncSession
 
 from src.core.exceptions import NotFoundException, ValidationException
-from src.models.user import User, UserRole, UserStatus
+from src.models.user import User, UserStatus
 from src.models.base import PaginationResponse
+from src.services.queries import user_list_query
+from src.utils.pagination import COUNT_ESTIMATE, paginate_keyset, paginate_offset
 
 
 class UserService:
@@ -236,77 +238,51 @@ class UserService:
         filters: Optional[Dict[str, Any]] = None,
         search: Optional[str] = None,
         sort: Optional[str] = None,
-        order: str = "desc"
+        order: str = "desc",
+        cursor: Optional[str] = None,
+        count: str = COUNT_ESTIMATE
     ) -> tuple[List[User], PaginationResponse]:
         """
         获取用户列表
         
         Args:
-            page: 页码
+            page: 页码（未提供游标时使用，第一页之后为 OFFSET 分页）
             size: 每页数量
             filters: 过滤条件
             search: 搜索关键词
-            sort: 排序字段
+            sort: 排序字段（游标分页仅支持按 created_at 排序）
             order: 排序方向
+            cursor: 上一页返回的 next_cursor
+            count: 总数计算方式（exact / estimate / none）
             
         Returns:
             (用户列表, 分页信息)
         """
         try:
-            # 构建查询
-            stmt = select(User)
-            
-            # 应用过滤条件
-            if filters:
-                conditions = []
-                
-                if filters.get("role"):
-                    conditions.append(User.role == UserRole(filters["role"]))
-                
-                if filters.get("status"):
-                    conditions.append(User.status == UserStatus(filters["status"]))
-                
-                if conditions:
-                    stmt = stmt.where(and_(*conditions))
-            
-            # 应用搜索
-            if search:
-                search_pattern = f"%{search}%"
-                stmt = stmt.where(
-                    or_(
-                        User.full_name.ilike(search_pattern),
-                        User.email.ilike(search_pattern)
-                    )
-                )
+            stmt = user_list_query(filters, search)
             
-            # 应用排序
-            if sort:
-                sort_column = getattr(User, sort, None)
-                if sort_column:
-                    if order.lower() == "asc":
-                        stmt = stmt.order_by(sort_column.asc())
-                    else:
-                        stmt = stmt.order_by(sort_column.desc())
-            else:
-                stmt = stmt.order_by(User.created_at.desc())
-            
-            # 获取总数
-            count_stmt = select(func.count()).select_from(stmt.subquery())
-            total_result = await self.db.execute(count_stmt)
-            total = total_result.scalar()
-            
-            # 应用分页
-            offset = (page - 1) * size
-            stmt = stmt.offset(offset).limit(size)
-            
-            # 执行查询
-            result = await self.db.execute(stmt)
-            users = result.scalars().all()
+            cache_key = (
+                "users",
+                search,
+                tuple(sorted((key, str(value)) for key, value in (filters or {}).items() if value))
+            )
+            if sort in (None, "created_at") and (cursor or page == 1):
+                return await paginate_keyset(
+                    self.db, stmt, User.created_at, User.id, size,
+                    cursor=cursor, descending=order.lower() != "asc",
+                    count=count, cache_key=cache_key
+                )
+            if cursor:
+                raise ValidationException("游标分页仅支持按创建时间排序")
             
-            # 创建分页响应
-            pagination = PaginationResponse.create(total, page, size)
+            # 应用排序（与游标分页相同的方向，id 作为同值时的稳定排序）
+            descending = order.lower() != "asc"
+            sort_column = getattr(User, sort, None) if sort else User.created_at
+            for column in (sort_column, User.id):
+                if column is not None:
+                    stmt = stmt.order_by(column.desc() if descending else column.asc())
             
-            return list(users), pagination
+            return await paginate_offset(self.db, stmt, page, size, count=count, cache_key=cache_key)
             
         except Exception as e:
             logger.error(f"Failed to list users: {e}")
@@ -320,36 +296,28 @@ class UserService:
             用户统计数据
         """
         try:
-            # 总用户数
-            total_stmt = select(func.count(User.id))
-            total_result = await self.db.execute(total_stmt)
-            total_users = total_result.scalar()
-            
-            # 按状态统计
-            status_stmt = (
-                select(User.status, func.count(User.id))
-                .group_by(User.status)
-            )
-            status_result = await self.db.execute(status_stmt)
-            status_stats = {status: count for status, count in status_result.fetchall()}
-            
-            # 按角色统计
-            role_stmt = (
-                select(User.role, func.count(User.id))
-                .group_by(User.role)
-            )
-            role_result = await self.db.execute(role_stmt)
-            role_stats = {role.value: count for role, count in role_result.fetchall()}
-            
-            # 最近注册用户数（7天内）
-            from datetime import timedelta
+            # 按 状态 × 角色 一次分组，同时统计最近7天注册数
             week_ago = datetime.now() - timedelta(days=7)
-            recent_stmt = (
-                select(func.count(User.id))
-                .where(User.created_at >= week_ago)
+            stmt = (
+                select(
+                    User.status,
+                    User.role,
+                    func.count(User.id),
+                    func.sum(case((User.created_at >= week_ago, 1), else_=0))
+                )
+                .group_by(User.status, User.role)
             )
-            recent_result = await self.db.execute(recent_stmt)
-            recent_users = recent_result.scalar()
+            result = await self.db.execute(stmt)
+            
+            total_users = 0
+            recent_users = 0
+            status_stats: Dict[str, int] = {}
+            role_stats: Dict[str, int] = {}
+            for user_status, role, count, recent in result.all():
+                total_users += count
+                recent_users += int(recent or 0)
+                status_stats[user_status] = status_stats.get(user_status, 0) + count
+                role_stats[role.value] = role_stats.get(role.value, 0) + count
             
             return {
                 "total_users": total_users,
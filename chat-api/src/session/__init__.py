@@ -4,7 +4,9 @@
 提供会话状态管理和持久化
 """
 
-from .manager import SessionManager, session_manager, init_session_manager, get_session_manager
+from .manager import (
+    SessionManager, session_manager, init_session_manager, get_session_manager, close_session_manager
+)
 from .service import SessionService
 
 __all__ = [
@@ -13,4 +15,5 @@ __all__ = [
     "SessionService",
     "init_session_manager",
     "get_session_manager",
+    "close_session_manager",
 ]
@@ -5,22 +5,23 @@
 """
 
 import asyncio
-import json
 import time
 from datetime import datetime, timedelta
-from typing import Dict, List, Optional, Any
+from typing import Dict, List, Optional
 from uuid import uuid4
 
 from loguru import logger
 
 from src.config.settings import get_settings
-from src.core.redis import get_redis_manager
+from src.core.redis import RedisLock, get_pubsub_dispatcher, get_redis_manager
 from src.core.exceptions import SessionException
 from src.models.session import (
     Session, SessionStatus, SessionCreate, SessionUpdate,
     SessionConfig
 )
 from src.models.conversation import AgentType
+from src.session.store import SessionStore
+from src.utils.cache import TTLCache
 from src.utils.metrics import metrics
 
 settings = get_settings()
@@ -37,14 +38,50 @@ class SessionManager:
         self.session_prefix = "session:"
         self.user_sessions_prefix = "user_sessions:"
         self.session_index_key = "session_index"
+        self.sweep_lock_prefix = "lock:session_sweep:"
+        
+        # 会话存储（哈希 + 有序集合索引）
+        self.store = SessionStore(
+            self.redis.session,
+            session_prefix=self.session_prefix,
+            user_sessions_prefix=self.user_sessions_prefix,
+            session_index_key=self.session_index_key,
+            shards=settings.SESSION_SWEEP_SHARDS,
+            idle_timeout=settings.SESSION_IDLE_TIMEOUT
+        )
+        
+        # 待写入的活动时间（会话ID -> 时间戳），按刷新窗口合并
+        self._pending_activity: Dict[str, float] = {}
+        self._activity_task: Optional[asyncio.Task] = None
+        self._activity_flush_event = asyncio.Event()
+        
+        # 进程内一级缓存，其他 worker 修改会话时通过发布订阅失效
+        self._cache: TTLCache[Session] = TTLCache(
+            "session", settings.SESSION_CACHE_SIZE, settings.SESSION_CACHE_TTL
+        )
+        self.invalidation_channel = "session:invalidate"
+        self._instance_id = uuid4().hex
         
         # 清理任务
         self._cleanup_task: Optional[asyncio.Task] = None
     
+    async def start(self):
+        """启动会话管理器：检查存储结构、订阅缓存失效通知、启动清理任务"""
+        await self.check_storage_layout()
+        
+        try:
+            await get_pubsub_dispatcher().subscribe(self.invalidation_channel, self._on_invalidate)
+        except Exception as e:
+            logger.warning(f"⚠️ Session cache invalidation unavailable, relying on TTL: {e}")
+        
+        self.start_cleanup()
+    
     async def create_session(self, session_data: SessionCreate) -> Session:
         """
         创建新会话
         
+        写入会话、更新两个索引并淘汰超出上限的旧会话在一次往返内完成
+        
         Args:
             session_data: 会话创建数据
             
@@ -68,30 +105,23 @@ class SessionManager:
                 expires_at=expires_at
             )
             
-            # 检查用户会话数限制
-            user_sessions = await self.get_user_sessions(session_data.user_id)
-            if len(user_sessions) >= settings.MAX_SESSIONS_PER_USER:
-                # 关闭最旧的会话
-                oldest_session = min(user_sessions, key=lambda s: s.created_at)
-                await self.close_session(oldest_session.session_id)
-            
-            # 保存会话到Redis
-            await self._save_session(session)
-            
-            # 添加到用户会话索引
-            await self._add_to_user_sessions(session_data.user_id, session_id)
-            
-            # 添加到全局会话索引
-            await self._add_to_session_index(session_id)
+            active_count, evicted = await self.store.create(
+                session,
+                max_per_user=settings.MAX_SESSIONS_PER_USER,
+                ttl=self.config.max_session_duration
+            )
             
             # 更新指标
-            metrics.set_active_sessions(await self.get_active_session_count())
+            metrics.set_active_sessions(active_count)
             
+            self._cache.set(session_id, session.model_copy(deep=True))
+            if evicted:
+                await self._invalidate(*evicted)
+                logger.info(f"Closed oldest sessions for user {session_data.user_id}: {evicted}")
             logger.info(f"Session created: {session_id} for user: {session_data.user_id}")
             
             # 启动清理任务
-            if not self._cleanup_task:
-                self._cleanup_task = asyncio.create_task(self._cleanup_loop())
+            self.start_cleanup()
             
             return session
             
@@ -110,20 +140,20 @@ class SessionManager:
             会话对象或None
         """
         try:
-            session_key = f"{self.session_prefix}{session_id}"
-            session_data = await self.redis.get_json(session_key, "session")
-            
-            if not session_data:
-                return None
-            
-            session = Session(**session_data)
+            session = self._cache.get(session_id)
+            if session is None:
+                session = await self.store.get(session_id)
+                if not session:
+                    return None
+                self._cache.set(session_id, session)
             
             # 检查会话是否过期
             if session.expires_at and datetime.now() > session.expires_at:
                 await self.close_session(session_id)
                 return None
             
-            return session
+            # 返回副本，避免调用方修改缓存中的对象
+            return session.model_copy(deep=True)
             
         except Exception as e:
             logger.error(f"Failed to get session {session_id}: {e}")
@@ -145,21 +175,19 @@ class SessionManager:
             更新后的会话对象
         """
         try:
-            session = await self.get_session(session_id)
+            now = datetime.now()
+            fields = {
+                key: value
+                for key, value in update_data.model_dump(exclude_none=True).items()
+                if key in Session.model_fields
+            }
+            fields["updated_at"] = now
+            fields["last_activity_at"] = now
+            
+            session = await self.store.update(session_id, fields)
             if not session:
                 raise SessionException(f"会话不存在: {session_id}")
-            
-            # 更新字段
-            update_dict = update_data.model_dump(exclude_none=True)
-            for key, value in update_dict.items():
-                if hasattr(session, key):
-                    setattr(session, key, value)
-            
-            session.updated_at = datetime.now()
-            session.last_activity_at = datetime.now()
-            
-            # 保存更新
-            await self._save_session(session)
+            await self._refresh_cache(session)
             
             logger.info(f"Session updated: {session_id}")
             return session
@@ -170,6 +198,25 @@ class SessionManager:
             logger.error(f"Failed to update session {session_id}: {e}")
             raise SessionException(f"更新会话失败: {str(e)}")
     
+    async def attach_conversation(self, session_id: str, conversation_id: int) -> Optional[Session]:
+        """
+        关联会话与对话
+        
+        Args:
+            session_id: 会话ID
+            conversation_id: 对话ID
+            
+        Returns:
+            更新后的会话对象，会话不存在时返回 None
+        """
+        session = await self.store.update(session_id, {
+            "conversation_id": conversation_id,
+            "updated_at": datetime.now()
+        })
+        if session:
+            await self._refresh_cache(session)
+        return session
+    
     async def close_session(self, session_id: str) -> bool:
         """
         关闭会话
@@ -181,23 +228,13 @@ class SessionManager:
             是否成功关闭
         """
         try:
-            session = await self.get_session(session_id)
-            if not session:
+            active_count = await self.store.close(session_id)
+            await self._invalidate(session_id)
+            if active_count is None:
                 return False
             
-            # 更新会话状态
-            session.status = SessionStatus.CLOSED
-            session.updated_at = datetime.now()
-            
-            # 保存更新
-            await self._save_session(session)
-            
-            # 从活跃会话索引中移除
-            await self._remove_from_user_sessions(session.user_id, session_id)
-            await self._remove_from_session_index(session_id)
-            
             # 更新指标
-            metrics.set_active_sessions(await self.get_active_session_count())
+            metrics.set_active_sessions(active_count)
             
             logger.info(f"Session closed: {session_id}")
             return True
@@ -217,17 +254,12 @@ class SessionManager:
             是否成功删除
         """
         try:
-            session = await self.get_session(session_id)
-            if not session:
+            active_count = await self.store.delete(session_id)
+            await self._invalidate(session_id)
+            if active_count is None:
                 return False
             
-            # 删除会话数据
-            session_key = f"{self.session_prefix}{session_id}"
-            await self.redis.delete(session_key, "session")
-            
-            # 从索引中移除
-            await self._remove_from_user_sessions(session.user_id, session_id)
-            await self._remove_from_session_index(session_id)
+            metrics.set_active_sessions(active_count)
             
             logger.info(f"Session deleted: {session_id}")
             return True
@@ -238,7 +270,7 @@ class SessionManager:
     
     async def get_user_sessions(self, user_id: str) -> List[Session]:
         """
-        获取用户的所有会话
+        获取用户的所有活跃会话
         
         Args:
             user_id: 用户ID
@@ -247,44 +279,77 @@ class SessionManager:
             会话列表
         """
         try:
-            user_sessions_key = f"{self.user_sessions_prefix}{user_id}"
-            session_ids = await self.redis.lrange(user_sessions_key, db="session")
-            
-            sessions = []
-            for session_id in session_ids:
-                session = await self.get_session(session_id)
-                if session:
-                    sessions.append(session)
-            
-            return sessions
-            
+            return await self.store.get_user_sessions(user_id)
         except Exception as e:
             logger.error(f"Failed to get user sessions for {user_id}: {e}")
             return []
     
     async def update_activity(self, session_id: str) -> bool:
         """
-        更新会话活动时间
+        记录会话活动时间
+        
+        只写入内存，同一会话在刷新窗口内的多次活动合并为一次，
+        由后台任务批量写入 Redis（不改写会话其余字段，也不重置 TTL）
         
         Args:
             session_id: 会话ID
             
         Returns:
-            是否成功更新
+            是否已记录
+        """
+        now = time.time()
+        self._pending_activity[session_id] = now
+        
+        cached = self._cache.peek(session_id)
+        if cached is not None:
+            cached.last_activity_at = datetime.fromtimestamp(now)
+        
+        if len(self._pending_activity) >= settings.SESSION_ACTIVITY_MAX_PENDING:
+            self._activity_flush_event.set()
+        
+        if not self._activity_task:
+            self._activity_task = asyncio.create_task(self._activity_flush_loop())
+        
+        return True
+    
+    async def flush_activity(self) -> int:
+        """
+        将合并后的活动时间写入 Redis
+        
+        Returns:
+            实际更新的会话数
         """
+        if not self._pending_activity:
+            return 0
+        
+        pending, self._pending_activity = self._pending_activity, {}
         try:
-            session = await self.get_session(session_id)
-            if not session:
-                return False
-            
-            session.last_activity_at = datetime.now()
-            await self._save_session(session)
-            
-            return True
-            
+            return await self.store.touch_many(pending)
         except Exception as e:
-            logger.error(f"Failed to update activity for session {session_id}: {e}")
-            return False
+            logger.error(f"Failed to flush session activity ({len(pending)} sessions): {e}")
+            # 写入失败时合并回待写队列，保留较新的时间
+            for session_id, ts in pending.items():
+                if ts > self._pending_activity.get(session_id, 0):
+                    self._pending_activity[session_id] = ts
+            return 0
+    
+    async def _activity_flush_loop(self):
+        """活动时间刷新循环"""
+        while True:
+            try:
+                try:
+                    await asyncio.wait_for(
+                        self._activity_flush_event.wait(),
+                        timeout=settings.SESSION_ACTIVITY_FLUSH_INTERVAL
+                    )
+                except asyncio.TimeoutError:
+                    pass
+                self._activity_flush_event.clear()
+                await self.flush_activity()
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Session activity flush loop error: {e}")
     
     async def switch_agent(
         self, 
@@ -308,23 +373,30 @@ class SessionManager:
             if not session:
                 raise SessionException(f"会话不存在: {session_id}")
             
-            old_agent_type = session.agent_type
-            session.agent_type = agent_type
-            session.updated_at = datetime.now()
-            session.last_activity_at = datetime.now()
+            old_agent_type = AgentType(session.agent_type)
+            agent_type = AgentType(agent_type)
+            now = datetime.now()
             
             # 记录切换信息到元数据
-            if "agent_switches" not in session.session_metadata:
-                session.session_metadata["agent_switches"] = []
-
-            session.session_metadata["agent_switches"].append({
+            session_metadata = dict(session.session_metadata)
+            agent_switches = list(session_metadata.get("agent_switches", []))
+            agent_switches.append({
                 "from": old_agent_type.value,
                 "to": agent_type.value,
                 "reason": reason,
-                "timestamp": datetime.now().isoformat()
+                "timestamp": now.isoformat()
             })
+            session_metadata["agent_switches"] = agent_switches
             
-            await self._save_session(session)
+            session = await self.store.update(session_id, {
+                "agent_type": agent_type,
+                "session_metadata": session_metadata,
+                "updated_at": now,
+                "last_activity_at": now
+            })
+            if not session:
+                raise SessionException(f"会话不存在: {session_id}")
+            await self._refresh_cache(session)
             
             logger.info(f"Agent switched for session {session_id}: {old_agent_type.value} -> {agent_type.value}")
             return session
@@ -338,96 +410,124 @@ class SessionManager:
     async def get_active_session_count(self) -> int:
         """获取活跃会话数"""
         try:
-            session_ids = await self.redis.lrange(self.session_index_key, db="session")
-            return len(session_ids)
+            return await self.store.count_active()
         except Exception:
             return 0
     
     async def cleanup_expired_sessions(self) -> int:
-        """清理过期会话"""
+        """
+        清理过期会话
+        
+        逐个分片从调度集合中弹出已到期的条目（分批、有上限），
+        每个分片同一时间只由一个 worker 处理
+        
+        Returns:
+            关闭的会话数
+        """
+        cleaned_count = 0
+        
+        for shard in range(self.store.shards):
+            try:
+                cleaned_count += await self._sweep_shard(shard)
+            except Exception as e:
+                logger.error(f"Failed to sweep session shard {shard}: {e}")
+        
+        if cleaned_count > 0:
+            metrics.set_active_sessions(await self.get_active_session_count())
+            logger.info(f"Cleaned up {cleaned_count} expired sessions")
+        
+        return cleaned_count
+    
+    async def _sweep_shard(self, shard: int) -> int:
+        """在分片锁保护下清理一个分片"""
+        lock = RedisLock(
+            self.redis.session,
+            f"{self.sweep_lock_prefix}{shard}",
+            ttl_ms=settings.SESSION_SWEEP_LOCK_TTL * 1000
+        )
+        if not await lock.acquire():
+            return 0
+        
+        cleaned_count = 0
         try:
-            session_ids = await self.redis.lrange(self.session_index_key, db="session")
-            cleaned_count = 0
-            
-            for session_id in session_ids:
-                session = await self.get_session(session_id)
-                if not session:
-                    # 会话不存在，从索引中移除
-                    await self._remove_from_session_index(session_id)
-                    cleaned_count += 1
-                    continue
-                
-                # 检查是否过期
-                now = datetime.now()
-                
-                # 检查绝对过期时间
-                if session.expires_at and now > session.expires_at:
-                    await self.close_session(session_id)
-                    cleaned_count += 1
-                    continue
+            for _ in range(settings.SESSION_SWEEP_MAX_BATCHES):
+                processed, closed = await self.store.sweep_shard(
+                    shard, settings.SESSION_SWEEP_BATCH_SIZE
+                )
+                cleaned_count += len(closed)
+                if closed:
+                    await self._invalidate(*closed)
+                if processed < settings.SESSION_SWEEP_BATCH_SIZE:
+                    break
                 
-                # 检查空闲超时
-                idle_time = now - session.last_activity_at
-                if idle_time.total_seconds() > settings.SESSION_IDLE_TIMEOUT:
-                    await self.close_session(session_id)
-                    cleaned_count += 1
-                    continue
-            
-            if cleaned_count > 0:
-                logger.info(f"Cleaned up {cleaned_count} expired sessions")
-            
-            return cleaned_count
-            
+                # 批次之间让出事件循环并续期锁
+                await asyncio.sleep(0)
+                if not await lock.extend():
+                    break
+        finally:
+            await lock.release()
+        
+        return cleaned_count
+    
+    async def check_storage_layout(self) -> bool:
+        """
+        检查 Redis 中是否残留旧版存储结构
+        
+        Returns:
+            存储结构是否为当前版本
+        """
+        try:
+            legacy_keys = await self.store.find_legacy_keys()
         except Exception as e:
-            logger.error(f"Failed to cleanup expired sessions: {e}")
-            return 0
+            logger.warning(f"⚠️ Failed to check session storage layout: {e}")
+            return True
+        
+        if legacy_keys:
+            logger.warning(
+                f"⚠️ Found legacy session keys (e.g. {legacy_keys[:3]}), "
+                f"run scripts/migrate_session_store.py to convert them"
+            )
+            return False
+        return True
     
-    async def _save_session(self, session: Session):
-        """保存会话到Redis"""
-        session_key = f"{self.session_prefix}{session.session_id}"
-        session_data = session.model_dump()
-        
-        # 转换datetime为字符串
-        for key, value in session_data.items():
-            if isinstance(value, datetime):
-                session_data[key] = value.isoformat()
-        
-        await self.redis.set_json(
-            session_key, 
-            session_data, 
-            expire=self.config.max_session_duration,
-            db="session"
-        )
+    # ==========================================
+    # 🧊 一级缓存
+    # ==========================================
+    
+    async def _refresh_cache(self, session: Session):
+        """用最新数据更新本地缓存，并通知其他 worker 失效"""
+        self._cache.set(session.session_id, session.model_copy(deep=True))
+        await self._publish_invalidation([session.session_id])
     
-    async def _add_to_user_sessions(self, user_id: str, session_id: str):
-        """添加到用户会话索引"""
-        user_sessions_key = f"{self.user_sessions_prefix}{user_id}"
-        await self.redis.lpush(user_sessions_key, session_id, db="session")
-        await self.redis.expire(user_sessions_key, self.config.max_session_duration, db="session")
+    async def _invalidate(self, *session_ids: str):
+        """使本地和其他 worker 的缓存失效"""
+        for session_id in session_ids:
+            self._cache.pop(session_id)
+        await self._publish_invalidation(list(session_ids))
     
-    async def _remove_from_user_sessions(self, user_id: str, session_id: str):
-        """从用户会话索引中移除"""
-        user_sessions_key = f"{self.user_sessions_prefix}{user_id}"
-        # Redis没有直接的lrem方法，需要手动实现
-        session_ids = await self.redis.lrange(user_sessions_key, db="session")
-        if session_id in session_ids:
-            session_ids.remove(session_id)
-            await self.redis.delete(user_sessions_key, db="session")
-            for sid in session_ids:
-                await self.redis.lpush(user_sessions_key, sid, db="session")
+    async def _publish_invalidation(self, session_ids: List[str]):
+        if not session_ids:
+            return
+        try:
+            await get_pubsub_dispatcher().publish(
+                self.invalidation_channel,
+                f"{self._instance_id}|{','.join(session_ids)}"
+            )
+        except Exception as e:
+            logger.warning(f"⚠️ Failed to publish session cache invalidation: {e}")
     
-    async def _add_to_session_index(self, session_id: str):
-        """添加到全局会话索引"""
-        await self.redis.lpush(self.session_index_key, session_id, db="session")
+    async def _on_invalidate(self, channel: str, data: str):
+        """处理其他 worker 的缓存失效通知"""
+        origin, _, session_ids = data.partition("|")
+        if origin == self._instance_id:
+            return
+        for session_id in session_ids.split(","):
+            self._cache.pop(session_id)
     
-    async def _remove_from_session_index(self, session_id: str):
-        """从全局会话索引中移除"""
-        session_ids = await self.redis.lrange(self.session_index_key, db="session")
-        if session_id in session_ids:
-            session_ids.remove(session_id)
-            await self.redis.delete(self.session_index_key, db="session")
-            for sid in session_ids:
-                await self.redis.lpush(self.session_index_key, sid, db="session")
+    def start_cleanup(self):
+        """启动后台清理任务（幂等）"""
+        if not self._cleanup_task:
+            self._cleanup_task = asyncio.create_task(self._cleanup_loop())
     
     async def _cleanup_loop(self):
         """清理循环"""
@@ -443,6 +543,17 @@ class SessionManager:
         if self._cleanup_task:
             self._cleanup_task.cancel()
         
+        if self._activity_task:
+            self._activity_task.cancel()
+            self._activity_task = None
+        await self.flush_activity()
+        
+        try:
+            await get_pubsub_dispatcher().unsubscribe(self.invalidation_channel)
+        except Exception:
+            pass
+        self._cache.clear()
+        
         logger.info("Session manager shutdown complete")
 
 
@@ -466,3 +577,9 @@ def get_session_manager() -> SessionManager:
     return session_manager
 
 
+async def close_session_manager() -> None:
+    """关闭会话管理器（写入未刷新的活动时间）"""
+    global session_manager
+    if session_manager is not None:
+        await session_manager.shutdown()
+        session_manager = None
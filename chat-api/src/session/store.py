@@ -0,0 +1,463 @@
+"""
+🗄️ 会话存储
+
+会话在 Redis 中的存储结构与原子操作
+
+- session:{session_id}        HASH  会话字段（字典字段为 JSON 字符串）
+- user_sessions:{user_id}     ZSET  用户的活跃会话，score 为过期时间戳
+- session_index               ZSET  全局活跃会话，score 为过期时间戳
+- session_expiry:{shard}      ZSET  清理调度，score 为下次可能过期的时间（空闲或绝对过期）
+
+创建、更新、关闭都由单个 Lua 脚本完成，往返次数与活跃会话数无关
+"""
+
+import json
+import time
+import zlib
+from datetime import datetime
+from enum import Enum
+from typing import Any, Dict, List, Optional, Tuple
+
+from redis.asyncio import Redis
+
+from src.models.session import Session, SessionStatus
+
+# 字典类型字段，存储为 JSON 字符串
+_JSON_FIELDS = ("context", "session_metadata")
+
+# 可为空的字段，存储为空字符串
+_NULLABLE_FIELDS = ("conversation_id", "expires_at")
+
+# 供 Lua 脚本使用的数值时间戳字段，不属于会话模型
+_INTERNAL_FIELDS = ("last_activity_ts", "expires_ts")
+
+
+# 注意：脚本会访问由参数拼出的会话/用户键，仅适用于单实例或主从 Redis
+_CREATE_SCRIPT = """
+local now = tonumber(ARGV[1])
+local max_per_user = tonumber(ARGV[2])
+local ttl = tonumber(ARGV[3])
+local prefix = ARGV[4]
+local session_id = ARGV[5]
+local expires_ts = tonumber(ARGV[6])
+local closed_at = ARGV[7]
+local due_ts = tonumber(ARGV[8])
+
+redis.call('ZREMRANGEBYSCORE', KEYS[2], '-inf', now)
+
+local evicted = {}
+local excess = redis.call('ZCARD', KEYS[2]) - max_per_user + 1
+if excess > 0 then
+    local oldest = redis.call('ZRANGE', KEYS[2], 0, excess - 1)
+    for _, sid in ipairs(oldest) do
+        local key = prefix .. sid
+        if redis.call('EXISTS', key) == 1 then
+            redis.call('HSET', key, 'status', 'closed', 'updated_at', closed_at)
+        end
+        redis.call('ZREM', KEYS[2], sid)
+        redis.call('ZREM', KEYS[3], sid)
+        table.insert(evicted, sid)
+    end
+end
+
+redis.call('HSET', KEYS[1], unpack(ARGV, 9))
+redis.call('EXPIRE', KEYS[1], ttl)
+redis.call('ZADD', KEYS[2], expires_ts, session_id)
+redis.call('EXPIRE', KEYS[2], ttl)
+redis.call('ZADD', KEYS[3], expires_ts, session_id)
+redis.call('ZADD', KEYS[4], due_ts, session_id)
+
+return {redis.call('ZCOUNT', KEYS[3], now, '+inf'), evicted}
+"""
+
+_UPDATE_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return {}
+end
+redis.call('HSET', KEYS[1], unpack(ARGV))
+return redis.call('HGETALL', KEYS[1])
+"""
+
+_CLOSE_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return -1
+end
+local user_id = redis.call('HGET', KEYS[1], 'user_id')
+if ARGV[5] == '1' then
+    redis.call('DEL', KEYS[1])
+else
+    redis.call('HSET', KEYS[1], 'status', ARGV[3], 'updated_at', ARGV[4])
+end
+if user_id then
+    redis.call('ZREM', ARGV[1] .. user_id, ARGV[2])
+end
+redis.call('ZREM', KEYS[2], ARGV[2])
+redis.call('ZREM', KEYS[3], ARGV[2])
+return redis.call('ZCOUNT', KEYS[2], ARGV[6], '+inf')
+"""
+
+# 批量记录活动时间：KEYS 按 (会话键, 调度键) 成对传入，ARGV 按 (时间戳, ISO 时间) 成对传入
+# 只更新活动时间字段并推迟调度 score，不改写会话其余字段，也不重置 TTL
+_TOUCH_SCRIPT = """
+local idle_timeout = tonumber(ARGV[1])
+local touched = 0
+for i = 1, #KEYS, 2 do
+    local session_key = KEYS[i]
+    local ts = tonumber(ARGV[i + 1])
+    local fields = redis.call('HMGET', session_key, 'status', 'last_activity_ts', 'expires_ts')
+    local status = fields[1]
+    if status and status ~= 'closed' and status ~= 'expired' and ts > (tonumber(fields[2]) or 0) then
+        redis.call('HSET', session_key, 'last_activity_ts', ARGV[i + 1], 'last_activity_at', ARGV[i + 2])
+        local next_due = ts + idle_timeout
+        local expires_ts = tonumber(fields[3])
+        if expires_ts and expires_ts < next_due then
+            next_due = expires_ts
+        end
+        local sid = string.sub(session_key, #ARGV[#ARGV] + 1)
+        redis.call('ZADD', KEYS[i + 1], 'XX', 'GT', next_due, sid)
+        touched = touched + 1
+    end
+end
+return touched
+"""
+
+# 从调度集合中取出到期条目：仍有活动的会话按最新活动时间重新调度，其余关闭并移出索引
+# 被淘汰/已关闭的会话可能仍留在调度集合中，这里一并清除
+_SWEEP_SCRIPT = """
+local now = tonumber(ARGV[1])
+local batch = tonumber(ARGV[2])
+local idle_timeout = tonumber(ARGV[3])
+local session_prefix = ARGV[4]
+local user_prefix = ARGV[5]
+local closed_at = ARGV[6]
+
+local due = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', now, 'LIMIT', 0, batch)
+local closed = {}
+for _, sid in ipairs(due) do
+    local key = session_prefix .. sid
+    local fields = redis.call('HMGET', key, 'status', 'last_activity_ts', 'expires_ts', 'user_id')
+    local status = fields[1]
+    if (not status) or status == 'closed' or status == 'expired' then
+        redis.call('ZREM', KEYS[1], sid)
+        redis.call('ZREM', KEYS[2], sid)
+    else
+        local last_activity = tonumber(fields[2]) or now
+        local expires_ts = tonumber(fields[3])
+        local next_due = last_activity + idle_timeout
+        if expires_ts and expires_ts < next_due then
+            next_due = expires_ts
+        end
+        if next_due > now then
+            redis.call('ZADD', KEYS[1], next_due, sid)
+        else
+            redis.call('HSET', key, 'status', 'closed', 'updated_at', closed_at)
+            redis.call('ZREM', KEYS[1], sid)
+            redis.call('ZREM', KEYS[2], sid)
+            if fields[4] then
+                redis.call('ZREM', user_prefix .. fields[4], sid)
+            end
+            table.insert(closed, sid)
+        end
+    end
+end
+return {#due, closed}
+"""
+
+
+def _encode_value(value: Any) -> str:
+    """编码单个字段值"""
+    if value is None:
+        return ""
+    if isinstance(value, datetime):
+        return value.isoformat()
+    if isinstance(value, Enum):
+        return str(value.value)
+    if isinstance(value, (dict, list)):
+        return json.dumps(value, ensure_ascii=False, default=str)
+    return str(value)
+
+
+def serialize_session(session: Session) -> Dict[str, str]:
+    """会话对象 -> Redis 哈希字段"""
+    return serialize_fields(session.model_dump())
+
+
+def serialize_fields(fields: Dict[str, Any]) -> Dict[str, str]:
+    """部分字段 -> Redis 哈希字段（同时写入对应的数值时间戳）"""
+    mapping = {key: _encode_value(value) for key, value in fields.items()}
+    if isinstance(fields.get("last_activity_at"), datetime):
+        mapping["last_activity_ts"] = str(fields["last_activity_at"].timestamp())
+    if "expires_at" in fields:
+        expires_at = fields["expires_at"]
+        mapping["expires_ts"] = str(expires_at.timestamp()) if isinstance(expires_at, datetime) else ""
+    return mapping
+
+
+def deserialize_session(mapping: Dict[str, str]) -> Optional[Session]:
+    """Redis 哈希字段 -> 会话对象"""
+    if not mapping:
+        return None
+
+    data: Dict[str, Any] = dict(mapping)
+    for key in _INTERNAL_FIELDS:
+        data.pop(key, None)
+    for key in _JSON_FIELDS:
+        raw = data.get(key)
+        data[key] = json.loads(raw) if raw else {}
+    for key in _NULLABLE_FIELDS:
+        if not data.get(key):
+            data[key] = None
+
+    return Session(**data)
+
+
+def _flat_to_dict(flat: List[str]) -> Dict[str, str]:
+    """HGETALL 的扁平返回值 -> 字典"""
+    return dict(zip(flat[::2], flat[1::2]))
+
+
+class SessionStore:
+    """基于 Redis 哈希 + 有序集合的会话存储"""
+
+    def __init__(
+        self,
+        client: Redis,
+        session_prefix: str = "session:",
+        user_sessions_prefix: str = "user_sessions:",
+        session_index_key: str = "session_index",
+        expiry_prefix: str = "session_expiry:",
+        shards: int = 16,
+        idle_timeout: int = 1800
+    ):
+        self.client = client
+        self.session_prefix = session_prefix
+        self.user_sessions_prefix = user_sessions_prefix
+        self.session_index_key = session_index_key
+        self.expiry_prefix = expiry_prefix
+        self.shards = max(1, shards)
+        self.idle_timeout = idle_timeout
+
+        self._create_script = client.register_script(_CREATE_SCRIPT)
+        self._update_script = client.register_script(_UPDATE_SCRIPT)
+        self._close_script = client.register_script(_CLOSE_SCRIPT)
+        self._sweep_script = client.register_script(_SWEEP_SCRIPT)
+        self._touch_script = client.register_script(_TOUCH_SCRIPT)
+
+    # ==========================================
+    # 🔑 键
+    # ==========================================
+
+    def session_key(self, session_id: str) -> str:
+        return f"{self.session_prefix}{session_id}"
+
+    def user_sessions_key(self, user_id: str) -> str:
+        return f"{self.user_sessions_prefix}{user_id}"
+
+    def shard_of(self, session_id: str) -> int:
+        return zlib.crc32(session_id.encode("utf-8")) % self.shards
+
+    def expiry_key(self, shard: int) -> str:
+        return f"{self.expiry_prefix}{shard}"
+
+    # ==========================================
+    # 📝 写操作
+    # ==========================================
+
+    async def create(self, session: Session, max_per_user: int, ttl: int) -> Tuple[int, List[str]]:
+        """
+        原子创建会话（单次往返）
+
+        写入会话哈希和两个索引，并关闭该用户超出上限的最旧会话
+
+        Returns:
+            (活跃会话数, 被关闭的会话ID列表)
+        """
+        now = time.time()
+        expires_ts = session.expires_at.timestamp() if session.expires_at else now + ttl
+        due_ts = min(session.last_activity_at.timestamp() + self.idle_timeout, expires_ts)
+
+        mapping = serialize_session(session)
+        field_args: List[str] = []
+        for key, value in mapping.items():
+            field_args.extend((key, value))
+
+        active_count, evicted = await self._create_script(
+            keys=[
+                self.session_key(session.session_id),
+                self.user_sessions_key(session.user_id),
+                self.session_index_key,
+                self.expiry_key(self.shard_of(session.session_id)),
+            ],
+            args=[
+                now,
+                max_per_user,
+                ttl,
+                self.session_prefix,
+                session.session_id,
+                expires_ts,
+                datetime.now().isoformat(),
+                due_ts,
+                *field_args,
+            ],
+        )
+        return int(active_count), list(evicted or [])
+
+    async def update(self, session_id: str, fields: Dict[str, Any]) -> Optional[Session]:
+        """
+        原子更新部分字段并返回更新后的会话（单次往返）
+
+        Returns:
+            更新后的会话，会话不存在时返回 None
+        """
+        field_args: List[str] = []
+        for key, value in serialize_fields(fields).items():
+            field_args.extend((key, value))
+
+        flat = await self._update_script(keys=[self.session_key(session_id)], args=field_args)
+        return deserialize_session(_flat_to_dict(flat)) if flat else None
+
+    async def close(self, session_id: str, status: SessionStatus = SessionStatus.CLOSED) -> Optional[int]:
+        """
+        原子关闭会话并从索引中移除（单次往返）
+
+        Returns:
+            关闭后的活跃会话数，会话不存在时返回 None
+        """
+        return await self._remove(session_id, status=status, delete=False)
+
+    async def delete(self, session_id: str) -> Optional[int]:
+        """原子删除会话并从索引中移除（单次往返）"""
+        return await self._remove(session_id, status=SessionStatus.CLOSED, delete=True)
+
+    async def _remove(self, session_id: str, status: SessionStatus, delete: bool) -> Optional[int]:
+        result = await self._close_script(
+            keys=[
+                self.session_key(session_id),
+                self.session_index_key,
+                self.expiry_key(self.shard_of(session_id)),
+            ],
+            args=[
+                self.user_sessions_prefix,
+                session_id,
+                status.value,
+                datetime.now().isoformat(),
+                "1" if delete else "0",
+                time.time(),
+            ],
+        )
+        result = int(result)
+        return None if result < 0 else result
+
+    async def touch_many(self, activity: Dict[str, float], chunk_size: int = 500) -> int:
+        """
+        批量记录会话活动时间（每批一次往返）
+
+        Args:
+            activity: 会话ID -> 最后活动时间戳
+            chunk_size: 每次脚本调用处理的会话数，避免单个脚本阻塞 Redis 过久
+
+        Returns:
+            实际更新的会话数
+        """
+        items = list(activity.items())
+        touched = 0
+
+        for start in range(0, len(items), chunk_size):
+            keys: List[str] = []
+            args: List[Any] = [self.idle_timeout]
+            for session_id, ts in items[start:start + chunk_size]:
+                keys.extend((self.session_key(session_id), self.expiry_key(self.shard_of(session_id))))
+                args.extend((ts, datetime.fromtimestamp(ts).isoformat()))
+            args.append(self.session_prefix)
+
+            touched += int(await self._touch_script(keys=keys, args=args))
+
+        return touched
+
+    async def sweep_shard(self, shard: int, batch_size: int) -> Tuple[int, List[str]]:
+        """
+        处理一个分片中已到期的一批调度条目
+
+        Returns:
+            (处理的条目数, 被关闭的会话ID列表)
+        """
+        processed, closed = await self._sweep_script(
+            keys=[self.expiry_key(shard), self.session_index_key],
+            args=[
+                time.time(),
+                batch_size,
+                self.idle_timeout,
+                self.session_prefix,
+                self.user_sessions_prefix,
+                datetime.now().isoformat(),
+            ],
+        )
+        return int(processed), list(closed or [])
+
+    async def schedule(self, session_ids: List[str], due_ts: Optional[float] = None):
+        """将会话加入清理调度（已在调度中的保持原 score）"""
+        due_ts = time.time() if due_ts is None else due_ts
+        pipe = self.client.pipeline(transaction=False)
+        for session_id in session_ids:
+            pipe.zadd(self.expiry_key(self.shard_of(session_id)), {session_id: due_ts}, nx=True)
+        await pipe.execute()
+
+    # ==========================================
+    # 🔍 读操作
+    # ==========================================
+
+    async def get(self, session_id: str) -> Optional[Session]:
+        """读取会话（单次往返）"""
+        return deserialize_session(await self.client.hgetall(self.session_key(session_id)))
+
+    async def get_user_sessions(self, user_id: str) -> List[Session]:
+        """读取用户的活跃会话（两次往返，与会话数无关）"""
+        session_ids = await self.client.zrangebyscore(
+            self.user_sessions_key(user_id), time.time(), "+inf"
+        )
+        if not session_ids:
+            return []
+
+        pipe = self.client.pipeline(transaction=False)
+        for session_id in session_ids:
+            pipe.hgetall(self.session_key(session_id))
+        results = await pipe.execute()
+
+        return [session for session in map(deserialize_session, results) if session]
+
+    async def count_active(self) -> int:
+        """活跃会话数（O(log N)）"""
+        return await self.client.zcount(self.session_index_key, time.time(), "+inf")
+
+    # ==========================================
+    # 🔧 存储结构检查
+    # ==========================================
+
+    async def find_legacy_keys(self, sample: int = 100) -> List[str]:
+        """
+        抽样查找旧版存储结构的键（列表索引 / JSON 字符串会话）
+
+        Args:
+            sample: 每种键前缀抽样扫描的数量
+
+        Returns:
+            需要迁移的键（抽样结果，不保证完整）
+        """
+        legacy: List[str] = []
+        if await self.client.type(self.session_index_key) == "list":
+            legacy.append(self.session_index_key)
+
+        for pattern, legacy_type in (
+            (f"{self.user_sessions_prefix}*", "list"),
+            (f"{self.session_prefix}*", "string"),
+        ):
+            _, keys = await self.client.scan(0, match=pattern, count=sample)
+            if not keys:
+                continue
+            pipe = self.client.pipeline(transaction=False)
+            for key in keys:
+                pipe.type(key)
+            types = await pipe.execute()
+            legacy.extend(key for key, key_type in zip(keys, types) if key_type == legacy_type)
+
+        return legacy
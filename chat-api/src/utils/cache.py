@@ -0,0 +1,99 @@
+"""
+🧊 进程内缓存
+
+有容量上限的 LRU + TTL 缓存，用于热点数据的本地一级缓存
+所有操作为 O(1)，仅在事件循环线程中使用，不加锁
+"""
+
+import time
+from collections import OrderedDict
+from typing import Generic, Hashable, Optional, Tuple, TypeVar
+
+from src.utils.metrics import metrics
+
+V = TypeVar("V")
+
+
+class TTLCache(Generic[V]):
+    """有容量上限的 LRU + TTL 缓存"""
+
+    def __init__(self, name: str, maxsize: int, ttl: float):
+        """
+        Args:
+            name: 缓存名称（用于指标标签）
+            maxsize: 最大条目数，超出时淘汰最久未使用的条目
+            ttl: 默认存活时间（秒）
+        """
+        self.name = name
+        self.maxsize = max(0, maxsize)
+        self.ttl = ttl
+        self._data: "OrderedDict[Hashable, Tuple[float, V]]" = OrderedDict()
+
+    def __len__(self) -> int:
+        return len(self._data)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return self.get(key, record=False) is not None
+
+    def get(self, key: Hashable, record: bool = True) -> Optional[V]:
+        """
+        读取缓存
+
+        Args:
+            key: 键
+            record: 是否记录命中率指标
+
+        Returns:
+            缓存值，不存在或已过期时返回 None
+        """
+        entry = self._data.get(key)
+        if entry is not None:
+            expires_at, value = entry
+            if expires_at > time.monotonic():
+                self._data.move_to_end(key)
+                if record:
+                    metrics.record_cache_lookup(self.name, True)
+                return value
+            del self._data[key]
+
+        if record:
+            metrics.record_cache_lookup(self.name, False)
+        return None
+
+    def set(self, key: Hashable, value: V, ttl: Optional[float] = None):
+        """
+        写入缓存
+
+        Args:
+            key: 键
+            value: 值
+            ttl: 存活时间（秒），默认使用缓存的 TTL
+        """
+        if self.maxsize == 0:
+            return
+
+        ttl = self.ttl if ttl is None else ttl
+        if ttl <= 0:
+            self._data.pop(key, None)
+            return
+
+        self._data[key] = (time.monotonic() + ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+
+    def pop(self, key: Hashable) -> Optional[V]:
+        """移除并返回缓存值"""
+        entry = self._data.pop(key, None)
+        return entry[1] if entry else None
+
+    def peek(self, key: Hashable) -> Optional[V]:
+        """读取缓存但不更新 LRU 顺序、不记录指标"""
+        entry = self._data.get(key)
+        if entry is None or entry[0] <= time.monotonic():
+            return None
+        return entry[1]
+
+    def clear(self):
+        """清空缓存"""
+        self._data.clear()
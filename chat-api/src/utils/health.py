@@ -107,22 +107,39 @@ async def _check_ai_services() -> Dict[str, Any]:
     try:
         # 这里可以添加AI服务的健康检查
         # 目前返回基本状态
-        ai_status = {
-            "status": "healthy",
-            "dashscope": {
-                "configured": bool(settings.DASHSCOPE_API_KEY),
-                "status": "available" if settings.DASHSCOPE_API_KEY else "not_configured"
-            },
-            "openai": {
-                "configured": bool(settings.OPENAI_API_KEY),
-                "status": "available" if settings.OPENAI_API_KEY else "not_configured"
-            }
+        from src.ai.breaker import circuit_breakers
+        
+        circuits = circuit_breakers.get_states()
+        configured = {
+            "dashscope": bool(settings.DASHSCOPE_API_KEY),
+            "openai": bool(settings.OPENAI_API_KEY),
         }
         
-        # 如果没有配置任何AI服务，标记为不健康
-        if not settings.DASHSCOPE_API_KEY and not settings.OPENAI_API_KEY:
+        ai_status = {"status": "healthy"}
+        for provider, is_configured in configured.items():
+            circuit = circuits.get(provider, {"state": "closed", "opened_until": None})
+            if not is_configured:
+                provider_status = "not_configured"
+            elif circuit["state"] == "closed":
+                provider_status = "available"
+            else:
+                provider_status = "circuit_open"
+            ai_status[provider] = {
+                "configured": is_configured,
+                "status": provider_status,
+                "circuit": circuit,
+            }
+        
+        # 如果没有配置任何AI服务，或所有已配置的服务都已熔断，标记为不健康
+        if not any(configured.values()):
             ai_status["status"] = "unhealthy"
             ai_status["error"] = "No AI services configured"
+        elif all(
+            ai_status[provider]["status"] == "circuit_open"
+            for provider, is_configured in configured.items() if is_configured
+        ):
+            ai_status["status"] = "unhealthy"
+            ai_status["error"] = "All AI service circuits are open"
         
         return ai_status
         
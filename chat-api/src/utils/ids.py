@@ -0,0 +1,200 @@
+"""
+🆔 分布式ID生成
+
+消息在写入数据库之前就需要ID（推送给前端、写入上下文窗口、批量写入时去重），
+这里使用雪花算法在进程内生成递增ID，不依赖数据库自增
+- 布局: 41 位毫秒时间戳 + 6 位 worker + 6 位序列，共 53 位，
+  保持在 JavaScript 安全整数范围内，前端按数字处理不会丢失精度
+- worker 编号: 配置固定值，或启动时通过 Redis 租约自动分配并定期续约；
+  没有有效租约时不启用批量写入（同步写入遇到主键冲突会直接报错）
+"""
+
+import asyncio
+import secrets
+import threading
+import time
+from typing import Optional
+
+from loguru import logger
+
+from src.config.settings import get_settings
+
+settings = get_settings()
+
+# 2024-01-01 00:00:00 UTC
+EPOCH_MS = 1704067200000
+
+WORKER_BITS = 6
+SEQUENCE_BITS = 6
+MAX_WORKER_ID = (1 << WORKER_BITS) - 1
+MAX_SEQUENCE = (1 << SEQUENCE_BITS) - 1
+
+
+class SnowflakeGenerator:
+    """雪花ID生成器"""
+
+    def __init__(self, worker_id: int = 0):
+        self._lock = threading.Lock()
+        self._last_ms = -1
+        self._sequence = 0
+        self._rolled_back = False
+        self.worker_id = 0
+        self.set_worker_id(worker_id)
+
+    def set_worker_id(self, worker_id: int):
+        if not 0 <= worker_id <= MAX_WORKER_ID:
+            raise ValueError(f"worker_id must be between 0 and {MAX_WORKER_ID}")
+        with self._lock:
+            self.worker_id = worker_id
+
+    def next_id(self) -> int:
+        """生成下一个ID"""
+        with self._lock:
+            now = int(time.time() * 1000)
+            rolled_back = now < self._last_ms
+            if rolled_back:
+                # 时钟回拨时沿用上次的时间戳
+                if not self._rolled_back:
+                    logger.warning(f"Clock moved backwards by {self._last_ms - now} ms, continuing from last timestamp")
+                now = self._last_ms
+            self._rolled_back = rolled_back
+
+            if now == self._last_ms:
+                self._sequence = (self._sequence + 1) & MAX_SEQUENCE
+                if self._sequence == 0:
+                    if rolled_back:
+                        # 回拨期间不等待真实时钟（可能长达数秒，且持有锁），逻辑上推进一毫秒
+                        now = self._last_ms + 1
+                    else:
+                        while now <= self._last_ms:
+                            time.sleep(0.0001)
+                            now = int(time.time() * 1000)
+            else:
+                self._sequence = 0
+
+            self._last_ms = now
+            return ((now - EPOCH_MS) << (WORKER_BITS + SEQUENCE_BITS)) | (self.worker_id << SEQUENCE_BITS) | self._sequence
+
+    @staticmethod
+    def timestamp(snowflake_id: int) -> float:
+        """从ID中解析生成时间（秒）"""
+        return ((snowflake_id >> (WORKER_BITS + SEQUENCE_BITS)) + EPOCH_MS) / 1000
+
+
+class WorkerIdLease:
+    """
+    通过 Redis 租约为当前进程分配 worker 编号
+
+    租约只由持有者续期和释放（token 校验），续期时发现被其他进程占用或已过期则重新申请；
+    申请不到时 valid 为 False，依赖ID唯一性的批量写入不再接收消息
+    """
+
+    def __init__(self, generator: SnowflakeGenerator, prefix: str = "snowflake_worker:", ttl: int = 60):
+        self.generator = generator
+        self.prefix = prefix
+        self.ttl = ttl
+        self._fixed = False
+        self._lock = None
+        self._worker_id: Optional[int] = None
+        self._expires_at = 0.0
+        self._task: Optional[asyncio.Task] = None
+
+    @property
+    def redis(self):
+        from src.core.redis import get_redis_manager
+        return get_redis_manager().client
+
+    @property
+    def valid(self) -> bool:
+        """当前 worker 编号是否唯一（固定配置，或租约仍在有效期内）"""
+        if self._fixed:
+            return True
+        return self._lock is not None and time.monotonic() < self._expires_at
+
+    async def start(self):
+        """分配 worker 编号并开始续约"""
+        if settings.SNOWFLAKE_WORKER_ID >= 0:
+            self.generator.set_worker_id(settings.SNOWFLAKE_WORKER_ID)
+            self._fixed = True
+            return
+
+        if not await self._acquire():
+            logger.warning(
+                f"⚠️ No snowflake worker id leased, using random worker id {self.generator.worker_id} "
+                f"until a lease is acquired"
+            )
+        self._task = asyncio.create_task(self._renew_loop())
+
+    async def _acquire(self) -> bool:
+        """申请一个空闲的 worker 编号"""
+        from src.core.redis import RedisLock
+
+        try:
+            for worker_id in range(MAX_WORKER_ID + 1):
+                lock = RedisLock(self.redis, f"{self.prefix}{worker_id}", self.ttl * 1000)
+                started = time.monotonic()
+                if await lock.acquire():
+                    self._lock = lock
+                    self._worker_id = worker_id
+                    self._expires_at = started + self.ttl
+                    self.generator.set_worker_id(worker_id)
+                    logger.info(f"Snowflake worker id {worker_id} leased")
+                    return True
+        except Exception as e:
+            logger.warning(f"Failed to lease snowflake worker id: {e}")
+        return False
+
+    async def _renew(self):
+        """续约；租约丢失时改用新的编号，申请不到则换成随机编号并保持无效状态"""
+        if self._lock is not None:
+            started = time.monotonic()
+            try:
+                if await self._lock.extend():
+                    self._expires_at = started + self.ttl
+                    return
+            except Exception as e:
+                # Redis 暂时不可用，租约到期前仍然有效
+                logger.warning(f"Failed to renew snowflake worker id lease: {e}")
+                return
+
+            logger.error(f"Snowflake worker id {self._worker_id} lease was lost, leasing a new one")
+            self._lock = None
+            self._worker_id = None
+            self.generator.set_worker_id(_random_worker_id())
+
+        await self._acquire()
+
+    async def _renew_loop(self):
+        while True:
+            await asyncio.sleep(self.ttl / 3)
+            await self._renew()
+
+    async def stop(self):
+        """停止续约并释放租约"""
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+        if self._lock is not None:
+            try:
+                await self._lock.release()
+            except Exception as e:
+                logger.warning(f"Failed to release snowflake worker id lease: {e}")
+            self._lock = None
+            self._worker_id = None
+
+
+def _random_worker_id() -> int:
+    # 未取得租约时使用随机编号，避免容器内进程号相同（如都为 1）的 worker 全部落在同一编号
+    return secrets.randbelow(MAX_WORKER_ID + 1)
+
+
+# 全局ID生成器
+id_generator = SnowflakeGenerator(_random_worker_id())
+worker_id_lease = WorkerIdLease(id_generator)
+
+
+def next_id() -> int:
+    """生成下一个ID"""
+    return id_generator.next_id()
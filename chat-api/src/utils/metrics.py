@@ -78,6 +78,94 @@ class MetricsCollector:
             registry=self.registry
         )
         
+        self.ai_http_requests_total = Counter(
+            'ai_http_requests_total',
+            'HTTP requests sent to AI providers',
+            ['service'],
+            registry=self.registry
+        )
+        
+        self.ai_http_connections_opened_total = Counter(
+            'ai_http_connections_opened_total',
+            'New connections (TCP) and TLS handshakes to AI providers',
+            ['service', 'kind'],
+            registry=self.registry
+        )
+        
+        self.ai_http_pool_connections = Gauge(
+            'ai_http_pool_connections',
+            'AI provider connection pool connections',
+            ['service', 'state'],
+            registry=self.registry
+        )
+        
+        self.ai_http_pool_utilization = Gauge(
+            'ai_http_pool_utilization',
+            'Active connections divided by the AI provider pool limit',
+            ['service'],
+            registry=self.registry
+        )
+        
+        self.ai_http_pool_timeouts_total = Counter(
+            'ai_http_pool_timeouts_total',
+            'Requests that timed out waiting for a pooled AI provider connection',
+            ['service'],
+            registry=self.registry
+        )
+        
+        self.ai_hedge_requests_total = Counter(
+            'ai_hedge_requests_total',
+            'Hedged AI requests launched and won per provider',
+            ['service', 'result'],
+            registry=self.registry
+        )
+        
+        self.ai_circuit_state = Gauge(
+            'ai_circuit_state',
+            'AI provider circuit breaker state (0=closed, 1=half_open, 2=open)',
+            ['service'],
+            registry=self.registry
+        )
+        
+        self.ai_circuit_transitions_total = Counter(
+            'ai_circuit_transitions_total',
+            'AI provider circuit breaker state transitions',
+            ['service', 'state'],
+            registry=self.registry
+        )
+        
+        self.ai_singleflight_requests_total = Counter(
+            'ai_singleflight_requests_total',
+            'AI completions that started an upstream request (leader) or joined one in flight (follower)',
+            ['role'],
+            registry=self.registry
+        )
+        
+        self.ai_queue_depth = Gauge(
+            'ai_queue_depth',
+            'AI reply jobs waiting in the queue',
+            registry=self.registry
+        )
+        
+        self.ai_queue_active_jobs = Gauge(
+            'ai_queue_active_jobs',
+            'AI reply jobs currently being processed by workers',
+            registry=self.registry
+        )
+        
+        self.ai_queue_wait_seconds = Histogram(
+            'ai_queue_wait_seconds',
+            'Time AI reply jobs spent waiting in the queue',
+            buckets=[0.01, 0.05, 0.1, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0],
+            registry=self.registry
+        )
+        
+        self.ai_queue_rejected_total = Counter(
+            'ai_queue_rejected_total',
+            'AI reply jobs rejected because the queue was full',
+            registry=self.registry
+        )
+        
         # 数据库指标
         self.database_connections = Gauge(
             'database_connections',
@@ -92,6 +180,25 @@ class MetricsCollector:
             registry=self.registry
         )
         
+        self.message_flush_rows = Histogram(
+            'message_flush_rows',
+            'Messages written per batched insert',
+            buckets=[1, 2, 5, 10, 25, 50, 100, 200, 500],
+            registry=self.registry
+        )
+        
+        self.message_flush_duration_seconds = Histogram(
+            'message_flush_duration_seconds',
+            'Duration of batched message inserts in seconds',
+            registry=self.registry
+        )
+        
+        self.message_dead_letters_total = Counter(
+            'message_dead_letters_total',
+            'Buffered messages that could not be written and were moved to the dead letter stream',
+            registry=self.registry
+        )
+        
         # Redis指标
         self.redis_operations_total = Counter(
             'redis_operations_total',
@@ -113,6 +220,44 @@ class MetricsCollector:
             ['direction', 'type'],
             registry=self.registry
         )
+        
+        self.websocket_send_queue_depth = Gauge(
+            'websocket_send_queue_depth',
+            'Outbound WebSocket queue depth across connections',
+            ['stat'],
+            registry=self.registry
+        )
+        
+        self.websocket_frames_dropped_total = Counter(
+            'websocket_frames_dropped_total',
+            'Outbound WebSocket frames dropped by the overflow policy',
+            ['type', 'reason'],
+            registry=self.registry
+        )
+        
+        self.websocket_slow_consumers_total = Counter(
+            'websocket_slow_consumers_total',
+            'WebSocket connections closed because their outbound queue stayed full',
+            registry=self.registry
+        )
+        
+        # 进程内缓存指标
+        self.cache_lookups_total = Counter(
+            'cache_lookups_total',
+            'In-process cache lookups',
+            ['cache', 'result'],
+            registry=self.registry
+        )
+        
+        self.cache_hit_ratio = Gauge(
+            'cache_hit_ratio',
+            'In-process cache hit ratio since startup',
+            ['cache'],
+            registry=self.registry
+        )
+        
+        # 各缓存的 [命中数, 查询数]
+        self._cache_stats: Dict[str, list] = {}
     
     def record_http_request(
         self, 
@@ -160,6 +305,82 @@ class MetricsCollector:
             service=service
         ).observe(duration)
     
+    def record_ai_http_request(self, service: str):
+        """记录发往AI服务的HTTP请求"""
+        if not PROMETHEUS_AVAILABLE:
+            return
+        
+        self.ai_http_requests_total.labels(service=service).inc()
+    
+    def record_ai_connection_opened(self, service: str, kind: str):
+        """记录AI服务新建连接（tcp）或TLS握手（tls）"""
+        if not PROMETHEUS_AVAILABLE:
+            return
+        
+        self.ai_http_connections_opened_total.labels(service=service, kind=kind).inc()
+    
+    def set_ai_pool_stats(self, service: str, active: int, idle: int, utilization: float):
+        """设置AI服务连接池状态"""
+        if not PROMETHEUS_AVAILABLE:
+            return
+        
+        self.ai_http_pool_connections.labels(service=service, state="active").set(active)
+        self.ai_http_pool_connections.labels(service=service, state="idle").set(idle)
+        self.ai_http_pool_utilization.labels(service=service).set(utilization)
+    
+    def record_ai_pool_timeout(self, service: str):
+        """记录等待AI服务连接池超时"""
+        if not PROMETHEUS_AVAILABLE:
+            return
+        
+        self.ai_http_pool_timeouts_total.labels(service=service).inc()
+    
+    def record_ai_hedge(self, service: str, result: str):
+        """记录对冲请求（launched / won）"""
+        if not PROMETHEUS_AVAILABLE:
+            return
+        
+        self.ai_hedge_requests_total.labels(service=service, result=result).inc()
+    
+    def set_ai_circuit_state(self, service: str, state: str, transition: bool = True):
+        """设置AI服务熔断状态（transition 为 True 时同时计入状态转换次数）"""
+        if not PROMETHEUS_AVAILABLE:
+            return
+        
+        value = {"closed": 0, "half_open": 1, "open": 2}.get(state, 0)
+        self.ai_circuit_state.labels(service=service).set(value)
+        if transition:
+            self.ai_circuit_transitions_total.labels(service=service, state=state).inc()
+    
+    def record_ai_singleflight(self, role: str):
+        """记录请求合并（leader / follower）"""
+        if not PROMETHEUS_AVAILABLE:
+            return
+        
+        self.ai_singleflight_requests_total.labels(role=role).inc()
+    
+    def set_ai_queue_stats(self, depth: int, active: int):
+        """设置AI回复队列长度与进行中的任务数"""
+        if not PROMETHEUS_AVAILABLE:
+            return
+        
+        self.ai_queue_depth.set(depth)
+        self.ai_queue_active_jobs.set(active)
+    
+    def record_ai_queue_wait(self, wait_time: float):
+        """记录AI回复任务排队时间"""
+        if not PROMETHEUS_AVAILABLE:
+            return
+        
+        self.ai_queue_wait_seconds.observe(wait_time)
+    
+    def record_ai_queue_rejected(self):
+        """记录因队列已满被拒绝的AI回复任务"""
+        if not PROMETHEUS_AVAILABLE:
+            return
+        
+        self.ai_queue_rejected_total.inc()
+    
     def set_active_sessions(self, count: int):
         """设置活跃会话数"""
         if not PROMETHEUS_AVAILABLE:
@@ -174,6 +395,21 @@ class MetricsCollector:
         
         self.database_query_duration_seconds.observe(duration)
     
+    def record_message_flush(self, rows: int, duration: float):
+        """记录一次批量消息写入"""
+        if not PROMETHEUS_AVAILABLE:
+            return
+        
+        self.message_flush_rows.observe(rows)
+        self.message_flush_duration_seconds.observe(duration)
+    
+    def record_message_dead_letter(self):
+        """记录转入死信流的消息"""
+        if not PROMETHEUS_AVAILABLE:
+            return
+        
+        self.message_dead_letters_total.inc()
+    
     def set_database_connections(self, state: str, count: int):
         """设置数据库连接数"""
         if not PROMETHEUS_AVAILABLE:
@@ -198,7 +434,7 @@ class MetricsCollector:
         
         self.websocket_connections.set(count)
     
-    def record_websocket_message(self, direction: str, message_type: str):
+    def record_websocket_message(self, direction: str, message_type: str, count: int = 1):
         """记录WebSocket消息指标"""
         if not PROMETHEUS_AVAILABLE:
             return
@@ -206,7 +442,47 @@ class MetricsCollector:
         self.websocket_messages_total.labels(
             direction=direction,
             type=message_type
+        ).inc(count)
+    
+    def set_websocket_queue_depth(self, total: int, max_depth: int):
+        """设置WebSocket出站队列深度"""
+        if not PROMETHEUS_AVAILABLE:
+            return
+        
+        self.websocket_send_queue_depth.labels(stat="total").set(total)
+        self.websocket_send_queue_depth.labels(stat="max").set(max_depth)
+    
+    def record_websocket_frame_dropped(self, message_type: str, reason: str):
+        """记录被溢出策略丢弃的WebSocket帧"""
+        if not PROMETHEUS_AVAILABLE:
+            return
+        
+        self.websocket_frames_dropped_total.labels(
+            type=message_type,
+            reason=reason
+        ).inc()
+    
+    def record_websocket_slow_consumer(self):
+        """记录因队列持续满载而断开的慢连接"""
+        if not PROMETHEUS_AVAILABLE:
+            return
+        
+        self.websocket_slow_consumers_total.inc()
+    
+    def record_cache_lookup(self, cache: str, hit: bool):
+        """记录进程内缓存查询并更新命中率"""
+        if not PROMETHEUS_AVAILABLE:
+            return
+        
+        self.cache_lookups_total.labels(
+            cache=cache,
+            result="hit" if hit else "miss"
         ).inc()
+        
+        stats = self._cache_stats.setdefault(cache, [0, 0])
+        stats[0] += int(hit)
+        stats[1] += 1
+        self.cache_hit_ratio.labels(cache=cache).set(stats[0] / stats[1])
     
     def generate_metrics(self) -> str:
         """生成指标数据"""
@@ -268,8 +544,15 @@ async def _update_realtime_metrics():
         # 更新活跃会话数（这里需要实际的会话管理器）
         # metrics.set_active_sessions(session_manager.get_active_count())
         
-        # 更新WebSocket连接数（这里需要实际的WebSocket管理器）
-        # metrics.set_websocket_connections(websocket_manager.get_connection_count())
+        # 更新WebSocket连接数和出站队列深度
+        from src.websocket.manager import websocket_manager
+        metrics.set_websocket_connections(websocket_manager.get_connection_count())
+        queue_stats = websocket_manager.get_queue_stats()
+        metrics.set_websocket_queue_depth(queue_stats["total"], queue_stats["max"])
+        
+        # 更新AI连接池指标
+        from src.ai.client import export_ai_transport_metrics
+        export_ai_transport_metrics()
         
     except Exception as e:
         logger.warning(f"Failed to update realtime metrics: {e}")
@@ -0,0 +1,205 @@
+"""
+📑 游标分页
+
+OFFSET 分页需要扫描并丢弃前面所有行，COUNT(*) 需要扫描全部匹配行，两者都随表增长线性变慢
+这里按 (排序列, id) 做键集分页：
+- 游标是不透明的 base64 字符串，记录上一页最后一行的 (排序值, id)
+- 下一页条件等价于 (col, id) < (v, i)，配合 (…, col, id) 复合索引只读取需要的行
+- 多取一行判断是否有下一页，不需要总数
+- 总数可选: exact 精确计数；estimate 使用缓存的计数（过期后重新计数）；none 不计数
+"""
+
+import base64
+import json
+from datetime import datetime
+from typing import Any, Hashable, List, Optional, Tuple
+
+from sqlalchemy import func, or_, select
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.sql import Select
+
+from src.config.settings import get_settings
+from src.core.exceptions import ValidationException
+from src.models.base import PaginationResponse
+from src.utils.cache import TTLCache
+
+settings = get_settings()
+
+COUNT_EXACT = "exact"
+COUNT_ESTIMATE = "estimate"
+COUNT_NONE = "none"
+COUNT_MODES = (COUNT_EXACT, COUNT_ESTIMATE, COUNT_NONE)
+
+# 列表总数的本地缓存（按查询名称与过滤条件区分）
+count_cache: TTLCache[int] = TTLCache("pagination_count", 1000, settings.PAGINATION_COUNT_CACHE_TTL)
+
+
+def encode_cursor(value: Any, row_id: int) -> str:
+    """把 (排序值, id) 编码为游标"""
+    if isinstance(value, datetime):
+        value = {"dt": value.isoformat()}
+    elif hasattr(value, "value"):
+        value = value.value
+    raw = json.dumps([value, row_id], separators=(",", ":"))
+    return base64.urlsafe_b64encode(raw.encode("utf-8")).decode("ascii").rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[Any, int]:
+    """解析游标"""
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        value, row_id = json.loads(raw)
+        if isinstance(value, dict):
+            value = datetime.fromisoformat(value["dt"])
+        return value, int(row_id)
+    except (ValueError, TypeError, KeyError) as e:
+        raise ValidationException("无效的分页游标", details={"cursor": cursor}) from e
+
+
+async def count_rows(
+    db: AsyncSession,
+    stmt: Select,
+    mode: str = COUNT_ESTIMATE,
+    cache_key: Hashable = None
+) -> Optional[int]:
+    """
+    统计查询的总行数
+
+    Args:
+        db: 数据库会话
+        stmt: 未排序、未分页的查询
+        mode: 计数方式
+        cache_key: estimate 模式下的缓存键（不提供时按精确计数处理）
+    """
+    if mode not in COUNT_MODES:
+        raise ValidationException(f"count 参数必须是 {', '.join(COUNT_MODES)} 之一")
+    if mode == COUNT_NONE:
+        return None
+
+    if mode == COUNT_ESTIMATE and cache_key is not None:
+        total = count_cache.get(cache_key)
+        if total is not None:
+            return total
+
+    count_stmt = select(func.count()).select_from(stmt.order_by(None).subquery())
+    total = (await db.execute(count_stmt)).scalar() or 0
+    if cache_key is not None:
+        count_cache.set(cache_key, total)
+    return total
+
+
+def keyset_statement(
+    stmt: Select,
+    order_column,
+    id_column,
+    size: int,
+    after: Optional[Tuple[Any, int]] = None,
+    descending: bool = True
+) -> Select:
+    """
+    构建一页的键集查询
+
+    翻页条件写成 col <= v AND (col < v OR id < i)：第一项是 (…, col, id) 索引上的范围条件，
+    第二项只在范围内过滤，MySQL 与 SQLite 都能走索引而不退化为 OR 合并
+
+    Args:
+        stmt: 已应用过滤条件、未排序的查询
+        order_column: 排序列
+        id_column: 主键列
+        size: 每页数量（实际多取一行）
+        after: 上一页最后一行的 (排序值, id)
+        descending: 是否倒序
+    """
+    if after is not None:
+        value, row_id = after
+        if descending:
+            stmt = stmt.where(order_column <= value, or_(order_column < value, id_column < row_id))
+        else:
+            stmt = stmt.where(order_column >= value, or_(order_column > value, id_column > row_id))
+
+    if descending:
+        stmt = stmt.order_by(order_column.desc(), id_column.desc())
+    else:
+        stmt = stmt.order_by(order_column.asc(), id_column.asc())
+
+    # 多取一行判断是否还有下一页
+    return stmt.limit(size + 1)
+
+
+async def paginate_keyset(
+    db: AsyncSession,
+    stmt: Select,
+    order_column,
+    id_column,
+    size: int,
+    cursor: Optional[str] = None,
+    descending: bool = True,
+    count: str = COUNT_ESTIMATE,
+    cache_key: Hashable = None
+) -> Tuple[List[Any], PaginationResponse]:
+    """
+    按 (order_column, id_column) 游标分页
+
+    Args:
+        db: 数据库会话
+        stmt: 已应用过滤条件、未排序的查询
+        order_column: 排序列（例如 created_at）
+        id_column: 主键列，排序值相同时作为次序
+        size: 每页数量
+        cursor: 上一页返回的 next_cursor，不提供时返回第一页
+        descending: 是否倒序
+        count: 总数计算方式
+        cache_key: 总数缓存键
+
+    Returns:
+        (当前页的行, 分页信息)
+    """
+    total = await count_rows(db, stmt, count, cache_key)
+
+    after = decode_cursor(cursor) if cursor else None
+    page_stmt = keyset_statement(stmt, order_column, id_column, size, after, descending)
+
+    rows = list((await db.execute(page_stmt)).scalars().all())
+    has_next = len(rows) > size
+    rows = rows[:size]
+
+    next_cursor = None
+    if has_next and rows:
+        last = rows[-1]
+        next_cursor = encode_cursor(getattr(last, order_column.key), getattr(last, id_column.key))
+
+    pagination = PaginationResponse.create_cursor(
+        size=size,
+        next_cursor=next_cursor,
+        has_prev=bool(cursor),
+        total=total,
+        estimated=count == COUNT_ESTIMATE and total is not None
+    )
+    return rows, pagination
+
+
+async def paginate_offset(
+    db: AsyncSession,
+    stmt: Select,
+    page: int,
+    size: int,
+    count: str = COUNT_EXACT,
+    cache_key: Hashable = None
+) -> Tuple[List[Any], PaginationResponse]:
+    """
+    OFFSET 分页（兼容按页码访问的旧客户端）
+
+    stmt 需要已排序；count 为 none 时同样多取一行判断是否有下一页
+    """
+    total = await count_rows(db, stmt, count, cache_key)
+    rows = list((await db.execute(stmt.offset((page - 1) * size).limit(size + 1))).scalars().all())
+    has_next = len(rows) > size
+    rows = rows[:size]
+
+    if total is None:
+        pagination = PaginationResponse.create_cursor(size=size, next_cursor=None, has_prev=page > 1, page=page)
+        pagination.has_next = has_next
+    else:
+        pagination = PaginationResponse.create(total, page, size)
+        pagination.total_estimated = count == COUNT_ESTIMATE
+    return rows, pagination
@@ -0,0 +1,93 @@
+"""
+🔍 查询计划检查
+
+对热点查询执行 EXPLAIN，发现全表扫描或额外排序（filesort / 临时 B 树）时报告问题
+- MySQL: type=ALL 视为全表扫描，Extra 含 Using filesort / Using temporary 视为额外排序
+- SQLite: 不带索引的 SCAN 视为全表扫描，USE TEMP B-TREE 视为额外排序
+
+供 tests/test_query_plans.py（SQLite）与 scripts/check_query_plans.py（MySQL 等真实数据库）共用
+"""
+
+from typing import Any, Callable, Dict, List, Mapping
+
+from sqlalchemy.engine import Connection
+from sqlalchemy.ext.compiler import compiles
+from sqlalchemy.sql.expression import ClauseElement, Executable
+
+
+class explain(Executable, ClauseElement):
+    """EXPLAIN 语句"""
+
+    inherit_cache = False
+
+    def __init__(self, statement):
+        self.statement = statement
+
+
+@compiles(explain)
+def _compile_explain(element, compiler, **kw):
+    return "EXPLAIN " + compiler.process(element.statement, **kw)
+
+
+@compiles(explain, "sqlite")
+def _compile_explain_sqlite(element, compiler, **kw):
+    return "EXPLAIN QUERY PLAN " + compiler.process(element.statement, **kw)
+
+
+def _mysql_problems(rows: List[Mapping[str, Any]]) -> List[str]:
+    problems = []
+    for row in rows:
+        table = row.get("table")
+        extra = row.get("Extra") or ""
+        if row.get("type") == "ALL":
+            problems.append(f"full table scan on {table}")
+        if "Using filesort" in extra:
+            problems.append(f"filesort on {table}")
+        if "Using temporary" in extra:
+            problems.append(f"temporary table on {table}")
+    return problems
+
+
+def _sqlite_problems(rows: List[Mapping[str, Any]]) -> List[str]:
+    problems = []
+    for row in rows:
+        detail = row.get("detail") or ""
+        if detail.startswith("SCAN ") and " USING " not in detail:
+            problems.append(f"full table scan: {detail}")
+        if "USE TEMP B-TREE" in detail:
+            problems.append(f"extra sort: {detail}")
+    return problems
+
+
+PLAN_CHECKERS: Dict[str, Callable[[List[Mapping[str, Any]]], List[str]]] = {
+    "mysql": _mysql_problems,
+    "sqlite": _sqlite_problems,
+}
+
+
+def explain_statement(conn: Connection, statement) -> List[Mapping[str, Any]]:
+    """执行 EXPLAIN 并返回计划行"""
+    return [dict(row) for row in conn.execute(explain(statement)).mappings()]
+
+
+def check_statement(conn: Connection, statement) -> List[str]:
+    """检查单条语句的查询计划，返回发现的问题"""
+    checker = PLAN_CHECKERS.get(conn.dialect.name)
+    if checker is None:
+        raise NotImplementedError(f"No query plan checker for dialect {conn.dialect.name}")
+    return checker(explain_statement(conn, statement))
+
+
+def check_queries(conn: Connection, queries: Mapping[str, Callable[[], Any]]) -> Dict[str, List[str]]:
+    """
+    检查一组查询
+
+    Returns:
+        查询名称 -> 问题列表（只包含有问题的查询）
+    """
+    report = {}
+    for name, build in queries.items():
+        problems = check_statement(conn, build())
+        if problems:
+            report[name] = problems
+    return report
@@ -0,0 +1,357 @@
+"""
+📮 WebSocket 消息代理
+
+多 worker / 多节点部署时的跨进程消息分发
+
+- LocalBroker: 单进程部署，所有操作为空操作
+- RedisBroker: 基于队列 Redis 的发布订阅，按会话/用户频道分发，
+  并维护集群范围的在线状态注册表
+"""
+
+import asyncio
+import os
+import socket
+from abc import ABC, abstractmethod
+from typing import Any, Awaitable, Callable, Dict, Optional
+from uuid import uuid4
+
+from loguru import logger
+
+from src.config.settings import get_settings
+from src.websocket.frames import decode_payload, encode_payload
+
+settings = get_settings()
+
+# 消息分发范围
+SCOPE_SESSION = "session"
+SCOPE_USER = "user"
+SCOPE_BROADCAST = "broadcast"
+
+# 收到远端消息时的回调 (scope, key, envelope)
+DeliverCallback = Callable[[str, str, Dict[str, Any]], Awaitable[None]]
+
+
+class WebSocketBroker(ABC):
+    """WebSocket 消息代理基类"""
+
+    def __init__(self):
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}:{uuid4().hex[:6]}"
+        self._deliver: Optional[DeliverCallback] = None
+
+    async def start(self, deliver: DeliverCallback):
+        """启动代理并注册远端消息回调"""
+        self._deliver = deliver
+
+    async def stop(self):
+        """停止代理"""
+
+    @abstractmethod
+    async def join(self, scope: str, key: str):
+        """本 worker 开始持有该会话/用户的连接"""
+
+    @abstractmethod
+    async def leave(self, scope: str, key: str):
+        """本 worker 不再持有该会话/用户的连接"""
+
+    @abstractmethod
+    async def publish(self, scope: str, key: str, envelope: Dict[str, Any], body: Optional[str] = None):
+        """
+        发布消息到其他 worker
+        
+        Args:
+            scope: 分发范围
+            key: 会话ID / 用户ID
+            envelope: 消息头
+            body: 已编码的帧文本，原样传递不再重新序列化
+        """
+
+    async def publish_stream(self, session_id: str, event: Dict[str, Any]):
+        """发布AI流式事件，并保存流快照供任意 worker 补齐"""
+        await self.publish(SCOPE_SESSION, session_id, {"kind": "stream", "event": event})
+
+    async def load_stream(self, session_id: str) -> Optional[Dict[str, Any]]:
+        """读取AI流快照"""
+        return None
+
+    async def get_session_presence(self, session_id: str) -> Dict[str, int]:
+        """获取会话在各 worker 上的连接数"""
+        return {}
+
+
+class LocalBroker(WebSocketBroker):
+    """单进程代理，不做跨进程分发"""
+
+    async def join(self, scope: str, key: str):
+        pass
+
+    async def leave(self, scope: str, key: str):
+        pass
+
+    async def publish(self, scope: str, key: str, envelope: Dict[str, Any], body: Optional[str] = None):
+        pass
+
+    async def publish_stream(self, session_id: str, event: Dict[str, Any]):
+        pass
+
+
+class RedisBroker(WebSocketBroker):
+    """基于 Redis 发布订阅的跨 worker 代理"""
+
+    def __init__(self, prefix: str = None):
+        super().__init__()
+        self.prefix = prefix or settings.WS_BROKER_PREFIX
+        self.presence_ttl = settings.WS_PRESENCE_TTL
+        self._dispatcher = None
+        self._redis = None
+        # 本 worker 在各频道上的本地连接引用计数
+        self._refs: Dict[str, int] = {}
+        self._presence: Dict[str, int] = {}
+        self._presence_task: Optional[asyncio.Task] = None
+
+    # ==========================================
+    # 🔑 键与频道
+    # ==========================================
+
+    def _channel(self, scope: str, key: str = "") -> str:
+        if scope == SCOPE_BROADCAST:
+            return f"{self.prefix}broadcast"
+        return f"{self.prefix}{scope}:{key}"
+
+    def _presence_key(self, session_id: str) -> str:
+        return f"{self.prefix}presence:{session_id}"
+
+    def _worker_key(self, worker_id: str) -> str:
+        return f"{self.prefix}worker:{worker_id}"
+
+    def _stream_keys(self, session_id: str):
+        return f"{self.prefix}stream:{session_id}:text", f"{self.prefix}stream:{session_id}:meta"
+
+    # ==========================================
+    # 🔄 生命周期
+    # ==========================================
+
+    async def start(self, deliver: DeliverCallback):
+        from src.core.redis import get_pubsub_dispatcher, get_redis_manager
+
+        await super().start(deliver)
+        self._dispatcher = get_pubsub_dispatcher()
+        self._redis = get_redis_manager().queue
+
+        await self._dispatcher.subscribe(self._channel(SCOPE_BROADCAST), self._on_message)
+        await self._redis.set(self._worker_key(self.worker_id), "1", ex=self.presence_ttl)
+        self._presence_task = asyncio.create_task(self._presence_loop())
+
+        logger.info(f"✅ Redis WebSocket broker started: {self.worker_id}")
+
+    async def stop(self):
+        if self._presence_task:
+            self._presence_task.cancel()
+            self._presence_task = None
+
+        if not self._redis:
+            return
+
+        try:
+            # 清除本 worker 的在线登记
+            pipe = self._redis.pipeline(transaction=False)
+            for session_id in self._presence:
+                pipe.hdel(self._presence_key(session_id), self.worker_id)
+            pipe.delete(self._worker_key(self.worker_id))
+            await pipe.execute()
+
+            for channel in list(self._refs) + [self._channel(SCOPE_BROADCAST)]:
+                await self._dispatcher.unsubscribe(channel)
+        except Exception as e:
+            logger.warning(f"⚠️ Failed to clean broker presence: {e}")
+
+        self._refs.clear()
+        self._presence.clear()
+
+    # ==========================================
+    # 👥 在线状态
+    # ==========================================
+
+    async def join(self, scope: str, key: str):
+        channel = self._channel(scope, key)
+        count = self._refs.get(channel, 0) + 1
+        self._refs[channel] = count
+
+        try:
+            if count == 1:
+                await self._dispatcher.subscribe(channel, self._on_message)
+            if scope == SCOPE_SESSION:
+                self._presence[key] = count
+                pipe = self._redis.pipeline(transaction=False)
+                pipe.hset(self._presence_key(key), self.worker_id, count)
+                pipe.expire(self._presence_key(key), self.presence_ttl)
+                await pipe.execute()
+        except Exception as e:
+            logger.warning(f"⚠️ Broker join failed for {scope}:{key}: {e}")
+
+    async def leave(self, scope: str, key: str):
+        channel = self._channel(scope, key)
+        count = self._refs.get(channel, 0) - 1
+        if count > 0:
+            self._refs[channel] = count
+        else:
+            self._refs.pop(channel, None)
+
+        try:
+            if count <= 0:
+                await self._dispatcher.unsubscribe(channel)
+            if scope == SCOPE_SESSION:
+                if count > 0:
+                    self._presence[key] = count
+                    await self._redis.hset(self._presence_key(key), self.worker_id, count)
+                elif self._presence.pop(key, None) is not None:
+                    await self._redis.hdel(self._presence_key(key), self.worker_id)
+        except Exception as e:
+            logger.warning(f"⚠️ Broker leave failed for {scope}:{key}: {e}")
+
+    async def get_session_presence(self, session_id: str) -> Dict[str, int]:
+        presence = await self._redis.hgetall(self._presence_key(session_id))
+        if not presence:
+            return {}
+
+        # 过滤已失联 worker 的残留登记
+        worker_ids = list(presence.keys())
+        pipe = self._redis.pipeline(transaction=False)
+        for worker_id in worker_ids:
+            pipe.exists(self._worker_key(worker_id))
+        alive = await pipe.execute()
+
+        return {
+            worker_id: int(presence[worker_id])
+            for worker_id, is_alive in zip(worker_ids, alive)
+            if is_alive
+        }
+
+    async def _presence_loop(self):
+        """定期续期 worker 存活标记和在线登记"""
+        interval = max(1, self.presence_ttl // 3)
+        while True:
+            try:
+                await asyncio.sleep(interval)
+
+                pipe = self._redis.pipeline(transaction=False)
+                pipe.set(self._worker_key(self.worker_id), "1", ex=self.presence_ttl)
+                for session_id, count in self._presence.items():
+                    pipe.hset(self._presence_key(session_id), self.worker_id, count)
+                    pipe.expire(self._presence_key(session_id), self.presence_ttl)
+                await pipe.execute()
+
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"Broker presence loop error: {e}")
+
+    # ==========================================
+    # 📤 发布
+    # ==========================================
+
+    def _encode(self, scope: str, key: str, envelope: Dict[str, Any], body: Optional[str] = None) -> str:
+        """消息格式：单行 JSON 消息头，帧文本（如有）跟在第一个换行之后"""
+        header = encode_payload(dict(envelope, origin=self.worker_id, scope=scope, key=key))
+        if body is None:
+            return header
+        return f"{header}\n{body}"
+
+    async def publish(self, scope: str, key: str, envelope: Dict[str, Any], body: Optional[str] = None):
+        try:
+            await self._dispatcher.publish(self._channel(scope, key), self._encode(scope, key, envelope, body))
+        except Exception as e:
+            logger.warning(f"⚠️ Broker publish failed for {scope}:{key}: {e}")
+
+    async def publish_stream(self, session_id: str, event: Dict[str, Any]):
+        text_key, meta_key = self._stream_keys(session_id)
+        ttl = settings.WS_STREAM_BUFFER_TTL
+
+        try:
+            # 快照写入与发布放在同一次往返内完成
+            pipe = self._redis.pipeline(transaction=False)
+            if event["op"] == "delta":
+                if event["seq"] == 1:
+                    pipe.set(text_key, event["delta"], ex=ttl)
+                else:
+                    pipe.append(text_key, event["delta"])
+                    pipe.expire(text_key, ttl)
+                pipe.hset(meta_key, mapping={
+                    "stream_id": event["stream_id"],
+                    "seq": event["seq"],
+                    "is_complete": 0,
+                    "message_id": "",
+                })
+            else:
+                pipe.set(text_key, event["full_content"], ex=ttl)
+                pipe.hset(meta_key, mapping={
+                    "stream_id": event["stream_id"],
+                    "seq": event["seq"],
+                    "is_complete": 1,
+                    "message_id": event.get("message_id") or "",
+                })
+            pipe.expire(meta_key, ttl)
+            pipe.publish(
+                self._channel(SCOPE_SESSION, session_id),
+                self._encode(SCOPE_SESSION, session_id, {"kind": "stream", "event": event})
+            )
+            await pipe.execute()
+        except Exception as e:
+            logger.warning(f"⚠️ Broker stream publish failed for session {session_id}: {e}")
+
+    async def load_stream(self, session_id: str) -> Optional[Dict[str, Any]]:
+        text_key, meta_key = self._stream_keys(session_id)
+        try:
+            pipe = self._redis.pipeline(transaction=False)
+            pipe.get(text_key)
+            pipe.hgetall(meta_key)
+            text, meta = await pipe.execute()
+        except Exception as e:
+            logger.warning(f"⚠️ Failed to load stream snapshot for session {session_id}: {e}")
+            return None
+
+        if text is None or not meta:
+            return None
+
+        return {
+            "stream_id": meta.get("stream_id"),
+            "seq": int(meta.get("seq", 0)),
+            "full_content": text,
+            "is_complete": meta.get("is_complete") == "1",
+            "message_id": int(meta["message_id"]) if meta.get("message_id") else None,
+        }
+
+    # ==========================================
+    # 📥 接收
+    # ==========================================
+
+    async def _on_message(self, channel: str, data: str):
+        header, separator, body = data.partition("\n")
+        try:
+            envelope = decode_payload(header)
+        except ValueError:
+            logger.warning(f"⚠️ Invalid broker payload on {channel}")
+            return
+
+        if separator:
+            envelope["body"] = body
+
+        # 本 worker 发布的消息已在本地投递
+        if envelope.get("origin") == self.worker_id or not self._deliver:
+            return
+
+        await self._deliver(envelope.get("scope"), envelope.get("key"), envelope)
+
+
+def create_broker(backend: str = None) -> WebSocketBroker:
+    """
+    根据配置创建消息代理
+
+    Args:
+        backend: 代理类型（local / redis）
+    """
+    backend = (backend or settings.WS_BROKER_BACKEND).lower()
+    if backend == "redis":
+        return RedisBroker()
+    if backend != "local":
+        logger.warning(f"⚠️ Unknown WebSocket broker backend '{backend}', falling back to local")
+    return LocalBroker()
@@ -0,0 +1,98 @@
+"""
+📦 WebSocket 帧编码
+
+出站消息在每次扇出时只序列化一次，生成的帧文本直接发送给所有目标连接
+有 orjson 时使用 orjson（原生支持 datetime / UUID / Enum），否则回退到标准库 json
+"""
+
+import json
+from datetime import date, datetime
+from enum import Enum
+from typing import Any, Dict, Union
+from uuid import UUID
+
+from loguru import logger
+from pydantic import BaseModel
+
+try:
+    import orjson
+    ORJSON_AVAILABLE = True
+except ImportError:
+    ORJSON_AVAILABLE = False
+    logger.warning("orjson not available, falling back to json for WebSocket frames")
+
+
+def _json_default(obj: Any) -> Any:
+    """标准库 json 的兜底编码器"""
+    if isinstance(obj, (datetime, date)):
+        return obj.isoformat()
+    if isinstance(obj, UUID):
+        return str(obj)
+    if isinstance(obj, Enum):
+        return obj.value
+    if isinstance(obj, BaseModel):
+        return obj.model_dump(mode="json")
+    raise TypeError(f"Object of type {type(obj)} is not JSON serializable")
+
+
+def _orjson_default(obj: Any) -> Any:
+    """orjson 无法原生处理的类型"""
+    if isinstance(obj, BaseModel):
+        return obj.model_dump(mode="json")
+    raise TypeError(f"Object of type {type(obj)} is not JSON serializable")
+
+
+if ORJSON_AVAILABLE:
+    _ORJSON_OPTIONS = orjson.OPT_NON_STR_KEYS
+
+    def encode_payload(payload: Any) -> str:
+        """序列化为 JSON 文本"""
+        return orjson.dumps(payload, default=_orjson_default, option=_ORJSON_OPTIONS).decode("utf-8")
+
+    def decode_payload(data: Union[str, bytes]) -> Any:
+        """解析 JSON 文本"""
+        return orjson.loads(data)
+else:
+    def encode_payload(payload: Any) -> str:
+        """序列化为 JSON 文本"""
+        return json.dumps(payload, ensure_ascii=False, separators=(",", ":"), default=_json_default)
+
+    def decode_payload(data: Union[str, bytes]) -> Any:
+        """解析 JSON 文本"""
+        return json.loads(data)
+
+
+class Frame:
+    """已序列化的出站帧"""
+
+    __slots__ = ("type", "text")
+
+    def __init__(self, frame_type: str, text: str):
+        self.type = frame_type
+        self.text = text
+
+    def __repr__(self) -> str:
+        return f"Frame(type={self.type!r}, size={len(self.text)})"
+
+
+OutboundMessage = Union[Frame, BaseModel, Dict[str, Any]]
+
+
+def build_frame(message: OutboundMessage) -> Frame:
+    """
+    将出站消息编码为帧
+
+    Args:
+        message: 帧、Pydantic 模型（如 WebSocketResponse）或字典
+
+    Returns:
+        可直接发送给任意连接的帧
+    """
+    if isinstance(message, Frame):
+        return message
+
+    if isinstance(message, BaseModel):
+        frame_type = getattr(message, "type", None) or "unknown"
+        return Frame(frame_type, message.model_dump_json())
+
+    return Frame(message.get("type", "unknown"), encode_payload(message))
@@ -5,9 +5,9 @@
 """
 
 import asyncio
-import json
 import time
-from typing import Dict, List, Optional, Set, Any
+from collections import deque
+from typing import Any, Deque, Dict, Iterable, List, Optional, Set, Tuple
 from uuid import uuid4
 
 from fastapi import WebSocket, WebSocketDisconnect
@@ -17,14 +17,26 @@ from src.config.settings import get_settings
 from src.core.exceptions import WebSocketException
 from src.models.message import WebSocketMessage, WebSocketResponse
 from src.utils.metrics import metrics
+from src.websocket.broker import (
+    SCOPE_BROADCAST, SCOPE_SESSION, SCOPE_USER, WebSocketBroker, create_broker
+)
+from src.websocket.frames import Frame, OutboundMessage, build_frame
+from src.websocket.stream import (
+    AIStreamBuffer, STREAM_PROTOCOL_DELTA, STREAM_PROTOCOL_LEGACY
+)
 
 settings = get_settings()
 
 
 class Connection:
-    """WebSocket连接封装"""
+    """
+    WebSocket连接封装
     
-    def __init__(self, websocket: WebSocket, connection_id: str):
+    出站消息进入有界队列，由独立的写任务发送，
+    发送方永远不会被单个慢连接阻塞
+    """
+    
+    def __init__(self, websocket: WebSocket, connection_id: str, queue_size: int = None):
         self.websocket = websocket
         self.connection_id = connection_id
         self.session_id: Optional[str] = None
@@ -33,32 +45,139 @@ class Connection:
         self.created_at = time.time()
         self.last_activity = time.time()
         self.metadata: Dict[str, Any] = {}
+        # 协商后的AI流式协议版本
+        self.stream_protocol = STREAM_PROTOCOL_LEGACY
+        
+        # 出站队列 [(message_type, text)]
+        self.queue_size = queue_size or settings.WS_SEND_QUEUE_SIZE
+        self.closed = False
+        self._queue: Deque[Tuple[str, str]] = deque()
+        self._queue_event = asyncio.Event()
+        self._writer_task: Optional[asyncio.Task] = None
+        self._close_task: Optional[asyncio.Task] = None
+    
+    @property
+    def queue_depth(self) -> int:
+        """出站队列长度"""
+        return len(self._queue)
+    
+    def start_writer(self):
+        """启动写任务"""
+        if self._writer_task is None:
+            self._writer_task = asyncio.create_task(self._writer_loop())
+    
+    def enqueue(self, text: str, message_type: str = "unknown") -> bool:
+        """
+        将已序列化的消息放入出站队列（不阻塞）
+        
+        Args:
+            text: 序列化后的消息
+            message_type: 消息类型，用于溢出策略
+            
+        Returns:
+            是否入队成功
+        """
+        if self.closed:
+            return False
+        
+        if len(self._queue) >= self.queue_size and not self._handle_overflow(message_type):
+            return False
+        
+        self._queue.append((message_type, text))
+        self._queue_event.set()
+        return True
+    
+    def enqueue_frame(self, frame: Frame) -> bool:
+        """将预构建的帧放入出站队列"""
+        return self.enqueue(frame.text, frame.type)
     
-    async def send_message(self, message: Dict[str, Any]) -> bool:
+    async def send_message(self, message: OutboundMessage) -> bool:
         """发送消息"""
+        return self.enqueue_frame(build_frame(message))
+    
+    async def send_response(self, response: WebSocketResponse) -> bool:
+        """发送响应"""
+        return await self.send_message(response)
+    
+    def _handle_overflow(self, message_type: str) -> bool:
+        """
+        队列已满时的处理策略：先丢弃可丢弃帧（正在输入、心跳），
+        仍然放不下时按配置断开慢连接或丢弃新消息
+        
+        Returns:
+            是否腾出了空间
+        """
+        droppable = settings.ws_droppable_frame_types_list
+        
+        if message_type in droppable:
+            metrics.record_websocket_frame_dropped(message_type, "queue_full")
+            return False
+        
+        for index, (queued_type, _) in enumerate(self._queue):
+            if queued_type in droppable:
+                del self._queue[index]
+                metrics.record_websocket_frame_dropped(queued_type, "evicted")
+                return True
+        
+        if settings.WS_SLOW_CONSUMER_POLICY == "disconnect":
+            logger.warning(
+                f"Disconnecting slow consumer {self.connection_id}: "
+                f"outbound queue full ({len(self._queue)})"
+            )
+            metrics.record_websocket_slow_consumer()
+            self.close_nowait(code=1013, reason="slow consumer")
+        else:
+            metrics.record_websocket_frame_dropped(message_type, "queue_full")
+        
+        return False
+    
+    async def _writer_loop(self):
+        """写任务：按顺序发送出站队列中的消息"""
         try:
-            # 使用自定义 JSON 编码器处理 datetime 对象
-            await self.websocket.send_text(json.dumps(message, ensure_ascii=False, default=self._json_encoder))
-            self.last_activity = time.time()
-            return True
+            while not self.closed:
+                if not self._queue:
+                    self._queue_event.clear()
+                    await self._queue_event.wait()
+                    continue
+                
+                _, text = self._queue.popleft()
+                await asyncio.wait_for(
+                    self.websocket.send_text(text),
+                    timeout=settings.WS_SEND_TIMEOUT
+                )
+                self.last_activity = time.time()
+        
+        except asyncio.CancelledError:
+            raise
         except Exception as e:
             logger.error(f"Failed to send message to {self.connection_id}: {e}")
-            return False
-
-    def _json_encoder(self, obj):
-        """JSON 编码器，处理特殊类型"""
-        from datetime import datetime
-        import uuid
-
-        if isinstance(obj, datetime):
-            return obj.isoformat()
-        elif isinstance(obj, uuid.UUID):
-            return str(obj)
-        raise TypeError(f"Object of type {type(obj)} is not JSON serializable")
+            self.close_nowait(code=1011, reason="send failed")
     
-    async def send_response(self, response: WebSocketResponse) -> bool:
-        """发送响应"""
-        return await self.send_message(response.model_dump())
+    def close_nowait(self, code: int = 1000, reason: str = ""):
+        """标记连接关闭并在后台关闭底层 WebSocket"""
+        if self.closed:
+            return
+        
+        self.closed = True
+        self._queue.clear()
+        self._queue_event.set()
+        # 保留任务引用，避免关闭过程中被垃圾回收
+        self._close_task = asyncio.create_task(self._close_websocket(code, reason))
+    
+    async def _close_websocket(self, code: int, reason: str):
+        try:
+            await self.websocket.close(code=code, reason=reason)
+        except Exception as e:
+            # 对端已断开时关闭失败是预期情况
+            logger.debug(f"Failed to close websocket {self.connection_id}: {e}")
+    
+    def stop_writer(self):
+        """停止写任务"""
+        self.closed = True
+        self._queue.clear()
+        if self._writer_task:
+            self._writer_task.cancel()
+            self._writer_task = None
     
     def update_activity(self):
         """更新活动时间"""
@@ -83,16 +202,27 @@ class ConnectionManager:
         # 用户连接映射 {user_id: Set[connection_id]}
         self.user_connections: Dict[str, Set[str]] = {}
         
+        # AI流式回复缓冲 {session_id: AIStreamBuffer}
+        self.ai_streams: Dict[str, AIStreamBuffer] = {}
+        
+        # 跨 worker 消息代理
+        self.broker: WebSocketBroker = create_broker()
+        
         # 心跳任务
         self._heartbeat_task: Optional[asyncio.Task] = None
         self._cleanup_task: Optional[asyncio.Task] = None
     
+    async def start(self):
+        """启动管理器（连接消息代理）"""
+        await self.broker.start(self._on_broker_message)
+    
     async def connect(self, websocket: WebSocket) -> str:
         """接受新连接"""
         await websocket.accept()
         
         connection_id = str(uuid4())
         connection = Connection(websocket, connection_id)
+        connection.start_writer()
         
         self.connections[connection_id] = connection
         
@@ -116,21 +246,20 @@ class ConnectionManager:
             return
         
         # 从会话映射中移除
-        if connection.session_id:
-            session_connections = self.session_connections.get(connection.session_id, set())
-            session_connections.discard(connection_id)
-            if not session_connections:
-                del self.session_connections[connection.session_id]
+        await self.leave_session(connection_id)
         
         # 从用户映射中移除
         if connection.user_id:
-            user_connections = self.user_connections.get(connection.user_id, set())
-            user_connections.discard(connection_id)
-            if not user_connections and connection.user_id in self.user_connections:
-                del self.user_connections[connection.user_id]
+            user_connections = self.user_connections.get(connection.user_id)
+            if user_connections and connection_id in user_connections:
+                user_connections.discard(connection_id)
+                if not user_connections:
+                    del self.user_connections[connection.user_id]
+                await self.broker.leave(SCOPE_USER, connection.user_id)
         
-        # 移除连接
-        del self.connections[connection_id]
+        # 移除连接并停止写任务
+        self.connections.pop(connection_id, None)
+        connection.stop_writer()
         
         # 更新指标
         metrics.set_websocket_connections(len(self.connections))
@@ -141,7 +270,7 @@ class ConnectionManager:
         """获取连接"""
         return self.connections.get(connection_id)
     
-    def authenticate_connection(
+    async def authenticate_connection(
         self, 
         connection_id: str, 
         user_id: str, 
@@ -153,101 +282,410 @@ class ConnectionManager:
             return False
         
         connection.authenticated = True
-        connection.user_id = user_id
         
-        if session_id:
-            connection.session_id = session_id
+        # 添加到用户映射
+        if connection.user_id != user_id:
+            if connection.user_id:
+                old_connections = self.user_connections.get(connection.user_id)
+                if old_connections and connection_id in old_connections:
+                    old_connections.discard(connection_id)
+                    if not old_connections:
+                        del self.user_connections[connection.user_id]
+                    await self.broker.leave(SCOPE_USER, connection.user_id)
             
-            # 添加到会话映射
-            if session_id not in self.session_connections:
-                self.session_connections[session_id] = set()
-            self.session_connections[session_id].add(connection_id)
+            connection.user_id = user_id
+            self.user_connections.setdefault(user_id, set()).add(connection_id)
+            await self.broker.join(SCOPE_USER, user_id)
         
-        # 添加到用户映射
-        if user_id not in self.user_connections:
-            self.user_connections[user_id] = set()
-        self.user_connections[user_id].add(connection_id)
+        # 添加到会话映射
+        if session_id:
+            await self.join_session(connection_id, session_id)
         
         logger.info(f"Connection authenticated: {connection_id} -> user:{user_id}, session:{session_id}")
         return True
     
+    async def join_session(self, connection_id: str, session_id: str) -> bool:
+        """将连接加入会话（离开之前的会话）"""
+        connection = self.connections.get(connection_id)
+        if not connection:
+            return False
+        
+        if connection.session_id == session_id:
+            return True
+        
+        await self.leave_session(connection_id)
+        
+        connection.session_id = session_id
+        self.session_connections.setdefault(session_id, set()).add(connection_id)
+        await self.broker.join(SCOPE_SESSION, session_id)
+        return True
+    
+    async def leave_session(self, connection_id: str) -> Optional[str]:
+        """
+        将连接移出当前会话
+        
+        Returns:
+            离开的会话ID
+        """
+        connection = self.connections.get(connection_id)
+        if not connection or not connection.session_id:
+            return None
+        
+        session_id = connection.session_id
+        connection.session_id = None
+        
+        session_connections = self.session_connections.get(session_id)
+        if session_connections and connection_id in session_connections:
+            session_connections.discard(connection_id)
+            if not session_connections:
+                del self.session_connections[session_id]
+            await self.broker.leave(SCOPE_SESSION, session_id)
+        
+        return session_id
+    
     async def send_to_connection(
         self, 
         connection_id: str, 
-        message: Dict[str, Any]
+        message: OutboundMessage
     ) -> bool:
-        """发送消息到指定连接"""
+        """发送消息到指定连接（入队后立即返回）"""
         connection = self.connections.get(connection_id)
         if not connection:
             return False
         
-        success = await connection.send_message(message)
+        frame = build_frame(message)
+        success = connection.enqueue_frame(frame)
         if success:
-            metrics.record_websocket_message("outbound", message.get("type", "unknown"))
+            metrics.record_websocket_message("outbound", frame.type)
         
         return success
     
-    async def send_to_session(
+    def _fanout(
         self,
-        session_id: str,
-        message: Dict[str, Any],
+        connection_ids: Iterable[str],
+        frame: Frame,
         exclude_connection: str = None
     ) -> int:
-        """发送消息到会话的所有连接"""
-        connection_ids = self.session_connections.get(session_id, set())
-        logger.debug(f"Sending message to session {session_id}, found {len(connection_ids)} connections: {connection_ids}")
-
-        if exclude_connection:
-            connection_ids = connection_ids - {exclude_connection}
-
+        """
+        将同一帧放入多个连接的出站队列
+        
+        帧在调用方只编码一次，入队不阻塞，慢连接由各自的写任务和溢出策略处理
+        
+        Returns:
+            成功入队的连接数
+        """
         sent_count = 0
-        for connection_id in connection_ids.copy():  # 复制集合避免修改时出错
-            logger.debug(f"Sending message to connection {connection_id}: {message.get('type', 'unknown')}")
-            if await self.send_to_connection(connection_id, message):
+        for connection_id in list(connection_ids):
+            if connection_id == exclude_connection:
+                continue
+            connection = self.connections.get(connection_id)
+            if connection and connection.enqueue_frame(frame):
                 sent_count += 1
-                logger.debug(f"Successfully sent message to connection {connection_id}")
-            else:
-                logger.warning(f"Failed to send message to connection {connection_id}")
-
-        logger.debug(f"Sent message to {sent_count} connections for session {session_id}")
+        
+        if sent_count:
+            metrics.record_websocket_message("outbound", frame.type, sent_count)
+        return sent_count
+    
+    async def send_to_session(
+        self,
+        session_id: str,
+        message: OutboundMessage,
+        exclude_connection: str = None
+    ) -> int:
+        """
+        发送消息到会话的所有连接（包括其他 worker 持有的连接）
+        
+        Returns:
+            本 worker 上成功发送的连接数
+        """
+        frame = build_frame(message)
+        sent_count = await self._deliver_to_session(session_id, frame, exclude_connection)
+        await self.broker.publish(SCOPE_SESSION, session_id, {"kind": "frame", "type": frame.type}, frame.text)
+        return sent_count
+    
+    async def _deliver_to_session(
+        self,
+        session_id: str,
+        frame: Frame,
+        exclude_connection: str = None
+    ) -> int:
+        """投递帧到本 worker 上会话的连接"""
+        connection_ids = self.session_connections.get(session_id, ())
+        sent_count = self._fanout(connection_ids, frame, exclude_connection=exclude_connection)
+        logger.debug(f"Sent {frame.type} to {sent_count} connections for session {session_id}")
         return sent_count
     
     async def send_to_user(
         self, 
         user_id: str, 
-        message: Dict[str, Any],
+        message: OutboundMessage,
         exclude_connection: str = None
     ) -> int:
-        """发送消息到用户的所有连接"""
-        connection_ids = self.user_connections.get(user_id, set())
-        if exclude_connection:
-            connection_ids = connection_ids - {exclude_connection}
-        
-        sent_count = 0
-        for connection_id in connection_ids.copy():
-            if await self.send_to_connection(connection_id, message):
-                sent_count += 1
-        
+        """发送消息到用户的所有连接（包括其他 worker 持有的连接）"""
+        frame = build_frame(message)
+        sent_count = await self._deliver_to_user(user_id, frame, exclude_connection)
+        await self.broker.publish(SCOPE_USER, user_id, {"kind": "frame", "type": frame.type}, frame.text)
         return sent_count
     
+    async def _deliver_to_user(
+        self, 
+        user_id: str, 
+        frame: Frame,
+        exclude_connection: str = None
+    ) -> int:
+        """投递帧到本 worker 上用户的连接"""
+        connection_ids = self.user_connections.get(user_id, ())
+        return self._fanout(connection_ids, frame, exclude_connection=exclude_connection)
+    
     async def broadcast(
         self, 
-        message: Dict[str, Any],
+        message: OutboundMessage,
+        authenticated_only: bool = False
+    ) -> int:
+        """广播消息到所有连接（包括其他 worker 持有的连接）"""
+        frame = build_frame(message)
+        sent_count = await self._deliver_broadcast(frame, authenticated_only)
+        await self.broker.publish(SCOPE_BROADCAST, "", {
+            "kind": "frame",
+            "type": frame.type,
+            "authenticated_only": authenticated_only
+        }, frame.text)
+        return sent_count
+    
+    async def _deliver_broadcast(
+        self, 
+        frame: Frame,
         authenticated_only: bool = False
     ) -> int:
-        """广播消息到所有连接"""
+        """广播帧到本 worker 的所有连接"""
+        connection_ids = [
+            connection_id for connection_id, connection in self.connections.items()
+            if connection.authenticated or not authenticated_only
+        ]
+        sent_count = self._fanout(connection_ids, frame)
+        
+        if sent_count > 0:
+            metrics.record_websocket_message("broadcast", frame.type)
+        
+        return sent_count
+    
+    # ==========================================
+    # 🌊 AI 流式回复
+    # ==========================================
+    
+    def begin_ai_stream(self, session_id: str) -> AIStreamBuffer:
+        """
+        开始会话的新一轮AI流式回复
+        
+        新缓冲成为会话的当前缓冲（用于补齐），调用方持有返回的缓冲推送片段和结束帧
+        """
+        buffer = AIStreamBuffer(session_id)
+        self.ai_streams[session_id] = buffer
+        return buffer
+    
+    def get_ai_stream(self, session_id: str) -> Optional[AIStreamBuffer]:
+        """获取会话当前的AI流式缓冲"""
+        return self.ai_streams.get(session_id)
+    
+    def discard_ai_stream(self, session_id: str):
+        """丢弃会话的AI流式缓冲"""
+        self.ai_streams.pop(session_id, None)
+    
+    async def push_ai_stream(self, buffer: AIStreamBuffer, delta: str) -> int:
+        """
+        追加AI回复片段并推送给会话连接（包括其他 worker 持有的连接）
+        
+        同一会话可能有多轮回复重叠，片段写入 begin_ai_stream 返回的缓冲，
+        而不是按会话查找当前缓冲
+        
+        Args:
+            buffer: begin_ai_stream 返回的流缓冲
+            delta: 内容片段
+            
+        Returns:
+            本 worker 上成功发送的连接数
+        """
+        seq = buffer.append(delta)
+        
+        sent_count = await self._fanout_stream_delta(buffer, delta, seq)
+        await self.broker.publish_stream(buffer.session_id, {
+            "op": "delta",
+            "stream_id": buffer.stream_id,
+            "seq": seq,
+            "delta": delta
+        })
+        return sent_count
+    
+    async def complete_ai_stream(
+        self,
+        buffer: AIStreamBuffer,
+        full_content: str,
+        message_id: Optional[int] = None
+    ) -> int:
+        """
+        结束AI流式回复并推送结束帧
+        
+        Args:
+            buffer: begin_ai_stream 返回的流缓冲
+            full_content: 最终保存的完整回复
+            message_id: 保存后的消息ID
+            
+        Returns:
+            本 worker 上成功发送的连接数
+        """
+        sent_count = await self._fanout_stream_complete(buffer, full_content, message_id)
+        await self.broker.publish_stream(buffer.session_id, {
+            "op": "complete",
+            "stream_id": buffer.stream_id,
+            "seq": buffer.seq,
+            "full_content": full_content,
+            "message_id": message_id
+        })
+        return sent_count
+    
+    async def _fanout_stream_delta(self, buffer: AIStreamBuffer, delta: str, seq: int) -> int:
+        """
+        推送增量到本 worker 上的会话连接
+        
+        v2 连接只收到增量帧，v1 连接收到携带累计全文的兼容帧，
+        两种帧各自最多构建一次
+        """
+        delta_ids, legacy_ids = self._split_by_protocol(buffer.session_id)
         sent_count = 0
-        for connection in self.connections.values():
-            if authenticated_only and not connection.authenticated:
+        if delta_ids:
+            sent_count += self._fanout(delta_ids, build_frame(buffer.delta_frame(delta, seq)))
+        if legacy_ids:
+            sent_count += self._fanout(legacy_ids, build_frame(buffer.legacy_frame(delta)))
+        return sent_count
+    
+    def _split_by_protocol(self, session_id: str) -> Tuple[List[str], List[str]]:
+        """按协商的流式协议划分会话连接"""
+        delta_ids: List[str] = []
+        legacy_ids: List[str] = []
+        for connection_id in self.session_connections.get(session_id, ()):
+            connection = self.connections.get(connection_id)
+            if not connection:
                 continue
+            if connection.stream_protocol >= STREAM_PROTOCOL_DELTA:
+                delta_ids.append(connection_id)
+            else:
+                legacy_ids.append(connection_id)
+        return delta_ids, legacy_ids
+    
+    async def _fanout_stream_complete(
+        self,
+        buffer: AIStreamBuffer,
+        full_content: str,
+        message_id: Optional[int]
+    ) -> int:
+        """推送结束帧到本 worker 上的会话连接"""
+        # 最终内容与已推送的增量不一致（如使用默认回复）时，v2 客户端需要补齐
+        content_replaced = buffer.partial or buffer.full_content != full_content
+        if content_replaced:
+            buffer.replace(full_content)
+        buffer.complete(message_id)
+        
+        delta_ids, legacy_ids = self._split_by_protocol(buffer.session_id)
+        sent_count = 0
+        if delta_ids:
+            frame = buffer.resync_frame() if content_replaced else buffer.complete_frame()
+            sent_count += self._fanout(delta_ids, build_frame(frame))
+        if legacy_ids:
+            sent_count += self._fanout(legacy_ids, build_frame(buffer.legacy_complete_frame()))
+        return sent_count
+    
+    async def _apply_remote_stream_event(self, session_id: str, event: Dict[str, Any]):
+        """将其他 worker 的AI流式事件应用到本地镜像缓冲并推送"""
+        buffer = self.ai_streams.get(session_id)
+        if not buffer or buffer.stream_id != event.get("stream_id"):
+            buffer = AIStreamBuffer(session_id, event.get("stream_id"))
+            self.ai_streams[session_id] = buffer
+        
+        seq = event.get("seq", 0)
+        if event.get("op") == "complete":
+            await self._fanout_stream_complete(buffer, event.get("full_content", ""), event.get("message_id"))
+            return
+        
+        if seq <= buffer.seq:
+            return
+        
+        if seq != buffer.seq + 1:
+            # 中途加入的镜像缓冲缺少前缀，从快照补齐
+            snapshot = await self.broker.load_stream(session_id)
+            if snapshot and snapshot["stream_id"] == buffer.stream_id and snapshot["seq"] >= seq:
+                buffer.restore(snapshot["full_content"], snapshot["seq"])
+            else:
+                buffer.seq = seq - 1
+                buffer.partial = True
+        
+        if seq == buffer.seq + 1:
+            buffer.append(event.get("delta", ""))
+        await self._fanout_stream_delta(buffer, event.get("delta", ""), seq)
+    
+    async def send_ai_stream_resync(
+        self,
+        connection_id: str,
+        session_id: str,
+        last_seq: Optional[int] = None
+    ) -> bool:
+        """
+        向连接发送补齐帧
+        
+        Args:
+            connection_id: 连接ID
+            session_id: 会话ID
+            last_seq: 客户端已收到的最后序号，已是最新时不发送
             
-            if await connection.send_message(message):
-                sent_count += 1
+        Returns:
+            是否发送了补齐帧
+        """
+        buffer = self.ai_streams.get(session_id)
+        if not buffer or buffer.partial:
+            # 本 worker 没有完整缓冲时使用集群快照
+            snapshot = await self.broker.load_stream(session_id)
+            if snapshot:
+                buffer = AIStreamBuffer.from_snapshot(session_id, snapshot)
         
-        if sent_count > 0:
-            metrics.record_websocket_message("broadcast", message.get("type", "unknown"))
+        if not buffer or buffer.partial:
+            return False
         
-        return sent_count
+        if last_seq is not None and last_seq >= buffer.seq:
+            return False
+        
+        return await self.send_to_connection(connection_id, buffer.resync_frame())
+    
+    # ==========================================
+    # 📮 跨 worker 消息
+    # ==========================================
+    
+    async def _on_broker_message(self, scope: str, key: str, envelope: Dict[str, Any]):
+        """处理其他 worker 发布的消息"""
+        kind = envelope.get("kind")
+        
+        if kind == "stream" and scope == SCOPE_SESSION:
+            await self._apply_remote_stream_event(key, envelope.get("event", {}))
+            return
+        
+        body = envelope.get("body")
+        if kind != "frame" or body is None:
+            return
+        
+        # 其他 worker 已编码好的帧原样转发，不再重新序列化
+        frame = Frame(envelope.get("type", "unknown"), body)
+        if scope == SCOPE_SESSION:
+            await self._deliver_to_session(key, frame)
+        elif scope == SCOPE_USER:
+            await self._deliver_to_user(key, frame)
+        elif scope == SCOPE_BROADCAST:
+            await self._deliver_broadcast(frame, envelope.get("authenticated_only", False))
+    
+    async def get_session_presence(self, session_id: str) -> Dict[str, int]:
+        """获取会话在集群各 worker 上的连接数"""
+        presence = await self.broker.get_session_presence(session_id)
+        local_count = len(self.session_connections.get(session_id, ()))
+        if local_count:
+            presence[self.broker.worker_id] = local_count
+        return presence
     
     def get_session_connections(self, session_id: str) -> List[str]:
         """获取会话的所有连接ID"""
@@ -265,27 +703,41 @@ class ConnectionManager:
         """获取已认证连接数"""
         return sum(1 for conn in self.connections.values() if conn.authenticated)
     
+    def get_queue_stats(self) -> Dict[str, int]:
+        """获取出站队列深度统计"""
+        total = 0
+        max_depth = 0
+        for connection in self.connections.values():
+            depth = connection.queue_depth
+            total += depth
+            if depth > max_depth:
+                max_depth = depth
+        return {"total": total, "max": max_depth}
+    
     async def _heartbeat_loop(self):
         """心跳循环"""
         while True:
             try:
                 await asyncio.sleep(settings.WS_HEARTBEAT_INTERVAL)
                 
-                # 发送心跳到所有连接
-                heartbeat_message = {
+                # 发送心跳到所有连接（只入队，不逐个等待发送）
+                heartbeat_frame = build_frame({
                     "type": "heartbeat",
                     "timestamp": time.time()
-                }
+                })
+                self._fanout(self.connections.keys(), heartbeat_frame)
                 
-                failed_connections = []
-                for connection_id, connection in self.connections.items():
-                    if not await connection.send_message(heartbeat_message):
-                        failed_connections.append(connection_id)
-                
-                # 移除失败的连接
-                for connection_id in failed_connections:
+                # 移除写任务已失败的连接
+                closed_connections = [
+                    connection_id for connection_id, connection in self.connections.items()
+                    if connection.closed
+                ]
+                for connection_id in closed_connections:
                     await self.disconnect(connection_id)
                 
+                stats = self.get_queue_stats()
+                metrics.set_websocket_queue_depth(stats["total"], stats["max"])
+                
             except Exception as e:
                 logger.error(f"Heartbeat loop error: {e}")
     
@@ -305,6 +757,14 @@ class ConnectionManager:
                     await self.disconnect(connection_id)
                     logger.info(f"Cleaned up expired connection: {connection_id}")
                 
+                # 清理过期的AI流式缓冲
+                stale_streams = [
+                    session_id for session_id, buffer in self.ai_streams.items()
+                    if buffer.is_stale()
+                ]
+                for session_id in stale_streams:
+                    del self.ai_streams[session_id]
+                
             except Exception as e:
                 logger.error(f"Cleanup loop error: {e}")
     
@@ -316,8 +776,11 @@ class ConnectionManager:
         if self._cleanup_task:
             self._cleanup_task.cancel()
         
+        await self.broker.stop()
+        
         # 关闭所有连接
         for connection in self.connections.values():
+            connection.stop_writer()
             try:
                 await connection.websocket.close()
             except Exception:
@@ -326,6 +789,7 @@ class ConnectionManager:
         self.connections.clear()
         self.session_connections.clear()
         self.user_connections.clear()
+        self.ai_streams.clear()
         
         logger.info("WebSocket manager shutdown complete")
 
@@ -336,6 +800,7 @@ websocket_manager = ConnectionManager()
 
 async def init_websocket_manager():
     """初始化WebSocket管理器"""
+    await websocket_manager.start()
     logger.info("✅ WebSocket manager initialized")
 
 
@@ -18,6 +18,9 @@ from src.models.message import (
     WebSocketMessageSend, TypingIndicator
 )
 from src.websocket.manager import websocket_manager
+from src.websocket.stream import (
+    STREAM_PROTOCOL_DELTA, negotiate_stream_protocol, supported_stream_protocols
+)
 from src.utils.metrics import metrics
 
 settings = get_settings()
@@ -47,12 +50,13 @@ async def websocket_endpoint(websocket: WebSocket):
             data={
                 "connection_id": connection_id,
                 "status": "connected",
-                "server_time": datetime.now().isoformat()
+                "server_time": datetime.now().isoformat(),
+                "stream_protocols": supported_stream_protocols()
             }
         )
         await websocket_manager.send_to_connection(
             connection_id,
-            welcome_message.model_dump(mode='json')
+            welcome_message
         )
         
         # 消息处理循环
@@ -116,6 +120,8 @@ async def handle_websocket_message(connection_id: str, message_data: Dict[str, A
             await handle_leave_session(connection_id, message_data)
         elif message_type == "system":
             await handle_system_message(connection_id, message_data)
+        elif message_type == "stream_resync":
+            await handle_stream_resync(connection_id, message_data)
         else:
             await send_error_response(connection_id, "UNKNOWN_TYPE", f"未知消息类型: {message_type}")
     
@@ -133,6 +139,7 @@ async def handle_auth_message(connection_id: str, message_data: Dict[str, Any]):
         # 暂时使用简单的认证逻辑
         token = auth_data.token
         session_id = auth_data.session_id
+        stream_protocol = _negotiate_connection_protocol(connection_id, auth_data.stream_protocol)
         
         if token:
             # 验证token并获取用户信息
@@ -141,7 +148,7 @@ async def handle_auth_message(connection_id: str, message_data: Dict[str, Any]):
             user_id = "user_123"  # 从token解析
             
             # 认证连接
-            success = websocket_manager.authenticate_connection(
+            success = await websocket_manager.authenticate_connection(
                 connection_id, user_id, session_id
             )
             
@@ -151,7 +158,8 @@ async def handle_auth_message(connection_id: str, message_data: Dict[str, Any]):
                     data={
                         "status": "authenticated",
                         "user_id": user_id,
-                        "session_id": session_id
+                        "session_id": session_id,
+                        "stream_protocol": stream_protocol
                     }
                 )
             else:
@@ -164,7 +172,7 @@ async def handle_auth_message(connection_id: str, message_data: Dict[str, Any]):
         else:
             # 游客认证
             user_id = f"guest_{connection_id[:8]}"
-            websocket_manager.authenticate_connection(
+            await websocket_manager.authenticate_connection(
                 connection_id, user_id, session_id
             )
             
@@ -174,15 +182,20 @@ async def handle_auth_message(connection_id: str, message_data: Dict[str, Any]):
                     "status": "authenticated",
                     "user_id": user_id,
                     "session_id": session_id,
+                    "stream_protocol": stream_protocol,
                     "guest": True
                 }
             )
         
         await websocket_manager.send_to_connection(
             connection_id, 
-            response.model_dump()
+            response
         )
         
+        # 重连到仍在生成回复的会话时补齐已推送的内容
+        if session_id and stream_protocol >= STREAM_PROTOCOL_DELTA:
+            await websocket_manager.send_ai_stream_resync(connection_id, session_id)
+        
     except Exception as e:
         logger.error(f"Auth message error: {e}")
         await send_error_response(connection_id, "AUTH_ERROR", "认证失败")
@@ -200,7 +213,7 @@ async def handle_ping_message(connection_id: str, message_data: Dict[str, Any]):
     
     await websocket_manager.send_to_connection(
         connection_id, 
-        response.model_dump()
+        response
     )
 
 
@@ -236,10 +249,7 @@ async def handle_chat_message(connection_id: str, message_data: Dict[str, Any]):
             session_id = session.session_id
 
             # 关联WebSocket连接到会话
-            connection.session_id = session_id
-            if session_id not in websocket_manager.session_connections:
-                websocket_manager.session_connections[session_id] = set()
-            websocket_manager.session_connections[session_id].add(connection_id)
+            await websocket_manager.join_session(connection_id, session_id)
 
             logger.info(f"Connection {connection_id} associated with new session {session_id}")
 
@@ -255,12 +265,12 @@ async def handle_chat_message(connection_id: str, message_data: Dict[str, Any]):
 
         await websocket_manager.send_to_connection(
             connection_id,
-            confirm_response.model_dump(mode='json')
+            confirm_response
         )
 
-        # 异步处理消息，避免数据库会话冲突
-        import asyncio
-        asyncio.create_task(_process_chat_message_async(session_id, content))
+        # 在独立的数据库会话中保存消息；AI回复由回复队列异步处理，
+        # 这里直接等待保存完成，单个连接的消息处理天然有界
+        await _process_chat_message_async(session_id, content)
 
     except Exception as e:
         logger.error(f"Chat message error: {e}")
@@ -326,7 +336,7 @@ async def handle_typing_message(connection_id: str, message_data: Dict[str, Any]
         
         await websocket_manager.send_to_session(
             typing.session_id,
-            typing_response.model_dump(),
+            typing_response,
             exclude_connection=connection_id
         )
         
@@ -347,32 +357,30 @@ async def handle_join_session(connection_id: str, message_data: Dict[str, Any]):
             await send_error_response(connection_id, "NOT_AUTHENTICATED", "未认证")
             return
         
-        # 更新连接的会话ID
-        old_session_id = connection.session_id
-        connection.session_id = session_id
-        
-        # 更新会话映射
-        if old_session_id and old_session_id in websocket_manager.session_connections:
-            websocket_manager.session_connections[old_session_id].discard(connection_id)
+        if "stream_protocol" in message_data:
+            _negotiate_connection_protocol(connection_id, message_data.get("stream_protocol"))
         
-        if session_id not in websocket_manager.session_connections:
-            websocket_manager.session_connections[session_id] = set()
-        websocket_manager.session_connections[session_id].add(connection_id)
+        # 更新连接的会话映射
+        await websocket_manager.join_session(connection_id, session_id)
         
         # 发送确认
         response = WebSocketResponse(
             type="session_joined",
             data={
                 "session_id": session_id,
-                "status": "joined"
+                "status": "joined",
+                "stream_protocol": connection.stream_protocol
             }
         )
         
         await websocket_manager.send_to_connection(
             connection_id,
-            response.model_dump()
+            response
         )
         
+        if connection.stream_protocol >= STREAM_PROTOCOL_DELTA:
+            await websocket_manager.send_ai_stream_resync(connection_id, session_id)
+        
         logger.info(f"Connection {connection_id} joined session {session_id}")
         
     except Exception as e:
@@ -387,14 +395,9 @@ async def handle_leave_session(connection_id: str, message_data: Dict[str, Any])
         if not connection:
             return
         
-        session_id = connection.session_id
+        # 从会话映射中移除
+        session_id = await websocket_manager.leave_session(connection_id)
         if session_id:
-            # 从会话映射中移除
-            if session_id in websocket_manager.session_connections:
-                websocket_manager.session_connections[session_id].discard(connection_id)
-            
-            connection.session_id = None
-            
             # 发送确认
             response = WebSocketResponse(
                 type="session_left",
@@ -406,7 +409,7 @@ async def handle_leave_session(connection_id: str, message_data: Dict[str, Any])
             
             await websocket_manager.send_to_connection(
                 connection_id,
-                response.model_dump()
+                response
             )
             
             logger.info(f"Connection {connection_id} left session {session_id}")
@@ -415,6 +418,41 @@ async def handle_leave_session(connection_id: str, message_data: Dict[str, Any])
         logger.error(f"Leave session error: {e}")
 
 
+async def handle_stream_resync(connection_id: str, message_data: Dict[str, Any]):
+    """处理AI流式补齐请求（客户端发现序号缺口时发送）"""
+    connection = websocket_manager.get_connection(connection_id)
+    if not connection:
+        return
+    
+    session_id = message_data.get("session_id") or connection.session_id
+    if not session_id or session_id != connection.session_id:
+        await send_error_response(connection_id, "INVALID_SESSION", "会话ID无效")
+        return
+    
+    last_seq = message_data.get("last_seq")
+    try:
+        last_seq = int(last_seq) if last_seq is not None else None
+    except (TypeError, ValueError):
+        last_seq = None
+    
+    buffer = websocket_manager.get_ai_stream(session_id)
+    stream_id = message_data.get("stream_id")
+    if buffer and stream_id and stream_id != buffer.stream_id:
+        # 客户端持有的是上一轮回复，需完整补齐当前轮
+        last_seq = None
+    
+    await websocket_manager.send_ai_stream_resync(connection_id, session_id, last_seq)
+
+
+def _negotiate_connection_protocol(connection_id: str, requested: Any) -> int:
+    """协商并记录连接的AI流式协议版本"""
+    version = negotiate_stream_protocol(requested)
+    connection = websocket_manager.get_connection(connection_id)
+    if connection:
+        connection.stream_protocol = version
+    return version
+
+
 async def handle_system_message(connection_id: str, message_data: Dict[str, Any]):
     """处理系统消息（转人工、AI接管等）"""
     try:
@@ -476,7 +514,7 @@ async def handle_handover_request(connection_id: str, session_id: str, user_id:
                     }
                 )
 
-                await websocket_manager.send_to_connection(connection_id, response.model_dump())
+                await websocket_manager.send_to_connection(connection_id, response)
 
                 # 通知管理员有新的转人工请求
                 await notify_admin_handover_request(conversation.id, session_id)
@@ -526,7 +564,7 @@ async def handle_ai_takeover(connection_id: str, session_id: str, user_id: str):
                     }
                 )
 
-                await websocket_manager.send_to_connection(connection_id, response.model_dump())
+                await websocket_manager.send_to_connection(connection_id, response)
 
                 logger.info(f"AI takeover processed for session {session_id}, conversation {conversation.id}")
             else:
@@ -574,5 +612,5 @@ async def send_error_response(connection_id: str, error_code: str, error_message
 
     await websocket_manager.send_to_connection(
         connection_id,
-        response.model_dump()
+        response
     )
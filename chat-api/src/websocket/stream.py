@@ -0,0 +1,193 @@
+"""
+🌊 AI 流式回复协议
+
+ai_stream 帧的版本协商、服务端流缓冲与帧构建
+
+协议版本:
+    1 (legacy) - 每帧携带 content 片段和累计的 full_content，兼容旧客户端
+    2 (delta)  - 每帧只携带增量 delta 和递增的 seq，客户端发现缺帧或重连时
+                 通过 ai_stream_resync 帧一次性补齐全文
+"""
+
+import time
+from typing import Any, Dict, List, Optional
+from uuid import uuid4
+
+from src.config.settings import get_settings
+
+settings = get_settings()
+
+STREAM_PROTOCOL_LEGACY = 1
+STREAM_PROTOCOL_DELTA = 2
+
+
+def negotiate_stream_protocol(requested: Any) -> int:
+    """
+    协商AI流式协议版本
+
+    Args:
+        requested: 客户端请求的协议版本
+
+    Returns:
+        双方都支持的最高协议版本，无法识别时回退到 legacy
+    """
+    try:
+        version = int(requested)
+    except (TypeError, ValueError):
+        return STREAM_PROTOCOL_LEGACY
+
+    server_max = max(STREAM_PROTOCOL_LEGACY, settings.WS_STREAM_PROTOCOL_VERSION)
+    return max(STREAM_PROTOCOL_LEGACY, min(version, server_max))
+
+
+def supported_stream_protocols() -> List[int]:
+    """服务端支持的协议版本列表"""
+    server_max = max(STREAM_PROTOCOL_LEGACY, settings.WS_STREAM_PROTOCOL_VERSION)
+    return list(range(STREAM_PROTOCOL_LEGACY, min(server_max, STREAM_PROTOCOL_DELTA) + 1))
+
+
+class AIStreamBuffer:
+    """单个会话正在进行（或刚结束）的AI流式回复缓冲"""
+
+    def __init__(self, session_id: str, stream_id: Optional[str] = None):
+        self.session_id = session_id
+        self.stream_id = stream_id or uuid4().hex
+        self.seq = 0
+        self.length = 0
+        self.is_complete = False
+        self.message_id: Optional[int] = None
+        self.updated_at = time.time()
+        # 镜像缓冲缺少前缀时为 True，不能用于补齐
+        self.partial = False
+        self._chunks: List[str] = []
+        self._joined: Optional[str] = ""
+
+    @classmethod
+    def from_snapshot(cls, session_id: str, snapshot: Dict[str, Any]) -> "AIStreamBuffer":
+        """从集群快照构建缓冲"""
+        buffer = cls(session_id, snapshot.get("stream_id"))
+        buffer.restore(snapshot.get("full_content", ""), snapshot.get("seq", 0))
+        if snapshot.get("is_complete"):
+            buffer.complete(snapshot.get("message_id"))
+        return buffer
+
+    @property
+    def full_content(self) -> str:
+        """当前累计的完整内容（按需拼接并缓存）"""
+        if self._joined is None:
+            self._joined = "".join(self._chunks)
+            self._chunks = [self._joined]
+        return self._joined
+
+    def append(self, delta: str) -> int:
+        """
+        追加增量内容
+
+        Args:
+            delta: 内容片段
+
+        Returns:
+            该片段对应的序号
+        """
+        self._chunks.append(delta)
+        self._joined = None
+        self.length += len(delta)
+        self.seq += 1
+        self.updated_at = time.time()
+        return self.seq
+
+    def replace(self, content: str):
+        """用完整内容覆盖缓冲（如回复为空时使用的默认文案）"""
+        self.restore(content, self.seq + 1)
+
+    def restore(self, content: str, seq: int):
+        """用截至 seq 的完整内容重置缓冲"""
+        self._chunks = [content]
+        self._joined = content
+        self.length = len(content)
+        self.seq = seq
+        self.partial = False
+        self.updated_at = time.time()
+
+    def complete(self, message_id: Optional[int] = None):
+        """标记流结束"""
+        self.is_complete = True
+        self.message_id = message_id
+        self.updated_at = time.time()
+
+    def is_stale(self, ttl: int = None) -> bool:
+        """缓冲是否已超过保留时间"""
+        ttl = ttl or settings.WS_STREAM_BUFFER_TTL
+        return time.time() - self.updated_at > ttl
+
+    # ==========================================
+    # 📦 帧构建
+    # ==========================================
+
+    def delta_frame(self, delta: str, seq: int) -> Dict[str, Any]:
+        """构建 v2 增量帧"""
+        return {
+            "type": "ai_stream",
+            "data": {
+                "session_id": self.session_id,
+                "stream_id": self.stream_id,
+                "seq": seq,
+                "delta": delta,
+                "is_complete": False
+            }
+        }
+
+    def legacy_frame(self, delta: str) -> Dict[str, Any]:
+        """构建 v1 兼容帧（携带累计全文）"""
+        return {
+            "type": "ai_stream",
+            "data": {
+                "session_id": self.session_id,
+                "content": delta,
+                "full_content": self.full_content,
+                "is_complete": False
+            }
+        }
+
+    def complete_frame(self) -> Dict[str, Any]:
+        """构建 v2 结束帧，只携带序号和长度供客户端校验"""
+        return {
+            "type": "ai_stream",
+            "data": {
+                "session_id": self.session_id,
+                "stream_id": self.stream_id,
+                "seq": self.seq,
+                "delta": "",
+                "length": self.length,
+                "is_complete": True,
+                "message_id": self.message_id
+            }
+        }
+
+    def legacy_complete_frame(self) -> Dict[str, Any]:
+        """构建 v1 结束帧"""
+        return {
+            "type": "ai_stream",
+            "data": {
+                "session_id": self.session_id,
+                "content": "",
+                "full_content": self.full_content,
+                "is_complete": True,
+                "message_id": self.message_id
+            }
+        }
+
+    def resync_frame(self) -> Dict[str, Any]:
+        """构建补齐帧，携带截至当前序号的完整内容"""
+        return {
+            "type": "ai_stream_resync",
+            "data": {
+                "session_id": self.session_id,
+                "stream_id": self.stream_id,
+                "seq": self.seq,
+                "full_content": self.full_content,
+                "length": self.length,
+                "is_complete": self.is_complete,
+                "message_id": self.message_id
+            }
+        }
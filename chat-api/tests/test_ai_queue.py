@@ -0,0 +1,172 @@
+"""
+🧪 AI 回复队列测试
+
+验证出队顺序（优先级、来源轮转）、同一会话串行处理、队列满时拒绝，以及停止时处理完排队任务
+（处理函数由测试注入，不调用AI服务）
+"""
+
+import asyncio
+from typing import List
+
+import pytest
+
+from src.ai.queue import AIReplyJob, AIReplyQueue
+from src.core.exceptions import RateLimitException
+
+
+class Recorder:
+    """记录处理顺序的处理函数，第一个任务阻塞到 release 以便先把其余任务排进队列"""
+
+    def __init__(self, block_first: bool = True, delay: float = 0):
+        self.jobs: List[AIReplyJob] = []
+        self.started = asyncio.Event()
+        self.release = asyncio.Event()
+        self.delay = delay
+        self.running: List[str] = []
+        self.max_per_session = 0
+        if not block_first:
+            self.release.set()
+
+    async def __call__(self, job: AIReplyJob):
+        self.jobs.append(job)
+        self.running.append(job.session_id)
+        self.max_per_session = max(self.max_per_session, self.running.count(job.session_id))
+        self.started.set()
+        try:
+            await self.release.wait()
+            await asyncio.sleep(self.delay)
+        finally:
+            self.running.remove(job.session_id)
+
+    @property
+    def messages(self) -> List[str]:
+        return [job.user_message for job in self.jobs]
+
+
+async def _queue(recorder: Recorder, workers: int = 1, max_size: int = 100) -> AIReplyQueue:
+    queue = AIReplyQueue(handler=recorder, workers=workers, max_size=max_size)
+    queue.start()
+    return queue
+
+
+async def _block(queue: AIReplyQueue, recorder: Recorder):
+    """提交一个占住 worker 的任务"""
+    await queue.submit("blocker", 0, "blocker")
+    await recorder.started.wait()
+
+
+class TestAIReplyQueue:
+    """AI回复队列测试类"""
+
+    async def test_priority_order(self):
+        """高优先级对话的任务先出队，同优先级按入队顺序"""
+        recorder = Recorder()
+        queue = await _queue(recorder)
+        await _block(queue, recorder)
+
+        for conversation_id, priority in enumerate(("low", "medium", "urgent", "high", "urgent"), start=1):
+            queue.set_priority(conversation_id, priority)
+            await queue.submit(f"s{conversation_id}", conversation_id, f"{priority}-{conversation_id}")
+
+        recorder.release.set()
+        await queue.stop(timeout=5)
+
+        assert recorder.messages == ["blocker", "urgent-3", "urgent-5", "high-4", "medium-2", "low-1"]
+
+    async def test_round_robin_between_sources(self):
+        """同优先级时在来源之间轮转，刷屏的来源不会饿死其他来源"""
+        recorder = Recorder()
+        queue = await _queue(recorder)
+        await _block(queue, recorder)
+
+        for index in range(3):
+            await queue.submit(f"a{index}", 1, f"a{index}", fairness_key="tenant-a")
+        await queue.submit("b0", 1, "b0", fairness_key="tenant-b")
+        await queue.submit("c0", 1, "c0", fairness_key="tenant-c")
+
+        recorder.release.set()
+        await queue.stop(timeout=5)
+
+        assert recorder.messages == ["blocker", "a0", "b0", "c0", "a1", "a2"]
+
+    async def test_one_job_per_session(self):
+        """同一会话的任务即使有空闲 worker 也串行处理，且保持顺序"""
+        recorder = Recorder(block_first=False, delay=0.01)
+        queue = await _queue(recorder, workers=4)
+
+        for index in range(3):
+            await queue.submit("same", 1, f"same-{index}")
+        await queue.submit("other", 1, "other-0")
+
+        await queue.stop(timeout=5)
+
+        assert recorder.max_per_session == 1
+        assert [message for message in recorder.messages if message.startswith("same")] == [
+            "same-0", "same-1", "same-2"
+        ]
+        assert "other-0" in recorder.messages[:2]
+
+    async def test_busy_session_does_not_block_its_source(self):
+        """会话忙时同一来源中其他会话的任务照常出队"""
+        recorder = Recorder()
+        queue = await _queue(recorder, workers=2)
+        await queue.submit("busy", 1, "busy-0", fairness_key="tenant")
+        await recorder.started.wait()
+
+        queue.set_priority(2, "urgent")
+        await queue.submit("busy", 2, "busy-1", fairness_key="tenant")
+        await queue.submit("free", 1, "free-0", fairness_key="tenant")
+        await asyncio.sleep(0)
+
+        assert recorder.messages == ["busy-0", "free-0"]
+
+        recorder.release.set()
+        await queue.stop(timeout=5)
+        assert recorder.messages == ["busy-0", "free-0", "busy-1"]
+
+    async def test_rejects_when_full(self):
+        """排队数达到上限时拒绝新任务"""
+        recorder = Recorder()
+        queue = await _queue(recorder, max_size=2)
+        await _block(queue, recorder)
+
+        assert await queue.submit("s1", 1, "m1") == 1
+        assert await queue.submit("s2", 1, "m2") == 2
+        with pytest.raises(RateLimitException):
+            await queue.submit("s3", 1, "m3")
+
+        recorder.release.set()
+        await queue.stop(timeout=5)
+        assert recorder.messages == ["blocker", "m1", "m2"]
+
+    async def test_stop_drains_queued_jobs(self):
+        """停止时处理完已排队的任务，之后不再接收新任务"""
+        recorder = Recorder(delay=0.01)
+        queue = await _queue(recorder, workers=2)
+        await _block(queue, recorder)
+        for index in range(4):
+            await queue.submit(f"s{index}", 1, f"m{index}")
+
+        stopping = asyncio.create_task(queue.stop(timeout=5))
+        await asyncio.sleep(0)
+        with pytest.raises(RateLimitException):
+            await queue.submit("late", 1, "late")
+
+        recorder.release.set()
+        await stopping
+
+        assert sorted(recorder.messages) == ["blocker", "m0", "m1", "m2", "m3"]
+        assert queue.depth == 0
+        assert queue.active == 0
+
+    async def test_stop_timeout_drops_remaining(self):
+        """超时后丢弃仍在排队的任务并取消进行中的任务"""
+        recorder = Recorder()
+        queue = await _queue(recorder)
+        await _block(queue, recorder)
+        await queue.submit("s1", 1, "m1")
+
+        await queue.stop(timeout=0.05)
+
+        assert recorder.messages == ["blocker"]
+        assert queue.depth == 0
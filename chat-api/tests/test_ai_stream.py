@@ -0,0 +1,121 @@
+"""
+🧪 AI 流式回复测试
+
+验证增量帧 / 兼容帧 / 补齐帧的协议，以及同一会话中重叠的两轮回复互不干扰
+（使用本地消息代理，不需要 Redis）
+"""
+
+import json
+from typing import Any, Dict, List
+
+import pytest
+
+from src.websocket.manager import Connection, ConnectionManager
+from src.websocket.stream import STREAM_PROTOCOL_DELTA, STREAM_PROTOCOL_LEGACY
+
+SESSION_ID = "s1"
+
+
+@pytest.fixture
+def manager() -> ConnectionManager:
+    """带一个 v2 连接和一个 v1 连接的管理器（不启动写任务，帧留在出站队列中）"""
+    manager = ConnectionManager()
+    for connection_id, protocol in (("delta", STREAM_PROTOCOL_DELTA), ("legacy", STREAM_PROTOCOL_LEGACY)):
+        connection = Connection(None, connection_id)
+        connection.session_id = SESSION_ID
+        connection.stream_protocol = protocol
+        manager.connections[connection_id] = connection
+        manager.session_connections.setdefault(SESSION_ID, set()).add(connection_id)
+    return manager
+
+
+def _frames(manager: ConnectionManager, connection_id: str) -> List[Dict[str, Any]]:
+    """取出连接出站队列中的全部帧"""
+    queue = manager.connections[connection_id]._queue
+    frames = [json.loads(text) for _, text in queue]
+    queue.clear()
+    return frames
+
+
+class TestAIStreamProtocol:
+    """流式协议测试类"""
+
+    async def test_delta_and_legacy_frames(self, manager):
+        """v2 连接只收到增量和结束帧，v1 连接收到累计全文"""
+        stream = manager.begin_ai_stream(SESSION_ID)
+        for chunk in ("你好", "，", "世界"):
+            await manager.push_ai_stream(stream, chunk)
+        await manager.complete_ai_stream(stream, "你好，世界", message_id=7)
+
+        delta = [frame["data"] for frame in _frames(manager, "delta")]
+        assert [data["seq"] for data in delta] == [1, 2, 3, 3]
+        assert [data["delta"] for data in delta] == ["你好", "，", "世界", ""]
+        assert delta[-1]["is_complete"] is True
+        assert delta[-1]["length"] == len("你好，世界")
+        assert delta[-1]["message_id"] == 7
+        assert all("full_content" not in data for data in delta)
+
+        legacy = [frame["data"] for frame in _frames(manager, "legacy")]
+        assert [data["full_content"] for data in legacy] == ["你好", "你好，", "你好，世界", "你好，世界"]
+        assert legacy[-1]["is_complete"] is True
+
+    async def test_replaced_content_sends_resync(self, manager):
+        """最终内容与已推送的增量不一致时，v2 连接收到补齐帧"""
+        stream = manager.begin_ai_stream(SESSION_ID)
+        await manager.complete_ai_stream(stream, "默认回复", message_id=1)
+
+        frame = _frames(manager, "delta")[-1]
+        assert frame["type"] == "ai_stream_resync"
+        assert frame["data"]["full_content"] == "默认回复"
+        assert frame["data"]["seq"] == 1
+
+    async def test_resync_after_reconnect(self, manager):
+        """客户端落后时补齐当前全文，已是最新时不发送"""
+        stream = manager.begin_ai_stream(SESSION_ID)
+        await manager.push_ai_stream(stream, "abc")
+        await manager.push_ai_stream(stream, "def")
+        _frames(manager, "delta")
+
+        assert await manager.send_ai_stream_resync("delta", SESSION_ID, last_seq=1)
+        frame = _frames(manager, "delta")[0]
+        assert frame["type"] == "ai_stream_resync"
+        assert frame["data"]["full_content"] == "abcdef"
+        assert frame["data"]["seq"] == 2
+
+        assert not await manager.send_ai_stream_resync("delta", SESSION_ID, last_seq=2)
+        assert _frames(manager, "delta") == []
+
+    async def test_overlapping_streams_in_one_session(self, manager):
+        """同一会话重叠的两轮回复各自保持内容、序号和 stream_id"""
+        first = manager.begin_ai_stream(SESSION_ID)
+        await manager.push_ai_stream(first, "first-1 ")
+        second = manager.begin_ai_stream(SESSION_ID)
+        await manager.push_ai_stream(second, "second-1 ")
+        await manager.push_ai_stream(first, "first-2")
+        await manager.push_ai_stream(second, "second-2")
+
+        assert first.stream_id != second.stream_id
+        assert first.full_content == "first-1 first-2"
+        assert second.full_content == "second-1 second-2"
+        assert first.seq == second.seq == 2
+
+        await manager.complete_ai_stream(first, "first-1 first-2", message_id=1)
+        await manager.complete_ai_stream(second, "second-1 second-2", message_id=2)
+
+        by_stream: Dict[str, List[Dict[str, Any]]] = {}
+        for frame in _frames(manager, "delta"):
+            assert frame["type"] == "ai_stream"
+            by_stream.setdefault(frame["data"]["stream_id"], []).append(frame["data"])
+
+        for stream, message_id in ((first, 1), (second, 2)):
+            data = by_stream[stream.stream_id]
+            assert [item["seq"] for item in data] == [1, 2, 2]
+            assert "".join(item["delta"] for item in data) == stream.full_content
+            assert data[-1]["is_complete"] is True
+            assert data[-1]["message_id"] == message_id
+
+        legacy = [frame["data"] for frame in _frames(manager, "legacy") if frame["data"]["is_complete"]]
+        assert [data["full_content"] for data in legacy] == ["first-1 first-2", "second-1 second-2"]
+
+        # 会话的当前缓冲是最新一轮回复
+        assert manager.get_ai_stream(SESSION_ID) is second
@@ -0,0 +1,227 @@
+"""
+🧪 消息写入管道测试
+
+验证缓冲条目的编解码、重复投递的幂等写入、坏数据与ID冲突转入死信流，
+以及雪花ID的单调性和 worker 编号租约
+（使用 SQLite 与 fakeredis，不需要真实的 Redis）
+"""
+
+import json
+import time
+from datetime import datetime
+from unittest import mock
+
+import pytest
+
+pytest.importorskip("sqlalchemy")
+pytest.importorskip("aiosqlite")
+fakeredis = pytest.importorskip("fakeredis")
+pytest.importorskip("lupa")
+
+from sqlalchemy import func, select
+from sqlalchemy.ext.asyncio import async_sessionmaker, create_async_engine
+
+import src.core.database as database
+import src.models  # noqa: F401  注册全部模型
+from src.core.database import Base
+from src.models.message import Message, MessageType, SenderType
+from src.services.message_writer import MessageWriter, _decode, _encode
+from src.utils.ids import MAX_WORKER_ID, SnowflakeGenerator, WorkerIdLease
+
+
+def _message(message_id: int, content="hello", **kwargs) -> Message:
+    now = datetime(2024, 6, 1, 12, 30, 15, 123456)
+    fields = dict(
+        id=message_id,
+        uuid=f"00000000-0000-0000-0000-{message_id:012d}",
+        conversation_id=1,
+        sender_type=SenderType.AI,
+        sender_id=None,
+        content=content,
+        message_type=MessageType.TEXT,
+        message_metadata={"model": "gpt", "tokens": 12, "tags": ["a", "b"]},
+        is_private=False,
+        created_at=now,
+        updated_at=now,
+    )
+    fields.update(kwargs)
+    return Message(**fields)
+
+
+@pytest.fixture
+async def db_engine(tmp_path, monkeypatch):
+    """按模型建表的 SQLite 数据库，get_db_session 使用该库"""
+    engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'messages.db'}")
+    async with engine.begin() as conn:
+        await conn.run_sync(Base.metadata.create_all)
+
+    monkeypatch.setattr(database, "async_session_maker", async_sessionmaker(engine, expire_on_commit=False))
+    yield engine
+    await engine.dispose()
+
+
+@pytest.fixture
+def redis(monkeypatch):
+    """写入器与租约共用的 fakeredis"""
+    redis = fakeredis.FakeAsyncRedis(decode_responses=True)
+    monkeypatch.setattr(MessageWriter, "redis", property(lambda self: redis))
+    monkeypatch.setattr(WorkerIdLease, "redis", property(lambda self: redis))
+    return redis
+
+
+@pytest.fixture
+def writer(redis):
+    """使用 fakeredis 的写入器"""
+    return MessageWriter(stream="test_message_ingest")
+
+
+async def _count_messages(engine) -> int:
+    async with engine.connect() as conn:
+        return (await conn.execute(select(func.count(Message.id)))).scalar()
+
+
+class TestMessageEncoding:
+    """缓冲条目编解码测试"""
+
+    def test_round_trip(self):
+        """枚举、时间与元数据编解码后保持不变"""
+        message = _message(42)
+        row = _decode(_encode(message))
+
+        assert row["id"] == 42
+        assert row["sender_type"] is SenderType.AI
+        assert row["message_type"] is MessageType.TEXT
+        assert row["created_at"] == message.created_at
+        assert row["updated_at"] == message.updated_at
+        assert row["message_metadata"] == {"model": "gpt", "tokens": 12, "tags": ["a", "b"]}
+        assert row["is_private"] is False
+        assert row["sender_id"] is None
+
+    def test_encoded_row_is_json(self):
+        """缓冲条目是可读的 JSON，非 ASCII 内容不转义"""
+        raw = _encode(_message(1, content="你好"))
+
+        assert json.loads(raw)["content"] == "你好"
+        assert "你好" in raw
+
+
+class TestMessageFlush:
+    """批量写入测试"""
+
+    async def test_duplicate_batch_is_ignored(self, db_engine, writer):
+        """同一批条目重复投递时按主键忽略，不报错、不重复插入，也不算冲突"""
+        rows = [_decode(_encode(_message(message_id))) for message_id in (1, 2, 3)]
+
+        for _ in range(2):
+            async with database.get_db_session() as db:
+                assert await writer._insert(db, rows) == []
+                await db.commit()
+
+        assert await _count_messages(db_engine) == 3
+
+    async def test_id_conflict_goes_to_dead_letter(self, db_engine, writer):
+        """主键已被 uuid 不同的消息占用时不当作重复投递，转入死信流"""
+        original = _message(1)
+        async with database.get_db_session() as db:
+            await writer._insert(db, [_decode(_encode(original))])
+            await db.commit()
+
+        clash = _message(1, content="other", uuid="11111111-1111-1111-1111-111111111111")
+        entries = [("1-0", {"row": _encode(clash)})]
+        await writer._flush_rows(entries, [_decode(entries[0][1]["row"])])
+
+        assert await _count_messages(db_engine) == 1
+        dead = await writer.redis.xrange(writer.dead_letter_stream)
+        assert len(dead) == 1
+        assert json.loads(dead[0][1]["row"])["uuid"] == clash.uuid
+
+    async def test_bad_row_goes_to_dead_letter(self, db_engine, writer):
+        """单行写入失败的条目转入死信流，其余条目正常写入"""
+        messages = [_message(1), _message(2, content=None), _message(3)]
+        entries = [(f"{index}-0", {"row": _encode(message)}) for index, message in enumerate(messages, 1)]
+        rows = [_decode(fields["row"]) for _, fields in entries]
+
+        await writer._flush_rows(entries, rows)
+
+        assert await _count_messages(db_engine) == 2
+        dead = await writer.redis.xrange(writer.dead_letter_stream)
+        assert len(dead) == 1
+        assert json.loads(dead[0][1]["row"])["id"] == 2
+        assert dead[0][1]["error"]
+
+
+class TestSnowflake:
+    """雪花ID测试"""
+
+    def test_monotonic_and_safe_integer(self):
+        """ID 严格递增且不超过 JavaScript 安全整数范围"""
+        generator = SnowflakeGenerator(worker_id=63)
+        ids = [generator.next_id() for _ in range(5000)]
+
+        assert ids == sorted(set(ids))
+        assert all(0 < snowflake_id < 2 ** 53 for snowflake_id in ids)
+
+    def test_clock_rollback_does_not_block(self):
+        """时钟回拨后仍然递增，序列用完时不等待真实时钟"""
+        generator = SnowflakeGenerator(worker_id=1)
+        before = [generator.next_id() for _ in range(10)]
+
+        rolled_back = time.time() - 60
+        with mock.patch("src.utils.ids.time.time", return_value=rolled_back):
+            started = time.perf_counter()
+            after = [generator.next_id() for _ in range(1000)]
+            elapsed = time.perf_counter() - started
+
+        ids = before + after
+        assert ids == sorted(set(ids))
+        assert elapsed < 1
+
+
+class TestWorkerIdLease:
+    """worker 编号租约测试"""
+
+    async def test_leases_are_unique(self, redis):
+        """两个进程分到不同的编号，停止时只释放自己的租约"""
+        first = WorkerIdLease(SnowflakeGenerator(), prefix="wid:")
+        second = WorkerIdLease(SnowflakeGenerator(), prefix="wid:")
+        await first.start()
+        await second.start()
+
+        assert first.valid and second.valid
+        assert first.generator.worker_id != second.generator.worker_id
+
+        await first.stop()
+        assert not first.valid
+        assert await redis.exists(f"wid:{first.generator.worker_id}") == 0
+        assert await redis.exists(f"wid:{second.generator.worker_id}") == 1
+        await second.stop()
+
+    async def test_lost_lease_is_not_taken_back(self, redis):
+        """续约时发现编号已被其他进程占用，不覆盖对方而是改用新的编号"""
+        lease = WorkerIdLease(SnowflakeGenerator(), prefix="wid:")
+        assert await lease._acquire()
+        lost_id = lease.generator.worker_id
+        await redis.set(f"wid:{lost_id}", "other-process")
+
+        await lease._renew()
+
+        assert lease.valid
+        assert lease.generator.worker_id != lost_id
+        assert await redis.get(f"wid:{lost_id}") == "other-process"
+        await lease.stop()
+
+    async def test_no_free_worker_id(self, redis):
+        """编号全部被占用时租约无效，写入器不启动"""
+        for worker_id in range(MAX_WORKER_ID + 1):
+            await redis.set(f"wid:{worker_id}", "other-process")
+
+        lease = WorkerIdLease(SnowflakeGenerator(), prefix="wid:")
+        assert not await lease._acquire()
+        assert not lease.valid
+
+        with mock.patch("src.services.message_writer.worker_id_lease", lease):
+            writer = MessageWriter(stream="test_message_ingest")
+            writer.enabled = True
+            await writer.start()
+            assert not writer.running
+            assert not await writer.submit(_message(1))
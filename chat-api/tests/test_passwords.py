@@ -0,0 +1,88 @@
+"""
+🧪 密码哈希测试
+
+验证密码运算不阻塞事件循环，且并发过高时快速拒绝
+"""
+
+import asyncio
+import time
+
+import pytest
+
+pytest.importorskip("passlib")
+
+from passlib.context import CryptContext
+
+from src.core.exceptions import RateLimitException
+from src.core.passwords import PasswordHasher
+
+
+@pytest.fixture
+def hasher():
+    """使用真实 bcrypt 轮数的独立哈希器"""
+    context = CryptContext(schemes=["bcrypt"], deprecated="auto", bcrypt__rounds=12)
+    hasher = PasswordHasher(context=context, max_workers=2, max_pending=8)
+    yield hasher
+    hasher.shutdown()
+
+
+async def _measure_loop_lag(stop: asyncio.Event, interval: float = 0.01) -> float:
+    """测量事件循环的最大调度延迟"""
+    max_lag = 0.0
+    while not stop.is_set():
+        start = time.perf_counter()
+        await asyncio.sleep(interval)
+        max_lag = max(max_lag, time.perf_counter() - start - interval)
+    return max_lag
+
+
+class TestPasswordHasher:
+    """密码哈希测试类"""
+
+    async def test_hash_and_verify(self, hasher):
+        """测试哈希与校验"""
+        hashed = await hasher.hash("password123")
+
+        assert await hasher.verify("password123", hashed)
+        assert not await hasher.verify("wrongpassword", hashed)
+        assert hasher.pending == 0
+
+    async def test_event_loop_responsive_during_login_storm(self, hasher):
+        """测试登录洪峰期间事件循环保持响应"""
+        hashed = await hasher.hash("password123")
+
+        stop = asyncio.Event()
+        lag_task = asyncio.create_task(_measure_loop_lag(stop))
+
+        results = await asyncio.gather(
+            *(hasher.verify("password123", hashed) for _ in range(hasher.max_pending)),
+            return_exceptions=True
+        )
+
+        stop.set()
+        max_lag = await lag_task
+
+        assert all(result is True for result in results)
+        # 单次 bcrypt(12) 约 250ms，若在事件循环上执行，延迟会累积到数秒
+        assert max_lag < 0.1
+
+    async def test_back_pressure_when_saturated(self, hasher):
+        """测试并发超过上限时快速拒绝"""
+        hashed = await hasher.hash("password123")
+
+        tasks = [
+            asyncio.create_task(hasher.verify("password123", hashed))
+            for _ in range(hasher.max_pending)
+        ]
+        await asyncio.sleep(0)
+        assert hasher.pending == hasher.max_pending
+
+        # 超出上限的请求立即被拒绝，而不是排队等待
+        start = time.perf_counter()
+        with pytest.raises(RateLimitException):
+            await hasher.verify("password123", hashed)
+        assert time.perf_counter() - start < 0.05
+
+        results = await asyncio.gather(*tasks)
+        assert all(results)
+        assert hasher.pending == 0
@@ -0,0 +1,45 @@
+"""
+🧪 查询计划回归测试
+
+在 SQLite 上对服务层的热点查询执行 EXPLAIN QUERY PLAN，
+出现全表扫描或额外排序时失败（真实 MySQL 上使用 scripts/check_query_plans.py）
+"""
+
+import pytest
+
+pytest.importorskip("sqlalchemy")
+
+from sqlalchemy import create_engine, select
+
+import src.models  # noqa: F401  注册全部模型
+from src.core.database import Base
+from src.models.message import Message
+from src.services.queries import HOT_QUERIES
+from src.utils.query_plans import check_statement
+
+
+@pytest.fixture(scope="module")
+def plan_conn():
+    """按模型定义（含 __table_args__ 中的索引）建表的内存数据库"""
+    engine = create_engine("sqlite://")
+    Base.metadata.create_all(engine)
+    with engine.connect() as conn:
+        yield conn
+    engine.dispose()
+
+
+class TestQueryPlans:
+    """热点查询计划测试"""
+
+    @pytest.mark.parametrize("name", sorted(HOT_QUERIES))
+    def test_hot_query_uses_index(self, plan_conn, name):
+        """热点查询既不全表扫描，也不额外排序"""
+        problems = check_statement(plan_conn, HOT_QUERIES[name]())
+        assert not problems, f"{name}: {problems}"
+
+    def test_checker_reports_scan_and_sort(self, plan_conn):
+        """没有可用索引的查询会被报告"""
+        stmt = select(Message).where(Message.content == "hello").order_by(Message.sender_type)
+        problems = check_statement(plan_conn, stmt)
+        assert any("full table scan" in problem for problem in problems)
+        assert any("extra sort" in problem for problem in problems)
@@ -0,0 +1,120 @@
+"""
+🧪 限流测试
+
+在 fakeredis（lupa 执行 Lua）上验证滑动窗口脚本与本地预检额度：
+窗口内恰好放行 N 次、窗口随时间滑动、本地额度不会让总放行数超出上限
+"""
+
+from types import SimpleNamespace
+
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+pytest.importorskip("lupa")
+
+import src.middleware.rate_limit as rate_limit
+from src.middleware.rate_limit import RateLimiter
+from src.utils.cache import TTLCache
+
+
+class FakeClock:
+    """可手动推进的时钟（只替换限流模块中的 time）"""
+
+    def __init__(self, now: float = 1_700_000_000.0):
+        self.now = now
+
+    def time(self) -> float:
+        return self.now
+
+    def advance(self, seconds: float):
+        self.now += seconds
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = FakeClock()
+    monkeypatch.setattr(rate_limit, "time", clock)
+    return clock
+
+
+@pytest.fixture
+def redis():
+    return fakeredis.FakeAsyncRedis(decode_responses=True)
+
+
+def _limiter(redis, local_share: float = 0.0) -> RateLimiter:
+    limiter = RateLimiter(SimpleNamespace(client=redis))
+    limiter.local_share = local_share
+    limiter._allowances = TTLCache("rate_limit_local_test", 100 if local_share > 0 else 0, limiter.local_ttl)
+    return limiter
+
+
+async def _admitted(limiter: RateLimiter, key: str, limit: int, window: int, attempts: int) -> int:
+    results = [await limiter.check(key, limit, window) for _ in range(attempts)]
+    return sum(result.allowed for result in results)
+
+
+class TestSlidingWindow:
+    """滑动窗口测试类"""
+
+    async def test_exactly_limit_per_window(self, redis, clock):
+        """窗口内恰好放行 N 次，第 N+1 次拒绝并给出重试时间"""
+        limiter = _limiter(redis)
+
+        results = [await limiter.check("rl:exact", 5, 10) for _ in range(6)]
+
+        assert [result.allowed for result in results] == [True] * 5 + [False]
+        assert results[4].remaining == 0
+        assert results[5].retry_after == 10
+        assert await redis.zcard("rl:exact") == 5
+
+    async def test_window_slides(self, redis, clock):
+        """请求按各自时间移出窗口，而不是整窗重置"""
+        limiter = _limiter(redis)
+
+        assert await _admitted(limiter, "rl:slide", 5, 10, 3) == 3
+        clock.advance(5)
+        assert await _admitted(limiter, "rl:slide", 5, 10, 3) == 2
+
+        # 最早的 3 次移出窗口，5 秒时的 2 次仍在窗口内
+        clock.advance(5.5)
+        assert await _admitted(limiter, "rl:slide", 5, 10, 4) == 3
+
+        # 5 秒时的 2 次也移出窗口
+        clock.advance(5)
+        assert await _admitted(limiter, "rl:slide", 5, 10, 3) == 2
+
+
+class TestLocalAllowance:
+    """本地预检额度测试类"""
+
+    async def test_single_process_never_exceeds_limit(self, redis, clock):
+        """单个进程使用本地额度时总放行数不超过上限，且本地放行会补写到 Redis"""
+        limiter = _limiter(redis, local_share=0.5)
+
+        admitted = 0
+        for _ in range(50):
+            admitted += (await limiter.check("rl:local", 20, 10)).allowed
+            clock.advance(0.01)
+
+        assert admitted == 20
+        assert await redis.zcard("rl:local") == 20
+
+    async def test_over_admission_is_bounded_across_processes(self, redis, clock):
+        """多个进程各自持有本地额度，超出上限的部分不超过 进程数 × 额度比例 × 上限"""
+        limit, share, processes = 100, 0.1, 4
+        limiters = [_limiter(redis, local_share=share) for _ in range(processes)]
+
+        # 最坏情况：各进程先领到额度，其中一个进程把窗口用满后，其余进程再消耗本地额度
+        admitted = 0
+        for limiter in limiters:
+            admitted += (await limiter.check("rl:shared", limit, 60)).allowed
+        admitted += await _admitted(limiters[0], "rl:shared", limit, 60, limit * 2)
+        for limiter in limiters[1:]:
+            admitted += await _admitted(limiter, "rl:shared", limit, 60, limit)
+
+        assert limit < admitted <= limit + processes * int(share * limit)
+
+        # 额度用完后全部回到 Redis 判定，不再放行
+        for limiter in limiters:
+            assert not (await limiter.check("rl:shared", limit, 60)).allowed
@@ -0,0 +1,113 @@
+"""
+🧪 会话存储测试
+
+在 fakeredis（lupa 执行 Lua）上验证会话存储脚本：
+创建 / 读取 / 更新 / 关闭时索引 score 的维护，以及清理只关闭已到期的会话
+"""
+
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+fakeredis = pytest.importorskip("fakeredis")
+pytest.importorskip("lupa")
+
+from src.models.session import Session, SessionStatus
+from src.session.store import SessionStore
+
+IDLE_TIMEOUT = 60
+TTL = 3600
+
+
+@pytest.fixture
+def redis():
+    return fakeredis.FakeAsyncRedis(decode_responses=True)
+
+
+@pytest.fixture
+def store(redis):
+    return SessionStore(redis, shards=1, idle_timeout=IDLE_TIMEOUT)
+
+
+def _session(session_id: str, user_id: str = "u1", idle_for: float = 0, expires_in: float = TTL) -> Session:
+    now = datetime.now()
+    return Session(
+        session_id=session_id,
+        user_id=user_id,
+        context={"lang": "zh"},
+        session_metadata={"tenant": "acme"},
+        last_activity_at=now - timedelta(seconds=idle_for),
+        expires_at=now + timedelta(seconds=expires_in),
+    )
+
+
+class TestSessionStore:
+    """会话存储脚本测试类"""
+
+    async def test_create_get_update_close(self, store, redis):
+        """完整生命周期中会话哈希与两个索引保持一致"""
+        session = _session("s1")
+        active, evicted = await store.create(session, max_per_user=5, ttl=TTL)
+
+        assert active == 1
+        assert evicted == []
+        expires_ts = session.expires_at.timestamp()
+        assert await redis.zscore(store.user_sessions_key("u1"), "s1") == pytest.approx(expires_ts)
+        assert await redis.zscore(store.session_index_key, "s1") == pytest.approx(expires_ts)
+        assert await redis.zscore(store.expiry_key(0), "s1") == pytest.approx(
+            session.last_activity_at.timestamp() + IDLE_TIMEOUT
+        )
+
+        loaded = await store.get("s1")
+        assert loaded.user_id == "u1"
+        assert loaded.context == {"lang": "zh"}
+        assert loaded.session_metadata == {"tenant": "acme"}
+        assert loaded.expires_at == session.expires_at
+        assert loaded.conversation_id is None
+
+        updated = await store.update("s1", {"conversation_id": 42, "context": {"lang": "en"}})
+        assert updated.conversation_id == 42
+        assert updated.context == {"lang": "en"}
+        assert updated.session_metadata == {"tenant": "acme"}
+        assert await store.update("missing", {"conversation_id": 1}) is None
+
+        assert await store.close("s1") == 0
+        assert (await store.get("s1")).status == SessionStatus.CLOSED
+        assert await redis.zscore(store.user_sessions_key("u1"), "s1") is None
+        assert await redis.zscore(store.session_index_key, "s1") is None
+        assert await redis.zscore(store.expiry_key(0), "s1") is None
+        assert await store.close("missing") is None
+
+    async def test_create_evicts_oldest_over_limit(self, store, redis):
+        """超过每用户上限时关闭最早过期的会话"""
+        await store.create(_session("old", expires_in=100), max_per_user=2, ttl=TTL)
+        await store.create(_session("mid", expires_in=200), max_per_user=2, ttl=TTL)
+        active, evicted = await store.create(_session("new", expires_in=300), max_per_user=2, ttl=TTL)
+
+        assert evicted == ["old"]
+        assert active == 2
+        assert (await store.get("old")).status == SessionStatus.CLOSED
+        assert await redis.zrange(store.user_sessions_key("u1"), 0, -1) == ["mid", "new"]
+
+    async def test_sweep_closes_only_expired(self, store, redis):
+        """清理只关闭空闲超时或已过期的会话，活跃会话重新调度"""
+        await store.create(_session("idle", idle_for=IDLE_TIMEOUT * 2), max_per_user=5, ttl=TTL)
+        await store.create(_session("fresh"), max_per_user=5, ttl=TTL)
+        await store.create(_session("touched", idle_for=IDLE_TIMEOUT * 2), max_per_user=5, ttl=TTL)
+        # 到期前有新的活动
+        assert await store.touch_many({"touched": time.time()}) == 1
+        # 调度先于活动到期（例如迁移时按立即到期加入），清理时按最新活动时间重新调度
+        await redis.zadd(store.expiry_key(0), {"touched": time.time() - 1})
+
+        processed, closed = await store.sweep_shard(0, batch_size=100)
+
+        assert processed == 2
+        assert closed == ["idle"]
+        assert (await store.get("idle")).status == SessionStatus.CLOSED
+        assert (await store.get("fresh")).status == SessionStatus.ACTIVE
+        assert (await store.get("touched")).status == SessionStatus.ACTIVE
+        assert set(await redis.zrange(store.session_index_key, 0, -1)) == {"fresh", "touched"}
+        assert await redis.zscore(store.user_sessions_key("u1"), "idle") is None
+        assert await redis.zscore(store.expiry_key(0), "touched") > time.time()
+        assert await store.count_active() == 2
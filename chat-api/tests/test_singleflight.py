@@ -0,0 +1,188 @@
+"""
+🧪 AI 请求合并测试
+
+验证相同请求只发起一次上游调用：后加入的订阅者补收已产生的片段、上游错误传给所有订阅者、
+单个订阅者断开不影响其他订阅者，以及请求结束后清理进行中的记录
+"""
+
+import asyncio
+from typing import AsyncGenerator, List
+
+import pytest
+
+from src.ai.singleflight import SingleFlight
+
+
+class Upstream:
+    """由测试逐片段驱动的上游流"""
+
+    def __init__(self):
+        self.calls = 0
+        self._queue: asyncio.Queue = asyncio.Queue()
+
+    def send(self, chunk: str):
+        self._queue.put_nowait(chunk)
+
+    def close(self):
+        self._queue.put_nowait(None)
+
+    def fail(self, error: Exception):
+        self._queue.put_nowait(error)
+
+    async def stream(self) -> AsyncGenerator[str, None]:
+        self.calls += 1
+        while True:
+            item = await self._queue.get()
+            if item is None:
+                return
+            if isinstance(item, Exception):
+                raise item
+            yield item
+
+
+async def _collect(agen: AsyncGenerator[str, None]) -> List[str]:
+    return [chunk async for chunk in agen]
+
+
+async def _settle():
+    """让后台任务处理完已发送的片段"""
+    for _ in range(5):
+        await asyncio.sleep(0)
+
+
+class TestSingleFlightStream:
+    """流式请求合并测试类"""
+
+    async def test_late_follower_replays_chunks(self):
+        """后加入的订阅者先收到已产生的片段，再和领头请求一起接收后续片段"""
+        flights = SingleFlight()
+        upstream = Upstream()
+
+        leader = asyncio.create_task(_collect(flights.stream("k", upstream.stream)))
+        await _settle()
+        upstream.send("a")
+        upstream.send("b")
+        await _settle()
+        assert flights._flights["k"].chunks == ["a", "b"]
+
+        follower = asyncio.create_task(_collect(flights.stream("k", upstream.stream)))
+        await _settle()
+        upstream.send("c")
+        upstream.close()
+
+        assert await leader == ["a", "b", "c"]
+        assert await follower == ["a", "b", "c"]
+        assert upstream.calls == 1
+
+    async def test_error_reaches_every_subscriber(self):
+        """上游错误传给所有订阅者"""
+        flights = SingleFlight()
+        upstream = Upstream()
+
+        subscribers = [asyncio.create_task(_collect(flights.stream("k", upstream.stream))) for _ in range(3)]
+        await _settle()
+        upstream.send("a")
+        upstream.fail(RuntimeError("provider down"))
+
+        results = await asyncio.gather(*subscribers, return_exceptions=True)
+        assert all(isinstance(result, RuntimeError) for result in results)
+        assert upstream.calls == 1
+        assert len(flights) == 0
+
+    async def test_disconnect_does_not_affect_others(self):
+        """一个订阅者断开后上游继续运行，其他订阅者照常接收"""
+        flights = SingleFlight()
+        upstream = Upstream()
+
+        leaving = flights.stream("k", upstream.stream)
+        staying = asyncio.create_task(_collect(flights.stream("k", upstream.stream)))
+        upstream.send("a")
+        assert await leaving.__anext__() == "a"
+        await leaving.aclose()
+
+        upstream.send("b")
+        upstream.close()
+
+        assert await staying == ["a", "b"]
+        assert upstream.calls == 1
+
+    async def test_flight_is_removed_when_finished(self):
+        """请求结束后清理记录，之后相同的请求重新发起上游调用"""
+        flights = SingleFlight()
+        upstream = Upstream()
+
+        first = asyncio.create_task(_collect(flights.stream("k", upstream.stream)))
+        await _settle()
+        assert len(flights) == 1
+        upstream.close()
+        await first
+        await _settle()
+        assert len(flights) == 0
+
+        second = asyncio.create_task(_collect(flights.stream("k", upstream.stream)))
+        await _settle()
+        upstream.send("x")
+        upstream.close()
+        assert await second == ["x"]
+        assert upstream.calls == 2
+
+
+class TestSingleFlightCall:
+    """非流式请求合并测试类"""
+
+    async def test_concurrent_calls_share_result(self):
+        """并发的相同请求共享同一次调用的结果，结束后清理记录"""
+        flights = SingleFlight()
+        release = asyncio.Event()
+        calls = 0
+
+        async def factory():
+            nonlocal calls
+            calls += 1
+            await release.wait()
+            return "result"
+
+        callers = [asyncio.create_task(flights.call("k", factory)) for _ in range(3)]
+        await _settle()
+        assert len(flights) == 1
+
+        release.set()
+        assert await asyncio.gather(*callers) == ["result"] * 3
+        assert calls == 1
+        assert len(flights) == 0
+
+    async def test_error_reaches_every_caller(self):
+        """调用失败时所有等待者都收到错误，之后可以重新调用"""
+        flights = SingleFlight()
+        release = asyncio.Event()
+
+        async def factory():
+            await release.wait()
+            raise ValueError("bad request")
+
+        callers = [asyncio.create_task(flights.call("k", factory)) for _ in range(2)]
+        await _settle()
+        release.set()
+
+        results = await asyncio.gather(*callers, return_exceptions=True)
+        assert all(isinstance(result, ValueError) for result in results)
+        assert len(flights) == 0
+
+    async def test_cancelled_caller_does_not_cancel_others(self):
+        """一个等待者取消不会取消共享的调用"""
+        flights = SingleFlight()
+        release = asyncio.Event()
+
+        async def factory():
+            await release.wait()
+            return 42
+
+        leaving = asyncio.create_task(flights.call("k", factory))
+        staying = asyncio.create_task(flights.call("k", factory))
+        await _settle()
+        leaving.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leaving
+
+        release.set()
+        assert await staying == 42
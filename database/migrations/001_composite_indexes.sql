@@ -0,0 +1,42 @@
+-- 001 热点查询复合索引
+-- MySQL 8.0+
+--
+-- 列表查询按等值过滤列 + (created_at, id) 排序游标分页，单列索引只能满足过滤或排序之一，
+-- 其余部分退化为 filesort。这里先创建复合索引，再删除被复合索引前缀覆盖的单列索引
+-- （外键所需的索引由复合索引的前缀满足）
+--
+-- 执行后可用 python chat-api/scripts/check_query_plans.py 验证执行计划
+
+USE chat_admin;
+
+-- 用户
+ALTER TABLE users
+    ADD INDEX idx_users_created (created_at, id),
+    ADD INDEX idx_users_role_created (role, created_at, id),
+    ADD INDEX idx_users_status_created (status, created_at, id),
+    ALGORITHM=INPLACE, LOCK=NONE;
+
+ALTER TABLE users
+    DROP INDEX idx_created_at;
+
+-- 对话
+ALTER TABLE conversations
+    ADD INDEX idx_conversations_created (created_at, id),
+    ADD INDEX idx_conversations_status_created (status, created_at, id),
+    ADD INDEX idx_conversations_priority_created (priority, created_at, id),
+    ADD INDEX idx_conversations_assignee_created (assignee_id, created_at, id),
+    ALGORITHM=INPLACE, LOCK=NONE;
+
+ALTER TABLE conversations
+    DROP INDEX idx_created_at,
+    DROP INDEX idx_status,
+    DROP INDEX idx_priority,
+    DROP INDEX idx_assignee_id;
+
+-- 消息
+ALTER TABLE messages
+    ADD INDEX idx_messages_conversation_created (conversation_id, created_at, id, is_private),
+    ALGORITHM=INPLACE, LOCK=NONE;
+
+ALTER TABLE messages
+    DROP INDEX idx_conversation_id;
@@ -0,0 +1,29 @@
+-- 002 客户联系人外部用户ID
+-- MySQL 8.0+
+--
+-- 新建对话时按会话 user_id 查找联系人，原先使用 JSON_CONTAINS(custom_attributes, ...)，
+-- 无法使用索引，每次都扫描整张 customer_contacts。这里新增普通列 external_user_id 并建立唯一索引，
+-- 服务端据此执行 INSERT ... ON DUPLICATE KEY UPDATE 原子 upsert
+--
+-- 未使用生成列：生成列的值由 custom_attributes 决定，历史数据中同一 user_id 的重复联系人
+-- 会使唯一索引无法建立；普通列可只回填每个 user_id 最早的一条，其余重复记录保持 NULL
+
+USE chat_admin;
+
+ALTER TABLE customer_contacts
+    ADD COLUMN external_user_id VARCHAR(255) NULL COMMENT '外部用户ID（会话 user_id）' AFTER custom_attributes,
+    ALGORITHM=INPLACE, LOCK=NONE;
+
+-- 回填：每个 user_id 只回填 id 最小的联系人
+UPDATE customer_contacts c
+JOIN (
+    SELECT JSON_UNQUOTE(JSON_EXTRACT(custom_attributes, '$.user_id')) AS user_id, MIN(id) AS id
+    FROM customer_contacts
+    WHERE JSON_EXTRACT(custom_attributes, '$.user_id') IS NOT NULL
+    GROUP BY user_id
+) first_contact ON first_contact.id = c.id
+SET c.external_user_id = first_contact.user_id;
+
+ALTER TABLE customer_contacts
+    ADD UNIQUE INDEX uq_customer_contacts_external_user_id (external_user_id),
+    ALGORITHM=INPLACE, LOCK=NONE;
@@ -22,7 +22,9 @@ CREATE TABLE IF NOT EXISTS users (
     
     INDEX idx_email (email),
     INDEX idx_role_status (role, status),
-    INDEX idx_created_at (created_at)
+    INDEX idx_users_created (created_at, id),
+    INDEX idx_users_role_created (role, created_at, id),
+    INDEX idx_users_status_created (status, created_at, id)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
 
 -- 2. 客户联系人表
@@ -34,11 +36,14 @@ CREATE TABLE IF NOT EXISTS customer_contacts (
     phone VARCHAR(20),
     avatar_url VARCHAR(500),
     custom_attributes JSON,
+    external_user_id VARCHAR(255),
     first_seen_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     last_seen_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
     updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP ON UPDATE CURRENT_TIMESTAMP,
     
+    -- 按会话 user_id 查找/upsert 联系人
+    UNIQUE INDEX uq_customer_contacts_external_user_id (external_user_id),
     INDEX idx_email (email),
     INDEX idx_phone (phone),
     INDEX idx_last_seen (last_seen_at),
@@ -85,13 +90,14 @@ CREATE TABLE IF NOT EXISTS conversations (
     FOREIGN KEY (inbox_id) REFERENCES inboxes(id) ON DELETE CASCADE,
     
     INDEX idx_contact_id (contact_id),
-    INDEX idx_assignee_id (assignee_id),
     INDEX idx_inbox_id (inbox_id),
-    INDEX idx_status (status),
-    INDEX idx_priority (priority),
     INDEX idx_current_agent_type (current_agent_type),
     INDEX idx_last_activity (last_activity_at),
-    INDEX idx_created_at (created_at)
+    -- 列表按 (created_at, id) 游标分页，常用过滤列在前
+    INDEX idx_conversations_created (created_at, id),
+    INDEX idx_conversations_status_created (status, created_at, id),
+    INDEX idx_conversations_priority_created (priority, created_at, id),
+    INDEX idx_conversations_assignee_created (assignee_id, created_at, id)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
 
 -- 5. 消息表
@@ -111,11 +117,12 @@ CREATE TABLE IF NOT EXISTS messages (
     FOREIGN KEY (conversation_id) REFERENCES conversations(id) ON DELETE CASCADE,
     FOREIGN KEY (sender_id) REFERENCES users(id) ON DELETE SET NULL,
     
-    INDEX idx_conversation_id (conversation_id),
     INDEX idx_sender_type (sender_type),
     INDEX idx_sender_id (sender_id),
     INDEX idx_message_type (message_type),
-    INDEX idx_created_at (created_at)
+    INDEX idx_created_at (created_at),
+    -- 对话内按时间翻页；is_private 放在末尾，公开消息的计数与过滤只读索引
+    INDEX idx_messages_conversation_created (conversation_id, created_at, id, is_private)
 ) ENGINE=InnoDB DEFAULT CHARSET=utf8mb4 COLLATE=utf8mb4_unicode_ci;
 
 -- 6. 标签表